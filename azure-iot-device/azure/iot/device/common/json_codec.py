@@ -0,0 +1,137 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains the JSON codec used for twin, method and provisioning payloads.
+
+The fastest JSON implementation which is installed is used: orjson, then ujson, then the json
+module of the standard library.  A different codec can be chosen with use_codec().
+"""
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class JSONCodec(object):
+    """A JSON implementation.
+
+    :ivar str name: The name of the codec.
+    """
+
+    def __init__(self, name, loads, dumps):
+        """
+        :param str name: The name of the codec.
+        :param loads: A function which decodes a str or bytes into an object.
+        :param dumps: A function which encodes an object into a str.
+        """
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+
+def _stdlib_loads(data):
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def _make_stdlib_codec():
+    return JSONCodec("json", _stdlib_loads, json.dumps)
+
+
+def _make_orjson_codec():
+    import orjson
+
+    def dumps(obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            # Something orjson does not support, such as an integer too large for 64 bits
+            return json.dumps(obj)
+
+    def loads(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Something orjson does not support, such as an integer too large for 64 bits.  If
+            # the document is not valid JSON, the json module raises the error instead.
+            return _stdlib_loads(data)
+
+    return JSONCodec("orjson", loads, dumps)
+
+
+def _make_ujson_codec():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=True, escape_forward_slashes=False)
+
+    return JSONCodec("ujson", ujson.loads, dumps)
+
+
+# Codec name -> function which creates it, in order of preference
+_codec_factories = [
+    ("orjson", _make_orjson_codec),
+    ("ujson", _make_ujson_codec),
+    ("json", _make_stdlib_codec),
+]
+
+_codec = None
+
+
+def _select_codec():
+    for name, factory in _codec_factories:
+        try:
+            codec = factory()
+        except ImportError:
+            continue
+        logger.debug("Using the {} JSON codec".format(name))
+        return codec
+
+
+def get_codec():
+    """
+    Return the JSONCodec which is in use.
+    """
+    global _codec
+    if _codec is None:
+        _codec = _select_codec()
+    return _codec
+
+
+def use_codec(name):
+    """
+    Use the given codec for all JSON encoding and decoding from now on.
+
+    :param str name: "orjson", "ujson" or "json".
+    :raises: ValueError if there is no codec with the given name.
+    :raises: ImportError if the codec is not installed.
+    """
+    global _codec
+    for codec_name, factory in _codec_factories:
+        if codec_name == name:
+            _codec = factory()
+            return
+    raise ValueError("Unknown JSON codec: {}".format(name))
+
+
+def loads(data):
+    """
+    Decode a JSON document.
+
+    :param data: The document, as str or UTF-8 encoded bytes.
+    :raises: ValueError if the document is not valid JSON.
+    """
+    return get_codec().loads(data)
+
+
+def dumps(obj):
+    """
+    Encode an object as a JSON document.
+
+    :returns: The document, as a str.
+    """
+    return get_codec().dumps(obj)
@@ -0,0 +1,443 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains an engine which drives the network traffic of many Paho MQTT clients from
+a single I/O thread.
+
+By default, every MQTTTransport calls Paho's loop_start(), which gives each connection its own
+network thread.  A gateway with thousands of downstream devices would need thousands of threads.
+An MQTTEngine instead uses Paho's external loop API (socket(), want_write(), loop_read(),
+loop_write() and loop_misc()) and waits for all of its clients' sockets with a single selector.
+An EventLoopMQTTEngine does the same on an asyncio event loop, so that the MQTT traffic of the
+aio clients is handled by the application's own event loop thread.
+"""
+
+import collections
+import logging
+import socket
+import threading
+import time
+import traceback
+import weakref
+import zlib
+
+try:
+    import selectors
+except ImportError:
+    # Python 2.7
+    selectors = None
+
+logger = logging.getLogger(__name__)
+
+# How often loop_misc is called for every client.  Paho uses loop_misc to send keepalive pings and
+# to retry unacknowledged messages, so this does not need to be more frequent than once a second.
+MISC_INTERVAL = 1.0
+
+# Same values as selectors.EVENT_READ and selectors.EVENT_WRITE
+_EVENT_READ = 1
+_EVENT_WRITE = 2
+
+_engines = {}
+# Keyed weakly, so that a loop which is no longer used is not kept alive by its engine
+_event_loop_engines = weakref.WeakKeyDictionary()
+_engines_lock = threading.Lock()
+
+
+def get_shared_engine(key, engine_count):
+    """
+    Return one of engine_count process-wide engines.  The same key always gets the same engine,
+    as long as engine_count does not change.  Engines are created the first time they are needed.
+
+    :param str key: The key used to pick the engine, e.g. the id of the client.
+    :param int engine_count: The number of engines (and I/O threads) to spread clients across.
+    """
+    index = (zlib.crc32(key.encode("utf-8")) & 0xFFFFFFFF) % engine_count
+    with _engines_lock:
+        engine = _engines.get((engine_count, index))
+        if engine is None:
+            engine = MQTTEngine(name="mqtt engine {}/{}".format(index + 1, engine_count))
+            _engines[(engine_count, index)] = engine
+        return engine
+
+
+def get_event_loop_engine(loop):
+    """
+    Return the engine which drives MQTT clients on the given asyncio event loop.  Every client
+    on the same loop shares one engine.
+
+    :param loop: The asyncio event loop.
+    """
+    with _engines_lock:
+        engine = _event_loop_engines.get(loop)
+        if engine is None:
+            engine = EventLoopMQTTEngine(loop)
+            _event_loop_engines[loop] = engine
+        return engine
+
+
+class _ClientState(object):
+    def __init__(self, client):
+        self.client = client
+        self.sock = None
+        self.fd = None
+        self.events = 0
+        self.removing = False
+
+
+class _BaseMQTTEngine(object):
+    """
+    The bookkeeping shared by the engines.  Subclasses decide how sockets are waited on, and on
+    which thread commands run.  Everything except add_client, remove_client and stop runs on
+    that thread.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        # Clients by Paho client object.  Only touched on the engine thread.
+        self._clients = {}
+
+    def add_client(self, client):
+        """
+        Start driving a connected Paho client.  Adding a client which was already added makes the
+        engine look at its socket again, which should be done after calling reconnect() on it.
+
+        :param client: The Paho client.
+        """
+        if hasattr(client, "on_socket_register_write"):
+            # Paho 1.5+ tells us when a publish from another thread could not be written out
+            # completely, so the engine can wait for the socket to become writable.
+            client.on_socket_register_write = self._on_socket_register_write
+        self._run_command(self._add_client, client)
+
+    def remove_client(self, client):
+        """
+        Stop driving a Paho client.  If the client still has a socket, the engine keeps driving it
+        until Paho closes the socket, so that a pending DISCONNECT packet is still sent.
+
+        :param client: The Paho client.
+        """
+        self._run_command(self._remove_client, client)
+
+    @property
+    def client_count(self):
+        """The number of clients which are being driven by the engine."""
+        return len(self._clients)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._run_command(self._update_client, client)
+
+    def _call(self, func):
+        try:
+            func()
+        except Exception:
+            logger.error("{}: Unexpected error driving MQTT client".format(self.name))
+            logger.error(traceback.format_exc())
+
+    def _drive(self, state, events):
+        """
+        Let Paho read from and/or write to the socket of a client, depending on which events
+        the socket is ready for.
+        """
+        if state.client not in self._clients:
+            return
+        if events & _EVENT_READ:
+            self._call(state.client.loop_read)
+        if events & _EVENT_WRITE:
+            self._call(state.client.loop_write)
+        self._update_state(state)
+
+    def _misc(self):
+        for state in list(self._clients.values()):
+            self._call(state.client.loop_misc)
+            self._update_state(state)
+
+    def _add_client(self, client):
+        state = self._clients.get(client)
+        if state is None:
+            state = _ClientState(client)
+            self._clients[client] = state
+        state.removing = False
+        self._update_state(state)
+
+    def _remove_client(self, client):
+        state = self._clients.get(client)
+        if state is not None:
+            state.removing = True
+            self._update_state(state)
+
+    def _update_client(self, client):
+        state = self._clients.get(client)
+        if state is not None:
+            self._update_state(state)
+
+    def _update_state(self, state):
+        """
+        Bring the registration of a client's socket up to date.  Paho replaces the socket when it
+        reconnects, and sets it to None once the connection is closed.
+        """
+        client = state.client
+        sock = client.socket()
+
+        if sock is not state.sock:
+            self._unregister(state)
+            if sock is not None:
+                self._register(state, sock)
+
+        if sock is None:
+            if state.removing:
+                del self._clients[client]
+            return
+
+        events = _EVENT_READ
+        if client.want_write():
+            events |= _EVENT_WRITE
+        if events != state.events:
+            self._set_events(state, events)
+            state.events = events
+
+        # Data which the SSL layer already took off the socket does not make it readable again
+        pending = getattr(sock, "pending", None)
+        if pending is not None and pending():
+            self._schedule_read(state)
+
+
+class MQTTEngine(_BaseMQTTEngine):
+    """
+    Drives the network traffic of any number of Paho MQTT clients from a single thread.
+
+    A client is handed to the engine with add_client after its connect() call has returned,
+    instead of calling loop_start().  The engine keeps track of the socket of the client, which
+    Paho replaces when it reconnects, until remove_client is called.  The engine thread is started
+    when the first client is added.
+
+    Paho callbacks of clients added to an engine (on_connect, on_message, etc.) are called on the
+    engine thread, so they must not block.
+    """
+
+    def __init__(self, name="mqtt engine"):
+        """
+        Initializer for MQTTEngine objects.
+
+        :param str name: The name of the I/O thread.
+
+        :raises: NotImplementedError if the selectors module is not available (Python 2.7)
+        """
+        if selectors is None:
+            raise NotImplementedError("MQTTEngine requires the selectors module (Python 3.4+)")
+        super(MQTTEngine, self).__init__(name)
+        self._selector = selectors.DefaultSelector()
+        self._commands = collections.deque()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        # Clients whose SSL socket holds data which was already read from the network
+        self._pending_reads = set()
+
+        self._wakeup_receiver, self._wakeup_sender = socket.socketpair()
+        self._wakeup_receiver.setblocking(False)
+        self._wakeup_sender.setblocking(False)
+        self._selector.register(self._wakeup_receiver, selectors.EVENT_READ, None)
+
+    def stop(self):
+        """
+        Stop the engine thread and wait for it to exit.  Clients which were added to the engine
+        are no longer driven.
+        """
+        with self._lock:
+            self._running = False
+            thread = self._thread
+            self._thread = None
+        self._wakeup()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run_command(self, func, client):
+        with self._lock:
+            self._commands.append((func, client))
+            if not self._running:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_sender.send(b"\x00")
+        except socket.error:
+            # The buffer is full, so the engine thread is going to wake up anyway
+            pass
+
+    def _run(self):
+        logger.info("{}: started".format(self.name))
+        next_misc = time.time() + MISC_INTERVAL
+        while self._running:
+            self._process_commands()
+
+            if self._pending_reads:
+                timeout = 0
+            else:
+                timeout = max(0, next_misc - time.time())
+            events = self._selector.select(timeout)
+
+            for key, mask in events:
+                if key.data is None:
+                    self._drain_wakeup()
+                elif key.fd == key.data.fd:
+                    self._drive(key.data, mask)
+
+            for client in list(self._pending_reads):
+                self._pending_reads.discard(client)
+                state = self._clients.get(client)
+                if state is not None:
+                    self._drive(state, _EVENT_READ)
+
+            if time.time() >= next_misc:
+                self._misc()
+                next_misc = time.time() + MISC_INTERVAL
+        logger.info("{}: stopped".format(self.name))
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_receiver.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def _process_commands(self):
+        while True:
+            with self._lock:
+                if not self._commands:
+                    return
+                func, client = self._commands.popleft()
+            func(client)
+
+    def _schedule_read(self, state):
+        self._pending_reads.add(state.client)
+
+    def _set_events(self, state, events):
+        self._selector.modify(state.fd, events, state)
+
+    def _register(self, state, sock):
+        fd = sock.fileno()
+        try:
+            self._selector.register(fd, selectors.EVENT_READ, state)
+        except KeyError:
+            # The descriptor was closed by another client, and the operating system has reused it
+            # for this socket before the engine noticed.
+            stale_state = self._selector.get_key(fd).data
+            stale_state.sock = None
+            stale_state.fd = None
+            stale_state.events = 0
+            self._selector.unregister(fd)
+            self._selector.register(fd, selectors.EVENT_READ, state)
+        state.sock = sock
+        state.fd = fd
+        state.events = selectors.EVENT_READ
+
+    def _unregister(self, state):
+        if state.fd is not None:
+            try:
+                # Sockets are registered by descriptor, because a closed socket object no longer
+                # knows its descriptor.
+                key = self._selector.get_key(state.fd)
+                if key.data is state:
+                    self._selector.unregister(state.fd)
+            except (KeyError, ValueError, OSError):
+                pass
+        self._pending_reads.discard(state.client)
+        state.sock = None
+        state.fd = None
+        state.events = 0
+
+
+class EventLoopMQTTEngine(_BaseMQTTEngine):
+    """
+    Drives the network traffic of any number of Paho MQTT clients from an asyncio event loop,
+    using loop.add_reader and loop.add_writer.  Paho callbacks of the clients are called on the
+    thread running the loop.
+
+    The engine must only be used with loops which support add_reader and add_writer, such as
+    the default selector event loop.
+    """
+
+    def __init__(self, loop):
+        """
+        Initializer for EventLoopMQTTEngine objects.
+
+        :param loop: The asyncio event loop to drive the clients from.
+        """
+        super(EventLoopMQTTEngine, self).__init__("mqtt event loop engine")
+        # A strong reference would keep the loop, and with it the engine, in _event_loop_engines
+        self._loop_ref = weakref.ref(loop)
+        # Clients by the descriptor of their socket
+        self._fds = {}
+        self._misc_handle = None
+
+    @property
+    def _loop(self):
+        return self._loop_ref()
+
+    def stop(self):
+        """
+        Stop driving every client which was added to the engine.
+        """
+        self._loop.call_soon_threadsafe(self._stop)
+
+    def _stop(self):
+        if self._misc_handle is not None:
+            self._misc_handle.cancel()
+            self._misc_handle = None
+        for state in list(self._clients.values()):
+            self._unregister(state)
+        self._clients.clear()
+
+    def _run_command(self, func, client):
+        self._loop.call_soon_threadsafe(func, client)
+
+    def _add_client(self, client):
+        super(EventLoopMQTTEngine, self)._add_client(client)
+        if self._misc_handle is None:
+            self._misc_handle = self._loop.call_later(MISC_INTERVAL, self._run_misc)
+
+    def _run_misc(self):
+        self._misc()
+        if self._clients:
+            self._misc_handle = self._loop.call_later(MISC_INTERVAL, self._run_misc)
+        else:
+            self._misc_handle = None
+
+    def _schedule_read(self, state):
+        self._loop.call_soon(self._drive, state, _EVENT_READ)
+
+    def _set_events(self, state, events):
+        if events & _EVENT_WRITE:
+            self._loop.add_writer(state.fd, self._drive, state, _EVENT_WRITE)
+        else:
+            self._loop.remove_writer(state.fd)
+
+    def _register(self, state, sock):
+        fd = sock.fileno()
+        stale_state = self._fds.get(fd)
+        if stale_state is not None:
+            # The descriptor was closed by another client, and the operating system has reused it
+            # for this socket before the engine noticed.
+            self._unregister(stale_state)
+        self._loop.add_reader(fd, self._drive, state, _EVENT_READ)
+        self._fds[fd] = state
+        state.sock = sock
+        state.fd = fd
+        state.events = _EVENT_READ
+
+    def _unregister(self, state):
+        if state.fd is not None and self._fds.get(state.fd) is state:
+            # Sockets are registered by descriptor, because a closed socket object no longer
+            # knows its descriptor.
+            self._loop.remove_reader(state.fd)
+            self._loop.remove_writer(state.fd)
+            del self._fds[state.fd]
+        state.sock = None
+        state.fd = None
+        state.events = 0
@@ -5,13 +5,21 @@
 # --------------------------------------------------------------------------
 
 import paho.mqtt.client as mqtt
+import collections
+import functools
 import logging
 import ssl
 import threading
 import traceback
+from . import ssl_context_cache, timer_wheel
 
 logger = logging.getLogger(__name__)
 
+# Responses for unknown MIDs are remembered until the operation they belong to is established,
+# which happens right after the Paho call which started the operation returns.
+DEFAULT_MAX_UNKNOWN_COMPLETIONS = 100
+UNKNOWN_COMPLETION_TIMEOUT = 10
+
 
 class MQTTTransport(object):
     """
@@ -21,48 +29,129 @@ class MQTTTransport(object):
     :type on_mqtt_connected: Function
     :ivar on_mqtt_disconnected: Event handler callback, called upon a disconnection.
     :type on_mqtt_disconnected: Function
+    :ivar on_mqtt_connection_failure: Event handler callback, called with a ConnectionFailedError
+      when the broker refuses a connection.
+    :type on_mqtt_connection_failure: Function
     :ivar on_mqtt_message_received: Event handler callback, called upon receiving a message.
     :type on_mqtt_message_received: Function
     """
 
-    def __init__(self, client_id, hostname, username, ca_cert=None):
+    def __init__(
+        self,
+        client_id,
+        hostname,
+        username,
+        ca_cert=None,
+        max_inflight_messages=None,
+        io_engine=None,
+        tls_session_resumption=False,
+        operation_timeout=None,
+        auto_reconnect=True,
+    ):
         """
         Constructor to instantiate an MQTT protocol wrapper.
         :param str client_id: The id of the client connecting to the broker.
         :param str hostname: Hostname or IP address of the remote broker.
         :param str username: Username for login to the remote broker.
         :param str ca_cert: Certificate which can be used to validate a server-side TLS connection (optional).
+        :param int max_inflight_messages: The maximum number of QoS 1 publishes which can be
+        awaiting a PUBACK at any given time (optional).  Further publishes are queued by the
+        protocol library until a slot frees up.
+        :param io_engine: An MQTTEngine which drives the network traffic of this transport
+        (optional).  If not provided, the transport uses a network thread of its own.
+        :param bool tls_session_resumption: If True, the TLS session of a connection is offered
+        to the broker when reconnecting, which lets the broker skip the full TLS handshake.
+        :param float operation_timeout: The number of seconds to wait for the broker to
+        acknowledge a publish, subscribe or unsubscribe before failing it with an
+        OperationTimeoutError (optional).  If not provided, operations wait forever.
+        :param bool auto_reconnect: If False, the protocol library does not reconnect by itself
+        when the connection is lost, and reconnecting is left to the owner of the transport.
         """
         self._client_id = client_id
         self._hostname = hostname
         self._username = username
         self._mqtt_client = None
         self._ca_cert = ca_cert
+        self._max_inflight_messages = max_inflight_messages
+        self._io_engine = io_engine
+        self._auto_reconnect = auto_reconnect
+        if tls_session_resumption:
+            self._tls_session = TLSSessionResumption()
+        else:
+            self._tls_session = None
 
         self.on_mqtt_connected = None
         self.on_mqtt_disconnected = None
+        self.on_mqtt_connection_failure = None
         self.on_mqtt_message_received = None
 
-        self._op_manager = OperationManager()
+        self._op_manager = OperationManager(operation_timeout=operation_timeout)
+        # What Paho's TLS is configured with, once the first connection is made
+        self._paho_ssl_context = None
 
         self._create_mqtt_client()
 
+    @property
+    def tls_session_hits(self):
+        """The number of reconnects which resumed the previous TLS session."""
+        return self._tls_session.hits if self._tls_session else 0
+
+    @property
+    def tls_session_misses(self):
+        """The number of reconnects which offered the previous TLS session, but did a full TLS
+        handshake because the broker did not accept it."""
+        return self._tls_session.misses if self._tls_session else 0
+
+    @property
+    def pending_operation_count(self):
+        """The number of operations which are waiting for the broker to acknowledge them."""
+        return self._op_manager.pending_count
+
+    @property
+    def orphaned_operation_count(self):
+        """The number of acknowledgements for unknown operations which are being remembered."""
+        return self._op_manager.orphaned_count
+
+    @property
+    def expired_operation_count(self):
+        """The number of operations which failed because they were not acknowledged in time."""
+        return self._op_manager.expired_count
+
     def _create_mqtt_client(self):
         """
         Create the MQTT client object and assign all necessary event handler callbacks.
         """
         logger.info("creating mqtt client")
 
+        kwargs = {}
+        if not self._auto_reconnect:
+            kwargs["reconnect_on_failure"] = False
         self._mqtt_client = mqtt.Client(
-            client_id=self._client_id, clean_session=False, protocol=mqtt.MQTTv311
+            client_id=self._client_id, clean_session=False, protocol=mqtt.MQTTv311, **kwargs
         )
         self._mqtt_client.enable_logger(logging.getLogger("paho"))
+        if self._max_inflight_messages is not None:
+            self._mqtt_client.max_inflight_messages_set(self._max_inflight_messages)
 
         def on_connect(client, userdata, flags, rc):
             logger.info("connected with result code: {}".format(rc))
 
-            # TODO: how to do failed connection?
-            if self.on_mqtt_connected:
+            if self._tls_session:
+                self._tls_session.on_handshake_complete(client.socket())
+
+            if rc != mqtt.CONNACK_ACCEPTED:
+                # Paho closes the connection, and calls on_disconnect, after this returns
+                if self.on_mqtt_connection_failure:
+                    try:
+                        self.on_mqtt_connection_failure(
+                            ConnectionFailedError(mqtt.connack_string(rc))
+                        )
+                    except Exception:
+                        logger.error("Unexpected error calling on_mqtt_connection_failure")
+                        logger.error(traceback.format_exc())
+                else:
+                    logger.info("No event handler callback set for on_mqtt_connection_failure")
+            elif self.on_mqtt_connected:
                 try:
                     self.on_mqtt_connected()
                 except Exception:
@@ -121,27 +210,6 @@ class MQTTTransport(object):
 
         logger.info("Created MQTT protocol client, assigned callbacks")
 
-    def _create_ssl_context(self, x509=None):
-        """
-        This method creates the SSLContext object used by Paho to authenticate the connection.
-        :param x509: The x509 certificate. If present then the SSLContext is created using x509.
-        """
-        logger.info("creating a SSL context")
-        ssl_context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLSv1_2)
-
-        if self._ca_cert:
-            ssl_context.load_verify_locations(cadata=self._ca_cert)
-        else:
-            ssl_context.load_default_certs()
-        ssl_context.verify_mode = ssl.CERT_REQUIRED
-        ssl_context.check_hostname = True
-
-        if x509 is not None:
-            logger.info("configuring SSL context with client-side certificate and key")
-            ssl_context.load_cert_chain(x509.certificate_file, x509.key_file, x509.pass_phrase)
-
-        return ssl_context
-
     def connect(self, password=None, client_certificate=None):
         """
         Connect to the MQTT broker, using hostname and username set at instantiation.
@@ -154,13 +222,27 @@ class MQTTTransport(object):
         """
         logger.info("connecting to mqtt broker")
 
-        ssl_context = self._create_ssl_context(client_certificate)
-        self._mqtt_client.tls_set_context(context=ssl_context)
-        self._mqtt_client.tls_insecure_set(False)
+        ssl_context = ssl_context_cache.get_ssl_context(self._ca_cert, client_certificate)
+        if self._paho_ssl_context is None:
+            self._paho_ssl_context = _PahoSSLContext(ssl_context, self._tls_session)
+            self._mqtt_client.tls_set_context(context=self._paho_ssl_context)
+            self._mqtt_client.tls_insecure_set(False)
+        else:
+            # Paho raises if its TLS is configured again, so the context of this connection,
+            # which differs if the certificates changed, is swapped in behind the stand-in
+            self._paho_ssl_context.ssl_context = ssl_context
         self._mqtt_client.username_pw_set(username=self._username, password=password)
 
         self._mqtt_client.connect(host=self._hostname, port=8883)
-        self._mqtt_client.loop_start()
+        if self._io_engine:
+            self._io_engine.add_client(self._mqtt_client)
+        else:
+            if not self._auto_reconnect:
+                # Without automatic reconnects, the network thread of the previous connection
+                # exited when that connection was lost.  It has to be cleaned up before another
+                # one can be started.
+                self._mqtt_client.loop_stop()
+            self._mqtt_client.loop_start()
 
     def reconnect(self, password):
         """
@@ -168,11 +250,26 @@ class MQTTTransport(object):
 
         Connect should have previously been called in order to use this function.
 
+        Publishes which are awaiting acknowledgement are sent again on the new connection.
+
         :param str password: The password for reconnecting with the MQTT broker.
         """
         logger.info("reconnecting MQTT client")
+        if not self._io_engine:
+            # The network thread must not touch the old socket while it is replaced.  Stopping
+            # it only joins the thread, and does not wait for any acknowledgements: publishes
+            # which are in flight stay unacknowledged, and Paho sends them again on the new
+            # connection.
+            self._mqtt_client.loop_stop()
         self._mqtt_client.username_pw_set(username=self._username, password=password)
-        self._mqtt_client.reconnect()
+        try:
+            self._mqtt_client.reconnect()
+        finally:
+            if self._io_engine:
+                # Paho has opened a new socket, which the engine needs to start waiting on
+                self._io_engine.add_client(self._mqtt_client)
+            else:
+                self._mqtt_client.loop_start()
 
     def disconnect(self):
         """
@@ -180,22 +277,30 @@ class MQTTTransport(object):
         """
         logger.info("disconnecting MQTT client")
         self._mqtt_client.disconnect()
-        self._mqtt_client.loop_stop()
+        if self._io_engine:
+            self._io_engine.remove_client(self._mqtt_client)
+        else:
+            self._mqtt_client.loop_stop()
 
     def subscribe(self, topic, qos=1, callback=None):
         """
-        This method subscribes the client to one topic from the MQTT broker.
+        This method subscribes the client to one or more topics from the MQTT broker.
 
-        :param str topic: a single string specifying the subscription topic to subscribe to
+        :param topic: a single string specifying the subscription topic to subscribe to, or a
+        list of them, which are all subscribed to with a single SUBSCRIBE packet.
         :param int qos: the desired quality of service level for the subscription. Defaults to 1.
-        :param callback: A callback to be triggered upon completion (Optional).
+        :param callback: A callback to be triggered upon completion (Optional).  If the operation
+        times out, it is called with the error as its 'error' keyword argument.
 
         :return: message ID for the subscribe request
         :raises: ValueError if qos is not 0, 1 or 2
         :raises: ValueError if topic is None or has zero string length
         """
         logger.info("subscribing to {} with qos {}".format(topic, qos))
-        (result, mid) = self._mqtt_client.subscribe(topic, qos=qos)
+        if isinstance(topic, list):
+            (result, mid) = self._mqtt_client.subscribe([(t, qos) for t in topic])
+        else:
+            (result, mid) = self._mqtt_client.subscribe(topic, qos=qos)
         self._op_manager.establish_operation(mid, callback)
 
     def unsubscribe(self, topic, callback=None):
@@ -203,7 +308,8 @@ class MQTTTransport(object):
         Unsubscribe the client from one topic on the MQTT broker.
 
         :param str topic: a single string which is the subscription topic to unsubscribe from.
-        :param callback: A callback to be triggered upon completion (Optional).
+        :param callback: A callback to be triggered upon completion (Optional).  If the operation
+        times out, it is called with the error as its 'error' keyword argument.
 
         :raises: ValueError if topic is None or has zero string length
         """
@@ -218,7 +324,10 @@ class MQTTTransport(object):
         :param str topic: topic: The topic that the message should be published on.
         :param str payload: The actual message to send.
         :param int qos: the desired quality of service level for the subscription. Defaults to 1.
-        :param callback: A callback to be triggered upon completion (Optional).
+        :param callback: A callback to be triggered upon completion (Optional).  If the operation
+        times out, it is called with the error as its 'error' keyword argument.  For QoS 0, it is
+        called before this method returns, since the broker does not acknowledge the message.  If
+        Paho could not send a QoS 0 message, it is called with a PublishFailedError.
 
         :raises: ValueError if qos is not 0, 1 or 2
         :raises: ValueError if topic is None or has zero string length
@@ -227,26 +336,194 @@ class MQTTTransport(object):
         """
         logger.info("sending")
         message_info = self._mqtt_client.publish(topic=topic, payload=payload, qos=qos)
-        self._op_manager.establish_operation(message_info.mid, callback)
+        if qos == 0:
+            # There is no PUBACK for a QoS 0 publish, so it is complete as soon as Paho has it
+            if message_info.rc != mqtt.MQTT_ERR_SUCCESS:
+                # Paho never sent the message, so there is nothing to wait for on its MID
+                logger.warning(
+                    "QoS 0 publish for MID: {} was dropped with rc {}".format(
+                        message_info.mid, message_info.rc
+                    )
+                )
+                if callback:
+                    callback(error=PublishFailedError(mqtt.error_string(message_info.rc)))
+                return
+            self._op_manager.establish_unacknowledged_operation(message_info.mid)
+            if callback:
+                callback()
+        else:
+            self._op_manager.establish_operation(message_info.mid, callback)
+
+
+class TLSSessionResumption(object):
+    """Remembers the TLS session of the most recent connection, so that it can be offered to the
+    broker when reconnecting.
+
+    :ivar hits: The number of connections where an offered session was resumed.
+    :type hits: int
+    :ivar misses: The number of connections where an offered session was not resumed.
+    :type misses: int
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._session = None
+        self._session_context = None
+        self._session_offered = False
+
+    def wrap_context(self, ssl_context):
+        """Return an object which Paho can use in place of ssl_context, and which offers the
+        remembered session when Paho wraps a new socket."""
+        return _PahoSSLContext(ssl_context, self)
+
+    def get_session(self, ssl_context):
+        """Return the remembered session, if it can be used with ssl_context."""
+        # A session can only be resumed with the context that created it.  The cached context
+        # is replaced when it is invalidated.
+        if self._session is not None and self._session_context is ssl_context:
+            self._session_offered = True
+            return self._session
+        self._session_offered = False
+        return None
+
+    def on_handshake_complete(self, sock):
+        """Remember the session of a connected socket, and count whether it resumed the
+        session which was offered."""
+        if not isinstance(sock, ssl.SSLSocket) or getattr(sock, "session", None) is None:
+            # SSLSocket.session requires Python 3.6
+            return
+        if self._session_offered:
+            self._session_offered = False
+            if sock.session_reused:
+                self.hits += 1
+                logger.info("TLS session resumed")
+            else:
+                self.misses += 1
+                logger.info("TLS session was not resumed.  Did a full handshake")
+        self._session = sock.session
+        self._session_context = sock.context
+
+
+class _PahoSSLContext(object):
+    """Stands in for the SSLContext which a Paho client is configured with.  Paho only lets its
+    TLS be configured once, so the real context can be replaced in here instead.  If given a
+    TLSSessionResumption, it offers the remembered TLS session for every socket it wraps.
+    Everything else is passed through to the real context."""
+
+    def __init__(self, ssl_context, tls_session=None):
+        self.ssl_context = ssl_context
+        self._tls_session = tls_session
+
+    def __getattr__(self, name):
+        return getattr(self.ssl_context, name)
+
+    @property
+    def check_hostname(self):
+        return self.ssl_context.check_hostname
+
+    @check_hostname.setter
+    def check_hostname(self, value):
+        self.ssl_context.check_hostname = value
+
+    def wrap_socket(self, sock, **kwargs):
+        if self._tls_session:
+            session = self._tls_session.get_session(self.ssl_context)
+            if session is not None:
+                kwargs["session"] = session
+        return self.ssl_context.wrap_socket(sock, **kwargs)
+
+
+class OperationTimeoutError(Exception):
+    """The response for an operation was not received before the deadline of the operation."""
+
+    pass
+
+
+class ConnectionFailedError(Exception):
+    """The broker refused the connection."""
+
+    pass
+
+
+class PublishFailedError(Exception):
+    """Paho could not send a publish, e.g. because the client is not connected."""
+
+    pass
 
 
 class OperationManager(object):
     """Tracks pending operations and thier associated callbacks until completion.
+
+    Pending operations can be given a deadline, after which they are completed with an
+    OperationTimeoutError.  Responses for unknown MIDs are only remembered for a short time, and
+    only up to a limit, so neither map grows without bound on a long-running connection.
+
+    :ivar expired_count: The number of operations which have been completed because their
+    deadline passed.
+    :type expired_count: int
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        operation_timeout=None,
+        max_unknown_completions=DEFAULT_MAX_UNKNOWN_COMPLETIONS,
+        timer_wheel=None,
+    ):
+        """
+        :param float operation_timeout: The number of seconds after which a pending operation
+        is completed with an error (optional).  If not provided, operations wait for their
+        response forever.
+        :param int max_unknown_completions: The maximum number of responses for unknown MIDs
+        which are remembered.  The oldest one is forgotten when a new one arrives.
+        :param timer_wheel: The TimerWheel which runs the deadlines (optional).  If not provided,
+        the process-wide wheel is used.
+        """
+        self._operation_timeout = operation_timeout
+        self._max_unknown_completions = max_unknown_completions
+        self._timer_wheel = timer_wheel
+
         # Maps mid->callback for operations where a request has been sent
         # but the reponse has not yet been received
         self._pending_operation_callbacks = {}
 
-        # Maps mid->mid for responses received that are NOT established in the _pending_operation_callbacks dict.
+        # Maps mid->Timer for the deadlines of pending operations
+        self._pending_operation_timers = {}
+
+        # MIDs of operations which do not wait for a response.  Paho still reports when they
+        # have been sent, and those reports are dropped.
+        self._unacknowledged_mids = set()
+
+        # MIDs of operations whose deadline passed.  A late response for one of them is dropped
+        # instead of being remembered as an unknown completion, which would complete the next
+        # operation that reuses the MID.
+        self._expired_mids = set()
+
+        # Maps mid->Timer for responses received that are NOT established in the
+        # _pending_operation_callbacks dict, oldest first.
         # Necessary because sometimes an operation will complete with a response before the
         # Paho call returns.
-        # TODO: make this map mid to something more useful (result code?)
-        self._unknown_operation_completions = {}
+        self._unknown_operation_completions = collections.OrderedDict()
+
+        self.expired_count = 0
 
         self._lock = threading.Lock()
 
+    @property
+    def pending_count(self):
+        """The number of operations which are waiting for a response."""
+        return len(self._pending_operation_callbacks)
+
+    @property
+    def orphaned_count(self):
+        """The number of responses for unknown MIDs which are being remembered."""
+        return len(self._unknown_operation_completions)
+
+    def _get_timer_wheel(self):
+        if self._timer_wheel is None:
+            self._timer_wheel = timer_wheel.get_shared_timer_wheel()
+        return self._timer_wheel
+
     def establish_operation(self, mid, callback=None):
         """Establish a pending operation identified by MID, and store its completion callback.
 
@@ -260,28 +537,41 @@ class OperationManager(object):
             if mid in self._unknown_operation_completions:
 
                 # Clear the recorded unknown response now that it has been resolved
-                del self._unknown_operation_completions[mid]
+                self._unknown_operation_completions.pop(mid).cancel()
 
                 # Since the operation has already completed, indicate callback should trigger
                 trigger_callback = True
 
             else:
-                # Store the operation as pending, along with callback
+                # Store the operation as pending, along with callback.  If the MID was last used
+                # by an unacknowledged operation which was never sent, or by an operation which
+                # expired, the MID is not theirs any more.
+                self._unacknowledged_mids.discard(mid)
+                self._expired_mids.discard(mid)
                 self._pending_operation_callbacks[mid] = callback
+                if self._operation_timeout is not None:
+                    self._pending_operation_timers[mid] = self._get_timer_wheel().schedule(
+                        self._operation_timeout, functools.partial(self._expire_operation, mid)
+                    )
                 logger.info("Waiting for response on MID: {}".format(mid))
 
         # Now that the lock has been released, if the callback should be triggered,
         # go ahead and trigger it now.
         if trigger_callback:
             logger.info("Response for MID: {} was received early - triggering callback".format(mid))
-            if callback:
-                try:
-                    callback()
-                except Exception:
-                    logger.error("Unexpected error calling callback for MID: {}".format(mid))
-                    logger.error(traceback.format_exc())
+            self._trigger_callback(mid, callback)
+
+    def establish_unacknowledged_operation(self, mid):
+        """Establish an operation identified by MID which is complete without a response, such
+        as a QoS 0 publish.  When Paho reports the operation as sent, the report is dropped
+        instead of being stored as an unknown completion.
+        """
+        with self._lock:
+            if mid in self._unknown_operation_completions:
+                # Paho already reported it
+                self._unknown_operation_completions.pop(mid).cancel()
             else:
-                logger.info("No callback for MID: {}".format(mid))
+                self._unacknowledged_mids.add(mid)
 
     def complete_operation(self, mid):
         """Complete an operation identified by MID and trigger the associated completion callback.
@@ -297,18 +587,35 @@ class OperationManager(object):
             if mid in self._pending_operation_callbacks:
 
                 # Retrieve the callback, and clear the pending operation now that it has been completed
-                callback = self._pending_operation_callbacks[mid]
-                del self._pending_operation_callbacks[mid]
+                callback = self._pending_operation_callbacks.pop(mid)
+                deadline = self._pending_operation_timers.pop(mid, None)
+                if deadline:
+                    deadline.cancel()
 
                 # Since the operation is complete, indicate the callback should be triggered
                 trigger_callback = True
 
+            elif mid in self._unacknowledged_mids:
+                # Nobody is waiting for this one
+                self._unacknowledged_mids.remove(mid)
+
+            elif mid in self._expired_mids:
+                # The operation already failed with an OperationTimeoutError
+                logger.info("Late response received for expired MID: {}".format(mid))
+                self._expired_mids.remove(mid)
+
             else:
-                # Otherwise, store the mid as an unknown response
+                # Otherwise, store the mid as an unknown response.  The operation is established
+                # right after the Paho call returns, so the response is forgotten soon after.
                 logger.warning("Response received for unknown MID: {}".format(mid))
-                self._unknown_operation_completions[
-                    mid
-                ] = mid  # TODO: set something more useful here
+                if mid in self._unknown_operation_completions:
+                    self._unknown_operation_completions.pop(mid).cancel()
+                elif len(self._unknown_operation_completions) >= self._max_unknown_completions:
+                    self._unknown_operation_completions.popitem(last=False)[1].cancel()
+                self._unknown_operation_completions[mid] = self._get_timer_wheel().schedule(
+                    UNKNOWN_COMPLETION_TIMEOUT,
+                    functools.partial(self._forget_unknown_completion, mid),
+                )
 
         # Now that the lock has been released, if the callback should be triggered,
         # go ahead and trigger it now.
@@ -316,11 +623,37 @@ class OperationManager(object):
             logger.info(
                 "Response received for recognized MID: {} - triggering callback".format(mid)
             )
-            if callback:
-                try:
+            self._trigger_callback(mid, callback)
+
+    def _expire_operation(self, mid):
+        with self._lock:
+            if mid not in self._pending_operation_timers:
+                # The response arrived while the deadline was firing
+                return
+            del self._pending_operation_timers[mid]
+            callback = self._pending_operation_callbacks.pop(mid)
+            self._expired_mids.add(mid)
+            self.expired_count += 1
+
+        logger.warning("No response received for MID: {} - operation timed out".format(mid))
+        error = OperationTimeoutError(
+            "No response received for MID {} within {} seconds".format(mid, self._operation_timeout)
+        )
+        self._trigger_callback(mid, callback, error)
+
+    def _forget_unknown_completion(self, mid):
+        with self._lock:
+            self._unknown_operation_completions.pop(mid, None)
+
+    def _trigger_callback(self, mid, callback, error=None):
+        if callback:
+            try:
+                if error:
+                    callback(error=error)
+                else:
                     callback()
-                except Exception:
-                    logger.error("Unexpected error calling callback for MID: {}".format(mid))
-                    logger.error(traceback.format_exc())
-            else:
-                logger.info("No callback set for MID: {}".format(mid))
+            except Exception:
+                logger.error("Unexpected error calling callback for MID: {}".format(mid))
+                logger.error(traceback.format_exc())
+        else:
+            logger.info("No callback set for MID: {}".format(mid))
@@ -0,0 +1,351 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a durable, size-capped FIFO of records, stored on disk as an append-only
+segment log.
+"""
+
+import logging
+import os
+import struct
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Eviction policies, used when appending a record to a full outbox
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+EVICTION_POLICIES = (DROP_OLDEST, DROP_NEWEST)
+
+DEFAULT_SEGMENT_SIZE = 1024 * 1024
+
+# Each record is stored as a header containing the length and CRC32 of the payload, followed by
+# the payload itself.
+_RECORD_HEADER = struct.Struct(">II")
+_SEGMENT_SUFFIX = ".log"
+_HEAD_FILE_NAME = "head"
+
+
+class OutboxFullError(Exception):
+    """
+    Raised when a record cannot be added to an outbox because there is no room for it.
+    """
+
+    pass
+
+
+def _segment_file_name(segment_id):
+    return "{:020d}{}".format(segment_id, _SEGMENT_SUFFIX)
+
+
+def _replace_file(src, dst):
+    # os.replace does not exist in Python 2.7, and os.rename does not overwrite on Windows.
+    replace = getattr(os, "replace", None)
+    if replace:
+        replace(src, dst)
+    else:
+        if os.name == "nt" and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class Outbox(object):
+    """
+    A durable FIFO of byte string records, which survives restarts of the process.
+
+    Records are appended to segment files in a directory.  When the active segment grows past
+    segment_size, a new segment is started.  Reading a record does not remove it.  Records are
+    only removed from the head of the outbox when they are committed, and segments are deleted
+    once every record in them has been committed.  The position of the head is kept in a
+    separate file so that committed records are not read again after a restart.
+
+    Records which were only partially written when the process stopped are discarded when the
+    outbox is opened.
+
+    This object is not thread-safe.
+
+    :ivar size: The number of bytes used by the records which have not been committed.
+    :type size: int
+    """
+
+    def __init__(
+        self, path, max_size, eviction_policy=DROP_OLDEST, segment_size=DEFAULT_SEGMENT_SIZE
+    ):
+        """
+        Initializer for Outbox objects.  If the directory already contains an outbox, the
+        records which were not committed before are read again, starting from the oldest one.
+
+        :param str path: The directory in which to keep the outbox.  It is created if it
+          does not exist.
+        :param int max_size: The maximum number of bytes which uncommitted records can use.
+        :param str eviction_policy: What to do when a record is appended to a full outbox.
+          DROP_OLDEST removes records from the head of the outbox until the new record fits.
+          DROP_NEWEST refuses the new record.
+        :param int segment_size: The size at which a new segment file is started.
+
+        :raises: ValueError if eviction_policy is not one of EVICTION_POLICIES
+        """
+        if eviction_policy not in EVICTION_POLICIES:
+            raise ValueError("Invalid eviction_policy: {}".format(eviction_policy))
+        self.path = path
+        self.max_size = max_size
+        self.eviction_policy = eviction_policy
+        self.segment_size = segment_size
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self._segment_ids = []
+        self._segment_sizes = {}
+        self._head = (0, 0)
+        self._read_position = (0, 0)
+        self._read_file = None
+        self._read_segment_id = None
+        self._write_file = None
+        self._count = 0
+        self.size = 0
+        self._open()
+
+    def __len__(self):
+        return self._count
+
+    def _segment_path(self, segment_id):
+        return os.path.join(self.path, _segment_file_name(segment_id))
+
+    def _open(self):
+        for file_name in os.listdir(self.path):
+            if file_name.endswith(_SEGMENT_SUFFIX):
+                self._segment_ids.append(int(file_name[: -len(_SEGMENT_SUFFIX)]))
+        self._segment_ids.sort()
+
+        head_path = os.path.join(self.path, _HEAD_FILE_NAME)
+        if os.path.exists(head_path):
+            with open(head_path, "r") as f:
+                segment_id, offset = f.read().split()
+            self._head = (int(segment_id), int(offset))
+        elif self._segment_ids:
+            self._head = (self._segment_ids[0], 0)
+        if self._segment_ids and self._head[0] not in self._segment_ids:
+            logger.warning("Outbox head refers to a missing segment.  Starting from the oldest one")
+            self._head = (self._segment_ids[0], 0)
+
+        # Segments before the head have been committed completely, but the process stopped
+        # before they were deleted.
+        for segment_id in [s for s in self._segment_ids if s < self._head[0]]:
+            os.remove(self._segment_path(segment_id))
+            self._segment_ids.remove(segment_id)
+
+        # Validate every segment, and count the records which have not been committed.
+        for segment_id in list(self._segment_ids):
+            start = self._head[1] if segment_id == self._head[0] else 0
+            valid_size, count = self._scan_segment(segment_id, start)
+            self._segment_sizes[segment_id] = valid_size
+            self._count += count
+            self.size += valid_size - start
+
+        if not self._segment_ids:
+            self._head = (self._head[0], 0)
+            self._segment_ids.append(self._head[0])
+            self._segment_sizes[self._head[0]] = 0
+        self._read_position = self._head
+
+        active_segment_id = self._segment_ids[-1]
+        self._write_file = open(self._segment_path(active_segment_id), "ab")
+        logger.info(
+            "Opened outbox at {} with {} records ({} bytes)".format(
+                self.path, self._count, self.size
+            )
+        )
+
+    def _scan_segment(self, segment_id, start):
+        """
+        Return the size of the valid part of a segment, and the number of records in it after the
+        start offset.  Anything after the last complete record is truncated.
+        """
+        segment_path = self._segment_path(segment_id)
+        count = 0
+        with open(segment_path, "rb") as f:
+            f.seek(start)
+            valid_size = start
+            while True:
+                record = self._read_record(f)
+                if record is None:
+                    break
+                valid_size = f.tell()
+                count += 1
+        if os.path.getsize(segment_path) != valid_size:
+            logger.warning(
+                "Discarding partially written record at the end of outbox segment {}".format(
+                    segment_path
+                )
+            )
+            with open(segment_path, "r+b") as f:
+                f.truncate(valid_size)
+        return valid_size, count
+
+    @staticmethod
+    def _read_record(f):
+        header = f.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size:
+            return None
+        length, crc = _RECORD_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) & 0xFFFFFFFF != crc:
+            return None
+        return payload
+
+    def append(self, record):
+        """
+        Add a record to the tail of the outbox.  The record is flushed to the operating system
+        before this function returns.
+
+        :param bytes record: The record to add.
+
+        :returns: The number of records which were evicted to make room for this one.
+        :raises: OutboxFullError if the record does not fit into the outbox.
+        """
+        record_size = _RECORD_HEADER.size + len(record)
+        if record_size > self.max_size:
+            raise OutboxFullError("Record is larger than the outbox")
+
+        evicted = 0
+        if self.size + record_size > self.max_size:
+            if self.eviction_policy == DROP_NEWEST:
+                raise OutboxFullError("Outbox is full")
+            while self.size + record_size > self.max_size:
+                self._evict_oldest()
+                evicted += 1
+            logger.warning("Outbox is full.  Dropped {} oldest records".format(evicted))
+
+        active_segment_id = self._segment_ids[-1]
+        if self._segment_sizes[active_segment_id] >= self.segment_size:
+            active_segment_id = self._start_segment()
+
+        self._write_file.write(
+            _RECORD_HEADER.pack(len(record), zlib.crc32(record) & 0xFFFFFFFF) + record
+        )
+        self._write_file.flush()
+        self._segment_sizes[active_segment_id] += record_size
+        self.size += record_size
+        self._count += 1
+        return evicted
+
+    def _start_segment(self):
+        self._write_file.flush()
+        os.fsync(self._write_file.fileno())
+        self._write_file.close()
+        segment_id = self._segment_ids[-1] + 1
+        self._segment_ids.append(segment_id)
+        self._segment_sizes[segment_id] = 0
+        self._write_file = open(self._segment_path(segment_id), "ab")
+        return segment_id
+
+    def _evict_oldest(self):
+        segment_id, offset = self._next_position(self._head)
+        with open(self._segment_path(segment_id), "rb") as f:
+            f.seek(offset)
+            record = self._read_record(f)
+            position = (segment_id, f.tell())
+        self._commit(self._next_position(position), len(record) + _RECORD_HEADER.size, 1)
+
+    def _next_position(self, position):
+        """
+        Return the position of the record following the given position, moving to the start of
+        the next segment if the position is at the end of a segment.
+        """
+        segment_id, offset = position
+        if offset >= self._segment_sizes[segment_id] and segment_id != self._segment_ids[-1]:
+            return (self._segment_ids[self._segment_ids.index(segment_id) + 1], 0)
+        return position
+
+    def read(self):
+        """
+        Read the next record which has not been read yet, without removing it from the outbox.
+
+        :returns: A (position, record) tuple, where position can be passed to commit once the
+          record has been dealt with, or None if every record has been read.
+        """
+        if self._read_position < self._head:
+            self._read_position = self._head
+        self._read_position = self._next_position(self._read_position)
+        segment_id, offset = self._read_position
+        if offset >= self._segment_sizes[segment_id]:
+            return None
+
+        if self._read_segment_id != segment_id:
+            self._close_read_file()
+            self._read_file = open(self._segment_path(segment_id), "rb")
+            self._read_segment_id = segment_id
+        # The record may still be sitting in the buffer of the write file
+        self._write_file.flush()
+        self._read_file.seek(offset)
+        record = self._read_record(self._read_file)
+        self._read_position = (segment_id, self._read_file.tell())
+        return (self._read_position, record)
+
+    def rewind(self):
+        """
+        Make the next call to read start again from the oldest uncommitted record.
+        """
+        self._read_position = self._head
+
+    def commit(self, position):
+        """
+        Remove every record up to and including the record at the given position from the outbox.
+
+        :param position: A position returned by read.
+        """
+        if position <= self._head:
+            return
+        # Count the records and bytes between the head and the new position
+        size = 0
+        count = 0
+        segment_id, offset = self._head
+        while (segment_id, offset) < position:
+            with open(self._segment_path(segment_id), "rb") as f:
+                f.seek(offset)
+                end = position[1] if segment_id == position[0] else self._segment_sizes[segment_id]
+                while f.tell() < end:
+                    self._read_record(f)
+                    count += 1
+                size += end - offset
+            segment_id, offset = self._next_position((segment_id, end))
+        self._commit(self._next_position(position), size, count)
+
+    def _commit(self, position, size, count):
+        self._head = position
+        self.size -= size
+        self._count -= count
+
+        head_path = os.path.join(self.path, _HEAD_FILE_NAME)
+        with open(head_path + ".tmp", "w") as f:
+            f.write("{} {}".format(*position))
+            f.flush()
+            os.fsync(f.fileno())
+        _replace_file(head_path + ".tmp", head_path)
+
+        while self._segment_ids[0] < position[0]:
+            segment_id = self._segment_ids.pop(0)
+            del self._segment_sizes[segment_id]
+            if self._read_segment_id == segment_id:
+                self._close_read_file()
+            os.remove(self._segment_path(segment_id))
+
+    def _close_read_file(self):
+        if self._read_file is not None:
+            self._read_file.close()
+            self._read_file = None
+            self._read_segment_id = None
+
+    def close(self):
+        """
+        Close the files used by the outbox.  The outbox can not be used after it has been closed.
+        """
+        self._close_read_file()
+        if self._write_file is not None:
+            self._write_file.flush()
+            os.fsync(self._write_file.fileno())
+            self._write_file.close()
+            self._write_file = None
@@ -0,0 +1,151 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import logging
+from . import pipeline_ops_base
+
+logger = logging.getLogger(__name__)
+
+# Matches the default in-flight window of the Paho MQTT client
+DEFAULT_MAX_INFLIGHT_MESSAGES = 20
+DEFAULT_MAX_PENDING_REQUESTS = 64
+DEFAULT_RECONNECT_INITIAL_DELAY = 1.0
+DEFAULT_RECONNECT_MAX_DELAY = 60.0
+
+
+class BasePipelineConfig(object):
+    """
+    A base class for storing all configurations/options shared across pipelines.  More specific
+    configurations, such as those that only apply to IoTHub pipelines, are found in the config
+    modules of the respective packages.
+
+    The configuration object is attached to the PipelineRootStage, so any stage can read it
+    through self.pipeline_root.pipeline_configuration.
+    """
+
+    def __init__(
+        self,
+        max_inflight_messages=DEFAULT_MAX_INFLIGHT_MESSAGES,
+        executor_shards=1,
+        mqtt_io_threads=None,
+        tls_session_resumption=False,
+        event_loop=None,
+        operation_timeout=None,
+        request_timeout=None,
+        max_pending_requests=DEFAULT_MAX_PENDING_REQUESTS,
+        connection_queue_drain_rate=None,
+        connection_queue_max_sizes=None,
+        auto_reconnect=True,
+        reconnect_initial_delay=DEFAULT_RECONNECT_INITIAL_DELAY,
+        reconnect_max_delay=DEFAULT_RECONNECT_MAX_DELAY,
+        warm_standby_reconnect=False,
+    ):
+        """
+        Initializer for BasePipelineConfig
+
+        :param int max_inflight_messages: The maximum number of QoS 1 publishes which can be
+        awaiting acknowledgement from the service at any given time.
+        :param int executor_shards: The number of pipeline threads (and callback threads) which
+        pipelines are spread across.  Each pipeline is pinned to one of them based on the
+        identity of its client.  With the default of 1, every pipeline in the process shares a
+        single pipeline thread and a single callback thread.  Pipelines which should share
+        threads must use the same value.
+        :param int mqtt_io_threads: The number of shared I/O threads which drive the MQTT
+        connections of every pipeline in the process.  Each connection is pinned to one of them
+        based on the identity of its client.  If not provided, each MQTT connection uses a network
+        thread of its own.  Requires Python 3.
+        :param bool tls_session_resumption: If True, the TLS session of a connection is offered to
+        the server when reconnecting, so that the full TLS handshake can be skipped.  Requires
+        Python 3.6.
+        :param event_loop: An asyncio event loop which runs the pipeline and drives its MQTT
+        connection, in place of the pipeline thread, the callback thread and the network thread.
+        Only for use with the aio clients, which must then be used from that loop.  The loop must
+        support add_reader and add_writer.
+        :param float operation_timeout: The number of seconds to wait for the server to
+        acknowledge an MQTT publish, subscribe or unsubscribe.  Operations which are not
+        acknowledged in time fail with an OperationTimeoutError.  If not provided, operations
+        wait forever.
+        :param float request_timeout: The number of seconds to wait for the response to a twin
+        request, or any other request which is answered by a response message.  Requests which
+        are not answered in time fail with a RequestTimeoutError.  If not provided, requests wait
+        forever.
+        :param int max_pending_requests: The maximum number of requests which can be waiting for
+        a response at any given time.  Further requests are held back until responses arrive, or
+        until requests time out.  Only applies if request_timeout is provided.
+        :param float connection_queue_drain_rate: The maximum number of operations per second
+        which are released once a connection is established, from those that were waiting for
+        it.  Operations are released by priority: control operations first, then method
+        responses, twin requests and telemetry.  If not provided, they are all released at once.
+        :param dict connection_queue_max_sizes: The maximum number of operations of each priority
+        which can wait for a connection, keyed by priority ("control", "method_response", "twin"
+        or "telemetry").  Further operations of that priority fail with a
+        ConnectionQueueFullError.  Priorities which are not in the dictionary are not bounded.
+        :param bool auto_reconnect: If True, a connection which is lost without being
+        disconnected is re-established, and the features which were enabled are enabled again.
+        :param float reconnect_initial_delay: The longest wait, in seconds, before the first
+        attempt to reconnect.  The longest wait doubles with every failed attempt.  Every wait is
+        picked at random between 0 and the longest wait, so that clients which lost their
+        connections at the same moment do not all reconnect at the same moment.
+        :param float reconnect_max_delay: The number of seconds past which the longest wait
+        between attempts to reconnect stops doubling.
+        :param bool warm_standby_reconnect: If True, reconnecting with new credentials (such as a
+        renewed SAS token) opens the new connection before the old one is closed, so that
+        operations do not wait for a disconnect and a full reconnect.  This shortens the gap, but
+        does not remove it: the service only allows one connection per client id, so it drops
+        the old connection as soon as the new one is established, and publishes which are in
+        flight on it at that moment are not acknowledged.  They are sent again on the new
+        connection, so delivery is at least once, and a message may be received twice.  The new
+        connection is subscribed to every topic the old one was.
+
+        :raises: ValueError if max_inflight_messages, executor_shards or mqtt_io_threads is not a
+        positive integer
+        :raises: ValueError if operation_timeout or request_timeout is not a positive number
+        :raises: ValueError if max_pending_requests is not a positive integer
+        :raises: ValueError if connection_queue_drain_rate is not a positive number
+        :raises: ValueError if connection_queue_max_sizes has an unknown priority, or a size which
+        is not a positive integer
+        :raises: ValueError if reconnect_initial_delay or reconnect_max_delay is not a positive
+        number, or if reconnect_max_delay is less than reconnect_initial_delay
+        """
+        if max_inflight_messages < 1:
+            raise ValueError("max_inflight_messages must be a positive integer")
+        if executor_shards < 1:
+            raise ValueError("executor_shards must be a positive integer")
+        if mqtt_io_threads is not None and mqtt_io_threads < 1:
+            raise ValueError("mqtt_io_threads must be a positive integer")
+        if operation_timeout is not None and operation_timeout <= 0:
+            raise ValueError("operation_timeout must be a positive number")
+        if request_timeout is not None and request_timeout <= 0:
+            raise ValueError("request_timeout must be a positive number")
+        if max_pending_requests < 1:
+            raise ValueError("max_pending_requests must be a positive integer")
+        if connection_queue_drain_rate is not None and connection_queue_drain_rate <= 0:
+            raise ValueError("connection_queue_drain_rate must be a positive number")
+        for priority, max_size in (connection_queue_max_sizes or {}).items():
+            if priority not in pipeline_ops_base.PRIORITIES:
+                raise ValueError(
+                    "Unknown priority in connection_queue_max_sizes: {}".format(priority)
+                )
+            if max_size < 1:
+                raise ValueError("connection_queue_max_sizes must be positive integers")
+        if reconnect_initial_delay <= 0:
+            raise ValueError("reconnect_initial_delay must be a positive number")
+        if reconnect_max_delay < reconnect_initial_delay:
+            raise ValueError("reconnect_max_delay must not be less than reconnect_initial_delay")
+        self.max_inflight_messages = max_inflight_messages
+        self.executor_shards = executor_shards
+        self.mqtt_io_threads = mqtt_io_threads
+        self.tls_session_resumption = tls_session_resumption
+        self.event_loop = event_loop
+        self.operation_timeout = operation_timeout
+        self.request_timeout = request_timeout
+        self.max_pending_requests = max_pending_requests
+        self.connection_queue_drain_rate = connection_queue_drain_rate
+        self.connection_queue_max_sizes = dict(connection_queue_max_sizes or {})
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_initial_delay = reconnect_initial_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.warm_standby_reconnect = warm_standby_reconnect
@@ -64,3 +64,23 @@ class IotResponseEvent(PipelineEvent):
         self.request_id = request_id
         self.status_code = status_code
         self.response_body = response_body
+
+
+class ReconnectAttemptEvent(PipelineEvent):
+    """
+    A PipelineEvent object which reports an attempt to re-establish a connection which was lost
+    unexpectedly.  One of these is raised for every attempt, whether it succeeds or fails.
+
+    :ivar attempt: The number of the attempt, counting from 1 since the connection was lost.
+    :type attempt: int
+    :ivar error: The error which the attempt failed with, or None if it succeeded.
+    :type error: Exception
+    :ivar next_delay: The number of seconds until the next attempt, or None if there is none.
+    :type next_delay: float
+    """
+
+    def __init__(self, attempt, error, next_delay):
+        super(ReconnectAttemptEvent, self).__init__()
+        self.attempt = attempt
+        self.error = error
+        self.next_delay = next_delay
@@ -4,6 +4,14 @@
 # license information.
 # --------------------------------------------------------------------------
 
+# Priorities of operations.  Operations which are waiting for a connection are released in the
+# order of PRIORITIES, highest first, once it is established.
+PRIORITY_CONTROL = "control"
+PRIORITY_METHOD_RESPONSE = "method_response"
+PRIORITY_TWIN = "twin"
+PRIORITY_TELEMETRY = "telemetry"
+PRIORITIES = (PRIORITY_CONTROL, PRIORITY_METHOD_RESPONSE, PRIORITY_TWIN, PRIORITY_TELEMETRY)
+
 
 class PipelineOperation(object):
     """
@@ -25,6 +33,9 @@ class PipelineOperation(object):
       requires a connection to operate.  This is currently used by the EnsureConnectionStage
       stage, but this functionality will be revamped shortly.
     :type needs_connection: Boolean
+    :ivar priority: The priority of the operation, one of PRIORITIES.  This is used by the
+      EnsureConnectionStage stage to decide which operations to release first after connecting.
+    :type priority: str
     :ivar error: The presence of a value in the error attribute indicates that the operation failed,
       absence of this value indicates that the operation either succeeded or hasn't been handled yet.
     :type error: Error
@@ -45,6 +56,7 @@ class PipelineOperation(object):
         self.name = self.__class__.__name__
         self.callback = callback
         self.needs_connection = False
+        self.priority = PRIORITY_CONTROL
         self.error = None
 
 
@@ -70,9 +82,22 @@ class ReconnectOperation(PipelineOperation):
     This operation is in the group of base operations because reconnecting is a common operation that many clients might need to do.
 
     Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IoTHub or MQTT stage).
+
+    :ivar pause_duration: The number of seconds for which other operations were held back while
+      reconnecting, or None if they were not held back.
+    :type pause_duration: float
     """
 
-    pass
+    def __init__(self, callback=None):
+        """
+        Initializer for ReconnectOperation objects.
+
+        :param Function callback: The function that gets called when this operation is complete or has
+          failed.  The callback function must accept A PipelineOperation object which indicates
+          the specific operation which has completed or failed.
+        """
+        super(ReconnectOperation, self).__init__(callback=callback)
+        self.pause_duration = None
 
 
 class DisconnectOperation(PipelineOperation):
@@ -84,7 +109,18 @@ class DisconnectOperation(PipelineOperation):
     Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IoTHub or MQTT stage).
     """
 
-    pass
+    def __init__(self, callback=None):
+        """
+        Initializer for DisconnectOperation objects.
+
+        :param Function callback: The function that gets called when this operation is complete or has
+          failed.  The callback function must accept A PipelineOperation object which indicates
+          the specific operation which has completed or failed.
+        """
+        super(DisconnectOperation, self).__init__(callback=callback)
+        # Released last, so that operations which are waiting for a connection are sent before
+        # disconnecting, as they would be if they had not been waiting.
+        self.priority = PRIORITY_TELEMETRY
 
 
 class EnableFeatureOperation(PipelineOperation):
@@ -242,6 +278,7 @@ class SendIotRequestAndWaitForResponseOperation(PipelineOperation):
         self.status_code = None
         self.response_body = None
         self.needs_connection = True
+        self.priority = PRIORITY_TWIN
 
 
 class SendIotRequestOperation(PipelineOperation):
@@ -279,3 +316,4 @@ class SendIotRequestOperation(PipelineOperation):
         self.request_body = request_body
         self.request_id = request_id
         self.needs_connection = True
+        self.priority = PRIORITY_TWIN
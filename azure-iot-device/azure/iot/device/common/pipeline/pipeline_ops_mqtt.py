@@ -42,12 +42,15 @@ class MQTTPublishOperation(PipelineOperation):
     This operation is in the group of MQTT operations because its attributes are very specific to the MQTT protocol.
     """
 
-    def __init__(self, topic, payload, callback=None):
+    def __init__(self, topic, payload, qos=1, callback=None):
         """
         Initializer for MQTTPublishOperation objects.
 
         :param str topic: The name of the topic to publish to
         :param str payload: The payload to publish
+        :param int qos: The quality of service level to publish with.  A QoS 1 publish completes
+          when the server acknowledges it, a QoS 0 publish completes as soon as it has been handed
+          to the protocol client library, and may be lost.
         :param Function callback: The function that gets called when this operation is complete or has failed.
           The callback function must accept A PipelineOperation object which indicates the specific operation which
           has completed or failed.
@@ -55,6 +58,7 @@ class MQTTPublishOperation(PipelineOperation):
         super(MQTTPublishOperation, self).__init__(callback=callback)
         self.topic = topic
         self.payload = payload
+        self.qos = qos
 
 
 class MQTTSubscribeOperation(PipelineOperation):
@@ -68,7 +72,8 @@ class MQTTSubscribeOperation(PipelineOperation):
         """
         Initializer for MQTTSubscribeOperation objects.
 
-        :param str topic: The name of the topic to subscribe to
+        :param topic: The name of the topic to subscribe to, or a list of topic names to
+          subscribe to with a single request
         :param Function callback: The function that gets called when this operation is complete or has failed.
           The callback function must accept A PipelineOperation object which indicates the specific operation which
           has completed or failed.
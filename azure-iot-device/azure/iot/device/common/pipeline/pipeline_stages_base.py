@@ -6,14 +6,18 @@
 
 import logging
 import abc
+import collections
+import functools
+import itertools
+import random
 import six
-import uuid
-from six.moves import queue
+import time
 from . import pipeline_events_base
 from . import pipeline_ops_base
 from . import operation_flow
 from . import pipeline_thread
-from azure.iot.device.common import unhandled_exceptions
+from .config import BasePipelineConfig
+from azure.iot.device.common import timer_wheel, unhandled_exceptions
 
 logger = logging.getLogger(__name__)
 
@@ -168,15 +172,67 @@ class PipelineRootStage(PipelineStage):
       events from the pipeline (such as C2D messages).  This function is called with
       a PipelineEvent object every time any such event occurs.
     :type on_pipeline_event: Function
+    :ivar pipeline_configuration: Options which apply to the entire pipeline.  Stages read
+      these through their pipeline_root attribute.
+    :type pipeline_configuration: BasePipelineConfig
+    :ivar executor_shard: The shard of the pipeline and callback executors which this pipeline
+      runs on, or None to use the executors which are shared by every unsharded pipeline.
+    :type executor_shard: int
     """
 
-    def __init__(self):
+    def __init__(self, pipeline_configuration=None, executor_shard=None):
         super(PipelineRootStage, self).__init__()
         self.on_pipeline_event = None
+        if pipeline_configuration is None:
+            pipeline_configuration = BasePipelineConfig()
+        self.pipeline_configuration = pipeline_configuration
+        self.executor_shard = executor_shard
 
     def run_op(self, op):
-        op.callback = pipeline_thread.invoke_on_callback_thread_nowait(op.callback)
-        pipeline_thread.invoke_on_pipeline_thread(super(PipelineRootStage, self).run_op)(op)
+        op.callback = pipeline_thread.invoke_on_callback_thread_nowait(
+            op.callback, shard=self.executor_shard
+        )
+        pipeline_thread.invoke_on_pipeline_thread(
+            super(PipelineRootStage, self).run_op, shard=self.executor_shard
+        )(op)
+
+    def run_op_batch(self, ops, callback):
+        """
+        Run a list of operations using a single switch into the pipeline thread.
+
+        The individual operations complete inside the pipeline thread.  Once all of them have
+        completed, the callback is called once on the callback thread with the list of
+        operations, so the caller can inspect the error attribute of each one.  Any callbacks
+        already set on the operations are replaced.
+
+        :param list ops: The operations to run.
+        :param callback: Function which is called with the list of operations after all of the
+          operations have completed.
+        """
+        callback = pipeline_thread.invoke_on_callback_thread_nowait(
+            callback, shard=self.executor_shard
+        )
+        if not ops:
+            callback(ops)
+            return
+
+        # list instead of int to work around the lack of "nonlocal" in 2.7
+        remaining = [len(ops)]
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_op_complete(op):
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                callback(ops)
+
+        for op in ops:
+            op.callback = on_op_complete
+
+        def run_ops():
+            for op in ops:
+                super(PipelineRootStage, self).run_op(op)
+
+        pipeline_thread.invoke_on_pipeline_thread(run_ops, shard=self.executor_shard)()
 
     @pipeline_thread.runs_on_pipeline_thread
     def _run_op(self, op):
@@ -222,6 +278,18 @@ class PipelineRootStage(PipelineStage):
             logger.warning("incoming pipeline event with no handler.  dropping.")
 
 
+class ConnectionQueueFullError(Exception):
+    """An operation could not wait for a connection, because too many operations of the same
+    priority are already waiting."""
+
+    pass
+
+
+# The shortest interval between two batches of operations released by EnsureConnectionStage, so
+# that a high connection_queue_drain_rate does not mean a timer for every operation.
+_minimum_release_interval = 0.05
+
+
 class EnsureConnectionStage(PipelineStage):
     # TODO: additional documentation and tests for this class are not being implemented because a significant rewriting to support more scenarios is pending
     """
@@ -229,6 +297,17 @@ class EnsureConnectionStage(PipelineStage):
     it needs to be connected, and it's responsible for queueing operations
     while we're waiting for the connect operation to complete.
 
+    Queued operations are kept in a queue per priority, and once the connection is complete they
+    are released highest priority first, at the connection_queue_drain_rate of the pipeline
+    configuration.  Operations which arrive while the queues are still being released are queued
+    behind them, so that a method response is not stuck behind telemetry which was queued before
+    it.
+
+    A ReconnectOperation, such as the one which puts a new sas token to use, also blocks this
+    stage, so that operations are held back while the protocol client reconnects and released
+    once it is done.  Unless the warm_standby_reconnect option is set, in which case the
+    protocol client keeps sending on the old connection while the new one connects.
+
     Note: this stage will likely be replaced by a more full-featured stage to handle
     other "block while we're setting something up" operations, such as subscribing to
     twin responses.  That is another example where we want to ensure some state and block
@@ -238,8 +317,13 @@ class EnsureConnectionStage(PipelineStage):
     def __init__(self):
         super(EnsureConnectionStage, self).__init__()
         self.connected = False
-        self.queue = queue.Queue()
+        # Priority -> operations of that priority which are waiting, in the order of PRIORITIES
+        self.queues = collections.OrderedDict(
+            (priority, collections.deque()) for priority in pipeline_ops_base.PRIORITIES
+        )
         self.blocked = False
+        self._releasing = False
+        self._release_timer = None
 
     @pipeline_thread.runs_on_pipeline_thread
     def _run_op(self, op):
@@ -251,7 +335,16 @@ class EnsureConnectionStage(PipelineStage):
                     self.name, op.name
                 )
             )
-            self.queue.put_nowait(op)
+            self._queue_op(op)
+
+        # If queued operations are still being released, this one waits its turn.
+        elif self.queued_op_count and not self._releasing:
+            logger.info(
+                "{}({}): queued operations are being released.  queueing.".format(
+                    self.name, op.name
+                )
+            )
+            self._queue_op(op)
 
         # If we get a request to connect, we either complete immediately (if we're already
         # connected) or we do the connect operation, which is pulled out into a helper
@@ -281,6 +374,24 @@ class EnsureConnectionStage(PipelineStage):
             else:
                 operation_flow.pass_op_to_next_stage(self, op)
 
+        # If we get a request to reconnect, such as to use new credentials, we either complete
+        # it immediately (if we're not connected, since the next connect uses them anyway) or
+        # we block this stage while the protocol client reconnects, so that operations wait
+        # for the new connection instead of failing on the old one.  With a warm standby, the
+        # protocol client keeps the old connection until the new one is up, so nothing waits.
+        elif isinstance(op, pipeline_ops_base.ReconnectOperation):
+            if not self.connected:
+                logger.info(
+                    "{}({}): protocol client is not connected.  completing early.".format(
+                        self.name, op.name
+                    )
+                )
+                operation_flow.complete_op(self, op)
+            elif self.pipeline_root.pipeline_configuration.warm_standby_reconnect:
+                operation_flow.pass_op_to_next_stage(self, op)
+            else:
+                self._do_reconnect(op)
+
         # Any other operation that requires a connection can trigger a connection if
         # we're not connected.
         elif op.needs_connection and not self.connected:
@@ -291,6 +402,40 @@ class EnsureConnectionStage(PipelineStage):
         else:
             operation_flow.pass_op_to_next_stage(self, op)
 
+    @property
+    def queued_op_count(self):
+        """The number of operations which are waiting to be released"""
+        return sum(len(ops) for ops in self.queues.values())
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _queue_op(self, op):
+        """
+        Queue an operation with the others of its priority, or fail it if there are too many.
+        """
+        ops = self.queues[op.priority]
+        max_size = self.pipeline_root.pipeline_configuration.connection_queue_max_sizes.get(
+            op.priority
+        )
+        if max_size is not None and len(ops) >= max_size:
+            logger.warning(
+                "{}({}): too many {} operations waiting for connect.  failing.".format(
+                    self.name, op.name, op.priority
+                )
+            )
+            op.error = ConnectionQueueFullError(
+                "Too many {} operations are waiting for a connection".format(op.priority)
+            )
+            operation_flow.complete_op(self, op)
+        else:
+            ops.append(op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _next_queued_op(self):
+        for ops in self.queues.values():
+            if ops:
+                return ops.popleft()
+        return None
+
     @pipeline_thread.runs_on_pipeline_thread
     def _block(self, op):
         """
@@ -309,14 +454,14 @@ class EnsureConnectionStage(PipelineStage):
         logger.info("{}({}): disabling block and releasing queued ops.".format(self.name, op.name))
         self.blocked = False
         logger.info(
-            "{}({}): processing {} items in queue".format(self.name, op.name, self.queue.qsize())
+            "{}({}): processing {} items in queue".format(self.name, op.name, self.queued_op_count)
         )
-        # loop through our queue and release all the blocked operations
-        while not self.queue.empty():
-            op_to_release = self.queue.get_nowait()
-            if error:
-                # if we're unblocking the queue because something (like a connect operation) failed,
-                # then we fail all of the blocked operations with the same error.
+        if error:
+            # if we're unblocking the queue because something (like a connect operation) failed,
+            # then we fail all of the blocked operations with the same error.
+            self._cancel_release_timer()
+            op_to_release = self._next_queued_op()
+            while op_to_release:
                 logger.info(
                     "{}({}): failing {} op because of error".format(
                         self.name, op.name, op_to_release.name
@@ -324,13 +469,50 @@ class EnsureConnectionStage(PipelineStage):
                 )
                 op_to_release.error = error
                 operation_flow.complete_op(self, op_to_release)
-            else:
-                # when we release, go back through this stage again to make sure requirements are _really_ satisfied.
-                # this also pre-maturely completes ops that might now be satisfied.
-                logger.info(
-                    "{}({}): releasing {} op.".format(self.name, op.name, op_to_release.name)
-                )
+                op_to_release = self._next_queued_op()
+        else:
+            self._release_queued_ops()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _release_queued_ops(self):
+        """
+        Release queued operations, highest priority first.  If there is a drain rate, release one
+        batch of them, and schedule the release of the next batch.
+        """
+        self._cancel_release_timer()
+        rate = self.pipeline_root.pipeline_configuration.connection_queue_drain_rate
+        if rate is None:
+            batch_size = interval = None
+        else:
+            interval = max(1.0 / rate, _minimum_release_interval)
+            batch_size = max(1, int(rate * interval))
+
+        released = 0
+        while not self.blocked and (batch_size is None or released < batch_size):
+            op_to_release = self._next_queued_op()
+            if op_to_release is None:
+                return
+            # when we release, go back through this stage again to make sure requirements are _really_ satisfied.
+            # this also pre-maturely completes ops that might now be satisfied.
+            logger.info("{}: releasing {} op.".format(self.name, op_to_release.name))
+            released += 1
+            self._releasing = True
+            try:
                 self.run_op(op_to_release)
+            finally:
+                self._releasing = False
+
+        # If the stage is blocked again, the rest is released once the connection is complete.
+        if not self.blocked and self.queued_op_count:
+            self._release_timer = timer_wheel.get_shared_timer_wheel().schedule(
+                interval, pipeline_thread.invoke_on_pipeline_thread_nowait(self._release_queued_ops)
+            )
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _cancel_release_timer(self):
+        if self._release_timer:
+            self._release_timer.cancel()
+            self._release_timer = None
 
     @pipeline_thread.runs_on_pipeline_thread
     def _do_connect(self, op):
@@ -344,7 +526,7 @@ class EnsureConnectionStage(PipelineStage):
         # that operation to run after the connection is complete.
         if not isinstance(op, pipeline_ops_base.ConnectOperation):
             logger.info("{}({}): queueing until connection complete".format(self.name, op.name))
-            self.queue.put_nowait(op)
+            self._queue_op(op)
 
         # function that gets called after we're connected.
         @pipeline_thread.runs_on_pipeline_thread
@@ -366,6 +548,33 @@ class EnsureConnectionStage(PipelineStage):
             self, pipeline_ops_base.ConnectOperation(callback=on_connected)
         )
 
+    @pipeline_thread.runs_on_pipeline_thread
+    def _do_reconnect(self, op):
+        """
+        Reconnect the protocol client, holding back all other operations until it is done.
+        """
+        self._block(op=op)
+        paused_at = time.time()
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_reconnected(op_reconnect):
+            op.pause_duration = time.time() - paused_at
+            logger.info(
+                "{}({}): reconnect is complete.  operations were paused for {:.3f} seconds.".format(
+                    self.name, op.name, op.pause_duration
+                )
+            )
+            op.error = op_reconnect.error
+            operation_flow.complete_op(self, op)
+            # Operations which were held back are released even if the reconnect failed.  If the
+            # connection is gone, they trigger a new connect instead of failing.
+            self._unblock(op=op, error=None)
+
+        logger.info("{}({}): calling down with Reconnect operation".format(self.name, op.name))
+        operation_flow.pass_op_to_next_stage(
+            self, pipeline_ops_base.ReconnectOperation(callback=on_reconnected)
+        )
+
     @pipeline_thread.runs_on_pipeline_thread
     def on_connected(self):
         self.connected = True
@@ -377,70 +586,366 @@ class EnsureConnectionStage(PipelineStage):
         PipelineStage.on_disconnected(self)
 
 
+# The number of failed reconnect attempts past which the longest wait stops doubling.  The wait is
+# capped by reconnect_max_delay long before that, this only keeps the arithmetic within a float.
+_max_reconnect_backoff_exponent = 32
+
+
+class ReconnectStage(PipelineStage):
+    """
+    This stage is responsible for re-establishing the connection when it is lost without a
+    DisconnectOperation, and for enabling the features which were enabled again once the
+    connection is back.
+
+    Attempts are spaced with capped exponential backoff and full jitter: the wait before attempt n
+    is picked at random between 0 and min(reconnect_max_delay, reconnect_initial_delay * 2 ** (n - 1))
+    seconds, so that the many clients which lose their connections at the same moment, such as
+    when the service restarts, do not all come back at the same moment.  The outcome of every
+    attempt is passed up as a ReconnectAttemptEvent.
+
+    This stage goes above EnsureConnectionStage, so that operations which need the connection
+    wait for it while an attempt is in progress.
+    """
+
+    def __init__(self):
+        super(ReconnectStage, self).__init__()
+        self.connected = False
+        # True from the moment the connection is established until a DisconnectOperation, which
+        # is when losing the connection is unexpected.
+        self.should_be_connected = False
+        # The number of DisconnectOperations which passed this stage but did not complete yet.
+        # A connection established while one is outstanding is about to be closed on purpose.
+        self._pending_disconnects = 0
+        # True from the moment the connection is lost unexpectedly until it is back
+        self.reconnecting = False
+        # The number of attempts since the connection was lost
+        self.attempt_count = 0
+        # Features to enable again once the connection is back
+        self.enabled_features = set()
+        self._reconnect_timer = None
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _run_op(self, op):
+        if isinstance(op, pipeline_ops_base.DisconnectOperation):
+            # Disconnecting on purpose, so the connection is not re-established.
+            self.should_be_connected = False
+            self._stop_reconnecting()
+            self._pending_disconnects += 1
+            callback = op.callback
+
+            @pipeline_thread.runs_on_pipeline_thread
+            def on_disconnect_complete(op):
+                self._pending_disconnects -= 1
+                callback(op)
+
+            op.callback = on_disconnect_complete
+        elif isinstance(op, pipeline_ops_base.EnableFeatureOperation):
+            self.enabled_features.add(op.feature_name)
+        elif isinstance(op, pipeline_ops_base.DisableFeatureOperation):
+            self.enabled_features.discard(op.feature_name)
+        operation_flow.pass_op_to_next_stage(self, op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _schedule_attempt(self):
+        """
+        Schedule the next reconnect attempt, and return the number of seconds until it is made.
+        """
+        config = self.pipeline_root.pipeline_configuration
+        exponent = min(self.attempt_count, _max_reconnect_backoff_exponent)
+        max_delay = min(config.reconnect_max_delay, config.reconnect_initial_delay * 2 ** exponent)
+        delay = random.uniform(0, max_delay)
+        self._reconnect_timer = timer_wheel.get_shared_timer_wheel().schedule(
+            delay, pipeline_thread.invoke_on_pipeline_thread_nowait(self._attempt_reconnect)
+        )
+        return delay
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _attempt_reconnect(self):
+        self._reconnect_timer = None
+        if not self.reconnecting:
+            # The connection came back by other means, or a DisconnectOperation arrived
+            return
+        self.attempt_count += 1
+        attempt = self.attempt_count
+        logger.info("{}: reconnect attempt {}".format(self.name, attempt))
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_connect_complete(op):
+            if op.error and self.reconnecting:
+                next_delay = self._schedule_attempt()
+                logger.warning(
+                    "{}: reconnect attempt {} failed: {}.  Retrying in {:.1f} seconds.".format(
+                        self.name, attempt, op.error, next_delay
+                    )
+                )
+            else:
+                next_delay = None
+            operation_flow.pass_event_to_previous_stage(
+                self,
+                pipeline_events_base.ReconnectAttemptEvent(
+                    attempt=attempt, error=op.error, next_delay=next_delay
+                ),
+            )
+
+        operation_flow.pass_op_to_next_stage(
+            self, pipeline_ops_base.ConnectOperation(callback=on_connect_complete)
+        )
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _stop_reconnecting(self):
+        self.reconnecting = False
+        self.attempt_count = 0
+        if self._reconnect_timer:
+            self._reconnect_timer.cancel()
+            self._reconnect_timer = None
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _enable_features(self):
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_enable_complete(op):
+            if op.error:
+                logger.warning(
+                    "{}: could not enable {} after reconnecting: {}".format(
+                        self.name, op.feature_name, op.error
+                    )
+                )
+
+        for feature_name in sorted(self.enabled_features):
+            operation_flow.pass_op_to_next_stage(
+                self,
+                pipeline_ops_base.EnableFeatureOperation(
+                    feature_name=feature_name, callback=on_enable_complete
+                ),
+            )
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def on_connected(self):
+        self.connected = True
+        if self._pending_disconnects:
+            # A connect which was in flight when a DisconnectOperation arrived completed first
+            logger.info("{}: connected while a disconnect is pending".format(self.name))
+        else:
+            self.should_be_connected = True
+        was_reconnecting = self.reconnecting
+        self._stop_reconnecting()
+        PipelineStage.on_connected(self)
+        if was_reconnecting:
+            self._enable_features()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def on_disconnected(self):
+        was_connected = self.connected
+        self.connected = False
+        PipelineStage.on_disconnected(self)
+        if (
+            was_connected
+            and self.should_be_connected
+            and not self.reconnecting
+            and self.pipeline_root.pipeline_configuration.auto_reconnect
+        ):
+            logger.info("{}: connection lost unexpectedly.  reconnecting.".format(self.name))
+            self.reconnecting = True
+            self._schedule_attempt()
+
+
+class RequestTimeoutError(Exception):
+    """The response to a request was not received before the deadline of the request."""
+
+    pass
+
+
+# The number of requests which timed out that are remembered, so that a response which arrives
+# for one of them later can be counted as late instead of unknown.
+_max_remembered_timed_out_requests = 100
+
+
 class CoordinateRequestAndResponseStage(PipelineStage):
     """
     Pipeline stage which is responsible for coordinating SendIotRequestAndWaitForResponseOperation operations.  For each
     SendIotRequestAndWaitForResponseOperation operation, this stage passes down a SendIotRequestOperation operation and waits for
     an IotResponseEvent event.  All other events are passed down unmodified.
+
+    If the request_timeout option is set in the pipeline configuration, requests which do not
+    receive a response in time are completed with a RequestTimeoutError.  No more than
+    max_pending_requests requests wait for a response at any given time then.  Requests beyond
+    that wait in this stage, and are sent in order as responses arrive or deadlines pass.  The
+    deadline of a request starts when it arrives in this stage, so it also covers the time it
+    waits to be sent.
+
+    Without a request_timeout, the number of pending requests is not limited: a response which is
+    lost, e.g. across a reconnect, would hold its place in the limit forever.
+
+    :ivar timed_out_count: The number of requests which have been completed because their
+    deadline passed.
+    :type timed_out_count: int
+    :ivar late_response_count: The number of responses which arrived after their request timed
+    out.
+    :type late_response_count: int
     """
 
     def __init__(self):
         super(CoordinateRequestAndResponseStage, self).__init__()
+        # Maps request_id->op for requests which have been sent but not yet answered
         self.pending_responses = {}
+        # Maps request_id->Timer for the deadlines of pending and waiting requests
+        self._deadlines = {}
+        # (request_id, op) for requests which have not been sent yet, because too many requests
+        # are pending
+        self._waiting_requests = collections.deque()
+        # Request ids only have to be unique among the requests of this pipeline
+        self._request_ids = itertools.count(1)
+        self._timed_out_request_ids = collections.OrderedDict()
+        self.timed_out_count = 0
+        self.late_response_count = 0
+
+    @property
+    def pending_count(self):
+        """The number of requests which are waiting for a response."""
+        return len(self.pending_responses)
+
+    @property
+    def waiting_count(self):
+        """The number of requests which are waiting to be sent."""
+        return len(self._waiting_requests)
 
     @pipeline_thread.runs_on_pipeline_thread
     def _run_op(self, op):
         if isinstance(op, pipeline_ops_base.SendIotRequestAndWaitForResponseOperation):
-            # Convert SendIotRequestAndWaitForResponseOperation operation into a SendIotRequestOperation operation
-            # and send it down.  A lower level will convert the SendIotRequestOperation into an
-            # actual protocol client operation.  The SendIotRequestAndWaitForResponseOperation operation will be
-            # completed when the corresponding IotResponse event is received in this stage.
-
-            request_id = str(uuid.uuid4())
+            config = self.pipeline_root.pipeline_configuration
+            request_id = str(next(self._request_ids))
+            if config.request_timeout:
+                self._deadlines[request_id] = timer_wheel.get_shared_timer_wheel().schedule(
+                    config.request_timeout,
+                    pipeline_thread.invoke_on_pipeline_thread_nowait(
+                        functools.partial(self._expire_request, request_id)
+                    ),
+                )
 
-            @pipeline_thread.runs_on_pipeline_thread
-            def on_send_request_done(send_request_op):
+            if (
+                config.request_timeout
+                and len(self.pending_responses) >= config.max_pending_requests
+            ):
                 logger.info(
-                    "{}({}): Finished sending {} request to {} resource {}".format(
-                        self.name, op.name, op.request_type, op.method, op.resource_location
+                    "{}({}): {} requests pending.  Waiting to send request".format(
+                        self.name, op.name, len(self.pending_responses)
                     )
                 )
-                if send_request_op.error:
-                    op.error = send_request_op.error
-                    logger.info(
-                        "{}({}): removing request {} from pending list".format(
-                            self.name, op.name, request_id
-                        )
-                    )
-                    del (self.pending_responses[request_id])
-                    operation_flow.complete_op(self, op)
-                else:
-                    # request sent.  Nothing to do except wait for the response
-                    pass
+                self._waiting_requests.append((request_id, op))
+            else:
+                self._send_request(request_id, op)
 
+        else:
+            operation_flow.pass_op_to_next_stage(self, op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _send_request(self, request_id, op):
+        # Convert SendIotRequestAndWaitForResponseOperation operation into a SendIotRequestOperation operation
+        # and send it down.  A lower level will convert the SendIotRequestOperation into an
+        # actual protocol client operation.  The SendIotRequestAndWaitForResponseOperation operation will be
+        # completed when the corresponding IotResponse event is received in this stage.
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_send_request_done(send_request_op):
             logger.info(
-                "{}({}): Sending {} request to {} resource {}".format(
+                "{}({}): Finished sending {} request to {} resource {}".format(
                     self.name, op.name, op.request_type, op.method, op.resource_location
                 )
             )
+            if send_request_op.error:
+                if self._remove_pending_request(request_id) is None:
+                    # The request already timed out
+                    return
+                op.error = send_request_op.error
+                logger.info(
+                    "{}({}): removing request {} from pending list".format(
+                        self.name, op.name, request_id
+                    )
+                )
+                operation_flow.complete_op(self, op)
+                self._send_waiting_requests()
+            else:
+                # request sent.  Nothing to do except wait for the response
+                pass
 
-            logger.info(
-                "{}({}): adding request {} to pending list".format(self.name, op.name, request_id)
-            )
-            self.pending_responses[request_id] = op
-
-            new_op = pipeline_ops_base.SendIotRequestOperation(
-                method=op.method,
-                resource_location=op.resource_location,
-                request_body=op.request_body,
-                request_id=request_id,
-                request_type=op.request_type,
-                callback=on_send_request_done,
+        logger.info(
+            "{}({}): Sending {} request to {} resource {}".format(
+                self.name, op.name, op.request_type, op.method, op.resource_location
             )
-            operation_flow.pass_op_to_next_stage(self, new_op)
+        )
+
+        logger.info(
+            "{}({}): adding request {} to pending list".format(self.name, op.name, request_id)
+        )
+        self.pending_responses[request_id] = op
+
+        new_op = pipeline_ops_base.SendIotRequestOperation(
+            method=op.method,
+            resource_location=op.resource_location,
+            request_body=op.request_body,
+            request_id=request_id,
+            request_type=op.request_type,
+            callback=on_send_request_done,
+        )
+        operation_flow.pass_op_to_next_stage(self, new_op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _remove_pending_request(self, request_id):
+        """
+        Remove a request from the pending list, and cancel its deadline.  Returns the
+        SendIotRequestAndWaitForResponseOperation, or None if the request is not pending.
+        """
+        deadline = self._deadlines.pop(request_id, None)
+        if deadline:
+            deadline.cancel()
+        return self.pending_responses.pop(request_id, None)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _send_waiting_requests(self):
+        config = self.pipeline_root.pipeline_configuration
+        while self._waiting_requests and len(self.pending_responses) < config.max_pending_requests:
+            request_id, op = self._waiting_requests.popleft()
+            self._send_request(request_id, op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _remove_waiting_request(self, request_id):
+        """
+        Remove a request which has not been sent yet.  Returns the
+        SendIotRequestAndWaitForResponseOperation, or None if the request is not waiting.
+        """
+        for waiting in self._waiting_requests:
+            if waiting[0] == request_id:
+                self._waiting_requests.remove(waiting)
+                self._deadlines.pop(request_id, None)
+                return waiting[1]
+        return None
 
+    @pipeline_thread.runs_on_pipeline_thread
+    def _expire_request(self, request_id):
+        op = self._remove_pending_request(request_id)
+        if op is not None:
+            self._timed_out_request_ids[request_id] = None
+            if len(self._timed_out_request_ids) > _max_remembered_timed_out_requests:
+                self._timed_out_request_ids.popitem(last=False)
         else:
-            operation_flow.pass_op_to_next_stage(self, op)
+            op = self._remove_waiting_request(request_id)
+            if op is None:
+                # The response arrived while the deadline was firing
+                return
+        self.timed_out_count += 1
+
+        request_timeout = self.pipeline_root.pipeline_configuration.request_timeout
+        logger.warning(
+            "{}({}): No response received for request {} within {} seconds".format(
+                self.name, op.name, request_id, request_timeout
+            )
+        )
+        op.error = RequestTimeoutError(
+            "No response received for {} request to {} resource {} within {} seconds".format(
+                op.request_type, op.method, op.resource_location, request_timeout
+            )
+        )
+        operation_flow.complete_op(self, op)
+        self._send_waiting_requests()
 
     @pipeline_thread.runs_on_pipeline_thread
     def _handle_pipeline_event(self, event):
@@ -454,9 +959,8 @@ class CoordinateRequestAndResponseStage(PipelineStage):
                     self.name, event.name, event.request_id
                 )
             )
-            if event.request_id in self.pending_responses:
-                op = self.pending_responses[event.request_id]
-                del (self.pending_responses[event.request_id])
+            op = self._remove_pending_request(event.request_id)
+            if op is not None:
                 op.status_code = event.status_code
                 op.response_body = event.response_body
                 logger.info(
@@ -470,6 +974,15 @@ class CoordinateRequestAndResponseStage(PipelineStage):
                     )
                 )
                 operation_flow.complete_op(self, op)
+                self._send_waiting_requests()
+            elif event.request_id in self._timed_out_request_ids:
+                del self._timed_out_request_ids[event.request_id]
+                self.late_response_count += 1
+                logger.warning(
+                    "{}({}): response for request {} arrived after it timed out.  Dropping".format(
+                        self.name, event.name, event.request_id
+                    )
+                )
             else:
                 logger.warning(
                     "{}({}): request_id {} not found in pending list.  Nothing to do.  Dropping".format(
@@ -13,18 +13,63 @@ from . import (
     operation_flow,
     pipeline_thread,
 )
+from azure.iot.device.common import mqtt_engine
 from azure.iot.device.common.mqtt_transport import MQTTTransport
 
 logger = logging.getLogger(__name__)
 
 
+class StandbyConnectionDroppedError(Exception):
+    """The standby connection was lost before it was established."""
+
+    pass
+
+
 class MQTTClientStage(PipelineStage):
     """
     PipelineStage object which is responsible for interfacing with the MQTT protocol wrapper object.
     This stage handles all MQTT operations and any other operations (such as ConnectOperation) which
     is not in the MQTT group of operations, but can only be run at the protocol level.
+
+    If the warm_standby_reconnect option of the pipeline configuration is set, a ReconnectOperation
+    does not close the current connection.  A standby MQTTTransport connects with the current
+    credentials instead, and once it is connected, it takes over: publishes and unsubscribes which
+    the old connection did not get acknowledged are sent again on it, it subscribes to every topic
+    the old connection was subscribed to or was subscribing to, and the old connection is closed.
     """
 
+    def __init__(self):
+        super(MQTTClientStage, self).__init__()
+        self.transport = None
+        # Publish operations which have not completed -> the transport they were published on
+        self._pending_publishes = {}
+        # Subscribe and unsubscribe operations which have not completed -> the transport they
+        # were sent on
+        self._pending_subscriptions = {}
+        self._subscribed_topics = set()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _create_transport(self):
+        config = self.pipeline_root.pipeline_configuration
+        if config.event_loop is not None:
+            io_engine = mqtt_engine.get_event_loop_engine(config.event_loop)
+        elif config.mqtt_io_threads:
+            io_engine = mqtt_engine.get_shared_engine(self.client_id, config.mqtt_io_threads)
+        else:
+            io_engine = None
+        return MQTTTransport(
+            client_id=self.client_id,
+            hostname=self.hostname,
+            username=self.username,
+            ca_cert=self.ca_cert,
+            max_inflight_messages=config.max_inflight_messages,
+            io_engine=io_engine,
+            tls_session_resumption=config.tls_session_resumption,
+            operation_timeout=config.operation_timeout,
+            # Reconnecting is up to the pipeline
+            auto_reconnect=False,
+        )
+
     @pipeline_thread.runs_on_pipeline_thread
     def _run_op(self, op):
         if isinstance(op, pipeline_ops_mqtt.SetMQTTConnectionArgsOperation):
@@ -37,12 +82,7 @@ class MQTTClientStage(PipelineStage):
             self.ca_cert = op.ca_cert
             self.sas_token = None
             self.trusted_certificate_chain = None
-            self.transport = MQTTTransport(
-                client_id=self.client_id,
-                hostname=self.hostname,
-                username=self.username,
-                ca_cert=self.ca_cert,
-            )
+            self.transport = self._create_transport()
             self.transport.on_mqtt_connected = self.on_connected
             self.transport.on_mqtt_disconnected = self.on_disconnected
             self.transport.on_mqtt_message_received = self._on_message_received
@@ -68,9 +108,20 @@ class MQTTClientStage(PipelineStage):
             def on_connected():
                 logger.info("{}({}): on_connected.  completing op.".format(self.name, op.name))
                 self.transport.on_mqtt_connected = self.on_connected
+                self.transport.on_mqtt_connection_failure = None
                 self.on_connected()
                 operation_flow.complete_op(self, op)
 
+            @pipeline_thread.invoke_on_pipeline_thread_nowait
+            def on_connection_failure(error):
+                logger.info(
+                    "{}({}): on_connection_failure.  failing op.".format(self.name, op.name)
+                )
+                self.transport.on_mqtt_connected = self.on_connected
+                self.transport.on_mqtt_connection_failure = None
+                op.error = error
+                operation_flow.complete_op(self, op)
+
             # A note on exceptions handling in Connect, Disconnct, and Reconnet:
             #
             # All calls into self.transport can raise an exception, and this is OK.
@@ -98,14 +149,22 @@ class MQTTClientStage(PipelineStage):
             # of callbacks.
             #
             self.transport.on_mqtt_connected = on_connected
+            self.transport.on_mqtt_connection_failure = on_connection_failure
             try:
                 self.transport.connect(
                     password=self.sas_token, client_certificate=self.trusted_certificate_chain
                 )
             except Exception as e:
                 self.transport.on_mqtt_connected = self.on_connected
+                self.transport.on_mqtt_connection_failure = None
                 raise e
 
+        elif (
+            isinstance(op, pipeline_ops_base.ReconnectOperation)
+            and self.pipeline_root.pipeline_configuration.warm_standby_reconnect
+        ):
+            self._reconnect_with_standby(op)
+
         elif isinstance(op, pipeline_ops_base.ReconnectOperation):
             logger.info("{}({}): reconnecting".format(self.name, op.name))
 
@@ -113,15 +172,30 @@ class MQTTClientStage(PipelineStage):
             def on_connected():
                 logger.info("{}({}): on_connected.  completing op.".format(self.name, op.name))
                 self.transport.on_mqtt_connected = self.on_connected
+                self.transport.on_mqtt_connection_failure = None
                 self.on_connected()
                 operation_flow.complete_op(self, op)
 
+            @pipeline_thread.invoke_on_pipeline_thread_nowait
+            def on_connection_failure(error):
+                logger.info(
+                    "{}({}): on_connection_failure.  failing op.".format(self.name, op.name)
+                )
+                self.transport.on_mqtt_connected = self.on_connected
+                self.transport.on_mqtt_connection_failure = None
+                op.error = error
+                operation_flow.complete_op(self, op)
+
             # See "A note on exception handling" above
             self.transport.on_mqtt_connected = on_connected
+            self.transport.on_mqtt_connection_failure = on_connection_failure
             try:
                 self.transport.reconnect(self.sas_token)
             except Exception as e:
                 self.transport.on_mqtt_connected = self.on_connected
+                self.transport.on_mqtt_connection_failure = None
+                # The old connection was closed before the new one failed
+                self.on_disconnected()
                 raise e
 
         elif isinstance(op, pipeline_ops_base.DisconnectOperation):
@@ -144,36 +218,261 @@ class MQTTClientStage(PipelineStage):
 
         elif isinstance(op, pipeline_ops_mqtt.MQTTPublishOperation):
             logger.info("{}({}): publishing on {}".format(self.name, op.name, op.topic))
+            self._publish(op)
 
-            @pipeline_thread.invoke_on_pipeline_thread_nowait
-            def on_published():
+        elif isinstance(op, pipeline_ops_mqtt.MQTTSubscribeOperation):
+            logger.info("{}({}): subscribing to {}".format(self.name, op.name, op.topic))
+            if isinstance(op.topic, list):
+                self._subscribed_topics.update(op.topic)
+            else:
+                self._subscribed_topics.add(op.topic)
+            self._subscribe(op)
+
+        elif isinstance(op, pipeline_ops_mqtt.MQTTUnsubscribeOperation):
+            logger.info("{}({}): unsubscribing from {}".format(self.name, op.name, op.topic))
+            self._subscribed_topics.discard(op.topic)
+            self._unsubscribe(op)
+
+        else:
+            operation_flow.pass_op_to_next_stage(self, op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _publish(self, op):
+        transport = self.transport
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_published(error=None):
+            if self._pending_publishes.get(op) is not transport:
+                # Published again on a standby connection, which completes it instead
+                return
+            del self._pending_publishes[op]
+            if error:
+                op.error = error
+            else:
                 logger.info("{}({}): PUBACK received. completing op.".format(self.name, op.name))
-                operation_flow.complete_op(self, op)
+            operation_flow.complete_op(self, op)
 
-            self.transport.publish(topic=op.topic, payload=op.payload, callback=on_published)
+        self._pending_publishes[op] = transport
+        try:
+            transport.publish(topic=op.topic, payload=op.payload, qos=op.qos, callback=on_published)
+        except Exception:
+            self._pending_publishes.pop(op, None)
+            raise
 
-        elif isinstance(op, pipeline_ops_mqtt.MQTTSubscribeOperation):
-            logger.info("{}({}): subscribing to {}".format(self.name, op.name, op.topic))
+    @pipeline_thread.runs_on_pipeline_thread
+    def _subscribe(self, op):
+        transport = self.transport
 
-            @pipeline_thread.invoke_on_pipeline_thread_nowait
-            def on_subscribed():
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_subscribed(error=None):
+            if self._pending_subscriptions.get(op) is not transport:
+                # Subscribed again on a standby connection, which completes it instead
+                return
+            del self._pending_subscriptions[op]
+            if error:
+                op.error = error
+            else:
                 logger.info("{}({}): SUBACK received. completing op.".format(self.name, op.name))
-                operation_flow.complete_op(self, op)
+            operation_flow.complete_op(self, op)
 
-            self.transport.subscribe(topic=op.topic, callback=on_subscribed)
+        self._pending_subscriptions[op] = transport
+        try:
+            transport.subscribe(topic=op.topic, callback=on_subscribed)
+        except Exception:
+            self._pending_subscriptions.pop(op, None)
+            raise
 
-        elif isinstance(op, pipeline_ops_mqtt.MQTTUnsubscribeOperation):
-            logger.info("{}({}): unsubscribing from {}".format(self.name, op.name, op.topic))
+    @pipeline_thread.runs_on_pipeline_thread
+    def _unsubscribe(self, op):
+        transport = self.transport
 
-            @pipeline_thread.invoke_on_pipeline_thread_nowait
-            def on_unsubscribed():
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_unsubscribed(error=None):
+            if self._pending_subscriptions.get(op) is not transport:
+                # Unsubscribed again on a standby connection, which completes it instead
+                return
+            del self._pending_subscriptions[op]
+            if error:
+                op.error = error
+            else:
                 logger.info("{}({}): UNSUBACK received.  completing op.".format(self.name, op.name))
-                operation_flow.complete_op(self, op)
+            operation_flow.complete_op(self, op)
+
+        self._pending_subscriptions[op] = transport
+        try:
+            transport.unsubscribe(topic=op.topic, callback=on_unsubscribed)
+        except Exception:
+            self._pending_subscriptions.pop(op, None)
+            raise
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _reconnect_with_standby(self, op):
+        logger.info("{}({}): connecting standby transport".format(self.name, op.name))
+        old_transport = self.transport
+        standby = self._create_transport()
+        # The service drops the old connection when the standby connects, which can be reported
+        # before the standby is.  That is not a lost connection, unless the standby fails.
+        old_dropped = []
+        # The handlers of the standby are queued on the pipeline thread, so more than one of them
+        # can run.  Only the first one completes the op.
+        finished = []
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_old_disconnected():
+            old_dropped.append(True)
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_standby_connected():
+            if finished:
+                return
+            finished.append(True)
+            logger.info("{}({}): standby connected.  switching over.".format(self.name, op.name))
+            self._switch_to_standby(standby)
+            operation_flow.complete_op(self, op)
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_standby_connection_failure(error):
+            if finished:
+                return
+            finished.append(True)
+            logger.info(
+                "{}({}): standby connection refused.  failing op.".format(self.name, op.name)
+            )
+            restore_old_transport()
+            op.error = error
+            operation_flow.complete_op(self, op)
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_standby_disconnected():
+            if finished:
+                if self.transport is standby:
+                    # Dropped after it connected, but before its handlers were switched over
+                    self.on_disconnected()
+                return
+            finished.append(True)
+            logger.info(
+                "{}({}): standby connection dropped before it was established.  failing op.".format(
+                    self.name, op.name
+                )
+            )
+            restore_old_transport()
+            op.error = StandbyConnectionDroppedError(
+                "The standby connection was lost before it was established"
+            )
+            operation_flow.complete_op(self, op)
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def restore_old_transport():
+            standby.on_mqtt_connected = None
+            standby.on_mqtt_connection_failure = None
+            standby.on_mqtt_disconnected = None
+            standby.on_mqtt_message_received = None
+            old_transport.on_mqtt_disconnected = self.on_disconnected
+            if old_dropped:
+                self.on_disconnected()
+
+        old_transport.on_mqtt_disconnected = on_old_disconnected
 
-            self.transport.unsubscribe(topic=op.topic, callback=on_unsubscribed)
+        # Messages can arrive on the standby connection before it takes over
+        standby.on_mqtt_message_received = self._on_message_received
+        standby.on_mqtt_connected = on_standby_connected
+        standby.on_mqtt_connection_failure = on_standby_connection_failure
+        standby.on_mqtt_disconnected = on_standby_disconnected
+        try:
+            standby.connect(
+                password=self.sas_token, client_certificate=self.trusted_certificate_chain
+            )
+        except Exception:
+            # The current connection is untouched, and the error fails the op
+            finished.append(True)
+            restore_old_transport()
+            raise
 
+    @pipeline_thread.runs_on_pipeline_thread
+    def _switch_to_standby(self, standby):
+        """
+        Make a connected standby transport the current one, and close the old one.  This runs as
+        a single step on the pipeline thread, so no operation sees a mix of the two.
+        """
+        old_transport = self.transport
+        self.transport = standby
+        self.pipeline_root.transport = standby
+        standby.on_mqtt_connected = self.on_connected
+        standby.on_mqtt_connection_failure = None
+        standby.on_mqtt_disconnected = self.on_disconnected
+
+        # The session on the broker keeps the subscriptions, but it is not guaranteed to be
+        # the same session.  One SUBSCRIBE makes sure, and it also completes the subscribes which
+        # were not acknowledged on the old transport, since their topics are part of it.
+        pending_subscribes = [
+            subscribe_op
+            for subscribe_op, transport in self._pending_subscriptions.items()
+            if transport is old_transport
+            and isinstance(subscribe_op, pipeline_ops_mqtt.MQTTSubscribeOperation)
+        ]
+        for subscribe_op in pending_subscribes:
+            self._pending_subscriptions[subscribe_op] = standby
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_resubscribed(error=None):
+            for subscribe_op in pending_subscribes:
+                if self._pending_subscriptions.get(subscribe_op) is not standby:
+                    continue
+                del self._pending_subscriptions[subscribe_op]
+                subscribe_op.error = error
+                operation_flow.complete_op(self, subscribe_op)
+
+        if self._subscribed_topics:
+            try:
+                standby.subscribe(topic=sorted(self._subscribed_topics), callback=on_resubscribed)
+            except Exception as e:
+                on_resubscribed(error=e)
         else:
-            operation_flow.pass_op_to_next_stage(self, op)
+            # Every topic they subscribed to was unsubscribed from since
+            on_resubscribed()
+
+        # The subscribes were moved over above, so only unsubscribes are left on the old transport
+        unacknowledged_unsubscribes = [
+            unsubscribe_op
+            for unsubscribe_op, transport in self._pending_subscriptions.items()
+            if transport is old_transport
+        ]
+        for unsubscribe_op in unacknowledged_unsubscribes:
+            try:
+                self._unsubscribe(unsubscribe_op)
+            except Exception as e:
+                self._pending_subscriptions.pop(unsubscribe_op, None)
+                unsubscribe_op.error = e
+                operation_flow.complete_op(self, unsubscribe_op)
+
+        unacknowledged = [
+            publish_op
+            for publish_op, transport in self._pending_publishes.items()
+            if transport is old_transport
+        ]
+        if unacknowledged:
+            logger.info(
+                "{}: publishing {} unacknowledged messages again on the standby transport".format(
+                    self.name, len(unacknowledged)
+                )
+            )
+        for publish_op in unacknowledged:
+            try:
+                self._publish(publish_op)
+            except Exception as e:
+                self._pending_publishes.pop(publish_op, None)
+                publish_op.error = e
+                operation_flow.complete_op(self, publish_op)
+
+        # The old connection going away is not a lost connection, so its handlers are detached
+        # before it is closed.
+        old_transport.on_mqtt_connected = None
+        old_transport.on_mqtt_disconnected = None
+        old_transport.on_mqtt_message_received = None
+        try:
+            old_transport.disconnect()
+        except Exception as e:
+            logger.warning("{}: error closing the old transport: {}".format(self.name, e))
 
     @pipeline_thread.invoke_on_pipeline_thread_nowait
     def _on_message_received(self, topic, payload):
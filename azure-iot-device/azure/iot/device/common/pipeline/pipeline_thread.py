@@ -7,8 +7,11 @@ import functools
 import logging
 import threading
 import traceback
+import weakref
+import zlib
+import six
 from multiprocessing.pool import ThreadPool
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
 from azure.iot.device.common import unhandled_exceptions
 
 logger = logging.getLogger(__name__)
@@ -70,25 +73,145 @@ These decorators use concurrent.futures.Future and the ThreadPoolExecutor becaus
 
 3. concurrent.futures is available as a backport to 2.7.
 
+Executors can be sharded so that pipelines which belong to different clients do not have to
+share a single pipeline thread and a single callback thread.  Each shard has its own pipeline
+thread and its own callback thread, and every pipeline uses exactly one shard, so the guarantees
+above still hold for each individual pipeline.  The threads of every shard keep the names
+"pipeline" and "callback".
+
+The shard which a decorated function runs on is chosen when the function is called:
+
+1. If a shard is passed to the decorator, that shard is used.
+
+2. Otherwise, if the function was decorated while running on the thread of some shard, that
+  shard is used.  This covers handlers which are created inside the pipeline and handed to
+  third-party libraries.
+
+3. Otherwise, if the first argument is a pipeline stage, the executor_shard attribute of its
+  pipeline root is used.  This covers methods of stages which are decorated at class level.
+
+4. Otherwise, the default (unsharded) executors are used.
+
+A shard can also be an EventLoopShard, which runs pipeline functions and callbacks on an asyncio
+event loop instead of on threads of their own.  This is used by the aio clients, so that a
+coroutine which calls into the pipeline does not have to switch threads at all.  Functions
+which are marked as running on the pipeline thread can run on the loop of an EventLoopShard,
+and the thread running the loop keeps its name.
+
 """
 
 _executors = {}
+# Keyed weakly, so that a loop which is no longer used is not kept alive by its shard
+_event_loop_shards = weakref.WeakKeyDictionary()
+
+# Holds the shard which the current thread belongs to, if any.
+_thread_state = threading.local()
 
+# Marker for "no shard was passed to the decorator"
+_unspecified = object()
 
-def _get_named_executor(thread_name):
+
+def shard_for_key(key, shard_count):
     """
-    Get a ThreadPoolExecutor object with the given name.  If no such executor exists,
-    this function will create on with a single worker and assign it to the provided
-    name.
+    Pick a shard for the given key.  The same key always maps to the same shard.
+
+    :param str key: A string which identifies the pipeline, such as the device id.
+    :param int shard_count: The number of shards to choose from.
+
+    :returns: The shard, or None if shard_count is 1 and the default executors should be used.
+    """
+    if shard_count <= 1:
+        return None
+    return (zlib.crc32(key.encode("utf-8")) & 0xFFFFFFFF) % shard_count
+
+
+class EventLoopShard(object):
+    """
+    A shard whose pipeline thread and callback thread are both the thread running an asyncio
+    event loop.  Use shard_for_event_loop to get the shard for a loop.
+    """
+
+    def __init__(self, loop):
+        # A strong reference would keep the loop, and with it the shard, in _event_loop_shards
+        self._loop = weakref.ref(loop)
+
+    @property
+    def loop(self):
+        """The asyncio event loop of the shard."""
+        return self._loop()
+
+    def is_current(self):
+        """
+        Return True if functions for this shard can run on the calling thread right away.  This
+        is the case on the thread which is running the loop, and on any thread while the loop is
+        not running at all, such as while a client is being created before the loop starts.
+        """
+        if not self.loop.is_running():
+            return True
+        # asyncio is only imported here, because this module must still import on Python 2.7
+        from azure.iot.device.common import asyncio_compat
+
+        try:
+            return asyncio_compat.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def submit(self, func):
+        """
+        Run func on the loop, in the same way as ThreadPoolExecutor.submit runs it on a thread.
+        """
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+
+        self.loop.call_soon_threadsafe(run)
+        return future
+
+
+def shard_for_event_loop(loop):
+    """
+    Get the EventLoopShard for an asyncio event loop.  The same loop always gets the same shard.
+
+    :param loop: The asyncio event loop.
+    """
+    if loop not in _event_loop_shards:
+        _event_loop_shards[loop] = EventLoopShard(loop)
+    return _event_loop_shards[loop]
+
+
+def _get_current_shard():
+    return getattr(_thread_state, "shard", None)
+
+
+def _get_named_executor(thread_name, shard=None):
+    """
+    Get a ThreadPoolExecutor object with the given name, for the given shard.  If no such
+    executor exists, this function will create on with a single worker and assign it to the
+    provided name and shard.
     """
     global _executors
-    if thread_name not in _executors:
-        logger.info("Creating {} executor".format(thread_name))
-        _executors[thread_name] = ThreadPoolExecutor(max_workers=1)
-    return _executors[thread_name]
+    key = thread_name if shard is None else (thread_name, shard)
+    if key not in _executors:
+        logger.info("Creating {} executor for shard {}".format(thread_name, shard))
+        _executors[key] = ThreadPoolExecutor(max_workers=1)
+    return _executors[key]
+
 
+def _get_shard_from_stage(obj):
+    pipeline_root = getattr(obj, "pipeline_root", None)
+    shard = getattr(pipeline_root, "executor_shard", None)
+    if isinstance(shard, six.integer_types + (EventLoopShard,)):
+        return shard
+    return None
 
-def _invoke_on_executor_thread(func, thread_name, block=True):
+
+def _invoke_on_executor_thread(func, thread_name, block=True, shard=_unspecified):
     """
     Return wrapper to run the function on a given thread.  If block==False,
     the call returns immediately without waiting for the decorated function to complete.
@@ -103,12 +226,36 @@ def _invoke_on_executor_thread(func, thread_name, block=True):
         function_name = str(func)
         function_has_name = False
 
+    if shard is _unspecified:
+        shard = _get_current_shard()
+
     def wrapper(*args, **kwargs):
-        if threading.current_thread().name is not thread_name:
+        target_shard = shard
+        if target_shard is None:
+            target_shard = _get_shard_from_stage(getattr(func, "__self__", None))
+        if target_shard is None and args:
+            target_shard = _get_shard_from_stage(args[0])
+
+        on_event_loop = isinstance(target_shard, EventLoopShard)
+        if on_event_loop:
+            on_thread = target_shard.is_current()
+        else:
+            on_thread = (
+                threading.current_thread().name is thread_name
+                and _get_current_shard() == target_shard
+            )
+
+        if not on_thread:
             logger.info("Starting {} in {} thread".format(function_name, thread_name))
 
             def thread_proc():
+                if on_event_loop:
+                    return _call_in_event_loop_shard(target_shard, thread_proc_body)
                 threading.current_thread().name = thread_name
+                _thread_state.shard = target_shard
+                return thread_proc_body()
+
+            def thread_proc_body():
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
@@ -124,13 +271,21 @@ def _invoke_on_executor_thread(func, thread_name, block=True):
                     raise
 
             # TODO: add a timeout here and throw exception on failure
-            future = _get_named_executor(thread_name).submit(thread_proc)
+            if on_event_loop:
+                executor = target_shard
+            elif target_shard is None:
+                executor = _get_named_executor(thread_name)
+            else:
+                executor = _get_named_executor(thread_name, target_shard)
+            future = executor.submit(thread_proc)
             if block:
                 return future.result()
             else:
                 return future
         else:
             logger.debug("Already in {} thread for {}".format(thread_name, function_name))
+            if on_event_loop:
+                return _call_in_event_loop_shard(target_shard, lambda: func(*args, **kwargs))
             return func(*args, **kwargs)
 
     # Silly hack:  On 2.7, we can't use @functools.wraps on callables don't have a __name__ attribute
@@ -143,25 +298,38 @@ def _invoke_on_executor_thread(func, thread_name, block=True):
         return wrapper
 
 
-def invoke_on_pipeline_thread(func):
+def _call_in_event_loop_shard(shard, func):
+    """
+    Call func on the current thread as part of an EventLoopShard.  The thread belongs to the
+    shard only for the duration of the call, since the loop also runs code of its own.
+    """
+    previous_shard = _get_current_shard()
+    _thread_state.shard = shard
+    try:
+        return func()
+    finally:
+        _thread_state.shard = previous_shard
+
+
+def invoke_on_pipeline_thread(func, shard=_unspecified):
     """
     Run the decorated function on the pipeline thread.
     """
-    return _invoke_on_executor_thread(func=func, thread_name="pipeline")
+    return _invoke_on_executor_thread(func=func, thread_name="pipeline", shard=shard)
 
 
-def invoke_on_pipeline_thread_nowait(func):
+def invoke_on_pipeline_thread_nowait(func, shard=_unspecified):
     """
     Run the decorated function on the pipeline thread, but don't wait for it to complete
     """
-    return _invoke_on_executor_thread(func=func, thread_name="pipeline", block=False)
+    return _invoke_on_executor_thread(func=func, thread_name="pipeline", block=False, shard=shard)
 
 
-def invoke_on_callback_thread_nowait(func):
+def invoke_on_callback_thread_nowait(func, shard=_unspecified):
     """
     Run the decorated function on the callback thread, but don't wait for it to complete
     """
-    return _invoke_on_executor_thread(func=func, thread_name="callback", block=False)
+    return _invoke_on_executor_thread(func=func, thread_name="callback", block=False, shard=shard)
 
 
 def _assert_executor_thread(func, thread_name):
@@ -173,8 +341,8 @@ def _assert_executor_thread(func, thread_name):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
 
-        assert (
-            threading.current_thread().name == thread_name
+        assert threading.current_thread().name == thread_name or isinstance(
+            _get_current_shard(), EventLoopShard
         ), """
             Function {function_name} is not running inside {thread_name} thread.
             It should be. You should use invoke_on_{thread_name}_thread(_nowait) to enter the
@@ -0,0 +1,91 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a process-wide cache of the SSLContext objects used for TLS connections.
+
+Loading CA certificates and client certificates into a new SSLContext costs CPU time and file
+I/O, so contexts are created once for each combination of CA certificate and client certificate,
+and shared by every connection which uses that combination.  SSLContext objects can safely be
+shared between threads.
+
+Certificates are identified by their file paths, so if the files of a certificate are replaced,
+the cached context has to be invalidated for the new files to be picked up.
+"""
+
+import logging
+import ssl
+import threading
+
+logger = logging.getLogger(__name__)
+
+_contexts = {}
+_lock = threading.Lock()
+
+
+def _cache_key(ca_cert, x509):
+    if x509 is None:
+        return (ca_cert, None, None, None)
+    return (ca_cert, x509.certificate_file, x509.key_file, x509.pass_phrase)
+
+
+def _create_ssl_context(ca_cert, x509):
+    logger.info("creating a SSL context")
+    ssl_context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLSv1_2)
+
+    if ca_cert:
+        ssl_context.load_verify_locations(cadata=ca_cert)
+    else:
+        ssl_context.load_default_certs()
+    ssl_context.verify_mode = ssl.CERT_REQUIRED
+    ssl_context.check_hostname = True
+
+    if x509 is not None:
+        logger.info("configuring SSL context with client-side certificate and key")
+        ssl_context.load_cert_chain(x509.certificate_file, x509.key_file, x509.pass_phrase)
+
+    return ssl_context
+
+
+def get_ssl_context(ca_cert=None, x509=None):
+    """
+    Return the SSLContext for a combination of CA certificate and client certificate, creating
+    it if it is not in the cache yet.
+
+    :param str ca_cert: Certificate which can be used to validate the server.  If not provided,
+    the default certificates of the system are used.
+    :param x509: The x509 certificate used to authenticate the client (optional).
+    :type x509: X509
+    """
+    key = _cache_key(ca_cert, x509)
+    # The context is created while holding the lock, so that many connections starting at the
+    # same time only load the certificates once.
+    with _lock:
+        ssl_context = _contexts.get(key)
+        if ssl_context is None:
+            ssl_context = _create_ssl_context(ca_cert, x509)
+            _contexts[key] = ssl_context
+        return ssl_context
+
+
+def invalidate(ca_cert=None, x509=None):
+    """
+    Remove the SSLContext for a combination of CA certificate and client certificate from the
+    cache, so that the next connection loads the certificates again.  Connections which are
+    already established are not affected.
+
+    :param str ca_cert: The CA certificate the context was created with.
+    :param x509: The x509 certificate the context was created with.
+    :type x509: X509
+    """
+    with _lock:
+        _contexts.pop(_cache_key(ca_cert, x509), None)
+
+
+def clear():
+    """
+    Remove every SSLContext from the cache.
+    """
+    with _lock:
+        _contexts.clear()
@@ -0,0 +1,205 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a hashed timer wheel, which runs many timers from a single thread.
+
+Starting a threading.Timer for every deadline would cost one thread per timer.  A TimerWheel
+instead sorts timers into a fixed number of slots by the tick on which they are due, so that
+scheduling and cancelling a timer is O(1), and its thread only has to look at the slots of the
+ticks which passed.  Its thread sleeps until the tick of the earliest timer, rather than waking
+up every tick.  Timers fire at tick granularity, so a timer fires up to one tick late.
+
+A process-wide wheel is shared by everything which does not need a wheel of its own.
+"""
+
+import heapq
+import logging
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TICK = 0.1
+DEFAULT_SLOT_COUNT = 512
+
+_shared_wheel = None
+_shared_wheel_lock = threading.Lock()
+
+
+def get_shared_timer_wheel():
+    """
+    Return the process-wide TimerWheel, creating it the first time it is needed.
+    """
+    global _shared_wheel
+    with _shared_wheel_lock:
+        if _shared_wheel is None:
+            _shared_wheel = TimerWheel(name="azure_iot_timer_wheel")
+        return _shared_wheel
+
+
+class Timer(object):
+    """A timer which was scheduled on a TimerWheel.
+
+    :ivar deadline_tick: The tick of the wheel on which the timer is due.
+    :type deadline_tick: int
+    """
+
+    def __init__(self, wheel, deadline_tick, callback):
+        self.deadline_tick = deadline_tick
+        self._wheel = wheel
+        self._callback = callback
+        # Set once the timer has fired or been cancelled
+        self._done = False
+
+    def cancel(self):
+        """Cancel the timer.  Cancelling a timer which already fired does nothing."""
+        self._wheel._cancel(self)
+
+
+class TimerWheel(object):
+    """Runs the callbacks of many timers from a single daemon thread.
+
+    The thread is started when the first timer is scheduled, and sleeps without waking up while
+    there are no timers.  Callbacks run on the thread of the wheel, so they should return quickly.
+    """
+
+    def __init__(self, tick=DEFAULT_TICK, slot_count=DEFAULT_SLOT_COUNT, name="timer wheel"):
+        """
+        :param float tick: The resolution of the wheel, in seconds.
+        :param int slot_count: The number of slots.  Timers which are due further than
+        tick * slot_count seconds in the future go around the wheel more than once.
+        :param str name: The name of the thread of the wheel.
+        """
+        if tick <= 0:
+            raise ValueError("tick must be a positive number")
+        if slot_count < 1:
+            raise ValueError("slot_count must be a positive integer")
+        self.tick = tick
+        self.name = name
+        self._slots = [set() for _ in range(slot_count)]
+        self._timer_count = 0
+        self._start_time = time.time()
+        # The next tick whose slot has not been processed yet
+        self._next_tick = 1
+        # Heap of the deadline ticks of the timers, so that the thread knows how long it can
+        # sleep.  Ticks of cancelled timers are left in it, and only cost a needless wake up.
+        self._deadline_ticks = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    @property
+    def timer_count(self):
+        """The number of timers which have been scheduled and have neither fired nor been
+        cancelled."""
+        return self._timer_count
+
+    def schedule(self, delay, callback):
+        """
+        Call callback with no arguments once delay seconds have passed.
+
+        :param float delay: The number of seconds to wait.
+        :param callback: The function to call.
+        :returns: A Timer which can be used to cancel the call.
+        """
+        with self._condition:
+            # Round up, so that a timer never fires early
+            deadline_tick = max(
+                self._next_tick, int((time.time() - self._start_time + delay) / self.tick) + 1
+            )
+            timer = Timer(self, deadline_tick, callback)
+            self._slots[deadline_tick % len(self._slots)].add(timer)
+            self._timer_count += 1
+            sooner = not self._deadline_ticks or deadline_tick < self._deadline_ticks[0]
+            heapq.heappush(self._deadline_ticks, deadline_tick)
+            if not self._running:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+            elif sooner:
+                # The thread is sleeping until a later tick, or until a timer is scheduled
+                self._condition.notify()
+        return timer
+
+    def stop(self):
+        """
+        Stop the thread of the wheel and wait for it to exit.  Timers which have not fired yet
+        are dropped without being called.
+        """
+        with self._condition:
+            self._running = False
+            thread = self._thread
+            self._thread = None
+            for slot in self._slots:
+                for timer in slot:
+                    timer._done = True
+                slot.clear()
+            self._timer_count = 0
+            self._deadline_ticks = []
+            self._condition.notify()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _cancel(self, timer):
+        with self._condition:
+            if timer._done:
+                return
+            timer._done = True
+            slot = self._slots[timer.deadline_tick % len(self._slots)]
+            if timer in slot:
+                slot.remove(timer)
+                self._timer_count -= 1
+
+    def _run(self):
+        logger.info("{}: started".format(self.name))
+        while True:
+            with self._condition:
+                if not self._running:
+                    break
+                if self._timer_count == 0:
+                    self._deadline_ticks = []
+                    self._condition.wait()
+                    # Nothing was due while the wheel was idle
+                    self._next_tick = max(self._next_tick, self._current_tick())
+                    continue
+                # Sleep until the tick of the earliest timer
+                wake_tick = max(self._next_tick, self._deadline_ticks[0])
+                delay = self._start_time + wake_tick * self.tick - time.time()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                due = self._collect_due_timers()
+
+            for timer in due:
+                try:
+                    timer._callback()
+                except Exception:
+                    logger.error("Unexpected error calling timer callback")
+                    logger.error(traceback.format_exc())
+        logger.info("{}: stopped".format(self.name))
+
+    def _current_tick(self):
+        return int((time.time() - self._start_time) / self.tick)
+
+    def _collect_due_timers(self):
+        """Remove the timers which are due by the current tick from their slots.  Must be called
+        while holding the lock."""
+        due = []
+        current_tick = self._current_tick()
+        # If the thread fell behind, process every slot it missed, but not more than one lap
+        first_tick = max(self._next_tick, current_tick - len(self._slots) + 1)
+        for tick in range(first_tick, current_tick + 1):
+            slot = self._slots[tick % len(self._slots)]
+            for timer in [t for t in slot if t.deadline_tick <= current_tick]:
+                slot.remove(timer)
+                timer._done = True
+                due.append(timer)
+        self._next_tick = current_tick + 1
+        self._timer_count -= len(due)
+        while self._deadline_ticks and self._deadline_ticks[0] <= current_tick:
+            heapq.heappop(self._deadline_ticks)
+        return due
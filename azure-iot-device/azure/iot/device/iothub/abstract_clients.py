@@ -12,7 +12,7 @@ import logging
 import os
 import io
 from . import auth
-from .pipeline import IoTHubPipeline
+from .pipeline import IoTHubPipeline, IoTHubPipelineConfig
 
 
 logger = logging.getLogger(__name__)
@@ -32,13 +32,16 @@ class AbstractIoTHubClient(object):
         self._pipeline = pipeline
 
     @classmethod
-    def create_from_connection_string(cls, connection_string, trusted_certificate_chain=None):
+    def create_from_connection_string(
+        cls, connection_string, trusted_certificate_chain=None, **kwargs
+    ):
         """
         Instantiate the client from a IoTHub device or module connection string.
 
         :param str connection_string: The connection string for the IoTHub you wish to connect to.
         :param str trusted_certificate_chain: The trusted certificate chain. Necessary when using a
         connection string with a GatewayHostName parameter. DEFAULT: None
+        :param kwargs: Pipeline options (e.g. max_inflight_messages). See IoTHubPipelineConfig.
 
         :raises: ValueError if given an invalid connection_string.
         """
@@ -49,22 +52,23 @@ class AbstractIoTHubClient(object):
         authentication_provider.ca_cert = (
             trusted_certificate_chain
         )  # TODO: make this part of the instantiation
-        pipeline = IoTHubPipeline(authentication_provider)
+        pipeline = IoTHubPipeline(authentication_provider, IoTHubPipelineConfig(**kwargs))
         return cls(pipeline)
 
     @classmethod
-    def create_from_shared_access_signature(cls, sas_token):
+    def create_from_shared_access_signature(cls, sas_token, **kwargs):
         """
         Instantiate the client from a Shared Access Signature (SAS) token.
 
         This method of instantiation is not recommended for general usage.
 
         :param str sas_token: The string representation of a SAS token.
+        :param kwargs: Pipeline options (e.g. max_inflight_messages). See IoTHubPipelineConfig.
 
         :raises: ValueError if given an invalid sas_token
         """
         authentication_provider = auth.SharedAccessSignatureAuthenticationProvider.parse(sas_token)
-        pipeline = IoTHubPipeline(authentication_provider)
+        pipeline = IoTHubPipeline(authentication_provider, IoTHubPipelineConfig(**kwargs))
         return cls(pipeline)
 
     @abc.abstractmethod
@@ -79,6 +83,14 @@ class AbstractIoTHubClient(object):
     def send_d2c_message(self, message):
         pass
 
+    @abc.abstractmethod
+    def send_d2c_message_nowait(self, message):
+        pass
+
+    @abc.abstractmethod
+    def send_d2c_messages(self, messages):
+        pass
+
     @abc.abstractmethod
     def receive_method_request(self, method_name=None):
         pass
@@ -95,6 +107,10 @@ class AbstractIoTHubClient(object):
     def patch_twin_reported_properties(self, reported_properties_patch):
         pass
 
+    @abc.abstractmethod
+    def update_reported_properties(self, reported_properties):
+        pass
+
     @abc.abstractmethod
     def receive_twin_desired_properties_patch(self):
         pass
@@ -103,7 +119,7 @@ class AbstractIoTHubClient(object):
 @six.add_metaclass(abc.ABCMeta)
 class AbstractIoTHubDeviceClient(AbstractIoTHubClient):
     @classmethod
-    def create_from_x509_certificate(cls, x509, hostname, device_id):
+    def create_from_x509_certificate(cls, x509, hostname, device_id, **kwargs):
         """
         Instantiate a client which using X509 certificate authentication.
         :param hostname: Host running the IotHub. Can be found in the Azure portal in the Overview tab as the string hostname.
@@ -111,12 +127,13 @@ class AbstractIoTHubDeviceClient(AbstractIoTHubClient):
         If the cert comes from a CER file, it needs to be base64 encoded.
         :type x509: X509
         :param device_id: The ID is used to uniquely identify a device in the IoTHub
+        :param kwargs: Pipeline options (e.g. max_inflight_messages). See IoTHubPipelineConfig.
         :return: A IoTHubClient which can use X509 authentication.
         """
         authentication_provider = auth.X509AuthenticationProvider(
             x509=x509, hostname=hostname, device_id=device_id
         )
-        pipeline = IoTHubPipeline(authentication_provider)
+        pipeline = IoTHubPipeline(authentication_provider, IoTHubPipelineConfig(**kwargs))
         return cls(pipeline)
 
     @abc.abstractmethod
@@ -127,13 +144,15 @@ class AbstractIoTHubDeviceClient(AbstractIoTHubClient):
 @six.add_metaclass(abc.ABCMeta)
 class AbstractIoTHubModuleClient(AbstractIoTHubClient):
     @classmethod
-    def create_from_edge_environment(cls):
+    def create_from_edge_environment(cls, **kwargs):
         """
         Instantiate the client from the IoT Edge environment.
 
         This method can only be run from inside an IoT Edge container, or in a debugging
         environment configured for Edge development (e.g. Visual Studio, Visual Studio Code)
 
+        :param kwargs: Pipeline options (e.g. max_inflight_messages). See IoTHubPipelineConfig.
+
         :raises: IoTEdgeError if the IoT Edge container is not configured correctly.
         :raises: ValueError if debug variables are invalid
         """
@@ -187,11 +206,11 @@ class AbstractIoTHubModuleClient(AbstractIoTHubClient):
                 api_version=api_version,
             )
 
-        pipeline = IoTHubPipeline(authentication_provider)
+        pipeline = IoTHubPipeline(authentication_provider, IoTHubPipelineConfig(**kwargs))
         return cls(pipeline)
 
     @classmethod
-    def create_from_x509_certificate(cls, x509, hostname, device_id, module_id):
+    def create_from_x509_certificate(cls, x509, hostname, device_id, module_id, **kwargs):
         """
         Instantiate a client which using X509 certificate authentication.
         :param hostname: Host running the IotHub. Can be found in the Azure portal in the Overview tab as the string hostname.
@@ -200,12 +219,13 @@ class AbstractIoTHubModuleClient(AbstractIoTHubClient):
         :type x509: X509
         :param device_id: The ID is used to uniquely identify a device in the IoTHub
         :param module_id : The ID of the module to uniquely identify a module on a device on the IoTHub.
+        :param kwargs: Pipeline options (e.g. max_inflight_messages). See IoTHubPipelineConfig.
         :return: A IoTHubClient which can use X509 authentication.
         """
         authentication_provider = auth.X509AuthenticationProvider(
             x509=x509, hostname=hostname, device_id=device_id, module_id=module_id
         )
-        pipeline = IoTHubPipeline(authentication_provider)
+        pipeline = IoTHubPipeline(authentication_provider, IoTHubPipelineConfig(**kwargs))
         return cls(pipeline)
 
     @abc.abstractmethod
@@ -8,7 +8,7 @@ Azure IoTHub Device SDK for Python.
 """
 
 import logging
-from azure.iot.device.common import async_adapter
+from azure.iot.device.common import async_adapter, asyncio_compat, json_codec
 from azure.iot.device.iothub.abstract_clients import (
     AbstractIoTHubClient,
     AbstractIoTHubDeviceClient,
@@ -36,12 +36,40 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         :param pipeline: The pipeline that the client will use.
         """
         super().__init__(pipeline)
+        # Handler which is called with the attempt number, the error (None if the attempt
+        # succeeded) and the number of seconds until the next attempt (None if there is none)
+        # every time the client tries to re-establish a lost connection.  It is called on a
+        # pipeline thread, so it must not block.
+        self.on_reconnect_attempt = None
         self._inbox_manager = InboxManager(inbox_type=AsyncClientInbox)
         self._pipeline.on_connected = self._on_connected
         self._pipeline.on_disconnected = self._on_disconnected
+        self._pipeline.on_reconnect_attempt = self._on_reconnect_attempt
         self._pipeline.on_method_request_received = self._inbox_manager.route_method_request
         self._pipeline.on_twin_patch_received = self._inbox_manager.route_twin_patch
 
+    def _make_async(self, fn, sends_telemetry=False):
+        """Returns a coroutine function which calls a pipeline method.
+
+        If the pipeline runs on the running event loop (see the event_loop option of the
+        'create_from_' classmethods), the method is called directly, since it does not block.
+        Otherwise, it is called on a worker thread.
+
+        :param fn: The pipeline method.
+        :param bool sends_telemetry: True if the method blocks while the in-flight window of the
+        pipeline is full, in which case it is called on a worker thread as well.
+        """
+        config = getattr(self._pipeline, "pipeline_configuration", None)
+        loop = getattr(config, "event_loop", None)
+        if loop is not None and loop is asyncio_compat.get_running_loop():
+            if not (sends_telemetry and self._pipeline.inflight_window_full):
+
+                async def call_directly(*args, **kwargs):
+                    return fn(*args, **kwargs)
+
+                return call_directly
+        return async_adapter.emulate_async(fn)
+
     def _on_connected(self):
         """Helper handler that is called upon a pipeline connect"""
         logger.info("Connection State - Connected")
@@ -52,28 +80,43 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         self._inbox_manager.clear_all_method_requests()
         logger.info("Cleared all pending method requests due to disconnect")
 
+    def _on_reconnect_attempt(self, attempt, error, next_delay):
+        """Helper handler that is called upon every attempt to re-establish a lost connection"""
+        if error:
+            logger.info("Connection State - Reconnect attempt {} failed: {}".format(attempt, error))
+        else:
+            logger.info("Connection State - Reconnected on attempt {}".format(attempt))
+        if self.on_reconnect_attempt:
+            self.on_reconnect_attempt(attempt, error, next_delay)
+
     async def connect(self):
         """Connects the client to an Azure IoT Hub or Azure IoT Edge Hub instance.
 
         The destination is chosen based on the credentials passed via the auth_provider parameter
         that was provided when this object was initialized.
+
+        :raises: The error which the connection failed with, if it failed.
         """
         logger.info("Connecting to Hub...")
-        connect_async = async_adapter.emulate_async(self._pipeline.connect)
+        connect_async = self._make_async(self._pipeline.connect)
 
-        def sync_callback():
-            logger.info("Successfully connected to Hub")
+        def sync_callback(error=None):
+            if not error:
+                logger.info("Successfully connected to Hub")
+            return error
 
         callback = async_adapter.AwaitableCallback(sync_callback)
 
         await connect_async(callback=callback)
-        await callback.completion()
+        error = await callback.completion()
+        if error:
+            raise error
 
     async def disconnect(self):
         """Disconnect the client from the Azure IoT Hub or Azure IoT Edge Hub instance.
         """
         logger.info("Disconnecting from Hub...")
-        disconnect_async = async_adapter.emulate_async(self._pipeline.disconnect)
+        disconnect_async = self._make_async(self._pipeline.disconnect)
 
         def sync_callback():
             logger.info("Successfully disconnected from Hub")
@@ -91,20 +134,99 @@ class GenericIoTHubClient(AbstractIoTHubClient):
 
         :param message: The actual message to send. Anything passed that is not an instance of the
         Message class will be converted to Message object.
+
+        :raises: The error which sending the message failed with, if it failed.
         """
         if not isinstance(message, Message):
             message = Message(message)
 
         logger.info("Sending message to Hub...")
-        send_d2c_message_async = async_adapter.emulate_async(self._pipeline.send_d2c_message)
+        send_d2c_message_async = self._make_async(
+            self._pipeline.send_d2c_message, sends_telemetry=True
+        )
 
-        def sync_callback():
-            logger.info("Successfully sent message to Hub")
+        def sync_callback(error=None):
+            if not error:
+                logger.info("Successfully sent message to Hub")
+            return error
 
         callback = async_adapter.AwaitableCallback(sync_callback)
 
         await send_d2c_message_async(message, callback=callback)
-        await callback.completion()
+        error = await callback.completion()
+        if error:
+            raise error
+
+    async def send_d2c_messages(self, messages):
+        """Sends a batch of messages to the default events endpoint on the Azure IoT Hub or Azure
+        IoT Edge Hub instance.
+
+        The messages are handed to the client's pipeline together rather than one at a time.
+
+        If the connection to the service has not previously been opened by a call to connect, this
+        function will open the connection before sending the events.
+
+        :param messages: An iterable of the messages to send. Anything passed that is not an
+        instance of the Message class will be converted to Message object.
+
+        :returns: A list with one result per message, in the same order as the messages.  Each
+        result is None if the message was sent successfully, or the error which caused it to fail.
+        """
+        messages = [
+            message if isinstance(message, Message) else Message(message) for message in messages
+        ]
+
+        logger.info("Sending {} messages to Hub...".format(len(messages)))
+        # Always on a worker thread, even if the pipeline runs on the running event loop.  A batch
+        # can need more slots of the in-flight window than are free, and sending it then waits
+        # for acknowledgements which are received on the event loop.
+        send_d2c_messages_async = async_adapter.emulate_async(self._pipeline.send_d2c_messages)
+
+        def sync_callback(message_results):
+            logger.info("Finished sending {} messages to Hub".format(len(message_results)))
+            return message_results
+
+        callback = async_adapter.AwaitableCallback(sync_callback)
+
+        await send_d2c_messages_async(messages, callback=callback)
+        return await callback.completion()
+
+    async def send_d2c_message_nowait(self, message):
+        """Sends a message to the default events endpoint on the Azure IoT Hub or Azure IoT Edge Hub
+        instance without waiting for the service to acknowledge it.
+
+        Up to max_inflight_messages messages (see the 'create_from_' classmethods) can be awaiting
+        acknowledgement at the same time.  This coroutine only waits while that window is full.
+
+        If the connection to the service has not previously been opened by a call to connect, this
+        function will open the connection before sending the event.
+
+        :param message: The actual message to send. Anything passed that is not an instance of the
+        Message class will be converted to Message object.
+
+        :returns: An asyncio.Future which completes once the service has acknowledged receipt of
+        the message, or with the error which sending the message failed with.
+        """
+        if not isinstance(message, Message):
+            message = Message(message)
+
+        logger.info("Sending message to Hub without waiting for acknowledgement...")
+        send_d2c_message_async = self._make_async(
+            self._pipeline.send_d2c_message, sends_telemetry=True
+        )
+
+        loop = asyncio_compat.get_running_loop()
+        future = asyncio_compat.create_future(loop)
+
+        def sync_callback(error=None):
+            if error:
+                loop.call_soon_threadsafe(future.set_exception, error)
+            else:
+                logger.info("Successfully sent message to Hub")
+                loop.call_soon_threadsafe(future.set_result, None)
+
+        await send_d2c_message_async(message, callback=sync_callback)
+        return future
 
     async def receive_method_request(self, method_name=None):
         """Receive a method request via the Azure IoT Hub or Azure IoT Edge Hub.
@@ -136,9 +258,7 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         :param method_response: The MethodResponse to send
         """
         logger.info("Sending method response to Hub...")
-        send_method_response_async = async_adapter.emulate_async(
-            self._pipeline.send_method_response
-        )
+        send_method_response_async = self._make_async(self._pipeline.send_method_response)
 
         def sync_callback():
             logger.info("Successfully sent method response to Hub")
@@ -156,7 +276,7 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         See azure.iot.device.common.pipeline.constant for possible values.
         """
         logger.info("Enabling feature:" + feature_name + "...")
-        enable_feature_async = async_adapter.emulate_async(self._pipeline.enable_feature)
+        enable_feature_async = self._make_async(self._pipeline.enable_feature)
 
         def sync_callback():
             logger.info("Successfully enabled feature:" + feature_name)
@@ -177,7 +297,7 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         if not self._pipeline.feature_enabled[constant.TWIN]:
             await self._enable_feature(constant.TWIN)
 
-        get_twin_async = async_adapter.emulate_async(self._pipeline.get_twin)
+        get_twin_async = self._make_async(self._pipeline.get_twin)
 
         twin = None
 
@@ -191,7 +311,8 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         await get_twin_async(callback=callback)
         await callback.completion()
 
-        return twin
+        # The pipeline hands over the twin as it was received, so that it is decoded here
+        return json_codec.loads(twin)
 
     async def patch_twin_reported_properties(self, reported_properties_patch):
         """
@@ -208,9 +329,7 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         if not self._pipeline.feature_enabled[constant.TWIN]:
             await self._enable_feature(constant.TWIN)
 
-        patch_twin_async = async_adapter.emulate_async(
-            self._pipeline.patch_twin_reported_properties
-        )
+        patch_twin_async = self._make_async(self._pipeline.patch_twin_reported_properties)
 
         def sync_callback():
             logger.info("Successfully sent twin patch")
@@ -220,6 +339,37 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         await patch_twin_async(patch=reported_properties_patch, callback=callback)
         await callback.completion()
 
+    async def update_reported_properties(self, reported_properties):
+        """
+        Update reported properties with the Azure IoT Hub or Azure IoT Edge Hub service, sending
+        only what changed since the last call.
+
+        Properties which were in the reported_properties of the last call, but are not anymore,
+        are removed from the service.
+
+        :param dict reported_properties: All of the reported properties of the device or module.
+
+        :raises: The error which updating the reported properties failed with, if it failed.
+        """
+        logger.info("Updating twin reported properties")
+
+        if not self._pipeline.feature_enabled[constant.TWIN]:
+            await self._enable_feature(constant.TWIN)
+
+        update_reported_async = self._make_async(self._pipeline.update_reported_properties)
+
+        def sync_callback(error=None):
+            if not error:
+                logger.info("Successfully updated reported properties")
+            return error
+
+        callback = async_adapter.AwaitableCallback(sync_callback)
+
+        await update_reported_async(full_state=reported_properties, callback=callback)
+        error = await callback.completion()
+        if error:
+            raise error
+
     async def receive_twin_desired_properties_patch(self):
         """
         Receive a desired property patch via the Azure IoT Hub or Azure IoT Edge Hub.
@@ -235,7 +385,7 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         logger.info("Waiting for twin patches...")
         patch = await twin_patch_inbox.get()
         logger.info("twin patch received")
-        return patch
+        return json_codec.loads(patch)
 
 
 class IoTHubDeviceClient(GenericIoTHubClient, AbstractIoTHubDeviceClient):
@@ -300,6 +450,8 @@ class IoTHubModuleClient(GenericIoTHubClient, AbstractIoTHubModuleClient):
         :param message: message to send to the given output. Anything passed that is not an instance of the
         Message class will be converted to Message object.
         :param output_name: Name of the output to send the event to.
+
+        :raises: The error which sending the message failed with, if it failed.
         """
         if not isinstance(message, Message):
             message = Message(message)
@@ -307,15 +459,21 @@ class IoTHubModuleClient(GenericIoTHubClient, AbstractIoTHubModuleClient):
         message.output_name = output_name
 
         logger.info("Sending message to output:" + output_name + "...")
-        send_output_event_async = async_adapter.emulate_async(self._pipeline.send_output_event)
+        send_output_event_async = self._make_async(
+            self._pipeline.send_output_event, sends_telemetry=True
+        )
 
-        def sync_callback():
-            logger.info("Successfully sent message to output: " + output_name)
+        def sync_callback(error=None):
+            if not error:
+                logger.info("Successfully sent message to output: " + output_name)
+            return error
 
         callback = async_adapter.AwaitableCallback(sync_callback)
 
         await send_output_event_async(message, callback=callback)
-        await callback.completion()
+        error = await callback.completion()
+        if error:
+            raise error
 
     async def receive_input_message(self, input_name):
         """Receive an input message that has been sent from another Module to a specific input.
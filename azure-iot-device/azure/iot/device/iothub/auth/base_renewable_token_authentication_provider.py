@@ -10,8 +10,9 @@ import abc
 import logging
 import math
 import six
-from threading import Timer
+import threading
 import six.moves.urllib as urllib
+from azure.iot.device.common import timer_wheel
 from .authentication_provider import AuthenticationProvider
 
 logger = logging.getLogger(__name__)
@@ -160,13 +161,20 @@ class BaseRenewableTokenAuthenticationProvider(AuthenticationProvider):
             seconds_until_update,
         )
 
-        def timerfunc():
+        def update_token():
             logger.info("Timed SAS update for (%s,%s)", self.device_id, self.module_id)
             self.generate_new_sas_token()
 
-        self._token_update_timer = Timer(seconds_until_update, timerfunc)
-        self._token_update_timer.daemon = True
-        self._token_update_timer.start()
+        def timerfunc():
+            # Signing can mean a request to an HSM, which must not hold up the other timers of the
+            # shared wheel, so the update runs on a thread of its own.
+            update_thread = threading.Thread(target=update_token, name="sas_token_update")
+            update_thread.daemon = True
+            update_thread.start()
+
+        self._token_update_timer = timer_wheel.get_shared_timer_wheel().schedule(
+            seconds_until_update, timerfunc
+        )
 
     def _notify_token_updated(self):
         """Notify clients that the SAS token has been updated by calling self.on_sas_token_updated.
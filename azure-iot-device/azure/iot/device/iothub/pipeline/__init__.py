@@ -6,3 +6,4 @@ INTERNAL USAGE ONLY
 """
 
 from .iothub_pipeline import IoTHubPipeline
+from .config import IoTHubPipelineConfig
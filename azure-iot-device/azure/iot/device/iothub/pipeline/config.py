@@ -0,0 +1,139 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import logging
+from azure.iot.device.common import outbox
+from azure.iot.device.common.pipeline.config import BasePipelineConfig
+from . import constant
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOX_MAX_SIZE = 16 * 1024 * 1024
+DEFAULT_OUTBOX_DRAIN_RATE = 50
+DEFAULT_REPORTED_PROPERTIES_COALESCE_MAX_SIZE = 8 * 1024
+
+# Features which can be subscribed to when connecting
+_features = [
+    constant.C2D_MSG,
+    constant.INPUT_MSG,
+    constant.METHODS,
+    constant.TWIN,
+    constant.TWIN_PATCHES,
+]
+
+
+class IoTHubPipelineConfig(BasePipelineConfig):
+    """
+    A class for storing all configurations/options for IoTHub clients in the Azure IoT Python
+    Device Client Library.  Keyword arguments passed to the client 'create_from_' classmethods
+    end up here.
+    """
+
+    def __init__(
+        self,
+        outbox_path=None,
+        outbox_max_size=DEFAULT_OUTBOX_MAX_SIZE,
+        outbox_eviction_policy=outbox.DROP_OLDEST,
+        outbox_drain_rate=DEFAULT_OUTBOX_DRAIN_RATE,
+        telemetry_qos=1,
+        twin_cache=False,
+        reported_properties_coalesce_interval=0,
+        reported_properties_coalesce_max_size=DEFAULT_REPORTED_PROPERTIES_COALESCE_MAX_SIZE,
+        subscribe_on_connect=None,
+        **kwargs
+    ):
+        """
+        Initializer for IoTHubPipelineConfig
+
+        :param int max_inflight_messages: The maximum number of telemetry messages which can be
+        awaiting acknowledgement from the service at any given time.
+        :param int executor_shards: The number of pipeline threads which clients in this process
+        are spread across.  See BasePipelineConfig.
+        :param int mqtt_io_threads: The number of shared threads which drive the MQTT connections
+        of every client in the process.  See BasePipelineConfig.
+        :param bool tls_session_resumption: Resume the previous TLS session when reconnecting.
+        :param event_loop: The asyncio event loop which an aio client is used from.  If provided,
+        the client runs its pipeline and MQTT connection on that loop instead of on threads of its
+        own.  See BasePipelineConfig.
+        :param float operation_timeout: The number of seconds to wait for the service to
+        acknowledge a message or a subscription before failing it.  See BasePipelineConfig.
+        :param float request_timeout: The number of seconds to wait for the response to a twin
+        request before failing it.  See BasePipelineConfig.
+        :param int max_pending_requests: The maximum number of twin requests which can be waiting
+        for a response at any given time.  See BasePipelineConfig.
+        :param float connection_queue_drain_rate: The maximum number of operations per second
+        which are released once the client connects, from those that were waiting for the
+        connection.  Method responses are released before twin requests, and twin requests before
+        telemetry.  See BasePipelineConfig.
+        :param dict connection_queue_max_sizes: The maximum number of operations of each priority
+        which can wait for the client to connect.  See BasePipelineConfig.
+        :param bool auto_reconnect: Reconnect when the connection is lost, with a random wait
+        before every attempt which grows with every failed attempt.  See BasePipelineConfig.
+        :param float reconnect_initial_delay: The longest wait before the first attempt to
+        reconnect, in seconds.  See BasePipelineConfig.
+        :param float reconnect_max_delay: The longest wait between attempts to reconnect, in
+        seconds.  See BasePipelineConfig.
+        :param bool warm_standby_reconnect: When the SAS token is renewed, connect with the new
+        token before closing the old connection, which shortens the time during which telemetry
+        cannot be sent.  Messages which were not acknowledged on the old connection are sent
+        again, and may be received twice.  See BasePipelineConfig.
+        :param str outbox_path: Directory in which telemetry messages are stored while the client
+        is not connected.  Messages in the outbox are sent once the client connects, even if they
+        were stored by a previous run of the process.  If not provided, messages are not stored.
+        :param int outbox_max_size: The maximum number of bytes which the outbox can use.
+        :param str outbox_eviction_policy: What to do with a new message when the outbox is full.
+        "drop_oldest" removes the oldest messages to make room for it, "drop_newest" fails it.
+        :param outbox_drain_rate: The maximum number of stored messages which are sent per second
+        after the client connects.
+        :param int telemetry_qos: The MQTT quality of service level which telemetry messages and
+        output events are sent with.  With the default of 1, sending a message completes when the
+        service acknowledges it.  With 0, sending completes as soon as the message has been handed
+        to the MQTT client, without waiting for the service, and messages can be lost.
+        :param bool twin_cache: Keep a local copy of the twin, which is kept up to date with
+        desired property patches while they are enabled, so that get_twin() does not have to
+        request the twin from the service every time.
+        :param float reported_properties_coalesce_interval: The number of seconds for which
+        reported property patches are held back, so that the patches made within that time are
+        merged and sent as a single request.  With the default of 0, every patch is sent right away.
+        :param int reported_properties_coalesce_max_size: The number of bytes of held back reported
+        property patches at which they are sent without waiting for the rest of the interval.
+        :param list subscribe_on_connect: Features which the client subscribes to every time it
+        connects, all with a single SUBSCRIBE request, so that using them later does not wait for
+        a subscription of their own.  Any of "c2d", "input", "methods", "twin" and "twin_patches".
+        "input" is left out for device clients, which have no inputs.
+
+        :raises: ValueError if any of the outbox options is invalid
+        :raises: ValueError if telemetry_qos is not 0 or 1
+        :raises: ValueError if any of the reported_properties_coalesce options is invalid
+        :raises: ValueError if subscribe_on_connect contains an unknown feature
+        """
+        super(IoTHubPipelineConfig, self).__init__(**kwargs)
+        if outbox_max_size < 1:
+            raise ValueError("outbox_max_size must be a positive integer")
+        if outbox_eviction_policy not in outbox.EVICTION_POLICIES:
+            raise ValueError(
+                "outbox_eviction_policy must be one of {}".format(outbox.EVICTION_POLICIES)
+            )
+        if outbox_drain_rate <= 0:
+            raise ValueError("outbox_drain_rate must be a positive number")
+        if telemetry_qos not in (0, 1):
+            raise ValueError("telemetry_qos must be 0 or 1")
+        if reported_properties_coalesce_interval < 0:
+            raise ValueError("reported_properties_coalesce_interval must not be negative")
+        if reported_properties_coalesce_max_size < 1:
+            raise ValueError("reported_properties_coalesce_max_size must be a positive integer")
+        for feature in subscribe_on_connect or []:
+            if feature not in _features:
+                raise ValueError("Unknown feature in subscribe_on_connect: {}".format(feature))
+        self.outbox_path = outbox_path
+        self.outbox_max_size = outbox_max_size
+        self.outbox_eviction_policy = outbox_eviction_policy
+        self.outbox_drain_rate = outbox_drain_rate
+        self.telemetry_qos = telemetry_qos
+        self.twin_cache = twin_cache
+        self.reported_properties_coalesce_interval = reported_properties_coalesce_interval
+        self.reported_properties_coalesce_max_size = reported_properties_coalesce_max_size
+        self.subscribe_on_connect = list(subscribe_on_connect or [])
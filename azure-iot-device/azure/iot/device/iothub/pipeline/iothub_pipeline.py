@@ -4,12 +4,17 @@
 # license information.
 # --------------------------------------------------------------------------
 
+import copy
 import logging
 import sys
+import threading
+from azure.iot.device.common import json_codec
 from azure.iot.device.common.pipeline import (
     pipeline_stages_base,
     pipeline_ops_base,
+    pipeline_events_base,
     pipeline_stages_mqtt,
+    pipeline_thread,
 )
 from . import (
     constant,
@@ -17,18 +22,32 @@ from . import (
     pipeline_events_iothub,
     pipeline_ops_iothub,
     pipeline_stages_iothub_mqtt,
+    twin_cache,
 )
+from .config import IoTHubPipelineConfig
 from azure.iot.device.iothub.auth.x509_authentication_provider import X509AuthenticationProvider
 
 logger = logging.getLogger(__name__)
 
 
 class IoTHubPipeline(object):
-    def __init__(self, auth_provider):
+    def __init__(self, auth_provider, pipeline_configuration=None):
         """
         Constructor for instantiating a pipeline adapter object
         :param auth_provider: The authentication provider
+        :param pipeline_configuration: The configuration generated based on user inputs
+        :type pipeline_configuration: IoTHubPipelineConfig
         """
+        if pipeline_configuration is None:
+            pipeline_configuration = IoTHubPipelineConfig()
+        self.pipeline_configuration = pipeline_configuration
+
+        # Telemetry messages which have been handed to the pipeline but not yet acknowledged by
+        # the service each hold one slot in this window.
+        self._inflight_window = threading.BoundedSemaphore(
+            pipeline_configuration.max_inflight_messages
+        )
+
         self.feature_enabled = {
             constant.C2D_MSG: False,
             constant.INPUT_MSG: False,
@@ -44,12 +63,41 @@ class IoTHubPipeline(object):
         self.on_input_message_received = None
         self.on_method_request_received = None
         self.on_twin_patch_received = None
+        self.on_reconnect_attempt = None
+
+        if pipeline_configuration.twin_cache:
+            self._twin_cache = twin_cache.TwinCache()
+        else:
+            self._twin_cache = None
+
+        # The reported properties the service acknowledged, or None if that is not known.
+        self._reported_state = None
+        # The reported properties of the newest update_reported_properties() call which is still
+        # waiting for the service, or None if no call is.
+        self._pending_reported_state = None
+        # Every call which sends a patch gets the next version.  Completions of calls with a
+        # version up to _reported_state_applied_version no longer change _reported_state.
+        self._reported_state_version = 0
+        self._reported_state_applied_version = 0
+        self._reported_state_lock = threading.Lock()
+
+        # Clients are pinned to an executor shard by their identity, so a client always uses
+        # the same pipeline thread.  Pipelines of aio clients can run on their event loop instead.
+        if pipeline_configuration.event_loop is not None:
+            executor_shard = pipeline_thread.shard_for_event_loop(pipeline_configuration.event_loop)
+        else:
+            executor_shard = pipeline_thread.shard_for_key(
+                "{}/{}".format(auth_provider.device_id, getattr(auth_provider, "module_id", None)),
+                pipeline_configuration.executor_shards,
+            )
 
         self._pipeline = (
-            pipeline_stages_base.PipelineRootStage()
+            pipeline_stages_base.PipelineRootStage(pipeline_configuration, executor_shard)
             .append_stage(pipeline_stages_iothub.UseAuthProviderStage())
             .append_stage(pipeline_stages_iothub.HandleTwinOperationsStage())
             .append_stage(pipeline_stages_base.CoordinateRequestAndResponseStage())
+            .append_stage(pipeline_stages_iothub.StoreAndForwardStage())
+            .append_stage(pipeline_stages_base.ReconnectStage())
             .append_stage(pipeline_stages_base.EnsureConnectionStage())
             .append_stage(pipeline_stages_iothub_mqtt.IoTHubMQTTConverterStage())
             .append_stage(pipeline_stages_mqtt.MQTTClientStage())
@@ -75,19 +123,31 @@ class IoTHubPipeline(object):
                     logger.warning("Method request event received with no handler. Dropping.")
 
             elif isinstance(event, pipeline_events_iothub.TwinDesiredPropertiesPatchEvent):
+                if self._twin_cache:
+                    self._twin_cache.add_patch(event.patch)
                 if self.on_twin_patch_received:
                     self.on_twin_patch_received(event.patch)
                 else:
                     logger.warning("Twin patch event received with no handler. Dropping.")
 
+            elif isinstance(event, pipeline_events_base.ReconnectAttemptEvent):
+                if self.on_reconnect_attempt:
+                    self.on_reconnect_attempt(event.attempt, event.error, event.next_delay)
+
             else:
                 logger.warning("Dropping unknown pipeline event {}".format(event.name))
 
         def _handle_connected():
+            if self._twin_cache:
+                # Patches reach the cache again.  The ones sent while disconnected are lost, which
+                # invalidating the cache on disconnect took care of.
+                self._twin_cache.resume_tracking()
             if self.on_connected:
                 self.on_connected()
 
         def _handle_disconnected():
+            if self._twin_cache:
+                self._twin_cache.invalidate()
             if self.on_disconnected:
                 self.on_disconnected()
 
@@ -110,19 +170,31 @@ class IoTHubPipeline(object):
 
         self._pipeline.run_op(op)
 
+    @property
+    def inflight_window_full(self):
+        """
+        True if sending a telemetry message would block until an earlier one is acknowledged.
+        """
+        if self._inflight_window.acquire(False):
+            self._inflight_window.release()
+            return False
+        return True
+
     def connect(self, callback=None):
         """
         Connect to the service.
 
         :param callback: callback which is called when the connection to the service is complete.
+        If the connection fails, it is called with the error as its error argument.
         """
         logger.info("Starting ConnectOperation on the pipeline")
 
         def on_complete(call):
             if call.error:
-                # TODO we need error semantics on the client
-                sys.exit(1)  # TODO: raise an error instead
-            if callback:
+                logger.error("Connect failed: {}".format(call.error))
+                if callback:
+                    callback(error=call.error)
+            elif callback:
                 callback()
 
         self._pipeline.run_op(pipeline_ops_base.ConnectOperation(callback=on_complete))
@@ -148,39 +220,93 @@ class IoTHubPipeline(object):
         """
         Send a telemetry message to the service.
 
+        This function returns as soon as the message has been handed to the pipeline.  It only
+        blocks if max_inflight_messages telemetry messages are already awaiting acknowledgement,
+        in which case it waits until one of them is acknowledged.
+
         :param message: message to send.
         :param callback: callback which is called when the message publish has been acknowledged by the service.
+        If the message fails, it is called with the error as its error argument.
         """
+        self._run_telemetry_op(
+            pipeline_ops_iothub.SendD2CMessageOperation(message=message), callback
+        )
 
-        def on_complete(call):
-            if call.error:
-                # TODO we need error semantics on the client
-                sys.exit(1)
-            if callback:
-                callback()
+    def send_d2c_messages(self, messages, callback=None):
+        """
+        Send a batch of telemetry messages to the service.
 
-        self._pipeline.run_op(
-            pipeline_ops_iothub.SendD2CMessageOperation(message=message, callback=on_complete)
-        )
+        As many messages as fit into the in-flight window are handed to the pipeline together,
+        so a batch which fits into the window only switches into the pipeline thread once.
+
+        :param messages: list of messages to send.
+        :param callback: callback which is called once all of the messages have completed.  It is
+        called with a list containing one result per message, in the same order as the messages.
+        Each result is None if the message was acknowledged by the service, or the error which
+        caused the message to fail.
+        """
+        ops = [pipeline_ops_iothub.SendD2CMessageOperation(message=message) for message in messages]
+
+        # list instead of int to work around the lack of "nonlocal" in 2.7
+        remaining = [len(ops)]
+        remaining_lock = threading.Lock()
+
+        def on_chunk_complete(chunk):
+            for _ in chunk:
+                self._inflight_window.release()
+            with remaining_lock:
+                remaining[0] -= len(chunk)
+                done = remaining[0] == 0
+            if done and callback:
+                callback([op.error for op in ops])
+
+        if not ops and callback:
+            callback([])
+
+        chunk = []
+        for op in ops:
+            if not self._inflight_window.acquire(False):
+                # The window is full.  Send what we have so far, and wait for a free slot.
+                if chunk:
+                    self._pipeline.run_op_batch(chunk, on_chunk_complete)
+                    chunk = []
+                self._inflight_window.acquire()
+            chunk.append(op)
+        if chunk:
+            self._pipeline.run_op_batch(chunk, on_chunk_complete)
 
     def send_output_event(self, message, callback=None):
         """
         Send an output message to the service.
 
+        Like send_d2c_message, this function only blocks if the in-flight window is full.
+
         :param message: message to send.
         :param callback: callback which is called when the message publish has been acknowledged by the service.
+        If the message fails, it is called with the error as its error argument.
         """
+        self._run_telemetry_op(
+            pipeline_ops_iothub.SendOutputEventOperation(message=message), callback
+        )
+
+    def _run_telemetry_op(self, op, callback):
+        """
+        Run a telemetry operation on the pipeline once a slot in the in-flight window is free.
+        The slot is returned when the operation completes.
+        """
+        self._inflight_window.acquire()
 
         def on_complete(call):
+            self._inflight_window.release()
             if call.error:
-                # TODO we need error semantics on the client
-                sys.exit(1)
-            if callback:
+                logger.error("{} failed: {}".format(call.name, call.error))
+                if callback:
+                    callback(error=call.error)
+            elif callback:
                 callback()
 
-        self._pipeline.run_op(
-            pipeline_ops_iothub.SendOutputEventOperation(message=message, callback=on_complete)
-        )
+        op.callback = on_complete
+        self._pipeline.run_op(op)
 
     def send_method_response(self, method_response, callback=None):
         """
@@ -200,7 +326,10 @@ class IoTHubPipeline(object):
 
         self._pipeline.run_op(
             pipeline_ops_iothub.SendMethodResponseOperation(
-                method_response=method_response, callback=on_complete
+                method_response=method_response,
+                # Encoded here, on the thread of the caller, rather than on the pipeline thread
+                payload=json_codec.dumps(method_response.payload),
+                callback=on_complete,
             )
         )
 
@@ -209,12 +338,23 @@ class IoTHubPipeline(object):
         Send a request for a full twin to the service.
 
         :param callback: callback which is called when request has been acknowledged by the service.
-        This callback should have one parameter, which will contain the requested twin when called.
+        This callback should have one parameter, which will contain the requested twin, JSON
+        encoded in bytes, when called.
         """
 
+        if self._twin_cache:
+            cached_twin = self._twin_cache.get()
+            if cached_twin is not None:
+                logger.info("IoTHubPipeline get_twin returning cached twin")
+                callback(cached_twin)
+                return
+            generation = self._twin_cache.generation
+
         def on_complete(call):
             if call.error:
                 sys.exit(1)
+            if self._twin_cache:
+                self._twin_cache.seed(generation, call.twin)
             if callback:
                 callback(call.twin)
 
@@ -231,6 +371,75 @@ class IoTHubPipeline(object):
         def on_complete(call):
             if call.error:
                 sys.exit(1)
+            if self._twin_cache:
+                # The reported properties in the cache are out of date now
+                self._twin_cache.clear()
+            if callback:
+                callback()
+
+        self._pipeline.run_op(
+            pipeline_ops_iothub.PatchTwinReportedPropertiesOperation(
+                patch=patch, callback=on_complete
+            )
+        )
+
+    def update_reported_properties(self, full_state, callback=None):
+        """
+        Send the smallest patch which turns the reported properties sent by the previous call
+        into the given ones.  Properties which were sent by the previous call, but are not in
+        full_state, are removed.
+
+        The first call, and the first call after a failed one, sends all of full_state, since
+        what the service has is not known.  Reported properties which are not in full_state are
+        only removed from then on.
+
+        :param dict full_state: All of the reported properties.
+        :param callback: callback which is called when request has been acknowledged by the
+        service, or right away if there is nothing to send.  If the request failed, it is called
+        with the error as its 'error' keyword argument.
+        """
+        # Copied, so that the application can go on changing its state
+        full_state = copy.deepcopy(full_state)
+        with self._reported_state_lock:
+            # A patch which is still pending has to be diffed against, so that properties it
+            # sends are removed if they are not in full_state anymore
+            if self._pending_reported_state is not None:
+                base = self._pending_reported_state
+            else:
+                base = self._reported_state
+            patch = twin_cache.create_merge_patch(base or {}, full_state)
+            if patch:
+                self._reported_state_version += 1
+                version = self._reported_state_version
+                self._pending_reported_state = full_state
+
+        if not patch:
+            logger.info("IoTHubPipeline reported properties are up to date.  Not sending a patch")
+            if callback:
+                callback()
+            return
+
+        def on_complete(call):
+            with self._reported_state_lock:
+                if version == self._reported_state_version:
+                    self._pending_reported_state = None
+                if call.error:
+                    # Whether the service applied the patch is not known, and the patches sent
+                    # after it were diffed against it, so their completions are ignored as well
+                    self._reported_state = None
+                    self._pending_reported_state = None
+                    self._reported_state_applied_version = self._reported_state_version
+                elif version > self._reported_state_applied_version:
+                    self._reported_state = full_state
+                    self._reported_state_applied_version = version
+            if call.error:
+                logger.error("{} failed: {}".format(call.name, call.error))
+                if callback:
+                    callback(error=call.error)
+                return
+            if self._twin_cache:
+                # The reported properties in the cache are out of date now
+                self._twin_cache.clear()
             if callback:
                 callback()
 
@@ -258,6 +467,9 @@ class IoTHubPipeline(object):
             if call.error:
                 # TODO we need error semantics on the client
                 sys.exit(1)
+            if self._twin_cache and feature_name == constant.TWIN_PATCHES:
+                # Every patch reaches the cache from now on
+                self._twin_cache.start_tracking()
             if callback:
                 callback()
 
@@ -280,6 +492,8 @@ class IoTHubPipeline(object):
         if feature_name not in self.feature_enabled:
             raise ValueError("Invalid feature_name")
         self.feature_enabled[feature_name] = False
+        if self._twin_cache and feature_name == constant.TWIN_PATCHES:
+            self._twin_cache.stop_tracking()
 
         def on_complete(call):
             if call.error:
@@ -4,12 +4,30 @@
 # license information.
 # --------------------------------------------------------------------------
 
+import collections
 import logging
 from datetime import date
 import six.moves.urllib as urllib
+from azure.iot.device.common import json_codec
+from azure.iot.device.iothub.models import Message, MethodRequest
 
 logger = logging.getLogger(__name__)
 
+# Kinds of incoming topics which are recognized by TopicRouter
+C2D = "c2d"
+INPUT = "input"
+METHOD = "method"
+TWIN_RESPONSE = "twin_response"
+TWIN_PATCH = "twin_patch"
+
+# The result of routing an incoming topic.  kind is one of the kinds above.  name is the input name
+# for INPUT and the method name for METHOD.  request_id is set for METHOD and TWIN_RESPONSE, and
+# status_code (as a string) for TWIN_RESPONSE.  properties is the encoded message properties string
+# for C2D and INPUT.  Fields which do not apply to a kind are None.
+IncomingTopic = collections.namedtuple(
+    "IncomingTopic", ["kind", "name", "request_id", "status_code", "properties"]
+)
+
 
 def _get_topic_base(device_id, module_id):
     """
@@ -144,6 +162,22 @@ def _extract_properties(properties_str):
     return d
 
 
+def _unquote(value):
+    """unquote_plus, without the cost of calling it for values which have nothing to unquote"""
+    if "%" in value or "+" in value:
+        return urllib.parse.unquote_plus(value)
+    return value
+
+
+def _get_request_id(query):
+    """Return the request id from the query string of a method or twin topic"""
+    for entry in query.split("&"):
+        if entry.startswith("$rid="):
+            return _unquote(entry[5:])
+    # Let the full parser raise the error for a malformed query string
+    return _extract_properties(query)["rid"]
+
+
 def get_method_request_id_from_topic(topic):
     """
     Extract the Request ID (RID) from the method topic.
@@ -163,6 +197,67 @@ def get_method_request_id_from_topic(topic):
         raise ValueError("topic has incorrect format")
 
 
+class TopicRouter(object):
+    """
+    Classifies incoming topics, and splits them into their parts, in a single pass.
+
+    The topic bases which a client can receive messages on are built once, when the router is
+    created, instead of every time a message arrives.  A router which is created without a
+    device_id only recognizes the topics which are the same for every client (methods and twin).
+    """
+
+    def __init__(self, device_id=None, module_id=None):
+        # (topic base, kind) pairs.  No base is a prefix of another one.
+        routes = []
+        if device_id:
+            routes.append(("devices/" + device_id + "/messages/devicebound", C2D))
+            if module_id:
+                routes.append(
+                    ("devices/" + device_id + "/modules/" + module_id + "/inputs/", INPUT)
+                )
+        routes.append(("$iothub/methods/POST/", METHOD))
+        routes.append(("$iothub/twin/res/", TWIN_RESPONSE))
+        routes.append(("$iothub/twin/PATCH/properties/desired", TWIN_PATCH))
+        self._routes = routes
+
+    def route(self, topic):
+        """
+        Return an IncomingTopic with the kind and the parts of the given topic, or None if the
+        topic is not one of the topics of this client.
+
+        :param str topic: The topic string
+        :raises: IndexError or KeyError if the request id is missing from a method or twin
+        response topic
+        """
+        for base, kind in self._routes:
+            if topic.startswith(base):
+                break
+        else:
+            return None
+        rest = topic[len(base) :]
+
+        if kind is C2D:
+            # devices/<deviceId>/messages/devicebound/<properties>
+            if rest and rest[0] != "/":
+                return None
+            parts = rest.split("/")
+            return IncomingTopic(kind, None, None, None, parts[1] if len(parts) > 1 else None)
+        elif kind is INPUT:
+            # devices/<deviceId>/modules/<moduleId>/inputs/<inputName>/<properties>
+            parts = rest.split("/")
+            return IncomingTopic(kind, parts[0], None, None, parts[1] if len(parts) > 1 else None)
+        elif kind is METHOD:
+            # $iothub/methods/POST/<method name>/?$rid=<request id>
+            path, _, query = rest.partition("?")
+            return IncomingTopic(kind, path.split("/")[0], _get_request_id(query), None, None)
+        elif kind is TWIN_RESPONSE:
+            # $iothub/twin/res/<status code>/?$rid=<request id>
+            path, _, query = rest.partition("?")
+            return IncomingTopic(kind, None, _get_request_id(query), path.split("/")[0], None)
+        else:
+            return IncomingTopic(kind, None, None, None, None)
+
+
 # TODO: this has too generic a name, given that it's only for messages
 def extract_properties_from_topic(topic, message_received):
     """
@@ -185,28 +280,139 @@ def extract_properties_from_topic(topic, message_received):
     else:
         raise ValueError("topic has incorrect format")
 
+    set_message_properties(properties, message_received)
+
+
+# Message attributes for the system properties which can be on the topic of a received message
+_system_property_attributes = {
+    "$.mid": "message_id",
+    "$.cid": "correlation_id",
+    "$.uid": "user_id",
+    "$.to": "to",
+    "$.ct": "content_type",
+    "$.ce": "content_encoding",
+}
+
+
+def _decode_properties(properties):
+    """
+    Decode an encoded properties string into a dictionary of Message attributes.  Custom
+    properties are in a dictionary under "custom_properties".
+    """
+    attributes = {}
+    custom_properties = {}
     if properties:
         key_value_pairs = properties.split("&")
 
         for entry in key_value_pairs:
             pair = entry.split("=")
-            key = urllib.parse.unquote_plus(pair[0])
-            value = urllib.parse.unquote_plus(pair[1])
-
-            if key == "$.mid":
-                message_received.message_id = value
-            elif key == "$.cid":
-                message_received.correlation_id = value
-            elif key == "$.uid":
-                message_received.user_id = value
-            elif key == "$.to":
-                message_received.to = value
-            elif key == "$.ct":
-                message_received.content_type = value
-            elif key == "$.ce":
-                message_received.content_encoding = value
+            key = _unquote(pair[0])
+            value = _unquote(pair[1])
+
+            if key in _system_property_attributes:
+                attributes[_system_property_attributes[key]] = value
             else:
-                message_received.custom_properties[key] = value
+                custom_properties[key] = value
+    attributes["custom_properties"] = custom_properties
+    return attributes
+
+
+def set_message_properties(properties, message_received):
+    """
+    Set the key=value pairs of an encoded properties string on a received message.
+    :param properties: The properties part of the topic, or None
+    :param message_received: The message received with the payload in bytes
+    """
+    attributes = _decode_properties(properties)
+    message_received.custom_properties.update(attributes.pop("custom_properties"))
+    for name, value in attributes.items():
+        setattr(message_received, name, value)
+
+
+# Message attributes which a ReceivedMessage decodes from its properties string
+_lazy_message_attributes = frozenset(
+    list(_system_property_attributes.values()) + ["custom_properties"]
+)
+
+# The other attributes which Message.__init__ sets, and their default values.  They are copied
+# into every ReceivedMessage, so that no attribute added to Message is missing on a received one.
+_message_defaults = dict(
+    (name, value)
+    for name, value in vars(Message(None)).items()
+    if name not in _lazy_message_attributes
+)
+
+
+class ReceivedMessage(Message):
+    """
+    A Message received on a C2D or input topic, which keeps the encoded properties string from
+    the topic and only decodes it the first time a property of the message is read.
+
+    Decoding the properties of every message on the pipeline thread is wasted work for
+    applications which only read .data, so it is done by whoever reads the properties instead.
+    """
+
+    def __init__(self, data, properties):
+        """
+        :param data: The payload of the message, in bytes
+        :param str properties: The properties part of the topic, or None
+        """
+        # Message.__init__ is not called, because it would set the lazy attributes, hiding the
+        # _LazyMessageAttribute which decodes them
+        self.__dict__.update(_message_defaults)
+        self.data = data
+        self._properties = properties
+
+    def _decode(self):
+        attributes = self.__dict__
+        decoded = _decode_properties(self._properties)
+        for attribute in _lazy_message_attributes:
+            # Do not overwrite what the application set before reading any property
+            if attribute not in attributes:
+                attributes[attribute] = decoded.get(attribute)
+
+
+class _LazyMessageAttribute(object):
+    """
+    Stands in for an attribute of a ReceivedMessage until the properties are decoded.  It has no
+    __set__, so once the attribute is set on the message, the message does not look at it again.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        instance._decode()
+        return instance.__dict__[self.name]
+
+
+for _name in _lazy_message_attributes:
+    setattr(ReceivedMessage, _name, _LazyMessageAttribute(_name))
+
+
+class ReceivedMethodRequest(MethodRequest):
+    """
+    A MethodRequest received on a method topic, which keeps the JSON encoded payload and only
+    decodes it the first time .payload is read, on the thread of whoever reads it.
+    """
+
+    def __init__(self, request_id, name, payload):
+        """
+        :param str request_id: The request id.
+        :param str name: The name of the method to be invoked
+        :param bytes payload: The JSON encoded payload of the request.
+        """
+        super(ReceivedMethodRequest, self).__init__(request_id=request_id, name=name, payload=None)
+        self._encoded_payload = payload
+
+    @property
+    def payload(self):
+        if self._encoded_payload is not None:
+            self._payload = json_codec.loads(self._encoded_payload)
+            self._encoded_payload = None
+        return self._payload
 
 
 # TODO: this has too generic a name, given that it's only for messages
@@ -264,6 +470,122 @@ def encode_properties(message_to_send, topic):
     return topic
 
 
+DEFAULT_PROPERTY_ENCODER_CACHE_SIZE = 128
+
+
+def _encode_value(key, value):
+    """Encode a single key=value pair the same way urlencode does"""
+    if isinstance(value, str):
+        return key + "=" + urllib.parse.quote_plus(value)
+    return urllib.parse.urlencode([("", value)]).replace("=", key + "=", 1)
+
+
+class PropertyEncoder(object):
+    """
+    Produces the same topics as encode_properties, but caches the encoded strings for the parts
+    of a message which tend to be the same from one message to the next.
+
+    The topic together with the output name, user id, to, content type and content encoding is
+    encoded once per distinct combination, and so is every distinct set of custom properties.
+    Only the message id, correlation id and expiry time are encoded for every message.  Both
+    caches are bounded, and drop the least recently used entry when they are full.
+    """
+
+    def __init__(self, max_cache_size=DEFAULT_PROPERTY_ENCODER_CACHE_SIZE):
+        """
+        :param int max_cache_size: The maximum number of entries of each cache.
+        """
+        if max_cache_size < 1:
+            raise ValueError("max_cache_size must be a positive integer")
+        self.max_cache_size = max_cache_size
+        # topic and recurring system properties -> (encoded prefix, encoded middle)
+        self._system_cache = collections.OrderedDict()
+        # tuple of custom property items -> encoded custom properties
+        self._custom_cache = collections.OrderedDict()
+
+    def encode(self, message_to_send, topic):
+        """
+        uri-encode the properties of a message on the topic, like encode_properties.
+        :param message_to_send: The message to send
+        :param topic: The topic which has not been encoded yet
+        :return: The topic which has been uri-encoded
+        """
+        key = (
+            topic,
+            message_to_send.output_name,
+            message_to_send.user_id,
+            message_to_send.to,
+            message_to_send.content_type,
+            message_to_send.content_encoding,
+        )
+        custom_properties = message_to_send.custom_properties
+        custom_key = tuple(custom_properties.items()) if custom_properties else None
+        try:
+            prefix, middle = self._get(self._system_cache, key, self._encode_system_properties)
+            if custom_key:
+                custom = self._get(self._custom_cache, custom_key, self._encode_custom_properties)
+        except TypeError:
+            # Something which cannot be a dictionary key, and so cannot be cached
+            return encode_properties(message_to_send, topic)
+
+        parts = []
+        if message_to_send.message_id:
+            parts.append(_encode_value("%24.mid", message_to_send.message_id))
+        if message_to_send.correlation_id:
+            parts.append(_encode_value("%24.cid", message_to_send.correlation_id))
+        if middle:
+            parts.append(middle)
+        if message_to_send.expiry_time_utc:
+            parts.append(
+                _encode_value(
+                    "%24.exp",
+                    message_to_send.expiry_time_utc.isoformat()
+                    if isinstance(message_to_send.expiry_time_utc, date)
+                    else message_to_send.expiry_time_utc,
+                )
+            )
+
+        if parts:
+            encoded = prefix + ("&" if prefix != topic else "") + "&".join(parts)
+        else:
+            encoded = prefix
+        if custom_key:
+            encoded += "&" + custom
+        return encoded
+
+    def _get(self, cache, key, encode):
+        try:
+            value = cache.pop(key)
+        except KeyError:
+            value = encode(key)
+            if len(cache) >= self.max_cache_size:
+                cache.popitem(last=False)
+        # (Re)inserting the entry makes it the most recently used one
+        cache[key] = value
+        return value
+
+    @staticmethod
+    def _encode_system_properties(key):
+        (topic, output_name, user_id, to, content_type, content_encoding) = key
+        prefix = topic
+        if output_name:
+            prefix += urllib.parse.urlencode([("$.on", output_name)])
+        middle = []
+        if user_id:
+            middle.append(("$.uid", user_id))
+        if to:
+            middle.append(("$.to", to))
+        if content_type:
+            middle.append(("$.ct", content_type))
+        if content_encoding:
+            middle.append(("$.ce", content_encoding))
+        return (prefix, urllib.parse.urlencode(middle))
+
+    @staticmethod
+    def _encode_custom_properties(items):
+        return urllib.parse.urlencode(items)
+
+
 def get_twin_response_topic_for_subscribe():
     return "$iothub/twin/res/#"
 
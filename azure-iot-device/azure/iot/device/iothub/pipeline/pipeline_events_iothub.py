@@ -58,5 +58,11 @@ class TwinDesiredPropertiesPatchEvent(PipelineEvent):
     """
 
     def __init__(self, patch):
+        """
+        Initializer for TwinDesiredPropertiesPatchEvent objects.
+
+        :param bytes patch: The JSON encoded patch.  It is decoded by the client, on the thread
+          of the application, rather than on the pipeline thread.
+        """
         super(TwinDesiredPropertiesPatchEvent, self).__init__()
         self.patch = patch
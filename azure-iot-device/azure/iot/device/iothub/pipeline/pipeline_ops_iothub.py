@@ -3,7 +3,7 @@
 # Licensed under the MIT License. See License.txt in the project root for
 # license information.
 # --------------------------------------------------------------------------
-from azure.iot.device.common.pipeline import PipelineOperation
+from azure.iot.device.common.pipeline import PipelineOperation, pipeline_ops_base
 
 
 # TODO This class handles types of operations that use cert.
@@ -117,6 +117,7 @@ class SendD2CMessageOperation(PipelineOperation):
         super(SendD2CMessageOperation, self).__init__(callback=callback)
         self.message = message
         self.needs_connection = True
+        self.priority = pipeline_ops_base.PRIORITY_TELEMETRY
 
 
 class SendOutputEventOperation(PipelineOperation):
@@ -139,6 +140,7 @@ class SendOutputEventOperation(PipelineOperation):
         super(SendOutputEventOperation, self).__init__(callback=callback)
         self.message = message
         self.needs_connection = True
+        self.priority = pipeline_ops_base.PRIORITY_TELEMETRY
 
 
 class SendMethodResponseOperation(PipelineOperation):
@@ -148,12 +150,15 @@ class SendMethodResponseOperation(PipelineOperation):
     This operation is in the group of IoTHub operations because it is very specific to the IoTHub client.
     """
 
-    def __init__(self, method_response, callback=None):
+    def __init__(self, method_response, payload=None, callback=None):
         """
         Initializer for SendMethodResponseOperation objects.
 
         :param method_response: The method response to be sent to IoTHub/EdgeHub
         :type method_response: MethodResponse
+        :param str payload: The payload of method_response, already JSON encoded by the caller so
+         that this does not happen on the pipeline thread.  If None, the payload is encoded
+         when the response is sent.
         :param callback: The function that gets called when this operation is complete or has failed.
          The callback function must accept a PipelineOperation object which indicates the specific operation has which
          has completed or failed.
@@ -161,7 +166,9 @@ class SendMethodResponseOperation(PipelineOperation):
         """
         super(SendMethodResponseOperation, self).__init__(callback=callback)
         self.method_response = method_response
+        self.payload = payload
         self.needs_connection = True
+        self.priority = pipeline_ops_base.PRIORITY_METHOD_RESPONSE
 
 
 class GetTwinOperation(PipelineOperation):
@@ -169,8 +176,10 @@ class GetTwinOperation(PipelineOperation):
     A PipelineOperation object which represents a request to get a device twin or a module twin from an Azure
     IoT Hub or Azure Iot Edge Hub service.
 
-    :ivar twin: Upon completion, this contains the twin which was retrieved from the service.
-    :type twin: Twin
+    :ivar twin: Upon completion, this contains the JSON encoded twin which was retrieved from the
+      service.  It is decoded by the client, on the thread of the application, rather than on the
+      pipeline thread.
+    :type twin: bytes
     """
 
     def __init__(self, callback=None):
@@ -180,6 +189,7 @@ class GetTwinOperation(PipelineOperation):
         super(GetTwinOperation, self).__init__(callback=callback)
         self.twin = None
         self.needs_connection = True
+        self.priority = pipeline_ops_base.PRIORITY_TWIN
 
 
 class PatchTwinReportedPropertiesOperation(PipelineOperation):
@@ -198,3 +208,4 @@ class PatchTwinReportedPropertiesOperation(PipelineOperation):
         super(PatchTwinReportedPropertiesOperation, self).__init__(callback=callback)
         self.patch = patch
         self.needs_connection = True
+        self.priority = pipeline_ops_base.PRIORITY_TWIN
@@ -4,14 +4,19 @@
 # license information.
 # --------------------------------------------------------------------------
 
-import json
+import base64
 import logging
+import time
+import six
+from datetime import date
+from azure.iot.device.common import json_codec, outbox, timer_wheel
 from azure.iot.device.common.pipeline import (
     pipeline_ops_base,
     PipelineStage,
     operation_flow,
     pipeline_thread,
 )
+from azure.iot.device.iothub.models import Message
 from . import pipeline_ops_iothub
 from . import constant
 
@@ -29,9 +34,17 @@ class UseAuthProviderStage(PipelineStage):
     generated sas token.  After passing down the args and the sas token, this stage
     completes the SetAuthProviderOperation operation.
 
+    If the Authentication Provider renews its sas token before it expires, this stage passes
+    every new token down, followed by a ReconnectOperation, so that the connection is
+    re-established with the new token before the old one expires.
+
     All other operations are passed down.
     """
 
+    def __init__(self):
+        super(UseAuthProviderStage, self).__init__()
+        self.auth_provider = None
+
     @pipeline_thread.runs_on_pipeline_thread
     def _run_op(self, op):
         def pipeline_ops_done(completed_op):
@@ -40,6 +53,9 @@ class UseAuthProviderStage(PipelineStage):
 
         if isinstance(op, pipeline_ops_iothub.SetAuthProviderOperation):
             auth_provider = op.auth_provider
+            self.auth_provider = auth_provider
+            if hasattr(auth_provider, "token_update_callback"):
+                auth_provider.token_update_callback = self._on_sas_token_updated
             operation_flow.run_ops_in_serial(
                 self,
                 pipeline_ops_iothub.SetAuthProviderArgsOperation(
@@ -73,6 +89,79 @@ class UseAuthProviderStage(PipelineStage):
         else:
             operation_flow.pass_op_to_next_stage(self, op)
 
+    @pipeline_thread.invoke_on_pipeline_thread_nowait
+    def _on_sas_token_updated(self):
+        logger.info("{}: new sas token available.  reconnecting with it.".format(self.name))
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_reconnect_complete(op):
+            if op.error:
+                logger.error(
+                    "{}({}): reconnecting with the new sas token failed: {}".format(
+                        self.name, op.name, op.error
+                    )
+                )
+            elif op.pause_duration is not None:
+                logger.info(
+                    "{}({}): reconnected with the new sas token.  operations were paused for {:.3f} seconds.".format(
+                        self.name, op.name, op.pause_duration
+                    )
+                )
+
+        operation_flow.run_ops_in_serial(
+            self,
+            pipeline_ops_base.SetSasTokenOperation(
+                sas_token=self.auth_provider.get_current_sas_token()
+            ),
+            pipeline_ops_base.ReconnectOperation(),
+            callback=on_reconnect_complete,
+        )
+
+
+def _map_twin_error(original_op, twin_op):
+    if twin_op.error:
+        original_op.error = twin_op.error
+    elif twin_op.status_code >= 300:
+        # TODO map error codes to correct exceptions
+        logger.error("Error {} received from twin operation".format(twin_op.status_code))
+        logger.error("response body: {}".format(twin_op.response_body))
+        original_op.error = Exception(
+            "twin operation returned status {}".format(twin_op.status_code)
+        )
+
+
+def _patches_conflict(merged_patch, patch):
+    """
+    Return True if patch cannot be merged into merged_patch without changing what applying
+    them one after the other would do.  This is the case when patch sets properties inside a
+    property which merged_patch sets to a value which is not an object, or removes: applied one
+    after the other, the property ends up with only the properties from patch in it, but
+    applied merged, it keeps the properties it had on the service.
+    """
+    for key, value in patch.items():
+        if isinstance(value, dict) and key in merged_patch:
+            merged_value = merged_patch[key]
+            if not isinstance(merged_value, dict) or _patches_conflict(merged_value, value):
+                return True
+    return False
+
+
+def _merge_patch(merged_patch, patch):
+    """
+    Merge patch into merged_patch, in place, so that applying merged_patch does what applying
+    the patches which were merged into it one after the other would.  Values of None, which
+    remove properties, are kept.  patch is not modified, and no part of it ends up in
+    merged_patch, so the caller can go on changing it.
+    """
+    for key, value in patch.items():
+        if isinstance(value, dict):
+            merged_value = merged_patch.get(key)
+            if not isinstance(merged_value, dict):
+                merged_value = merged_patch[key] = {}
+            _merge_patch(merged_value, value)
+        else:
+            merged_patch[key] = value
+
 
 class HandleTwinOperationsStage(PipelineStage):
     """
@@ -82,30 +171,41 @@ class HandleTwinOperationsStage(PipelineStage):
     for twin requests and responses is handled inside IoTHubMQTTConverterStage, when it converts
     the SendIotRequestOperation to a protocol-specific send operation and when it converts the
     protocol-specific receive event into an IotResponseEvent event.
+
+    If the reported_properties_coalesce_interval option is set in the pipeline configuration,
+    reported property patches are not sent right away.  Patches which arrive within the interval
+    are merged, and sent as a single PATCH request once the interval is over, or once the patches
+    add up to reported_properties_coalesce_max_size bytes.  Every PatchTwinReportedPropertiesOperation
+    which was merged into a request completes with the response to that request.  Pending
+    patches are sent before a GetTwinOperation, so that the twin has them in it.
     """
 
+    def __init__(self):
+        super(HandleTwinOperationsStage, self).__init__()
+        self._pending_patch = None
+        self._pending_patch_ops = []
+        # Sum of the sizes of the encoded patches which were merged into the pending patch.
+        # Merging never makes a patch larger, so the merged patch is at most this large.
+        self._pending_patch_size = 0
+        self._flush_timer = None
+        # Incremented every time the pending patches are sent, so that a flush timer which fired
+        # for patches which were already sent does not send the next patches early
+        self._patch_batch = 0
+
     @pipeline_thread.runs_on_pipeline_thread
     def _run_op(self, op):
-        def map_twin_error(original_op, twin_op):
-            if twin_op.error:
-                original_op.error = twin_op.error
-            elif twin_op.status_code >= 300:
-                # TODO map error codes to correct exceptions
-                logger.error("Error {} received from twin operation".format(twin_op.status_code))
-                logger.error("response body: {}".format(twin_op.response_body))
-                original_op.error = Exception(
-                    "twin operation returned status {}".format(twin_op.status_code)
-                )
-
         if isinstance(op, pipeline_ops_iothub.GetTwinOperation):
 
             def on_twin_response(twin_op):
                 logger.info("{}({}): Got response for GetTwinOperation".format(self.name, op.name))
-                map_twin_error(original_op=op, twin_op=twin_op)
+                _map_twin_error(original_op=op, twin_op=twin_op)
                 if not twin_op.error:
-                    op.twin = json.loads(twin_op.response_body.decode("utf-8"))
+                    op.twin = twin_op.response_body
                 operation_flow.complete_op(self, op)
 
+            if self._pending_patch_ops:
+                self._flush_reported_patch()
+
             operation_flow.pass_op_to_next_stage(
                 self,
                 pipeline_ops_base.SendIotRequestAndWaitForResponseOperation(
@@ -118,32 +218,382 @@ class HandleTwinOperationsStage(PipelineStage):
             )
 
         elif isinstance(op, pipeline_ops_iothub.PatchTwinReportedPropertiesOperation):
+            config = self.pipeline_root.pipeline_configuration
+            if config.reported_properties_coalesce_interval:
+                self._coalesce_reported_patch(op)
+            else:
+                self._send_reported_patch(op.patch, [op])
 
-            def on_twin_response(twin_op):
+        else:
+            operation_flow.pass_op_to_next_stage(self, op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _coalesce_reported_patch(self, op):
+        config = self.pipeline_root.pipeline_configuration
+        if self._pending_patch_ops and _patches_conflict(self._pending_patch, op.patch):
+            logger.info(
+                "{}({}): patch cannot be merged with pending patches.  Sending them first".format(
+                    self.name, op.name
+                )
+            )
+            self._flush_reported_patch()
+
+        if not self._pending_patch_ops:
+            self._pending_patch = {}
+        _merge_patch(self._pending_patch, op.patch)
+        self._pending_patch_ops.append(op)
+        self._pending_patch_size += len(json_codec.dumps(op.patch).encode("utf-8"))
+
+        if self._pending_patch_size >= config.reported_properties_coalesce_max_size:
+            self._flush_reported_patch()
+        elif not self._flush_timer:
+            batch = self._patch_batch
+            on_flush_timer = pipeline_thread.invoke_on_pipeline_thread_nowait(self._on_flush_timer)
+            self._flush_timer = timer_wheel.get_shared_timer_wheel().schedule(
+                config.reported_properties_coalesce_interval, lambda: on_flush_timer(batch)
+            )
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _on_flush_timer(self, batch):
+        if batch != self._patch_batch:
+            logger.info(
+                "{}: Flush timer fired for patches which were already sent.  Ignoring".format(
+                    self.name
+                )
+            )
+            return
+        self._flush_timer = None
+        self._flush_reported_patch()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _flush_reported_patch(self):
+        if self._flush_timer:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._pending_patch_ops:
+            return
+        self._patch_batch += 1
+        patch, ops = self._pending_patch, self._pending_patch_ops
+        self._pending_patch = None
+        self._pending_patch_ops = []
+        self._pending_patch_size = 0
+        self._send_reported_patch(patch, ops)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _send_reported_patch(self, patch, ops):
+        """
+        Send a reported properties patch, and complete all of the given
+        PatchTwinReportedPropertiesOperation operations with the response.
+        """
+
+        def on_twin_response(twin_op):
+            for op in ops:
                 logger.info(
                     "{}({}): Got response for PatchTwinReportedPropertiesOperation operation".format(
                         self.name, op.name
                     )
                 )
-                map_twin_error(original_op=op, twin_op=twin_op)
+                _map_twin_error(original_op=op, twin_op=twin_op)
                 operation_flow.complete_op(self, op)
 
+        if len(ops) == 1:
             logger.info(
-                "{}({}): Sending reported properties patch: {}".format(self.name, op.name, op.patch)
+                "{}({}): Sending reported properties patch: {}".format(
+                    self.name, ops[0].name, patch
+                )
             )
-
-            operation_flow.pass_op_to_next_stage(
-                self,
-                (
-                    pipeline_ops_base.SendIotRequestAndWaitForResponseOperation(
-                        request_type=constant.TWIN,
-                        method="PATCH",
-                        resource_location="/properties/reported/",
-                        request_body=json.dumps(op.patch),
-                        callback=on_twin_response,
-                    )
-                ),
+        else:
+            logger.info(
+                "{}: Sending reported properties patch merged from {} patches: {}".format(
+                    self.name, len(ops), patch
+                )
             )
 
+        operation_flow.pass_op_to_next_stage(
+            self,
+            (
+                pipeline_ops_base.SendIotRequestAndWaitForResponseOperation(
+                    request_type=constant.TWIN,
+                    method="PATCH",
+                    resource_location="/properties/reported/",
+                    request_body=json_codec.dumps(patch),
+                    callback=on_twin_response,
+                )
+            ),
+        )
+
+
+# Message attributes which are kept along with the data when a message is stored in the outbox
+_stored_message_attributes = [
+    "message_id",
+    "content_encoding",
+    "content_type",
+    "output_name",
+    "correlation_id",
+    "user_id",
+    "to",
+    "expiry_time_utc",
+    "custom_properties",
+]
+
+# Shortest time to wait before sending more messages from the outbox when the drain rate has
+# been reached.
+_minimum_drain_interval = 0.1
+
+# Time to wait before sending messages from the outbox again after one of them failed
+_drain_retry_interval = 5
+
+
+def _encode_payload(data):
+    """
+    Convert message data into the bytes which are published for it, in the same way as the MQTT
+    client converts the data of a message which is sent while connected.
+
+    :raises: TypeError if the MQTT client cannot publish data of this type either.
+    """
+    if isinstance(data, six.text_type):
+        return data.encode("utf-8")
+    elif isinstance(data, (six.binary_type, bytearray)):
+        return bytes(data)
+    elif isinstance(data, (float,) + six.integer_types):
+        return str(data).encode("ascii")
+    elif data is None:
+        return b""
+    else:
+        raise TypeError("payload must be a string, bytearray, int, float or None.")
+
+
+def _encode_telemetry_op(op):
+    """
+    Encode a SendD2CMessageOperation or SendOutputEventOperation as an outbox record.
+    """
+    payload = _encode_payload(op.message.data)
+    stored_data = {"bytes": base64.b64encode(payload).decode("ascii")}
+
+    properties = {}
+    for attribute in _stored_message_attributes:
+        value = getattr(op.message, attribute)
+        if isinstance(value, date):
+            value = value.isoformat()
+        if value:
+            properties[attribute] = value
+
+    record = {
+        "output": isinstance(op, pipeline_ops_iothub.SendOutputEventOperation),
+        "data": stored_data,
+        "properties": properties,
+    }
+    return json_codec.dumps(record).encode("utf-8")
+
+
+def _decode_telemetry_op(record):
+    """
+    Create a SendD2CMessageOperation or SendOutputEventOperation from an outbox record.
+    """
+    record = json_codec.loads(record)
+    message = Message(base64.b64decode(record["data"]["bytes"]))
+    for attribute, value in record["properties"].items():
+        setattr(message, attribute, value)
+
+    if record["output"]:
+        return pipeline_ops_iothub.SendOutputEventOperation(message=message)
+    else:
+        return pipeline_ops_iothub.SendD2CMessageOperation(message=message)
+
+
+class StoreAndForwardStage(PipelineStage):
+    """
+    PipelineStage which keeps telemetry in a durable outbox while the client is not connected.
+
+    This stage only does anything if the outbox_path option is set in the pipeline
+    configuration.  Otherwise, all operations are passed down.
+
+    SendD2CMessageOperation and SendOutputEventOperation operations which arrive while the
+    client is not connected, or while older messages are still waiting in the outbox, are
+    written to the outbox and completed as soon as they are stored.  If the client is not
+    connected, this stage also starts connecting it.  Messages left in the outbox by a previous
+    run of the process are picked up the same way.
+
+    Once the client connects, messages are read from the outbox and sent, at no more than
+    outbox_drain_rate messages per second and with no more than max_inflight_messages of them
+    awaiting acknowledgement at a time.  A message is only removed from the outbox after the
+    service acknowledges it.  Messages which were sent but not acknowledged when the connection
+    dropped are sent again after the next connect, so the service may receive them twice.
+
+    All other operations are passed down.
+    """
+
+    def __init__(self):
+        super(StoreAndForwardStage, self).__init__()
+        self.connected = False
+        self.outbox = None
+        self._connecting = False
+        # [position, acknowledged] for every message which was sent from the outbox but not yet
+        # removed from it, in the order they are stored.
+        self._draining = []
+        # Incremented whenever draining stops, so completions of older sends can be ignored.
+        self._drain_generation = 0
+        self._drain_timer = None
+        self._tokens = None
+        self._last_refill = None
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _run_op(self, op):
+        if (
+            isinstance(op, pipeline_ops_iothub.SendD2CMessageOperation)
+            or isinstance(op, pipeline_ops_iothub.SendOutputEventOperation)
+        ) and self._get_outbox() is not None:
+            if self.connected and not self._draining and not len(self.outbox):
+                operation_flow.pass_op_to_next_stage(self, op)
+            else:
+                self._store(op)
         else:
             operation_flow.pass_op_to_next_stage(self, op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _get_outbox(self):
+        """
+        Return the outbox, opening it the first time it is needed, or None if there is no outbox.
+        """
+        if self.outbox is None:
+            config = self.pipeline_root.pipeline_configuration
+            if config.outbox_path:
+                self.outbox = outbox.Outbox(
+                    path=config.outbox_path,
+                    max_size=config.outbox_max_size,
+                    eviction_policy=config.outbox_eviction_policy,
+                )
+        return self.outbox
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _store(self, op):
+        evicted = self.outbox.append(_encode_telemetry_op(op))
+        if evicted:
+            logger.warning(
+                "{}({}): outbox full.  dropped {} oldest messages".format(
+                    self.name, op.name, evicted
+                )
+            )
+        logger.info(
+            "{}({}): stored in outbox.  {} messages waiting".format(
+                self.name, op.name, len(self.outbox)
+            )
+        )
+        operation_flow.complete_op(self, op)
+        if not self.connected:
+            self._connect()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _connect(self):
+        if self._connecting:
+            return
+        self._connecting = True
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_connect_complete(connect_op):
+            self._connecting = False
+            if connect_op.error:
+                logger.error(
+                    "{}: connect failed.  {} messages remain in the outbox".format(
+                        self.name, len(self.outbox)
+                    ),
+                    exc_info=connect_op.error,
+                )
+
+        logger.info("{}: connecting to send messages from the outbox".format(self.name))
+        operation_flow.pass_op_to_next_stage(
+            self, pipeline_ops_base.ConnectOperation(callback=on_connect_complete)
+        )
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _drain(self):
+        """
+        Send as many messages from the outbox as the drain rate and the in-flight limit allow.
+        """
+        self._drain_timer = None
+        if not self.connected or self._get_outbox() is None:
+            return
+
+        config = self.pipeline_root.pipeline_configuration
+        rate = config.outbox_drain_rate
+        now = time.time()
+        if self._tokens is None:
+            self._tokens = float(rate)
+        else:
+            self._tokens = min(float(rate), self._tokens + max(0, now - self._last_refill) * rate)
+        self._last_refill = now
+
+        while len(self._draining) < config.max_inflight_messages:
+            if self._tokens < 1:
+                # Wait for the rate limit to allow some more messages to be sent
+                self._schedule_drain(max((1 - self._tokens) / rate, _minimum_drain_interval))
+                break
+            next_record = self.outbox.read()
+            if next_record is None:
+                break
+            self._tokens -= 1
+            self._send_stored(*next_record)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _schedule_drain(self, delay):
+        self._drain_timer = timer_wheel.get_shared_timer_wheel().schedule(
+            delay, pipeline_thread.invoke_on_pipeline_thread_nowait(self._drain)
+        )
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _send_stored(self, position, record):
+        op = _decode_telemetry_op(record)
+        entry = [position, False]
+        self._draining.append(entry)
+        generation = self._drain_generation
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_sent(sent_op):
+            if generation != self._drain_generation:
+                return
+            if sent_op.error:
+                logger.error(
+                    "{}({}): failed to send message from the outbox.  trying again in {} seconds".format(
+                        self.name, sent_op.name, _drain_retry_interval
+                    ),
+                    exc_info=sent_op.error,
+                )
+                self._stop_draining()
+                self._schedule_drain(_drain_retry_interval)
+                return
+
+            entry[1] = True
+            # Messages can be acknowledged out of order, but they can only be removed from the
+            # head of the outbox.
+            last_acknowledged = None
+            while self._draining and self._draining[0][1]:
+                last_acknowledged = self._draining.pop(0)[0]
+            if last_acknowledged:
+                self.outbox.commit(last_acknowledged)
+            if not self._drain_timer:
+                self._drain()
+
+        op.callback = on_sent
+        operation_flow.pass_op_to_next_stage(self, op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _stop_draining(self):
+        self._drain_generation += 1
+        self._draining = []
+        if self._drain_timer:
+            self._drain_timer.cancel()
+            self._drain_timer = None
+        if self.outbox is not None:
+            self.outbox.rewind()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def on_connected(self):
+        self.connected = True
+        PipelineStage.on_connected(self)
+        self._drain()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def on_disconnected(self):
+        self.connected = False
+        self._stop_draining()
+        PipelineStage.on_disconnected(self)
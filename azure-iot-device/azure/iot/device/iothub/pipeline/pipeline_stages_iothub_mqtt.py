@@ -5,7 +5,7 @@
 # --------------------------------------------------------------------------
 
 import logging
-import json
+from azure.iot.device.common import json_codec
 from azure.iot.device.common.pipeline import (
     pipeline_events_base,
     pipeline_ops_base,
@@ -15,7 +15,6 @@ from azure.iot.device.common.pipeline import (
     operation_flow,
     pipeline_thread,
 )
-from azure.iot.device.iothub.models import Message, MethodRequest
 from . import constant, pipeline_ops_iothub, pipeline_events_iothub, mqtt_topic_iothub
 
 logger = logging.getLogger(__name__)
@@ -25,11 +24,20 @@ class IoTHubMQTTConverterStage(PipelineStage):
     """
     PipelineStage which converts other Iot and IoTHub operations into MQTT operations.  This stage also
     converts mqtt pipeline events into Iot and IoTHub pipeline events.
+
+    If the subscribe_on_connect option is set in the pipeline configuration, this stage
+    subscribes to the topics of those features with a single SUBSCRIBE request every time the
+    client connects, before completing the connect.  EnableFeatureOperation operations for those
+    features are then completed without subscribing again.
     """
 
     def __init__(self):
         super(IoTHubMQTTConverterStage, self).__init__()
         self.feature_to_topic = {}
+        # Features whose topics were subscribed to as part of the last connect
+        self.features_subscribed_on_connect = set()
+        self.topic_router = mqtt_topic_iothub.TopicRouter()
+        self.property_encoder = mqtt_topic_iothub.PropertyEncoder()
 
     @pipeline_thread.runs_on_pipeline_thread
     def _run_op(self, op):
@@ -69,11 +77,15 @@ class IoTHubMQTTConverterStage(PipelineStage):
             op, pipeline_ops_iothub.SendOutputEventOperation
         ):
             # Convert SendTelementry and SendOutputEventOperation operations into MQTT Publish operations
-            topic = mqtt_topic_iothub.encode_properties(op.message, self.telemetry_topic)
+            topic = self.property_encoder.encode(op.message, self.telemetry_topic)
             operation_flow.delegate_to_different_op(
                 stage=self,
                 original_op=op,
-                new_op=pipeline_ops_mqtt.MQTTPublishOperation(topic=topic, payload=op.message.data),
+                new_op=pipeline_ops_mqtt.MQTTPublishOperation(
+                    topic=topic,
+                    payload=op.message.data,
+                    qos=self.pipeline_root.pipeline_configuration.telemetry_qos,
+                ),
             )
 
         elif isinstance(op, pipeline_ops_iothub.SendMethodResponseOperation):
@@ -81,13 +93,32 @@ class IoTHubMQTTConverterStage(PipelineStage):
             topic = mqtt_topic_iothub.get_method_topic_for_publish(
                 op.method_response.request_id, str(op.method_response.status)
             )
-            payload = json.dumps(op.method_response.payload)
+            if op.payload is not None:
+                payload = op.payload
+            else:
+                payload = json_codec.dumps(op.method_response.payload)
             operation_flow.delegate_to_different_op(
                 stage=self,
                 original_op=op,
                 new_op=pipeline_ops_mqtt.MQTTPublishOperation(topic=topic, payload=payload),
             )
 
+        elif isinstance(
+            op, (pipeline_ops_base.ConnectOperation, pipeline_ops_base.ReconnectOperation)
+        ) and (self.pipeline_root.pipeline_configuration.subscribe_on_connect):
+            self._connect_and_subscribe(op)
+
+        elif (
+            isinstance(op, pipeline_ops_base.EnableFeatureOperation)
+            and op.feature_name in self.features_subscribed_on_connect
+        ):
+            logger.info(
+                "{}({}): already subscribed to {} when connecting.  Completing".format(
+                    self.name, op.name, op.feature_name
+                )
+            )
+            operation_flow.complete_op(self, op)
+
         elif isinstance(op, pipeline_ops_base.EnableFeatureOperation):
             # Enabling a feature gets translated into an MQTT subscribe operation
             topic = self.feature_to_topic[op.feature_name]
@@ -100,6 +131,7 @@ class IoTHubMQTTConverterStage(PipelineStage):
         elif isinstance(op, pipeline_ops_base.DisableFeatureOperation):
             # Disabling a feature gets turned into an MQTT unsubscribe operation
             topic = self.feature_to_topic[op.feature_name]
+            self.features_subscribed_on_connect.discard(op.feature_name)
             operation_flow.delegate_to_different_op(
                 stage=self,
                 original_op=op,
@@ -129,6 +161,57 @@ class IoTHubMQTTConverterStage(PipelineStage):
             # All other operations get passed down
             operation_flow.pass_op_to_next_stage(self, op)
 
+    @pipeline_thread.runs_on_pipeline_thread
+    def _connect_and_subscribe(self, op):
+        """
+        Pass a connect or reconnect operation down, and once it is connected, subscribe to the
+        topics of all of the subscribe_on_connect features at once before completing it.
+        """
+        features = self.pipeline_root.pipeline_configuration.subscribe_on_connect
+        if constant.INPUT_MSG in features and not self.module_id:
+            # Only modules have inputs, and IoT Hub would reject the whole SUBSCRIBE request
+            logger.warning(
+                "{}({}): not subscribing to {} when connecting, because this is not a module".format(
+                    self.name, op.name, constant.INPUT_MSG
+                )
+            )
+            features = [feature for feature in features if feature != constant.INPUT_MSG]
+        self.features_subscribed_on_connect = set()
+        if not features:
+            operation_flow.pass_op_to_next_stage(self, op)
+            return
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_subscribed(subscribe_op):
+            if subscribe_op.error:
+                # Not fatal.  The features are subscribed to one by one when they are enabled.
+                logger.warning(
+                    "{}({}): failed to subscribe to {} when connecting".format(
+                        self.name, op.name, features
+                    ),
+                    exc_info=subscribe_op.error,
+                )
+            else:
+                self.features_subscribed_on_connect = set(features)
+            operation_flow.complete_op(self, op)
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_connected(connect_op):
+            if connect_op.error:
+                op.error = connect_op.error
+                operation_flow.complete_op(self, op)
+                return
+            logger.info("{}({}): subscribing to {}".format(self.name, op.name, features))
+            operation_flow.pass_op_to_next_stage(
+                self,
+                pipeline_ops_mqtt.MQTTSubscribeOperation(
+                    topic=[self.feature_to_topic[feature] for feature in features],
+                    callback=on_subscribed,
+                ),
+            )
+
+        operation_flow.pass_op_to_next_stage(self, type(op)(callback=on_connected))
+
     @pipeline_thread.runs_on_pipeline_thread
     def _set_topic_names(self, device_id, module_id):
         """
@@ -146,6 +229,7 @@ class IoTHubMQTTConverterStage(PipelineStage):
             constant.TWIN: (mqtt_topic_iothub.get_twin_response_topic_for_subscribe()),
             constant.TWIN_PATCHES: (mqtt_topic_iothub.get_twin_patch_topic_for_subscribe()),
         }
+        self.topic_router = mqtt_topic_iothub.TopicRouter(device_id, module_id)
 
     @pipeline_thread.runs_on_pipeline_thread
     def _handle_pipeline_event(self, event):
@@ -155,56 +239,50 @@ class IoTHubMQTTConverterStage(PipelineStage):
         """
         if isinstance(event, pipeline_events_mqtt.IncomingMQTTMessageEvent):
             topic = event.topic
+            incoming = self.topic_router.route(topic)
+
+            if incoming is None:
+                logger.info("Uunknown topic: {} passing up to next handler".format(topic))
+                operation_flow.pass_event_to_previous_stage(self, event)
 
-            if mqtt_topic_iothub.is_c2d_topic(topic, self.device_id):
-                message = Message(event.payload)
-                mqtt_topic_iothub.extract_properties_from_topic(topic, message)
+            elif incoming.kind is mqtt_topic_iothub.C2D:
+                message = mqtt_topic_iothub.ReceivedMessage(event.payload, incoming.properties)
                 operation_flow.pass_event_to_previous_stage(
                     self, pipeline_events_iothub.C2DMessageEvent(message)
                 )
 
-            elif mqtt_topic_iothub.is_input_topic(topic, self.device_id, self.module_id):
-                message = Message(event.payload)
-                mqtt_topic_iothub.extract_properties_from_topic(topic, message)
-                input_name = mqtt_topic_iothub.get_input_name_from_topic(topic)
+            elif incoming.kind is mqtt_topic_iothub.INPUT:
+                message = mqtt_topic_iothub.ReceivedMessage(event.payload, incoming.properties)
                 operation_flow.pass_event_to_previous_stage(
-                    self, pipeline_events_iothub.InputMessageEvent(input_name, message)
+                    self, pipeline_events_iothub.InputMessageEvent(incoming.name, message)
                 )
 
-            elif mqtt_topic_iothub.is_method_topic(topic):
-                request_id = mqtt_topic_iothub.get_method_request_id_from_topic(topic)
-                method_name = mqtt_topic_iothub.get_method_name_from_topic(topic)
-                method_received = MethodRequest(
-                    request_id=request_id,
-                    name=method_name,
-                    payload=json.loads(event.payload.decode("utf-8")),
+            elif incoming.kind is mqtt_topic_iothub.METHOD:
+                # The payload is decoded by whoever reads it, not on the pipeline thread
+                method_received = mqtt_topic_iothub.ReceivedMethodRequest(
+                    request_id=incoming.request_id, name=incoming.name, payload=event.payload
                 )
                 operation_flow.pass_event_to_previous_stage(
                     self, pipeline_events_iothub.MethodRequestEvent(method_received)
                 )
 
-            elif mqtt_topic_iothub.is_twin_response_topic(topic):
-                request_id = mqtt_topic_iothub.get_twin_request_id_from_topic(topic)
-                status_code = int(mqtt_topic_iothub.get_twin_status_code_from_topic(topic))
+            elif incoming.kind is mqtt_topic_iothub.TWIN_RESPONSE:
                 operation_flow.pass_event_to_previous_stage(
                     self,
                     pipeline_events_base.IotResponseEvent(
-                        request_id=request_id, status_code=status_code, response_body=event.payload
+                        request_id=incoming.request_id,
+                        status_code=int(incoming.status_code),
+                        response_body=event.payload,
                     ),
                 )
 
-            elif mqtt_topic_iothub.is_twin_desired_property_patch_topic(topic):
+            else:
+                # mqtt_topic_iothub.TWIN_PATCH.  The patch is decoded by the client, not here.
                 operation_flow.pass_event_to_previous_stage(
                     self,
-                    pipeline_events_iothub.TwinDesiredPropertiesPatchEvent(
-                        patch=json.loads(event.payload.decode("utf-8"))
-                    ),
+                    pipeline_events_iothub.TwinDesiredPropertiesPatchEvent(patch=event.payload),
                 )
 
-            else:
-                logger.info("Uunknown topic: {} passing up to next handler".format(topic))
-                operation_flow.pass_event_to_previous_stage(self, event)
-
         else:
             # all other messages get passed up
             operation_flow.pass_event_to_previous_stage(self, event)
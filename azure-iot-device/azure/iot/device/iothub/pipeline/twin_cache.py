@@ -0,0 +1,199 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a local copy of the twin, which is kept up to date with desired
+property patches so that the twin does not have to be requested from the service every time.
+"""
+
+import logging
+import threading
+from azure.iot.device.common import json_codec
+
+logger = logging.getLogger(__name__)
+
+# The maximum number of patches which are kept before they are applied.  Past this, the cache is
+# dropped instead of growing without bound while nobody reads the twin.
+MAX_PENDING_PATCHES = 100
+
+
+def apply_merge_patch(target, patch):
+    """
+    Apply a JSON merge patch (RFC 7386) to a dictionary, in place.  Keys with a value of None
+    are removed.
+    """
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            apply_merge_patch(target[key], value)
+        elif isinstance(value, dict):
+            target[key] = {}
+            apply_merge_patch(target[key], value)
+        else:
+            target[key] = value
+
+
+def create_merge_patch(source, target):
+    """
+    Create the smallest JSON merge patch (RFC 7386) which turns the source dictionary into the
+    target dictionary.  Keys which are missing from target, or which are None in it, are
+    removed with a value of None.
+
+    Values in the patch are shared with target, not copied.
+    """
+    patch = {}
+    for key in source:
+        if target.get(key) is None:
+            patch[key] = None
+    for key, value in target.items():
+        if value is None:
+            continue
+        old_value = source.get(key)
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            value_patch = create_merge_patch(old_value, value)
+            if value_patch:
+                patch[key] = value_patch
+        elif type(value) is not type(old_value) or value != old_value:
+            # Comparing types as well, since 1 == 1.0 == True but they are not the same JSON
+            patch[key] = value
+    return patch
+
+
+class TwinCache(object):
+    """
+    A local copy of the twin, seeded from a full twin and kept up to date by applying desired
+    property patches in $version order.
+
+    The cache can only be trusted while every desired property patch reaches it, so it is only
+    used while tracking is on, which is from the moment the twin patch subscription is in place
+    until the client disconnects or unsubscribes.  A patch whose $version is not the next one
+    means that a patch was missed, so the cache is dropped, and the next get() returns None.
+
+    Twins and patches are kept encoded until get() is called, so that nothing is decoded on the
+    thread which adds them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Whether the client is subscribed to desired property patches
+        self._subscribed = False
+        # Whether every patch reaches the cache.  Not while disconnected, even if subscribed.
+        self._tracking = False
+        # Incremented every time the cache is dropped, so that a twin which was requested
+        # before that does not seed the cache.
+        self._generation = 0
+        self._encoded_twin = None
+        self._twin = None
+        self._pending_patches = []
+
+    def start_tracking(self):
+        """Start trusting the cache.  Call once the twin patch subscription is in place."""
+        with self._lock:
+            self._subscribed = True
+            self._tracking = True
+
+    def stop_tracking(self):
+        """Drop the cache, and stop trusting it.  Call when unsubscribing from twin patches."""
+        with self._lock:
+            self._subscribed = False
+            self._tracking = False
+            self._drop()
+
+    def invalidate(self):
+        """Drop the cache, and stop trusting it until resume_tracking() is called.  Call when
+        the client disconnects, since patches sent while it is disconnected are lost."""
+        with self._lock:
+            self._tracking = False
+            self._drop()
+
+    def resume_tracking(self):
+        """Start trusting the cache again if the client is still subscribed to twin patches.
+        Call when the client connects."""
+        with self._lock:
+            self._tracking = self._subscribed
+
+    def clear(self):
+        """Drop the cache, so that the twin is requested again, but keep tracking patches."""
+        with self._lock:
+            self._drop()
+
+    @property
+    def generation(self):
+        """A token to pass to seed() along with a twin which is requested now."""
+        return self._generation
+
+    def seed(self, generation, encoded_twin):
+        """
+        Replace the cache with a full twin.
+
+        :param generation: The value of generation when the twin was requested.
+        :param bytes encoded_twin: The JSON encoded twin.
+        """
+        with self._lock:
+            if not self._tracking or generation != self._generation:
+                logger.debug("Twin cache was dropped while the twin was requested.  Not seeding.")
+                return
+            self._encoded_twin = encoded_twin
+            self._twin = None
+            # Patches received before the twin may or may not be in it.  The versions tell.
+
+    def add_patch(self, encoded_patch):
+        """
+        Add a desired property patch to the cache.
+
+        :param bytes encoded_patch: The JSON encoded patch.
+        """
+        with self._lock:
+            if not self._tracking:
+                return
+            if len(self._pending_patches) >= MAX_PENDING_PATCHES:
+                logger.info("Too many twin patches waiting to be applied.  Dropping twin cache.")
+                self._drop()
+                return
+            self._pending_patches.append(encoded_patch)
+
+    def get(self):
+        """
+        Return the JSON encoded twin, with every patch applied, or None if the twin has to be
+        requested from the service.
+        """
+        with self._lock:
+            if not self._tracking or self._encoded_twin is None:
+                return None
+            if not self._pending_patches:
+                return self._encoded_twin
+
+            if self._twin is None:
+                self._twin = json_codec.loads(self._encoded_twin)
+            desired = self._twin.setdefault("desired", {})
+            for encoded_patch in self._pending_patches:
+                patch = json_codec.loads(encoded_patch)
+                version = patch.get("$version")
+                current_version = desired.get("$version")
+                if version is None or current_version is None:
+                    logger.info("Twin patch without $version.  Dropping twin cache.")
+                    self._drop()
+                    return None
+                if version <= current_version:
+                    # Already in the twin the cache was seeded with
+                    continue
+                if version != current_version + 1:
+                    logger.info(
+                        "Missed twin patches between $version {} and {}.  Dropping twin cache.".format(
+                            current_version, version
+                        )
+                    )
+                    self._drop()
+                    return None
+                apply_merge_patch(desired, patch)
+            self._pending_patches = []
+            self._encoded_twin = json_codec.dumps(self._twin).encode("utf-8")
+            return self._encoded_twin
+
+    def _drop(self):
+        self._generation += 1
+        self._encoded_twin = None
+        self._twin = None
+        self._pending_patches = []
@@ -9,6 +9,8 @@ Azure IoTHub Device SDK for Python.
 
 import logging
 import threading
+from concurrent.futures import Future
+from azure.iot.device.common import json_codec
 from .abstract_clients import (
     AbstractIoTHubClient,
     AbstractIoTHubDeviceClient,
@@ -36,9 +38,15 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         :param pipeline: The pipeline that the client will use.
         """
         super(GenericIoTHubClient, self).__init__(pipeline)
+        # Handler which is called with the attempt number, the error (None if the attempt
+        # succeeded) and the number of seconds until the next attempt (None if there is none)
+        # every time the client tries to re-establish a lost connection.  It is called on a
+        # pipeline thread, so it must not block.
+        self.on_reconnect_attempt = None
         self._inbox_manager = InboxManager(inbox_type=SyncClientInbox)
         self._pipeline.on_connected = self._on_connected
         self._pipeline.on_disconnected = self._on_disconnected
+        self._pipeline.on_reconnect_attempt = self._on_reconnect_attempt
         self._pipeline.on_method_request_received = self._inbox_manager.route_method_request
         self._pipeline.on_twin_patch_received = self._inbox_manager.route_twin_patch
 
@@ -52,6 +60,15 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         self._inbox_manager.clear_all_method_requests()
         logger.info("Cleared all pending method requests due to disconnect")
 
+    def _on_reconnect_attempt(self, attempt, error, next_delay):
+        """Helper handler that is called upon every attempt to re-establish a lost connection"""
+        if error:
+            logger.info("Connection State - Reconnect attempt {} failed: {}".format(attempt, error))
+        else:
+            logger.info("Connection State - Reconnected on attempt {}".format(attempt))
+        if self.on_reconnect_attempt:
+            self.on_reconnect_attempt(attempt, error, next_delay)
+
     def connect(self):
         """Connects the client to an Azure IoT Hub or Azure IoT Edge Hub instance.
 
@@ -60,17 +77,26 @@ class GenericIoTHubClient(AbstractIoTHubClient):
 
         This is a synchronous call, meaning that this function will not return until the connection
         to the service has been completely established.
+
+        :raises: The error which the connection failed with, if it failed.
         """
         logger.info("Connecting to Hub...")
 
         connect_complete = threading.Event()
-
-        def callback():
+        # list instead of a plain variable to work around the lack of "nonlocal" in 2.7
+        connect_error = []
+
+        def callback(error=None):
+            if error:
+                connect_error.append(error)
+            else:
+                logger.info("Successfully connected to Hub")
             connect_complete.set()
-            logger.info("Successfully connected to Hub")
 
         self._pipeline.connect(callback=callback)
         connect_complete.wait()
+        if connect_error:
+            raise connect_error[0]
 
     def disconnect(self):
         """Disconnect the client from the Azure IoT Hub or Azure IoT Edge Hub instance.
@@ -100,19 +126,94 @@ class GenericIoTHubClient(AbstractIoTHubClient):
 
         :param message: The actual message to send. Anything passed that is not an instance of the
         Message class will be converted to Message object.
+
+        :raises: The error which sending the message failed with, if it failed.
         """
         if not isinstance(message, Message):
             message = Message(message)
 
         logger.info("Sending message to Hub...")
         send_complete = threading.Event()
-
-        def callback():
+        # list instead of a plain variable to work around the lack of "nonlocal" in 2.7
+        send_error = []
+
+        def callback(error=None):
+            if error:
+                send_error.append(error)
+            else:
+                logger.info("Successfully sent message to Hub")
             send_complete.set()
-            logger.info("Successfully sent message to Hub")
 
         self._pipeline.send_d2c_message(message, callback=callback)
         send_complete.wait()
+        if send_error:
+            raise send_error[0]
+
+    def send_d2c_messages(self, messages):
+        """Sends a batch of messages to the default events endpoint on the Azure IoT Hub or Azure
+        IoT Edge Hub instance.
+
+        The messages are handed to the client's pipeline together rather than one at a time.
+        This is a synchronous event, meaning that this function will not return until every
+        message has either been acknowledged by the service or has failed.
+
+        If the connection to the service has not previously been opened by a call to connect, this
+        function will open the connection before sending the events.
+
+        :param messages: An iterable of the messages to send. Anything passed that is not an
+        instance of the Message class will be converted to Message object.
+
+        :returns: A list with one result per message, in the same order as the messages.  Each
+        result is None if the message was sent successfully, or the error which caused it to fail.
+        """
+        messages = [
+            message if isinstance(message, Message) else Message(message) for message in messages
+        ]
+
+        logger.info("Sending {} messages to Hub...".format(len(messages)))
+        send_complete = threading.Event()
+        results = []
+
+        def callback(message_results):
+            results.extend(message_results)
+            send_complete.set()
+            logger.info("Finished sending {} messages to Hub".format(len(message_results)))
+
+        self._pipeline.send_d2c_messages(messages, callback=callback)
+        send_complete.wait()
+        return results
+
+    def send_d2c_message_nowait(self, message):
+        """Sends a message to the default events endpoint on the Azure IoT Hub or Azure IoT Edge Hub
+        instance without waiting for the service to acknowledge it.
+
+        Up to max_inflight_messages messages (see the 'create_from_' classmethods) can be awaiting
+        acknowledgement at the same time.  This function only blocks while that window is full.
+
+        If the connection to the service has not previously been opened by a call to connect, this
+        function will open the connection before sending the event.
+
+        :param message: The actual message to send. Anything passed that is not an instance of the
+        Message class will be converted to Message object.
+
+        :returns: A concurrent.futures.Future which completes once the service has acknowledged
+        receipt of the message, or with the error which sending the message failed with.
+        """
+        if not isinstance(message, Message):
+            message = Message(message)
+
+        logger.info("Sending message to Hub without waiting for acknowledgement...")
+        future = Future()
+
+        def callback(error=None):
+            if error:
+                future.set_exception(error)
+            else:
+                logger.info("Successfully sent message to Hub")
+                future.set_result(None)
+
+        self._pipeline.send_d2c_message(message, callback=callback)
+        return future
 
     def receive_method_request(self, method_name=None, block=True, timeout=None):
         """Receive a method request via the Azure IoT Hub or Azure IoT Edge Hub.
@@ -206,7 +307,8 @@ class GenericIoTHubClient(AbstractIoTHubClient):
 
         self._pipeline.get_twin(callback=on_pipeline_op_complete)
         op_complete.wait()
-        return context.twin
+        # The pipeline hands over the twin as it was received, so that it is decoded here
+        return json_codec.loads(context.twin)
 
     def patch_twin_reported_properties(self, reported_properties_patch):
         """
@@ -235,6 +337,40 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         op_complete.wait()
         print("Done with patch")
 
+    def update_reported_properties(self, reported_properties):
+        """
+        Update reported properties with the Azure IoT Hub or Azure IoT Edge Hub service, sending
+        only what changed since the last call.
+
+        This is a synchronous call, meaning that this function will not return until the patch
+        has been sent to the service and acknowledged, or right away if nothing changed.
+
+        Properties which were in the reported_properties of the last call, but are not anymore,
+        are removed from the service.
+
+        :param dict reported_properties: All of the reported properties of the device or module.
+
+        :raises: The error which updating the reported properties failed with, if it failed.
+        """
+        if not self._pipeline.feature_enabled[constant.TWIN]:
+            self._enable_feature(constant.TWIN)
+
+        op_complete = threading.Event()
+        # list instead of a plain variable to work around the lack of "nonlocal" in 2.7
+        op_error = []
+
+        def on_pipeline_op_complete(error=None):
+            if error:
+                op_error.append(error)
+            op_complete.set()
+
+        self._pipeline.update_reported_properties(
+            full_state=reported_properties, callback=on_pipeline_op_complete
+        )
+        op_complete.wait()
+        if op_error:
+            raise op_error[0]
+
     def receive_twin_desired_properties_patch(self, block=True, timeout=None):
         """
         Receive a desired property patch via the Azure IoT Hub or Azure IoT Edge Hub.
@@ -265,7 +401,7 @@ class GenericIoTHubClient(AbstractIoTHubClient):
         logger.info("Waiting for twin patches...")
         patch = twin_patch_inbox.get(block=block, timeout=timeout)
         logger.info("twin patch received")
-        return patch
+        return json_codec.loads(patch)
 
 
 class IoTHubDeviceClient(GenericIoTHubClient, AbstractIoTHubDeviceClient):
@@ -338,6 +474,8 @@ class IoTHubModuleClient(GenericIoTHubClient, AbstractIoTHubModuleClient):
         :param message: message to send to the given output. Anything passed that is not an instance of the
         Message class will be converted to Message object.
         :param output_name: Name of the output to send the event to.
+
+        :raises: The error which sending the message failed with, if it failed.
         """
         if not isinstance(message, Message):
             message = Message(message)
@@ -345,13 +483,20 @@ class IoTHubModuleClient(GenericIoTHubClient, AbstractIoTHubModuleClient):
 
         logger.info("Sending message to output:" + output_name + "...")
         send_complete = threading.Event()
-
-        def callback():
-            logger.info("Successfully sent message to output: " + output_name)
+        # list instead of a plain variable to work around the lack of "nonlocal" in 2.7
+        send_error = []
+
+        def callback(error=None):
+            if error:
+                send_error.append(error)
+            else:
+                logger.info("Successfully sent message to output: " + output_name)
             send_complete.set()
 
         self._pipeline.send_output_event(message, callback=callback)
         send_complete.wait()
+        if send_error:
+            raise send_error[0]
 
     def receive_input_message(self, input_name, block=True, timeout=None):
         """Receive an input message that has been sent from another Module to a specific input.
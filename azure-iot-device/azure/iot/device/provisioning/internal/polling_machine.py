@@ -5,10 +5,9 @@
 # --------------------------------------------------------------------------
 import logging
 import uuid
-import json
 import traceback
-from threading import Timer
 from transitions import Machine
+from azure.iot.device.common import json_codec, timer_wheel
 from azure.iot.device.provisioning.pipeline import constant
 import six.moves.urllib as urllib
 from .request_response_provider import RequestResponseProvider
@@ -337,8 +336,9 @@ class PollingMachine(object):
             self._registration_error = ValueError("Time is up for query timer")
             self._trig_error()
 
-        self._query_timer = Timer(constant.DEFAULT_TIMEOUT_INTERVAL, time_up_query)
-        self._query_timer.start()
+        self._query_timer = timer_wheel.get_shared_timer_wheel().schedule(
+            constant.DEFAULT_TIMEOUT_INTERVAL, time_up_query
+        )
 
     def _wait_for_interval(self, event_data):
         def time_up_polling():
@@ -356,9 +356,11 @@ class PollingMachine(object):
             else int(result.retry_after, 10)
         )
 
-        self._polling_timer = Timer(polling_interval, time_up_polling)
         logger.info("Waiting for " + str(constant.DEFAULT_POLLING_INTERVAL) + " secs")
-        self._polling_timer.start()  # This is waiting for that polling interval
+        # This is waiting for that polling interval
+        self._polling_timer = timer_wheel.get_shared_timer_wheel().schedule(
+            polling_interval, time_up_polling
+        )
 
     def _decode_complete_json_response(self, query_result, response):
         """
@@ -366,7 +368,7 @@ class PollingMachine(object):
         :param query_result: The partially formed result.
         :param response: The complete response from the service
         """
-        decoded_result = json.loads(response)
+        decoded_result = json_codec.loads(response)
 
         decoded_state = (
             None
@@ -405,7 +407,7 @@ class PollingMachine(object):
         :param retry_after: The time in secs after which to retry.
         :param response: The complete response from the service.
         """
-        decoded_result = json.loads(response)
+        decoded_result = json_codec.loads(response)
 
         operation_id = (
             None if "operationId" not in decoded_result else str(decoded_result["operationId"])
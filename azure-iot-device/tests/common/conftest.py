@@ -12,3 +12,4 @@ collect_ignore = []
 if sys.version_info < (3, 5):
     collect_ignore.append("test_async_adapter.py")
     collect_ignore.append("test_asyncio_compat.py")
+    collect_ignore.append("test_mqtt_engine.py")
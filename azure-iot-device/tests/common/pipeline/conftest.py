@@ -4,6 +4,7 @@
 # license information.
 # --------------------------------------------------------------------------
 
+import sys
 from tests.common.pipeline.fixtures import (
     callback,
     fake_exception,
@@ -18,3 +19,9 @@ from tests.common.pipeline.fixtures import (
     fake_non_pipeline_thread,
     unhandled_error_handler,
 )
+
+collect_ignore = []
+
+# Ignore Async tests if below Python 3.5
+if sys.version_info < (3, 5):
+    collect_ignore.append("test_pipeline_thread_event_loop.py")
@@ -4,6 +4,7 @@
 # license information.
 # --------------------------------------------------------------------------
 import pytest
+from azure.iot.device.common.pipeline import pipeline_ops_base
 
 fake_count = 0
 
@@ -20,7 +21,11 @@ def get_next_fake_value():
     return "__fake_value_{}__".format(fake_count)
 
 
-base_operation_defaults = {"needs_connection": False, "error": None}
+base_operation_defaults = {
+    "needs_connection": False,
+    "priority": pipeline_ops_base.PRIORITY_CONTROL,
+    "error": None,
+}
 base_event_defaults = {}
 
 
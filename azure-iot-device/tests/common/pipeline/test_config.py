@@ -0,0 +1,182 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import pytest
+from azure.iot.device.common.pipeline.config import (
+    BasePipelineConfig,
+    DEFAULT_MAX_INFLIGHT_MESSAGES,
+    DEFAULT_MAX_PENDING_REQUESTS,
+    DEFAULT_RECONNECT_INITIAL_DELAY,
+    DEFAULT_RECONNECT_MAX_DELAY,
+)
+
+
+@pytest.mark.describe("BasePipelineConfig - Instantiation")
+class TestBasePipelineConfigInstantiation(object):
+    @pytest.mark.it("Sets max_inflight_messages to the default if not provided")
+    def test_default_max_inflight_messages(self):
+        config = BasePipelineConfig()
+        assert config.max_inflight_messages == DEFAULT_MAX_INFLIGHT_MESSAGES
+
+    @pytest.mark.it("Sets max_inflight_messages to the provided value")
+    def test_max_inflight_messages(self):
+        config = BasePipelineConfig(max_inflight_messages=100)
+        assert config.max_inflight_messages == 100
+
+    @pytest.mark.it("Raises a ValueError if max_inflight_messages is less than 1")
+    @pytest.mark.parametrize("value", [pytest.param(0, id="Zero"), pytest.param(-1, id="Negative")])
+    def test_invalid_max_inflight_messages(self, value):
+        with pytest.raises(ValueError):
+            BasePipelineConfig(max_inflight_messages=value)
+
+    @pytest.mark.it("Sets executor_shards to 1 if not provided")
+    def test_default_executor_shards(self):
+        config = BasePipelineConfig()
+        assert config.executor_shards == 1
+
+    @pytest.mark.it("Sets executor_shards to the provided value")
+    def test_executor_shards(self):
+        config = BasePipelineConfig(executor_shards=8)
+        assert config.executor_shards == 8
+
+    @pytest.mark.it("Raises a ValueError if executor_shards is less than 1")
+    @pytest.mark.parametrize("value", [pytest.param(0, id="Zero"), pytest.param(-1, id="Negative")])
+    def test_invalid_executor_shards(self, value):
+        with pytest.raises(ValueError):
+            BasePipelineConfig(executor_shards=value)
+
+    @pytest.mark.it("Sets mqtt_io_threads to None if not provided")
+    def test_default_mqtt_io_threads(self):
+        config = BasePipelineConfig()
+        assert config.mqtt_io_threads is None
+
+    @pytest.mark.it("Sets mqtt_io_threads to the provided value")
+    def test_mqtt_io_threads(self):
+        config = BasePipelineConfig(mqtt_io_threads=4)
+        assert config.mqtt_io_threads == 4
+
+    @pytest.mark.it("Raises a ValueError if mqtt_io_threads is less than 1")
+    @pytest.mark.parametrize("value", [pytest.param(0, id="Zero"), pytest.param(-1, id="Negative")])
+    def test_invalid_mqtt_io_threads(self, value):
+        with pytest.raises(ValueError):
+            BasePipelineConfig(mqtt_io_threads=value)
+
+    @pytest.mark.it("Disables tls_session_resumption if not provided")
+    def test_default_tls_session_resumption(self):
+        config = BasePipelineConfig()
+        assert config.tls_session_resumption is False
+
+    @pytest.mark.it("Sets tls_session_resumption to the provided value")
+    def test_tls_session_resumption(self):
+        config = BasePipelineConfig(tls_session_resumption=True)
+        assert config.tls_session_resumption is True
+
+    @pytest.mark.it("Sets event_loop to None if not provided")
+    def test_default_event_loop(self):
+        config = BasePipelineConfig()
+        assert config.event_loop is None
+
+    @pytest.mark.it("Sets event_loop to the provided value")
+    def test_event_loop(self, mocker):
+        loop = mocker.MagicMock()
+        config = BasePipelineConfig(event_loop=loop)
+        assert config.event_loop is loop
+
+    @pytest.mark.it("Sets operation_timeout to None if not provided")
+    def test_default_operation_timeout(self):
+        config = BasePipelineConfig()
+        assert config.operation_timeout is None
+
+    @pytest.mark.it("Sets operation_timeout to the provided value")
+    def test_operation_timeout(self):
+        config = BasePipelineConfig(operation_timeout=60)
+        assert config.operation_timeout == 60
+
+    @pytest.mark.it("Raises ValueError if operation_timeout is not a positive number")
+    @pytest.mark.parametrize("value", [0, -1])
+    def test_invalid_operation_timeout(self, value):
+        with pytest.raises(ValueError):
+            BasePipelineConfig(operation_timeout=value)
+
+    @pytest.mark.it("Sets request_timeout to None if not provided")
+    def test_default_request_timeout(self):
+        config = BasePipelineConfig()
+        assert config.request_timeout is None
+
+    @pytest.mark.it("Sets request_timeout to the provided value")
+    def test_request_timeout(self):
+        config = BasePipelineConfig(request_timeout=30)
+        assert config.request_timeout == 30
+
+    @pytest.mark.it("Raises ValueError if request_timeout is not a positive number")
+    @pytest.mark.parametrize("value", [0, -1])
+    def test_invalid_request_timeout(self, value):
+        with pytest.raises(ValueError):
+            BasePipelineConfig(request_timeout=value)
+
+    @pytest.mark.it("Sets max_pending_requests to DEFAULT_MAX_PENDING_REQUESTS if not provided")
+    def test_default_max_pending_requests(self):
+        config = BasePipelineConfig()
+        assert config.max_pending_requests == DEFAULT_MAX_PENDING_REQUESTS
+
+    @pytest.mark.it("Raises ValueError if max_pending_requests is not a positive integer")
+    @pytest.mark.parametrize("value", [0, -1])
+    def test_invalid_max_pending_requests(self, value):
+        with pytest.raises(ValueError):
+            BasePipelineConfig(max_pending_requests=value)
+
+    @pytest.mark.it("Sets connection_queue_drain_rate to None if not provided")
+    def test_default_connection_queue_drain_rate(self):
+        config = BasePipelineConfig()
+        assert config.connection_queue_drain_rate is None
+
+    @pytest.mark.it("Raises ValueError if connection_queue_drain_rate is not a positive number")
+    @pytest.mark.parametrize("value", [0, -1])
+    def test_invalid_connection_queue_drain_rate(self, value):
+        with pytest.raises(ValueError):
+            BasePipelineConfig(connection_queue_drain_rate=value)
+
+    @pytest.mark.it("Sets connection_queue_max_sizes to an empty dictionary if not provided")
+    def test_default_connection_queue_max_sizes(self):
+        config = BasePipelineConfig()
+        assert config.connection_queue_max_sizes == {}
+
+    @pytest.mark.it("Raises ValueError if connection_queue_max_sizes is invalid")
+    @pytest.mark.parametrize(
+        "value",
+        [
+            pytest.param({"__not_a_priority__": 1}, id="Unknown priority"),
+            pytest.param({"telemetry": 0}, id="Size not positive"),
+        ],
+    )
+    def test_invalid_connection_queue_max_sizes(self, value):
+        with pytest.raises(ValueError):
+            BasePipelineConfig(connection_queue_max_sizes=value)
+
+    @pytest.mark.it("Enables auto_reconnect, with the default reconnect delays, if not provided")
+    def test_default_reconnect(self):
+        config = BasePipelineConfig()
+        assert config.auto_reconnect is True
+        assert config.reconnect_initial_delay == DEFAULT_RECONNECT_INITIAL_DELAY
+        assert config.reconnect_max_delay == DEFAULT_RECONNECT_MAX_DELAY
+
+    @pytest.mark.it("Raises ValueError if the reconnect delays are invalid")
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            pytest.param({"reconnect_initial_delay": 0}, id="Initial delay not positive"),
+            pytest.param(
+                {"reconnect_initial_delay": 10, "reconnect_max_delay": 5},
+                id="Max delay less than initial delay",
+            ),
+        ],
+    )
+    def test_invalid_reconnect_delays(self, kwargs):
+        with pytest.raises(ValueError):
+            BasePipelineConfig(**kwargs)
+
+    @pytest.mark.it("Disables warm_standby_reconnect if not provided")
+    def test_default_warm_standby_reconnect(self):
+        assert BasePipelineConfig().warm_standby_reconnect is False
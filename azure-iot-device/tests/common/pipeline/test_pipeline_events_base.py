@@ -25,3 +25,10 @@ pipeline_data_object_test.add_event_test(
     positional_arguments=["request_id", "status_code", "response_body"],
     keyword_arguments={},
 )
+
+pipeline_data_object_test.add_event_test(
+    cls=pipeline_events_base.ReconnectAttemptEvent,
+    module=this_module,
+    positional_arguments=["attempt", "error", "next_delay"],
+    keyword_arguments={},
+)
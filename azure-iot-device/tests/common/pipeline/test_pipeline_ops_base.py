@@ -30,12 +30,14 @@ pipeline_data_object_test.add_operation_test(
     module=this_module,
     positional_arguments=[],
     keyword_arguments={"callback": None},
+    extra_defaults={"priority": pipeline_ops_base.PRIORITY_TELEMETRY},
 )
 pipeline_data_object_test.add_operation_test(
     cls=pipeline_ops_base.ReconnectOperation,
     module=this_module,
     positional_arguments=[],
     keyword_arguments={"callback": None},
+    extra_defaults={"pause_duration": None},
 )
 pipeline_data_object_test.add_operation_test(
     cls=pipeline_ops_base.EnableFeatureOperation,
@@ -62,7 +64,7 @@ pipeline_data_object_test.add_operation_test(
     module=this_module,
     positional_arguments=["request_type", "method", "resource_location", "request_body"],
     keyword_arguments={"callback": None},
-    extra_defaults={"needs_connection": True},
+    extra_defaults={"needs_connection": True, "priority": pipeline_ops_base.PRIORITY_TWIN},
 )
 pipeline_data_object_test.add_operation_test(
     cls=pipeline_ops_base.SendIotRequestOperation,
@@ -75,5 +77,5 @@ pipeline_data_object_test.add_operation_test(
         "request_id",
     ],
     keyword_arguments={"callback": None},
-    extra_defaults={"needs_connection": True},
+    extra_defaults={"needs_connection": True, "priority": pipeline_ops_base.PRIORITY_TWIN},
 )
@@ -21,6 +21,8 @@ from tests.common.pipeline.helpers import (
     all_common_ops,
     all_common_events,
 )
+from azure.iot.device.common import timer_wheel
+from azure.iot.device.common.pipeline.config import BasePipelineConfig
 from tests.common.pipeline import pipeline_stage_test
 
 logging.basicConfig(level=logging.INFO)
@@ -45,6 +47,7 @@ pipeline_stage_test.add_base_pipeline_stage_tests(
     handled_ops=[
         pipeline_ops_base.ConnectOperation,
         pipeline_ops_base.DisconnectOperation,
+        pipeline_ops_base.ReconnectOperation,
         pipeline_ops_base.EnableFeatureOperation,
         pipeline_ops_base.DisableFeatureOperation,
         pipeline_ops_base.SendIotRequestAndWaitForResponseOperation,
@@ -68,7 +71,7 @@ pipeline_stage_test.add_base_pipeline_stage_tests(
     handled_ops=[],
     all_events=all_common_events,
     handled_events=all_common_events,
-    methods_that_can_run_in_any_thread=["append_stage", "run_op"],
+    methods_that_can_run_in_any_thread=["append_stage", "run_op", "run_op_batch"],
 )
 
 
@@ -116,6 +119,72 @@ TestPipelineRootStagePipelineThreading.test_runs_operation_in_pipeline_thread =
 )
 
 
+@pytest.mark.describe("PipelineRootStage - .run_op_batch()")
+class TestPipelineRootStageRunOpBatch(object):
+    @pytest.fixture
+    def stage(self, mocker):
+        stage = pipeline_stages_base.PipelineRootStage()
+        stage.pipeline_root = stage
+
+        def fake_run_op(op):
+            assert threading.current_thread().name == "pipeline"
+            operation_flow.complete_op(stage, op)
+
+        stage._run_op = mocker.MagicMock(side_effect=fake_run_op)
+        return stage
+
+    @pytest.fixture
+    def ops(self):
+        return [pipeline_ops_base.ConnectOperation(), pipeline_ops_base.DisconnectOperation()]
+
+    @pytest.mark.it("Runs every operation in the pipeline thread")
+    def test_runs_ops_in_pipeline_thread(self, stage, ops, fake_non_pipeline_thread):
+        callback_called = threading.Event()
+        stage.run_op_batch(ops, lambda ops: callback_called.set())
+        callback_called.wait()
+        assert stage._run_op.call_count == len(ops)
+        assert [call[0][0] for call in stage._run_op.call_args_list] == ops
+
+    @pytest.mark.it(
+        "Calls the callback once, in the callback thread, with the list of operations after all of them complete"
+    )
+    def test_calls_callback_once(self, stage, ops, fake_non_pipeline_thread):
+        callback_called = threading.Event()
+        callback_args = []
+
+        def callback(completed_ops):
+            assert threading.current_thread().name == "callback"
+            callback_args.append(completed_ops)
+            callback_called.set()
+
+        stage.run_op_batch(ops, callback)
+        callback_called.wait()
+        assert callback_args == [ops]
+
+    @pytest.mark.it("Leaves the error of each failed operation on the operation")
+    def test_keeps_errors(self, mocker, stage, ops, fake_non_pipeline_thread):
+        error = Exception()
+
+        def fake_run_op(op):
+            if isinstance(op, pipeline_ops_base.DisconnectOperation):
+                op.error = error
+            operation_flow.complete_op(stage, op)
+
+        stage._run_op.side_effect = fake_run_op
+        callback_called = threading.Event()
+        stage.run_op_batch(ops, lambda ops: callback_called.set())
+        callback_called.wait()
+        assert ops[0].error is None
+        assert ops[1].error is error
+
+    @pytest.mark.it("Calls the callback immediately if the list of operations is empty")
+    def test_empty_batch(self, stage, fake_non_pipeline_thread):
+        callback_called = threading.Event()
+        stage.run_op_batch([], lambda ops: callback_called.set())
+        callback_called.wait()
+        assert stage._run_op.call_count == 0
+
+
 pipeline_stage_test.add_base_pipeline_stage_tests(
     cls=pipeline_stages_base.CoordinateRequestAndResponseStage,
     module=this_module,
@@ -155,7 +224,9 @@ class TestCoordinateRequestAndResponseSendIotRequestRunOp(object):
 
     @pytest.fixture
     def stage(self, mocker):
-        return make_mock_stage(mocker, pipeline_stages_base.CoordinateRequestAndResponseStage)
+        stage = make_mock_stage(mocker, pipeline_stages_base.CoordinateRequestAndResponseStage)
+        stage.pipeline_configuration = BasePipelineConfig()
+        return stage
 
     @pytest.mark.it(
         "Sends an SendIotRequestOperation op to the next stage with the same parameters and a newly allocated request_id"
@@ -218,7 +289,9 @@ class TestCoordinateRequestAndResponseSendIotRequestHandleEvent(object):
 
     @pytest.fixture
     def stage(self, mocker):
-        return make_mock_stage(mocker, pipeline_stages_base.CoordinateRequestAndResponseStage)
+        stage = make_mock_stage(mocker, pipeline_stages_base.CoordinateRequestAndResponseStage)
+        stage.pipeline_configuration = BasePipelineConfig()
+        return stage
 
     @pytest.fixture
     def iot_request(self, stage, op):
@@ -289,3 +362,520 @@ class TestCoordinateRequestAndResponseSendIotRequestHandleEvent(object):
         operation_flow.pass_event_to_previous_stage(stage.next, iot_response)
         assert op.callback.call_count == 0
         assert unhandled_error_handler.call_count == 0
+
+
+@pytest.mark.describe("CoordinateRequestAndResponseStage - Deadlines and pending request limit")
+class TestCoordinateRequestAndResponseDeadlines(object):
+    @pytest.fixture
+    def wheel(self, mocker):
+        wheel = mocker.MagicMock()
+        mocker.patch.object(timer_wheel, "get_shared_timer_wheel", return_value=wheel)
+        return wheel
+
+    @pytest.fixture
+    def stage(self, mocker, wheel):
+        stage = make_mock_stage(mocker, pipeline_stages_base.CoordinateRequestAndResponseStage)
+        stage.pipeline_configuration = BasePipelineConfig(
+            request_timeout=10, max_pending_requests=2
+        )
+        # Operations passed down stay pending unless the test completes them
+        stage.next.run_op = mocker.MagicMock()
+        return stage
+
+    def send_requests(self, mocker, stage, count):
+        ops = [make_fake_request_and_response(mocker) for _ in range(count)]
+        for op in ops:
+            stage.run_op(op)
+        return ops
+
+    def requests_sent(self, stage):
+        return [call[0][0] for call in stage.next.run_op.call_args_list]
+
+    def respond(self, stage, request_id):
+        operation_flow.pass_event_to_previous_stage(
+            stage.next,
+            pipeline_events_base.IotResponseEvent(
+                request_id=request_id,
+                status_code=fake_status_code,
+                response_body=fake_response_body,
+            ),
+        )
+
+    def fire_deadline(self, wheel, index=0):
+        wheel.schedule.call_args_list[index][0][1]()
+
+    @pytest.mark.it("Uses increasing numbers as request ids")
+    def test_request_ids(self, mocker, stage):
+        self.send_requests(mocker, stage, 2)
+        assert [r.request_id for r in self.requests_sent(stage)] == ["1", "2"]
+
+    @pytest.mark.it("Schedules a deadline for every request")
+    def test_schedules_deadline(self, mocker, stage, wheel):
+        self.send_requests(mocker, stage, 1)
+        assert wheel.schedule.call_count == 1
+        assert wheel.schedule.call_args[0][0] == 10
+
+    @pytest.mark.it("Does not schedule deadlines if there is no request_timeout")
+    def test_no_timeout(self, mocker, stage, wheel):
+        stage.pipeline_configuration = BasePipelineConfig()
+        self.send_requests(mocker, stage, 1)
+        assert wheel.schedule.call_count == 0
+
+    @pytest.mark.it("Fails a request with RequestTimeoutError once its deadline passes")
+    def test_timeout(self, mocker, stage, wheel):
+        (op,) = self.send_requests(mocker, stage, 1)
+        self.fire_deadline(wheel)
+        assert_callback_failed(op=op, error=pipeline_stages_base.RequestTimeoutError)
+        assert stage.pending_count == 0
+        assert stage.timed_out_count == 1
+
+    @pytest.mark.it("Cancels the deadline of a request once its response arrives")
+    def test_cancels_deadline(self, mocker, stage, wheel):
+        (op,) = self.send_requests(mocker, stage, 1)
+        self.respond(stage, self.requests_sent(stage)[0].request_id)
+        assert wheel.schedule.return_value.cancel.call_count == 1
+        # A deadline which fires anyway does nothing
+        self.fire_deadline(wheel)
+        assert_callback_succeeded(op=op)
+        assert stage.timed_out_count == 0
+
+    @pytest.mark.it("Counts and drops responses which arrive after their request timed out")
+    def test_late_response(self, mocker, stage, wheel, unhandled_error_handler):
+        (op,) = self.send_requests(mocker, stage, 1)
+        self.fire_deadline(wheel)
+        op.callback.reset_mock()
+        self.respond(stage, self.requests_sent(stage)[0].request_id)
+        assert op.callback.call_count == 0
+        assert stage.late_response_count == 1
+        assert unhandled_error_handler.call_count == 0
+
+    @pytest.mark.it("Holds requests back while max_pending_requests requests are pending")
+    def test_holds_back(self, mocker, stage):
+        self.send_requests(mocker, stage, 3)
+        assert len(self.requests_sent(stage)) == 2
+        assert stage.pending_count == 2
+        assert stage.waiting_count == 1
+
+    @pytest.mark.it("Sends a request which was held back once a pending request completes")
+    @pytest.mark.parametrize("completion", ["response", "timeout", "failure"])
+    def test_sends_held_back(self, mocker, stage, wheel, completion):
+        self.send_requests(mocker, stage, 3)
+        first_request = self.requests_sent(stage)[0]
+        if completion == "response":
+            self.respond(stage, first_request.request_id)
+        elif completion == "timeout":
+            self.fire_deadline(wheel)
+        else:
+            first_request.error = Exception()
+            first_request.callback(first_request)
+        assert len(self.requests_sent(stage)) == 3
+        assert stage.pending_count == 2
+        assert stage.waiting_count == 0
+
+    @pytest.mark.it("Does not hold requests back if there is no request_timeout")
+    def test_no_limit_without_timeout(self, mocker, stage):
+        stage.pipeline_configuration = BasePipelineConfig(max_pending_requests=2)
+        self.send_requests(mocker, stage, 3)
+        assert len(self.requests_sent(stage)) == 3
+        assert stage.waiting_count == 0
+
+    @pytest.mark.it(
+        "Schedules the deadline of a request which is held back when it arrives, not when it is sent"
+    )
+    def test_held_back_deadline(self, mocker, stage, wheel):
+        self.send_requests(mocker, stage, 3)
+        assert wheel.schedule.call_count == 3
+        self.respond(stage, self.requests_sent(stage)[0].request_id)
+        assert len(self.requests_sent(stage)) == 3
+        assert wheel.schedule.call_count == 3
+
+    @pytest.mark.it(
+        "Fails a request which is held back with RequestTimeoutError once its deadline passes, without sending it"
+    )
+    def test_held_back_timeout(self, mocker, stage, wheel):
+        ops = self.send_requests(mocker, stage, 3)
+        self.fire_deadline(wheel, index=2)
+        assert_callback_failed(op=ops[2], error=pipeline_stages_base.RequestTimeoutError)
+        assert stage.waiting_count == 0
+        assert stage.timed_out_count == 1
+
+        self.respond(stage, self.requests_sent(stage)[0].request_id)
+        assert len(self.requests_sent(stage)) == 2
+
+
+@pytest.mark.describe("EnsureConnectionStage - Priorities of queued operations")
+class TestEnsureConnectionStagePriorities(object):
+    @pytest.fixture
+    def wheel(self, mocker):
+        wheel = mocker.MagicMock()
+        mocker.patch.object(timer_wheel, "get_shared_timer_wheel", return_value=wheel)
+        return wheel
+
+    @pytest.fixture
+    def stage(self, mocker, wheel):
+        stage = make_mock_stage(mocker, pipeline_stages_base.EnsureConnectionStage)
+        stage.pipeline_configuration = BasePipelineConfig()
+        # Operations passed down stay pending unless the test completes them
+        stage.next.run_op = mocker.MagicMock()
+        return stage
+
+    def make_op(self, mocker, priority):
+        op = make_fake_request_and_response(mocker)
+        op.priority = priority
+        return op
+
+    def queue_ops(self, mocker, stage, priorities):
+        ops = [self.make_op(mocker, priority) for priority in priorities]
+        for op in ops:
+            stage.run_op(op)
+        return ops
+
+    def complete_connect(self, stage, error=None):
+        connect_op = stage.next.run_op.call_args_list[0][0][0]
+        assert isinstance(connect_op, pipeline_ops_base.ConnectOperation)
+        stage.next.run_op.reset_mock()
+        if not error:
+            stage.connected = True
+        connect_op.error = error
+        operation_flow.complete_op(stage.next, connect_op)
+
+    def released_ops(self, stage):
+        return [call[0][0] for call in stage.next.run_op.call_args_list]
+
+    @pytest.mark.it("Releases queued operations highest priority first once connected")
+    def test_priority_order(self, mocker, stage):
+        telemetry, twin, method_response, control = self.queue_ops(
+            mocker,
+            stage,
+            [
+                pipeline_ops_base.PRIORITY_TELEMETRY,
+                pipeline_ops_base.PRIORITY_TWIN,
+                pipeline_ops_base.PRIORITY_METHOD_RESPONSE,
+                pipeline_ops_base.PRIORITY_CONTROL,
+            ],
+        )
+        self.complete_connect(stage)
+        assert self.released_ops(stage) == [control, method_response, twin, telemetry]
+        assert stage.queued_op_count == 0
+
+    @pytest.mark.it("Releases operations of the same priority in the order they were queued")
+    def test_fifo_within_priority(self, mocker, stage):
+        ops = self.queue_ops(mocker, stage, [pipeline_ops_base.PRIORITY_TELEMETRY] * 3)
+        self.complete_connect(stage)
+        assert self.released_ops(stage) == ops
+
+    @pytest.mark.it(
+        "Releases connection_queue_drain_rate operations per second, and queues new operations by priority until the queues are empty"
+    )
+    def test_drain_rate(self, mocker, stage, wheel):
+        stage.pipeline_configuration.connection_queue_drain_rate = 1
+        telemetry = self.queue_ops(mocker, stage, [pipeline_ops_base.PRIORITY_TELEMETRY] * 2)
+        self.complete_connect(stage)
+        assert self.released_ops(stage) == [telemetry[0]]
+        assert wheel.schedule.call_args[0][0] == 1
+
+        method_response = self.make_op(mocker, pipeline_ops_base.PRIORITY_METHOD_RESPONSE)
+        stage.run_op(method_response)
+        assert self.released_ops(stage) == [telemetry[0]]
+
+        wheel.schedule.call_args[0][1]()
+        assert self.released_ops(stage) == [telemetry[0], method_response]
+        wheel.schedule.call_args[0][1]()
+        assert self.released_ops(stage) == [telemetry[0], method_response, telemetry[1]]
+        assert wheel.schedule.call_count == 2
+
+        # Once the queues are empty, operations are passed down right away
+        op = self.make_op(mocker, pipeline_ops_base.PRIORITY_TELEMETRY)
+        stage.run_op(op)
+        assert self.released_ops(stage)[-1] is op
+
+    @pytest.mark.it("Releases operations in batches if the drain rate is high")
+    def test_drain_rate_batches(self, mocker, stage, wheel):
+        stage.pipeline_configuration.connection_queue_drain_rate = 100
+        self.queue_ops(mocker, stage, [pipeline_ops_base.PRIORITY_TELEMETRY] * 10)
+        self.complete_connect(stage)
+        assert len(self.released_ops(stage)) == 5
+        assert wheel.schedule.call_args[0][0] == pipeline_stages_base._minimum_release_interval
+
+    @pytest.mark.it(
+        "Fails operations with a ConnectionQueueFullError if too many operations of the same priority are queued"
+    )
+    def test_max_size(self, mocker, stage):
+        stage.pipeline_configuration.connection_queue_max_sizes = {
+            pipeline_ops_base.PRIORITY_TELEMETRY: 2
+        }
+        telemetry = self.queue_ops(mocker, stage, [pipeline_ops_base.PRIORITY_TELEMETRY] * 3)
+        twin = self.queue_ops(mocker, stage, [pipeline_ops_base.PRIORITY_TWIN] * 3)
+        assert_callback_failed(op=telemetry[2])
+        assert isinstance(telemetry[2].error, pipeline_stages_base.ConnectionQueueFullError)
+        assert stage.queued_op_count == 5
+
+        self.complete_connect(stage)
+        assert self.released_ops(stage) == twin + telemetry[:2]
+
+    @pytest.mark.it("Fails every queued operation if the connect fails")
+    def test_connect_fails(self, mocker, stage, fake_exception):
+        ops = self.queue_ops(
+            mocker,
+            stage,
+            [pipeline_ops_base.PRIORITY_TELEMETRY, pipeline_ops_base.PRIORITY_METHOD_RESPONSE],
+        )
+        self.complete_connect(stage, error=fake_exception)
+        for op in ops:
+            assert_callback_failed(op=op, error=fake_exception)
+        assert stage.queued_op_count == 0
+
+
+@pytest.mark.describe("EnsureConnectionStage - .run_op() -- called with ReconnectOperation")
+class TestEnsureConnectionStageReconnect(object):
+    @pytest.fixture
+    def stage(self, mocker):
+        stage = make_mock_stage(mocker, pipeline_stages_base.EnsureConnectionStage)
+        stage.pipeline_configuration = BasePipelineConfig()
+        stage.connected = True
+        # Operations passed down stay pending unless the test completes them
+        stage.next.run_op = mocker.MagicMock()
+        return stage
+
+    @pytest.fixture
+    def op(self, mocker):
+        return pipeline_ops_base.ReconnectOperation(callback=mocker.MagicMock())
+
+    def complete_reconnect(self, stage, error=None):
+        reconnect_op = stage.next.run_op.call_args_list[0][0][0]
+        assert isinstance(reconnect_op, pipeline_ops_base.ReconnectOperation)
+        stage.next.run_op.reset_mock()
+        reconnect_op.error = error
+        operation_flow.complete_op(stage.next, reconnect_op)
+
+    @pytest.mark.it("Completes the operation right away if the protocol client is not connected")
+    def test_not_connected(self, stage, op):
+        stage.connected = False
+        stage.run_op(op)
+        assert stage.next.run_op.call_count == 0
+        assert_callback_succeeded(op=op)
+
+    @pytest.mark.it(
+        "Holds back other operations while reconnecting, and releases them once reconnected"
+    )
+    def test_holds_back(self, mocker, stage, op):
+        stage.run_op(op)
+        request = make_fake_request_and_response(mocker)
+        stage.run_op(request)
+        assert stage.next.run_op.call_count == 1
+        assert request.callback.call_count == 0
+
+        self.complete_reconnect(stage)
+        assert_callback_succeeded(op=op)
+        assert stage.next.run_op.call_count == 1
+        assert stage.next.run_op.call_args[0][0] is request
+
+    @pytest.mark.it("Sets pause_duration to the number of seconds operations were held back")
+    def test_pause_duration(self, mocker, stage, op):
+        mocker.patch.object(pipeline_stages_base.time, "time", side_effect=[100.0, 100.25])
+        stage.run_op(op)
+        self.complete_reconnect(stage)
+        assert op.pause_duration == 0.25
+
+    @pytest.mark.it(
+        "Fails the operation, but releases the operations it held back, if the reconnect fails"
+    )
+    def test_reconnect_fails(self, mocker, stage, op, fake_exception):
+        stage.run_op(op)
+        request = make_fake_request_and_response(mocker)
+        stage.run_op(request)
+
+        self.complete_reconnect(stage, error=fake_exception)
+        assert_callback_failed(op=op, error=fake_exception)
+        assert request.callback.call_count == 0
+        assert stage.next.run_op.call_args[0][0] is request
+
+    @pytest.mark.it(
+        "Passes the operation down without holding anything back if warm_standby_reconnect is set"
+    )
+    def test_warm_standby(self, mocker, stage, op):
+        stage.pipeline_configuration.warm_standby_reconnect = True
+        stage.run_op(op)
+        request = make_fake_request_and_response(mocker)
+        stage.run_op(request)
+        assert stage.next.run_op.call_count == 2
+        assert stage.next.run_op.call_args[0][0] is request
+
+        self.complete_reconnect(stage)
+        assert_callback_succeeded(op=op)
+        assert op.pause_duration is None
+
+
+pipeline_stage_test.add_base_pipeline_stage_tests(
+    cls=pipeline_stages_base.ReconnectStage,
+    module=this_module,
+    all_ops=all_common_ops,
+    handled_ops=[
+        pipeline_ops_base.DisconnectOperation,
+        pipeline_ops_base.EnableFeatureOperation,
+        pipeline_ops_base.DisableFeatureOperation,
+    ],
+    all_events=all_common_events,
+    handled_events=[],
+)
+
+
+@pytest.mark.describe("ReconnectStage - Reconnecting")
+class TestReconnectStage(object):
+    @pytest.fixture
+    def wheel(self, mocker):
+        wheel = mocker.MagicMock()
+        mocker.patch.object(timer_wheel, "get_shared_timer_wheel", return_value=wheel)
+        return wheel
+
+    @pytest.fixture
+    def uniform(self, mocker):
+        # The longest wait, instead of a random one, so that the backoff can be checked
+        return mocker.patch.object(
+            pipeline_stages_base.random, "uniform", side_effect=lambda low, high: high
+        )
+
+    @pytest.fixture
+    def stage(self, mocker, wheel, uniform):
+        stage = make_mock_stage(mocker, pipeline_stages_base.ReconnectStage)
+        stage.pipeline_configuration = BasePipelineConfig(
+            reconnect_initial_delay=1, reconnect_max_delay=10
+        )
+        # Operations passed down stay pending unless the test completes them
+        stage.next.run_op = mocker.MagicMock()
+        stage.previous = mocker.MagicMock()
+        stage.on_connected()
+        return stage
+
+    def fire_timer(self, wheel):
+        wheel.schedule.call_args[0][1]()
+
+    def complete_connect(self, stage, error=None):
+        connect_op = stage.next.run_op.call_args[0][0]
+        assert isinstance(connect_op, pipeline_ops_base.ConnectOperation)
+        if not error:
+            stage.on_connected()
+        connect_op.error = error
+        operation_flow.complete_op(stage.next, connect_op)
+
+    def reported_attempts(self, stage):
+        events = [call[0][0] for call in stage.previous.handle_pipeline_event.call_args_list]
+        return [(event.attempt, event.error, event.next_delay) for event in events]
+
+    @pytest.mark.it("Schedules a reconnect attempt when the connection is lost")
+    def test_schedules_attempt(self, stage, wheel):
+        stage.on_disconnected()
+        assert wheel.schedule.call_count == 1
+        assert wheel.schedule.call_args[0][0] == 1
+        assert stage.next.run_op.call_count == 0
+
+        self.fire_timer(wheel)
+        assert stage.next.run_op.call_count == 1
+        assert isinstance(stage.next.run_op.call_args[0][0], pipeline_ops_base.ConnectOperation)
+
+    @pytest.mark.it("Picks every wait at random, up to the longest wait")
+    def test_jitter(self, stage, wheel, uniform):
+        stage.on_disconnected()
+        assert uniform.call_args[0] == (0, 1)
+
+    @pytest.mark.it(
+        "Doubles the longest wait after every failed attempt, up to reconnect_max_delay, and reports every attempt"
+    )
+    def test_backoff(self, stage, wheel, fake_exception):
+        stage.on_disconnected()
+        for _ in range(5):
+            self.fire_timer(wheel)
+            self.complete_connect(stage, error=fake_exception)
+        assert [call[0][0] for call in wheel.schedule.call_args_list] == [1, 2, 4, 8, 10, 10]
+        assert self.reported_attempts(stage) == [
+            (1, fake_exception, 2),
+            (2, fake_exception, 4),
+            (3, fake_exception, 8),
+            (4, fake_exception, 10),
+            (5, fake_exception, 10),
+        ]
+
+    @pytest.mark.it("Starts over from the initial wait once an attempt succeeds")
+    def test_success(self, stage, wheel, fake_exception):
+        stage.on_disconnected()
+        self.fire_timer(wheel)
+        self.complete_connect(stage, error=fake_exception)
+        self.fire_timer(wheel)
+        self.complete_connect(stage)
+        assert self.reported_attempts(stage) == [(1, fake_exception, 2), (2, None, None)]
+        assert wheel.schedule.call_count == 2
+
+        stage.on_disconnected()
+        assert wheel.schedule.call_args[0][0] == 1
+
+    @pytest.mark.it("Enables the features which were enabled again once the connection is back")
+    def test_enables_features(self, mocker, stage, wheel):
+        for feature_name in ["twin", "methods", "c2d"]:
+            stage.run_op(
+                pipeline_ops_base.EnableFeatureOperation(
+                    feature_name=feature_name, callback=mocker.MagicMock()
+                )
+            )
+        stage.run_op(
+            pipeline_ops_base.DisableFeatureOperation(
+                feature_name="c2d", callback=mocker.MagicMock()
+            )
+        )
+        stage.on_disconnected()
+        self.fire_timer(wheel)
+        stage.next.run_op.reset_mock()
+        stage.on_connected()
+
+        ops = [call[0][0] for call in stage.next.run_op.call_args_list]
+        assert all(isinstance(op, pipeline_ops_base.EnableFeatureOperation) for op in ops)
+        assert sorted(op.feature_name for op in ops) == ["methods", "twin"]
+
+    @pytest.mark.it("Does not reconnect after a DisconnectOperation")
+    def test_disconnect_operation(self, mocker, stage, wheel):
+        stage.run_op(pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock()))
+        stage.on_disconnected()
+        assert wheel.schedule.call_count == 0
+
+    @pytest.mark.it(
+        "Does not reconnect after a DisconnectOperation which arrived while a connect was in flight"
+    )
+    def test_disconnect_during_connect(self, mocker, stage, wheel):
+        stage.on_disconnected()
+        self.fire_timer(wheel)
+        callback = mocker.MagicMock()
+        disconnect_op = pipeline_ops_base.DisconnectOperation(callback=callback)
+        stage.run_op(disconnect_op)
+        # The connect completes before the disconnect, which waited for it further down
+        stage.on_connected()
+        stage.on_disconnected()
+        operation_flow.complete_op(stage.next, disconnect_op)
+        assert wheel.schedule.call_count == 1
+        assert callback.call_count == 1
+
+    @pytest.mark.it("Reconnects again once a DisconnectOperation completed and a connect followed")
+    def test_connect_after_disconnect(self, mocker, stage, wheel):
+        disconnect_op = pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock())
+        stage.run_op(disconnect_op)
+        stage.on_disconnected()
+        operation_flow.complete_op(stage.next, disconnect_op)
+        stage.on_connected()
+        stage.on_disconnected()
+        assert wheel.schedule.call_count == 1
+
+    @pytest.mark.it("Cancels a scheduled attempt when a DisconnectOperation arrives")
+    def test_disconnect_cancels(self, mocker, stage, wheel):
+        stage.on_disconnected()
+        stage.run_op(pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock()))
+        assert wheel.schedule.return_value.cancel.call_count == 1
+
+    @pytest.mark.it("Cancels a scheduled attempt if the connection is established by other means")
+    def test_connected_by_other_means(self, stage, wheel):
+        stage.on_disconnected()
+        stage.on_connected()
+        assert wheel.schedule.return_value.cancel.call_count == 1
+
+    @pytest.mark.it("Does not reconnect if auto_reconnect is disabled")
+    def test_auto_reconnect_disabled(self, stage, wheel):
+        stage.pipeline_configuration.auto_reconnect = False
+        stage.on_disconnected()
+        assert wheel.schedule.call_count == 0
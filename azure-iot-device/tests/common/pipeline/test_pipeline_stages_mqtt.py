@@ -126,8 +126,62 @@ class TestMQTTProviderRunOpWithSetConnectionArgs(object):
             hostname=fake_hostname,
             username=fake_username,
             ca_cert=fake_ca_cert,
+            max_inflight_messages=stage.pipeline_root.pipeline_configuration.max_inflight_messages,
+            io_engine=None,
+            tls_session_resumption=False,
+            operation_timeout=None,
+            auto_reconnect=False,
         )
 
+    @pytest.mark.it(
+        "Initializes the MQTTTransport object with the max_inflight_messages value from the pipeline configuration"
+    )
+    def test_passes_max_inflight_messages(self, stage, transport, op_set_connection_args):
+        stage.pipeline_root.pipeline_configuration.max_inflight_messages = 7
+        stage.run_op(op_set_connection_args)
+        assert transport.call_args[1]["max_inflight_messages"] == 7
+
+    @pytest.mark.it(
+        "Initializes the MQTTTransport object with a shared MQTTEngine if mqtt_io_threads is set in the pipeline configuration"
+    )
+    def test_passes_shared_engine(self, mocker, stage, transport, op_set_connection_args):
+        get_shared_engine = mocker.patch.object(
+            pipeline_stages_mqtt.mqtt_engine, "get_shared_engine"
+        )
+        stage.pipeline_root.pipeline_configuration.mqtt_io_threads = 3
+        stage.run_op(op_set_connection_args)
+        assert get_shared_engine.call_args == mocker.call(fake_client_id, 3)
+        assert transport.call_args[1]["io_engine"] is get_shared_engine.return_value
+
+    @pytest.mark.it(
+        "Initializes the MQTTTransport object with the MQTT engine of the event loop if event_loop is set in the pipeline configuration"
+    )
+    def test_passes_event_loop_engine(self, mocker, stage, transport, op_set_connection_args):
+        get_event_loop_engine = mocker.patch.object(
+            pipeline_stages_mqtt.mqtt_engine, "get_event_loop_engine"
+        )
+        loop = mocker.MagicMock()
+        stage.pipeline_root.pipeline_configuration.event_loop = loop
+        stage.run_op(op_set_connection_args)
+        assert get_event_loop_engine.call_args == mocker.call(loop)
+        assert transport.call_args[1]["io_engine"] is get_event_loop_engine.return_value
+
+    @pytest.mark.it(
+        "Initializes the MQTTTransport object with the tls_session_resumption value from the pipeline configuration"
+    )
+    def test_passes_tls_session_resumption(self, stage, transport, op_set_connection_args):
+        stage.pipeline_root.pipeline_configuration.tls_session_resumption = True
+        stage.run_op(op_set_connection_args)
+        assert transport.call_args[1]["tls_session_resumption"] is True
+
+    @pytest.mark.it(
+        "Initializes the MQTTTransport object with the operation_timeout value from the pipeline configuration"
+    )
+    def test_passes_operation_timeout(self, stage, transport, op_set_connection_args):
+        stage.pipeline_root.pipeline_configuration.operation_timeout = 60
+        stage.run_op(op_set_connection_args)
+        assert transport.call_args[1]["operation_timeout"] == 60
+
     @pytest.mark.it(
         "Sets on_mqtt_connected, on_mqtt_disconnected, and on_mqtt_messsage_received on the protocol client library"
     )
@@ -334,6 +388,38 @@ class TestMQTTProviderBasicFunctionality(object):
             stage.run_op(op)
 
 
+@pytest.mark.describe("MQTTClientStage - .run_op() -- called with MQTTPublishOperation")
+class TestMQTTProviderRunOpWithPublish(object):
+    @pytest.mark.it("Publishes with the QoS of the operation")
+    @pytest.mark.parametrize("qos", [0, 1])
+    def test_publish_qos(self, stage, create_transport, callback, qos):
+        op = pipeline_ops_mqtt.MQTTPublishOperation(
+            topic=fake_topic, payload=fake_payload, qos=qos, callback=callback
+        )
+        stage.run_op(op)
+        assert stage.transport.publish.call_args[1]["qos"] == qos
+
+
+@pytest.mark.parametrize("params", pubsub_ops)
+@pytest.mark.describe(
+    "MQTTClientStage - .run_op() -- called with op that publishes, subscribes, or unsubscribes"
+)
+class TestMQTTProviderRunOpWithPubSub(object):
+    @pytest.mark.it(
+        "Returns failure if the protocol client library completes the operation with an error"
+    )
+    def test_transport_completes_with_error(
+        self, stage, create_transport, params, op, fake_exception
+    ):
+        def fake_transport_function(*args, **kwargs):
+            kwargs["callback"](error=fake_exception)
+
+        setattr(stage.transport, params["transport_function"], fake_transport_function)
+        op.callback.reset_mock()
+        stage.run_op(op)
+        assert_callback_failed(op=op, error=fake_exception)
+
+
 @pytest.mark.parametrize("params", connection_ops)
 @pytest.mark.describe(
     "MQTTClientStage - .run_op() -- called with op that connects, disconnects, or reconnects"
@@ -392,6 +478,333 @@ class TestMQTTProviderRunOpWithConnect(object):
         assert handler_before == handler_after
 
 
+@pytest.mark.describe(
+    "MQTTClientStage - .run_op() -- called with ConnectOperation or ReconnectOperation which the broker refuses"
+)
+class TestMQTTProviderRunOpWithRefusedConnect(object):
+    @pytest.fixture(
+        params=[
+            (pipeline_ops_base.ConnectOperation, "connect"),
+            (pipeline_ops_base.ReconnectOperation, "reconnect"),
+        ],
+        ids=["Connect", "Reconnect"],
+    )
+    def op_and_transport_function(self, request):
+        return request.param
+
+    @pytest.fixture
+    def op(self, mocker, op_and_transport_function):
+        op_class = op_and_transport_function[0]
+        return op_class(callback=mocker.MagicMock())
+
+    @pytest.fixture
+    def transport_refuses_connection(self, stage, fake_exception, op_and_transport_function):
+        def fake_connect(*args, **kwargs):
+            stage.transport.on_mqtt_connection_failure(fake_exception)
+
+        setattr(stage.transport, op_and_transport_function[1], fake_connect)
+
+    @pytest.mark.it("Fails the operation with the error from the protocol client library")
+    def test_fails_op(
+        self, stage, create_transport, op, transport_refuses_connection, fake_exception
+    ):
+        stage.run_op(op)
+        assert_callback_failed(op=op, error=fake_exception)
+
+    @pytest.mark.it("Does not call the connected handler, and restores the transport handlers")
+    def test_restores_handlers(
+        self, mocker, stage, create_transport, op, transport_refuses_connection
+    ):
+        mocker.spy(stage.previous, "on_connected")
+        handler_before = stage.transport.on_mqtt_connected
+        stage.run_op(op)
+        assert stage.previous.on_connected.call_count == 0
+        assert stage.transport.on_mqtt_connected == handler_before
+        assert stage.transport.on_mqtt_connection_failure is None
+
+
+@pytest.mark.describe("MQTTClientStage - .run_op() -- called with ReconnectOperation which raises")
+class TestMQTTProviderRunOpWithFailedReconnect(object):
+    @pytest.mark.it(
+        "Fails the operation, and calls the disconnected handler, since the old connection is closed"
+    )
+    def test_calls_disconnected_handler(self, mocker, stage, create_transport, fake_exception):
+        stage.transport.reconnect = mocker.MagicMock(side_effect=fake_exception)
+        mocker.spy(stage.previous, "on_disconnected")
+        op = pipeline_ops_base.ReconnectOperation(callback=mocker.MagicMock())
+        stage.run_op(op)
+        assert_callback_failed(op=op, error=fake_exception)
+        assert stage.previous.on_disconnected.call_count == 1
+
+
+@pytest.mark.describe(
+    "MQTTClientStage - .run_op() -- called with ReconnectOperation, with warm_standby_reconnect"
+)
+class TestMQTTProviderRunOpWithWarmStandbyReconnect(object):
+    @pytest.fixture
+    def created_transports(self, mocker, stage, transport, create_transport):
+        stage.pipeline_root.pipeline_configuration.warm_standby_reconnect = True
+        created_transports = [stage.transport]
+        stage.transport.on_mqtt_connected = stage.on_connected
+        stage.transport.on_mqtt_disconnected = stage.on_disconnected
+
+        def create(**kwargs):
+            created_transports.append(mocker.MagicMock())
+            return created_transports[-1]
+
+        transport.side_effect = create
+        return created_transports
+
+    @pytest.fixture
+    def old_transport(self, created_transports):
+        return created_transports[0]
+
+    @pytest.fixture
+    def op(self, mocker):
+        return pipeline_ops_base.ReconnectOperation(callback=mocker.MagicMock())
+
+    @pytest.fixture
+    def pending_publish(self, mocker, stage, old_transport):
+        publish_op = pipeline_ops_mqtt.MQTTPublishOperation(
+            topic=fake_topic, payload=fake_payload, callback=mocker.MagicMock()
+        )
+        stage.run_op(publish_op)
+        return publish_op
+
+    @pytest.mark.it("Connects a new transport with the current credentials, keeping the old one")
+    def test_connects_standby(self, mocker, stage, created_transports, old_transport, op):
+        stage.run_op(op)
+        assert len(created_transports) == 2
+        standby = created_transports[1]
+        assert standby.connect.call_args == mocker.call(
+            password=fake_sas_token, client_certificate=fake_certificate
+        )
+        assert stage.transport is old_transport
+        assert old_transport.reconnect.call_count == 0
+        assert old_transport.disconnect.call_count == 0
+        assert op.callback.call_count == 0
+
+    @pytest.mark.it("Keeps publishing on the old transport while the new one connects")
+    def test_publishes_on_old(self, mocker, stage, created_transports, old_transport, op):
+        stage.run_op(op)
+        publish_op = pipeline_ops_mqtt.MQTTPublishOperation(
+            topic=fake_topic, payload=fake_payload, callback=mocker.MagicMock()
+        )
+        stage.run_op(publish_op)
+        assert old_transport.publish.call_count == 1
+        assert created_transports[1].publish.call_count == 0
+
+    @pytest.mark.it(
+        "Switches to the new transport once it connects, closes the old one and completes the op"
+    )
+    def test_switches(self, mocker, stage, created_transports, old_transport, op):
+        mocker.spy(stage.previous, "on_connected")
+        mocker.spy(stage.previous, "on_disconnected")
+        stage.run_op(op)
+        standby = created_transports[1]
+        standby.on_mqtt_connected()
+        assert stage.transport is standby
+        assert stage.pipeline_root.transport is standby
+        assert old_transport.disconnect.call_count == 1
+        assert_callback_succeeded(op=op)
+        # The pipeline never lost its connection
+        assert stage.previous.on_connected.call_count == 0
+        assert stage.previous.on_disconnected.call_count == 0
+
+        standby.on_mqtt_disconnected()
+        assert stage.previous.on_disconnected.call_count == 1
+
+    @pytest.mark.it("Subscribes the new transport to every subscribed topic, in one request")
+    def test_resubscribes(self, mocker, stage, created_transports, op):
+        for topic in [["a", "b"], "c", "d"]:
+            stage.run_op(
+                pipeline_ops_mqtt.MQTTSubscribeOperation(topic=topic, callback=mocker.MagicMock())
+            )
+        stage.run_op(
+            pipeline_ops_mqtt.MQTTUnsubscribeOperation(topic="d", callback=mocker.MagicMock())
+        )
+        stage.run_op(op)
+        standby = created_transports[1]
+        standby.on_mqtt_connected()
+        assert standby.subscribe.call_count == 1
+        assert standby.subscribe.call_args[1]["topic"] == ["a", "b", "c"]
+
+    @pytest.mark.it(
+        "Completes subscribes which were not acknowledged on the old transport once the new one subscribes"
+    )
+    @pytest.mark.parametrize("failed", [False, True], ids=["Success", "Failure"])
+    def test_moves_pending_subscribes(
+        self, mocker, stage, created_transports, old_transport, op, fake_exception, failed
+    ):
+        subscribe_op = pipeline_ops_mqtt.MQTTSubscribeOperation(
+            topic=fake_topic, callback=mocker.MagicMock()
+        )
+        stage.run_op(subscribe_op)
+        stage.run_op(op)
+        standby = created_transports[1]
+        standby.on_mqtt_connected()
+
+        # The acknowledgement from the old transport is ignored, the new one completes the op
+        old_transport.subscribe.call_args[1]["callback"]()
+        assert subscribe_op.callback.call_count == 0
+        if failed:
+            standby.subscribe.call_args[1]["callback"](error=fake_exception)
+            assert_callback_failed(op=subscribe_op, error=fake_exception)
+        else:
+            standby.subscribe.call_args[1]["callback"]()
+            assert_callback_succeeded(op=subscribe_op)
+
+    @pytest.mark.it(
+        "Completes a subscribe which was not acknowledged on the old transport if its topic was unsubscribed from since"
+    )
+    def test_moves_pending_subscribe_unsubscribed(
+        self, mocker, stage, created_transports, old_transport, op
+    ):
+        subscribe_op = pipeline_ops_mqtt.MQTTSubscribeOperation(
+            topic=fake_topic, callback=mocker.MagicMock()
+        )
+        stage.run_op(subscribe_op)
+        stage.run_op(
+            pipeline_ops_mqtt.MQTTUnsubscribeOperation(
+                topic=fake_topic, callback=mocker.MagicMock()
+            )
+        )
+        stage.run_op(op)
+        created_transports[1].on_mqtt_connected()
+        assert created_transports[1].subscribe.call_count == 0
+        assert_callback_succeeded(op=subscribe_op)
+
+    @pytest.mark.it(
+        "Unsubscribes again on the new transport from topics which the old one did not get acknowledged"
+    )
+    def test_moves_pending_unsubscribes(self, mocker, stage, created_transports, old_transport, op):
+        unsubscribe_op = pipeline_ops_mqtt.MQTTUnsubscribeOperation(
+            topic=fake_topic, callback=mocker.MagicMock()
+        )
+        stage.run_op(unsubscribe_op)
+        stage.run_op(op)
+        standby = created_transports[1]
+        standby.on_mqtt_connected()
+        assert standby.unsubscribe.call_count == 1
+        assert standby.unsubscribe.call_args[1]["topic"] == fake_topic
+
+        # The acknowledgement from the old transport is ignored, the new one completes the op
+        old_transport.unsubscribe.call_args[1]["callback"]()
+        assert unsubscribe_op.callback.call_count == 0
+        standby.unsubscribe.call_args[1]["callback"]()
+        assert_callback_succeeded(op=unsubscribe_op)
+
+    @pytest.mark.it(
+        "Publishes messages which are not acknowledged on the old transport again on the new one"
+    )
+    def test_moves_pending_publishes(
+        self, stage, created_transports, old_transport, pending_publish, op
+    ):
+        stage.run_op(op)
+        standby = created_transports[1]
+        standby.on_mqtt_connected()
+        assert standby.publish.call_count == 1
+        assert standby.publish.call_args[1]["payload"] == fake_payload
+
+        # The acknowledgement from the old transport is ignored, the new one completes the op
+        old_transport.publish.call_args[1]["callback"]()
+        assert pending_publish.callback.call_count == 0
+        standby.publish.call_args[1]["callback"]()
+        assert_callback_succeeded(op=pending_publish)
+
+    @pytest.mark.it("Does not publish acknowledged messages again")
+    def test_does_not_move_acknowledged_publishes(
+        self, stage, created_transports, old_transport, pending_publish, op
+    ):
+        old_transport.publish.call_args[1]["callback"]()
+        stage.run_op(op)
+        created_transports[1].on_mqtt_connected()
+        assert created_transports[1].publish.call_count == 0
+        assert pending_publish.callback.call_count == 1
+
+    @pytest.mark.it("Keeps the old transport, and fails the op, if the new one is refused")
+    def test_refused(self, stage, created_transports, old_transport, op, fake_exception):
+        stage.run_op(op)
+        created_transports[1].on_mqtt_connection_failure(fake_exception)
+        assert stage.transport is old_transport
+        assert old_transport.disconnect.call_count == 0
+        assert_callback_failed(op=op, error=fake_exception)
+
+    @pytest.mark.it(
+        "Keeps the old transport, and fails the op, if the new one is dropped before it connects"
+    )
+    def test_standby_dropped(self, stage, created_transports, old_transport, op):
+        stage.run_op(op)
+        standby = created_transports[1]
+        standby.on_mqtt_disconnected()
+        assert stage.transport is old_transport
+        assert old_transport.disconnect.call_count == 0
+        assert_callback_failed(op=op, error=pipeline_stages_mqtt.StandbyConnectionDroppedError)
+        assert standby.on_mqtt_disconnected is None
+
+    @pytest.mark.it("Completes the op only once if the new one is refused, and then dropped")
+    def test_refused_then_dropped(self, stage, created_transports, op, fake_exception):
+        stage.run_op(op)
+        standby = created_transports[1]
+        # Paho reports the refused connection as disconnected as well, and both handlers are
+        # called before either of them runs on the pipeline thread
+        on_connection_failure = standby.on_mqtt_connection_failure
+        on_disconnected = standby.on_mqtt_disconnected
+        on_connection_failure(fake_exception)
+        on_disconnected()
+        assert op.callback.call_count == 1
+        assert_callback_failed(op=op, error=fake_exception)
+
+    @pytest.mark.it(
+        "Reports the new connection as lost if it is dropped before its handlers are switched over"
+    )
+    def test_standby_dropped_after_connected(
+        self, mocker, stage, created_transports, old_transport, op
+    ):
+        mocker.spy(stage.previous, "on_disconnected")
+        stage.run_op(op)
+        standby = created_transports[1]
+        on_disconnected = standby.on_mqtt_disconnected
+        standby.on_mqtt_connected()
+        on_disconnected()
+        assert_callback_succeeded(op=op)
+        assert stage.previous.on_disconnected.call_count == 1
+
+    @pytest.mark.it("Keeps the old transport, and fails the op, if connecting the new one raises")
+    def test_connect_raises(
+        self, mocker, stage, transport, created_transports, old_transport, op, fake_exception
+    ):
+        transport.side_effect = lambda **kwargs: mocker.MagicMock(
+            connect=mocker.MagicMock(side_effect=fake_exception)
+        )
+        stage.run_op(op)
+        assert stage.transport is old_transport
+        assert_callback_failed(op=op, error=fake_exception)
+
+    @pytest.mark.it(
+        "Does not report the old connection being dropped while the new one connects, unless the new one is refused"
+    )
+    @pytest.mark.parametrize(
+        "outcome", ["switched", "refused", "dropped"], ids=["Switched over", "Refused", "Dropped"]
+    )
+    def test_old_dropped(
+        self, mocker, stage, created_transports, old_transport, op, fake_exception, outcome
+    ):
+        mocker.spy(stage.previous, "on_disconnected")
+        stage.run_op(op)
+        old_transport.on_mqtt_disconnected()
+        assert stage.previous.on_disconnected.call_count == 0
+        if outcome == "refused":
+            created_transports[1].on_mqtt_connection_failure(fake_exception)
+            assert stage.previous.on_disconnected.call_count == 1
+        elif outcome == "dropped":
+            created_transports[1].on_mqtt_disconnected()
+            assert stage.previous.on_disconnected.call_count == 1
+        else:
+            created_transports[1].on_mqtt_connected()
+            assert stage.previous.on_disconnected.call_count == 0
+
+
 @pytest.mark.describe("MQTTClientStage - EVENT: MQTT message received")
 class TestMQTTProviderProtocolClientEvents(object):
     @pytest.mark.it("Fires an IncomingMQTTMessageEvent event for each MQTT message received")
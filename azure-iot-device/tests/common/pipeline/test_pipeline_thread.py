@@ -0,0 +1,136 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import pytest
+import threading
+from azure.iot.device.common.pipeline import (
+    pipeline_thread,
+    pipeline_stages_base,
+    pipeline_ops_base,
+)
+
+
+def get_thread():
+    return threading.current_thread()
+
+
+@pytest.mark.describe("pipeline_thread - shard_for_key()")
+class TestShardForKey(object):
+    @pytest.mark.it("Returns None if shard_count is 1")
+    def test_single_shard(self):
+        assert pipeline_thread.shard_for_key("device", 1) is None
+
+    @pytest.mark.it("Returns a shard between 0 and shard_count - 1")
+    def test_range(self):
+        shards = set(pipeline_thread.shard_for_key("device {}".format(i), 4) for i in range(100))
+        assert shards == set([0, 1, 2, 3])
+
+    @pytest.mark.it("Always returns the same shard for the same key")
+    def test_stable(self):
+        assert pipeline_thread.shard_for_key("device", 16) == pipeline_thread.shard_for_key(
+            "device", 16
+        )
+
+
+@pytest.mark.describe("pipeline_thread - sharded executors")
+class TestShardedExecutors(object):
+    @pytest.mark.it("Uses a separate executor for each shard")
+    def test_separate_executors(self):
+        default = pipeline_thread._get_named_executor("pipeline")
+        shard_0 = pipeline_thread._get_named_executor("pipeline", 0)
+        shard_1 = pipeline_thread._get_named_executor("pipeline", 1)
+        assert len(set([default, shard_0, shard_1])) == 3
+        assert pipeline_thread._get_named_executor("pipeline", 0) is shard_0
+
+    @pytest.mark.it("Runs functions for each shard on a different thread named 'pipeline'")
+    def test_separate_threads(self):
+        default = pipeline_thread.invoke_on_pipeline_thread(get_thread)()
+        shard_0 = pipeline_thread.invoke_on_pipeline_thread(get_thread, shard=0)()
+        shard_1 = pipeline_thread.invoke_on_pipeline_thread(get_thread, shard=1)()
+        assert len(set([default, shard_0, shard_1])) == 3
+        assert default.name == shard_0.name == shard_1.name == "pipeline"
+
+    @pytest.mark.it("Runs functions for different shards concurrently")
+    def test_concurrent(self):
+        shard_0_blocked = threading.Event()
+        release = threading.Event()
+
+        def block():
+            shard_0_blocked.set()
+            release.wait()
+
+        pipeline_thread.invoke_on_pipeline_thread_nowait(block, shard=0)()
+        shard_0_blocked.wait()
+        try:
+            # shard 1 is not held up by shard 0
+            assert pipeline_thread.invoke_on_pipeline_thread(lambda: True, shard=1)()
+        finally:
+            release.set()
+
+    @pytest.mark.it("Runs callbacks for a shard on the callback thread of that shard")
+    def test_callback_thread(self):
+        done = threading.Event()
+        threads = []
+
+        def callback():
+            threads.append(get_thread())
+            done.set()
+
+        pipeline_thread.invoke_on_callback_thread_nowait(callback, shard=2)()
+        done.wait()
+        assert threads[0].name == "callback"
+        assert threads[0] is not pipeline_thread.invoke_on_pipeline_thread(get_thread, shard=2)()
+
+    @pytest.mark.it(
+        "Uses the shard of the current thread for functions which are decorated on a pipeline thread"
+    )
+    def test_captures_current_shard(self):
+        def make_handler():
+            return pipeline_thread.invoke_on_pipeline_thread(get_thread)
+
+        handler = pipeline_thread.invoke_on_pipeline_thread(make_handler, shard=3)()
+        assert handler() is pipeline_thread.invoke_on_pipeline_thread(get_thread, shard=3)()
+
+    @pytest.mark.it("Uses the executor_shard of the pipeline root for methods of pipeline stages")
+    def test_uses_stage_shard(self):
+        class StageForTest(pipeline_stages_base.PipelineStage):
+            def _run_op(self, op):
+                pass
+
+            @pipeline_thread.invoke_on_pipeline_thread
+            def get_thread(self):
+                return threading.current_thread()
+
+        stage = StageForTest()
+        stage.pipeline_root = pipeline_stages_base.PipelineRootStage(executor_shard=4)
+        assert (
+            stage.get_thread() is pipeline_thread.invoke_on_pipeline_thread(get_thread, shard=4)()
+        )
+
+    @pytest.mark.it("Runs operations and their callbacks on the shard of the PipelineRootStage")
+    def test_root_stage(self, mocker):
+        root = pipeline_stages_base.PipelineRootStage(executor_shard=5)
+        root.pipeline_root = root
+        threads = {}
+        done = threading.Event()
+
+        def run_op(op):
+            threads["pipeline"] = get_thread()
+            op.callback(op)
+
+        def callback(op):
+            threads["callback"] = get_thread()
+            done.set()
+
+        root._run_op = run_op
+        root.run_op(pipeline_ops_base.ConnectOperation(callback=callback))
+        done.wait()
+        assert (
+            threads["pipeline"] is pipeline_thread.invoke_on_pipeline_thread(get_thread, shard=5)()
+        )
+        assert (
+            threads["callback"]
+            is pipeline_thread.invoke_on_callback_thread_nowait(get_thread, shard=5)().result()
+        )
@@ -0,0 +1,156 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import asyncio
+import gc
+import pytest
+import threading
+import weakref
+from azure.iot.device.common.pipeline import (
+    pipeline_thread,
+    pipeline_stages_base,
+    pipeline_ops_base,
+)
+
+
+def get_thread():
+    return threading.current_thread()
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def running_loop(loop):
+    """An event loop which is running on a thread of its own"""
+    thread = threading.Thread(target=loop.run_forever, name="event loop thread")
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+def run_on_loop(loop, func):
+    """Run func on the thread running the loop, and return its result"""
+
+    async def call():
+        return func()
+
+    return asyncio.run_coroutine_threadsafe(call(), loop).result()
+
+
+@pytest.mark.describe("pipeline_thread - shard_for_event_loop()")
+class TestShardForEventLoop(object):
+    @pytest.mark.it("Returns an EventLoopShard for the loop")
+    def test_returns_shard(self, loop):
+        shard = pipeline_thread.shard_for_event_loop(loop)
+        assert isinstance(shard, pipeline_thread.EventLoopShard)
+        assert shard.loop is loop
+
+    @pytest.mark.it("Always returns the same shard for the same loop")
+    def test_stable(self, loop):
+        assert pipeline_thread.shard_for_event_loop(loop) is pipeline_thread.shard_for_event_loop(
+            loop
+        )
+
+    @pytest.mark.it("Does not keep the loop alive")
+    def test_does_not_keep_loop(self):
+        loop = asyncio.new_event_loop()
+        pipeline_thread.shard_for_event_loop(loop)
+        loop.close()
+        loop_ref = weakref.ref(loop)
+        del loop
+        gc.collect()
+        assert loop_ref() is None
+
+
+@pytest.mark.describe("pipeline_thread - EventLoopShard")
+class TestEventLoopShard(object):
+    @pytest.mark.it("Runs pipeline functions on the thread running the loop, without renaming it")
+    def test_pipeline_thread(self, running_loop):
+        shard = pipeline_thread.shard_for_event_loop(running_loop)
+        thread = pipeline_thread.invoke_on_pipeline_thread(get_thread, shard=shard)()
+        assert thread.name == "event loop thread"
+
+    @pytest.mark.it("Runs callbacks on the thread running the loop")
+    def test_callback_thread(self, running_loop):
+        shard = pipeline_thread.shard_for_event_loop(running_loop)
+        future = pipeline_thread.invoke_on_callback_thread_nowait(get_thread, shard=shard)()
+        assert future.result().name == "event loop thread"
+
+    @pytest.mark.it("Runs functions right away when called on the thread running the loop")
+    def test_no_thread_switch(self, running_loop):
+        shard = pipeline_thread.shard_for_event_loop(running_loop)
+        calls = []
+
+        def call_pipeline():
+            pipeline_thread.invoke_on_pipeline_thread_nowait(
+                lambda: calls.append(get_thread()), shard=shard
+            )()
+            # The function has already run by the time the call returns
+            return list(calls)
+
+        assert run_on_loop(running_loop, call_pipeline) == [run_on_loop(running_loop, get_thread)]
+
+    @pytest.mark.it("Runs functions right away on the calling thread if the loop is not running")
+    def test_loop_not_running(self, loop):
+        shard = pipeline_thread.shard_for_event_loop(loop)
+        thread = pipeline_thread.invoke_on_pipeline_thread(get_thread, shard=shard)()
+        assert thread is threading.current_thread()
+
+    @pytest.mark.it("Lets functions which run on the pipeline thread run inside the shard")
+    def test_runs_on_pipeline_thread(self, running_loop):
+        shard = pipeline_thread.shard_for_event_loop(running_loop)
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def pipeline_function():
+            return True
+
+        assert pipeline_thread.invoke_on_pipeline_thread(pipeline_function, shard=shard)()
+
+    @pytest.mark.it("Does not let functions which run on the pipeline thread run outside the shard")
+    def test_runs_on_pipeline_thread_outside(self, running_loop):
+        @pipeline_thread.runs_on_pipeline_thread
+        def pipeline_function():
+            return True
+
+        with pytest.raises(AssertionError):
+            run_on_loop(running_loop, pipeline_function)
+
+    @pytest.mark.it("Uses the shard for functions which are decorated inside the shard")
+    def test_captures_current_shard(self, running_loop):
+        shard = pipeline_thread.shard_for_event_loop(running_loop)
+
+        def make_handler():
+            return pipeline_thread.invoke_on_pipeline_thread(get_thread)
+
+        handler = pipeline_thread.invoke_on_pipeline_thread(make_handler, shard=shard)()
+        assert handler().name == "event loop thread"
+
+    @pytest.mark.it("Runs operations and their callbacks on the loop of the PipelineRootStage")
+    def test_root_stage(self, running_loop):
+        shard = pipeline_thread.shard_for_event_loop(running_loop)
+        root = pipeline_stages_base.PipelineRootStage(executor_shard=shard)
+        root.pipeline_root = root
+        threads = {}
+        done = threading.Event()
+
+        def run_op(op):
+            threads["pipeline"] = get_thread()
+            op.callback(op)
+
+        def callback(op):
+            threads["callback"] = get_thread()
+            done.set()
+
+        root._run_op = run_op
+        root.run_op(pipeline_ops_base.ConnectOperation(callback=callback))
+        assert done.wait(5)
+        assert threads["pipeline"].name == "event loop thread"
+        assert threads["callback"].name == "event loop thread"
@@ -0,0 +1,111 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import json
+import pytest
+from azure.iot.device.common import json_codec
+
+codec_names = ["orjson", "ujson", "json"]
+
+
+def is_installed(name):
+    try:
+        __import__(name)
+    except ImportError:
+        return False
+    return True
+
+
+@pytest.fixture(autouse=True)
+def restore_codec():
+    codec = json_codec._codec
+    yield
+    json_codec._codec = codec
+
+
+@pytest.fixture(params=codec_names)
+def codec_name(request):
+    if not is_installed(request.param):
+        pytest.skip("{} is not installed".format(request.param))
+    json_codec.use_codec(request.param)
+    return request.param
+
+
+document = {
+    "desired": {"temperature": 21.5, "fan": True, "schedule": [1, 2, 3], "$version": 4},
+    "reported": {"firmware": "1.0/2", "name": "caf\u00e9", "nothing": None},
+}
+
+
+@pytest.mark.describe("get_codec()")
+class TestGetCodec(object):
+    @pytest.mark.it("Selects the first installed codec, in order of preference")
+    def test_selects_installed(self):
+        json_codec._codec = None
+        expected = [name for name in codec_names if is_installed(name)][0]
+        assert json_codec.get_codec().name == expected
+
+    @pytest.mark.it("Falls back to the json module if no faster codec is installed")
+    def test_fallback(self, mocker):
+        def not_installed():
+            raise ImportError()
+
+        mocker.patch.object(
+            json_codec,
+            "_codec_factories",
+            [("orjson", not_installed), ("json", json_codec._make_stdlib_codec)],
+        )
+        json_codec._codec = None
+        assert json_codec.get_codec().name == "json"
+
+
+@pytest.mark.describe("use_codec()")
+class TestUseCodec(object):
+    @pytest.mark.it("Raises ValueError for an unknown codec")
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            json_codec.use_codec("__unknown__")
+
+    @pytest.mark.it("Uses the given codec from now on")
+    def test_uses_codec(self, codec_name):
+        assert json_codec.get_codec().name == codec_name
+
+
+@pytest.mark.describe("loads() and dumps()")
+class TestLoadsDumps(object):
+    @pytest.mark.it("Decodes UTF-8 encoded bytes")
+    def test_loads_bytes(self, codec_name):
+        assert json_codec.loads(json.dumps(document).encode("utf-8")) == document
+
+    @pytest.mark.it("Decodes str")
+    def test_loads_str(self, codec_name):
+        assert json_codec.loads(json.dumps(document)) == document
+
+    @pytest.mark.it("Encodes to a str which the json module decodes to the same object")
+    def test_dumps(self, codec_name):
+        encoded = json_codec.dumps(document)
+        assert isinstance(encoded, str)
+        assert json.loads(encoded) == document
+
+    @pytest.mark.it("Encodes scalars")
+    @pytest.mark.parametrize("value", ["text", 5, 1.5, True, None])
+    def test_dumps_scalar(self, codec_name, value):
+        assert json.loads(json_codec.dumps(value)) == value
+
+    @pytest.mark.it("Decodes with the json module what orjson fails to decode")
+    def test_orjson_loads_fallback(self, mocker):
+        if not is_installed("orjson"):
+            pytest.skip("orjson is not installed")
+        import orjson
+
+        mocker.patch.object(orjson, "loads", side_effect=orjson.JSONDecodeError("error", "", 0))
+        json_codec.use_codec("orjson")
+        big = 2 ** 64 + 1
+        assert json_codec.loads(json.dumps({"big": big}).encode("utf-8")) == {"big": big}
+
+    @pytest.mark.it("Raises ValueError for a document which is not valid JSON")
+    def test_loads_invalid(self, codec_name):
+        with pytest.raises(ValueError):
+            json_codec.loads(b"not json")
@@ -0,0 +1,327 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import asyncio
+import gc
+import socket
+import threading
+import weakref
+import pytest
+from azure.iot.device.common import mqtt_engine
+from azure.iot.device.common.mqtt_engine import MQTTEngine, EventLoopMQTTEngine
+
+# Long enough for the engine thread to react, short enough to not slow the tests down
+wait_timeout = 5
+
+
+class FakePahoClient(object):
+    """
+    Stands in for a Paho client driven by an external loop.  It owns one end of a socket pair,
+    and the test plays the broker at the other end.
+    """
+
+    def __init__(self):
+        self.sock, self.broker = socket.socketpair()
+        self.sock.setblocking(False)
+        self.received = []
+        self.writing = False
+        self.read_event = threading.Event()
+        self.write_event = threading.Event()
+        self.misc_event = threading.Event()
+        self.loop_read_error = None
+
+    def socket(self):
+        return self.sock
+
+    def want_write(self):
+        return self.writing
+
+    def loop_read(self):
+        self.read_thread = threading.current_thread()
+        if self.loop_read_error:
+            raise self.loop_read_error
+        try:
+            data = self.sock.recv(4096)
+        except socket.error:
+            return
+        if data:
+            self.received.append(data)
+        else:
+            # The broker closed the connection
+            self.sock.close()
+            self.sock = None
+        self.read_event.set()
+
+    def loop_write(self):
+        self.writing = False
+        self.write_event.set()
+
+    def loop_misc(self):
+        self.misc_event.set()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.broker.close()
+
+
+@pytest.fixture
+def engine():
+    engine = MQTTEngine()
+    yield engine
+    engine.stop()
+
+
+@pytest.fixture
+def client():
+    client = FakePahoClient()
+    yield client
+    client.close()
+
+
+def wait_for(condition):
+    event = threading.Event()
+    for _ in range(wait_timeout * 100):
+        if condition():
+            return True
+        event.wait(0.01)
+    return False
+
+
+@pytest.mark.describe("get_shared_engine()")
+class TestGetSharedEngine(object):
+    @pytest.mark.it("Returns the same engine for the same key")
+    def test_same_key(self):
+        assert mqtt_engine.get_shared_engine("a", 4) is mqtt_engine.get_shared_engine("a", 4)
+
+    @pytest.mark.it("Spreads keys across engine_count engines")
+    def test_spreads_keys(self):
+        engines = set(mqtt_engine.get_shared_engine("device{}".format(i), 4) for i in range(100))
+        assert len(engines) == 4
+
+    @pytest.mark.it("Returns a single engine if engine_count is 1")
+    def test_single_engine(self):
+        engines = set(mqtt_engine.get_shared_engine("device{}".format(i), 1) for i in range(10))
+        assert len(engines) == 1
+
+
+@pytest.mark.describe("MQTTEngine - .add_client()")
+class TestMQTTEngineAddClient(object):
+    @pytest.mark.it("Calls loop_read on the client when its socket becomes readable")
+    def test_loop_read(self, engine, client):
+        engine.add_client(client)
+        client.broker.send(b"CONNACK")
+        assert client.read_event.wait(wait_timeout)
+        assert client.received == [b"CONNACK"]
+
+    @pytest.mark.it("Calls loop_write on the client while it wants to write")
+    def test_loop_write(self, engine, client):
+        client.writing = True
+        engine.add_client(client)
+        assert client.write_event.wait(wait_timeout)
+
+    @pytest.mark.it("Calls loop_misc on the client periodically")
+    def test_loop_misc(self, mocker, engine, client):
+        mocker.patch.object(mqtt_engine, "MISC_INTERVAL", 0.01)
+        engine.add_client(client)
+        assert client.misc_event.wait(wait_timeout)
+
+    @pytest.mark.it("Drives many clients from a single thread")
+    def test_many_clients(self, engine):
+        clients = [FakePahoClient() for _ in range(50)]
+        try:
+            threads_before = threading.active_count()
+            for client in clients:
+                engine.add_client(client)
+            for client in clients:
+                client.broker.send(b"PUBACK")
+            for client in clients:
+                assert client.read_event.wait(wait_timeout)
+            assert threading.active_count() == threads_before + 1
+            assert engine.client_count == 50
+        finally:
+            for client in clients:
+                client.close()
+
+    @pytest.mark.it("Follows the client when Paho replaces its socket, when added again")
+    def test_new_socket(self, engine, client):
+        engine.add_client(client)
+        client.broker.send(b"one")
+        assert client.read_event.wait(wait_timeout)
+
+        # What Paho does on reconnect
+        client.read_event.clear()
+        client.sock.close()
+        client.broker.close()
+        client.sock, client.broker = socket.socketpair()
+        client.sock.setblocking(False)
+        engine.add_client(client)
+
+        client.broker.send(b"two")
+        assert client.read_event.wait(wait_timeout)
+        assert client.received == [b"one", b"two"]
+
+    @pytest.mark.it("Waits for the socket to become writable when Paho asks it to")
+    def test_socket_register_write(self, engine, client):
+        client.on_socket_register_write = None
+        engine.add_client(client)
+        assert wait_for(lambda: engine.client_count == 1)
+
+        client.writing = True
+        client.on_socket_register_write(client, None, client.sock)
+        assert client.write_event.wait(wait_timeout)
+
+    @pytest.mark.it("Keeps driving other clients if driving a client raises an exception")
+    def test_client_error(self, engine):
+        bad_client = FakePahoClient()
+        good_client = FakePahoClient()
+        try:
+            bad_client.loop_read_error = RuntimeError("boom")
+            engine.add_client(bad_client)
+            engine.add_client(good_client)
+            bad_client.broker.send(b"data")
+            good_client.broker.send(b"data")
+            assert good_client.read_event.wait(wait_timeout)
+        finally:
+            bad_client.close()
+            good_client.close()
+
+
+@pytest.mark.describe("MQTTEngine - .remove_client()")
+class TestMQTTEngineRemoveClient(object):
+    @pytest.mark.it("Stops driving a client which no longer has a socket")
+    def test_no_socket(self, engine, client):
+        engine.add_client(client)
+        assert wait_for(lambda: engine.client_count == 1)
+        client.sock.close()
+        client.sock = None
+
+        engine.remove_client(client)
+        assert wait_for(lambda: engine.client_count == 0)
+
+    @pytest.mark.it("Keeps driving a client until Paho closes its socket")
+    def test_waits_for_socket_close(self, engine, client):
+        engine.add_client(client)
+        engine.remove_client(client)
+        client.broker.send(b"data")
+        assert client.read_event.wait(wait_timeout)
+        assert engine.client_count == 1
+
+        client.read_event.clear()
+        client.broker.close()
+        assert client.read_event.wait(wait_timeout)
+        assert wait_for(lambda: engine.client_count == 0)
+
+
+@pytest.mark.describe("MQTTEngine - .stop()")
+class TestMQTTEngineStop(object):
+    @pytest.mark.it("Stops the engine thread")
+    def test_stops_thread(self, client):
+        engine = MQTTEngine(name="engine under test")
+        engine.add_client(client)
+        assert any(t.name == "engine under test" for t in threading.enumerate())
+        engine.stop()
+        assert not any(t.name == "engine under test" for t in threading.enumerate())
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def loop_engine(loop):
+    engine = EventLoopMQTTEngine(loop)
+    yield engine
+    engine.stop()
+    loop.run_until_complete(asyncio.sleep(0))
+
+
+def run_until(loop, condition):
+    """Run the loop until condition() is true, and return whether it became true"""
+
+    async def wait():
+        for _ in range(wait_timeout * 100):
+            if condition():
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+    return loop.run_until_complete(wait())
+
+
+@pytest.mark.describe("get_event_loop_engine()")
+class TestGetEventLoopEngine(object):
+    @pytest.mark.it("Returns the same EventLoopMQTTEngine for the same loop")
+    def test_same_loop(self, loop):
+        engine = mqtt_engine.get_event_loop_engine(loop)
+        assert isinstance(engine, EventLoopMQTTEngine)
+        assert mqtt_engine.get_event_loop_engine(loop) is engine
+
+    @pytest.mark.it("Does not keep the loop alive")
+    def test_does_not_keep_loop(self):
+        loop = asyncio.new_event_loop()
+        mqtt_engine.get_event_loop_engine(loop)
+        loop.close()
+        loop_ref = weakref.ref(loop)
+        del loop
+        gc.collect()
+        assert loop_ref() is None
+
+
+@pytest.mark.describe("EventLoopMQTTEngine - .add_client()")
+class TestEventLoopMQTTEngineAddClient(object):
+    @pytest.mark.it(
+        "Calls loop_read on the client on the event loop when its socket becomes readable"
+    )
+    def test_loop_read(self, loop, loop_engine, client):
+        loop_engine.add_client(client)
+        client.broker.send(b"CONNACK")
+        assert run_until(loop, client.read_event.is_set)
+        assert client.received == [b"CONNACK"]
+        assert client.read_thread is threading.current_thread()
+
+    @pytest.mark.it("Calls loop_write on the client while it wants to write")
+    def test_loop_write(self, loop, loop_engine, client):
+        client.writing = True
+        loop_engine.add_client(client)
+        assert run_until(loop, client.write_event.is_set)
+
+    @pytest.mark.it("Calls loop_misc on the client periodically")
+    def test_loop_misc(self, mocker, loop, loop_engine, client):
+        mocker.patch.object(mqtt_engine, "MISC_INTERVAL", 0.01)
+        loop_engine.add_client(client)
+        assert run_until(loop, client.misc_event.is_set)
+
+    @pytest.mark.it("Follows the client when Paho replaces its socket, when added again")
+    def test_new_socket(self, loop, loop_engine, client):
+        loop_engine.add_client(client)
+        assert run_until(loop, lambda: loop_engine.client_count == 1)
+
+        client.sock.close()
+        client.broker.close()
+        client.sock, client.broker = socket.socketpair()
+        client.sock.setblocking(False)
+        loop_engine.add_client(client)
+
+        client.broker.send(b"data")
+        assert run_until(loop, client.read_event.is_set)
+        assert client.received == [b"data"]
+
+
+@pytest.mark.describe("EventLoopMQTTEngine - .remove_client()")
+class TestEventLoopMQTTEngineRemoveClient(object):
+    @pytest.mark.it("Keeps driving a client until Paho closes its socket")
+    def test_waits_for_socket_close(self, loop, loop_engine, client):
+        loop_engine.add_client(client)
+        loop_engine.remove_client(client)
+        client.broker.send(b"data")
+        assert run_until(loop, client.read_event.is_set)
+        assert loop_engine.client_count == 1
+
+        client.broker.close()
+        assert run_until(loop, lambda: loop_engine.client_count == 0)
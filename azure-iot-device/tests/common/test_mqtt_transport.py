@@ -4,9 +4,17 @@
 # license information.
 # --------------------------------------------------------------------------
 
-from azure.iot.device.common.mqtt_transport import MQTTTransport, OperationManager
+from azure.iot.device.common.mqtt_transport import (
+    ConnectionFailedError,
+    MQTTTransport,
+    OperationManager,
+    OperationTimeoutError,
+    TLSSessionResumption,
+)
+from azure.iot.device.common import mqtt_transport, ssl_context_cache
 from azure.iot.device.common.models.x509 import X509
 import paho.mqtt.client as mqtt
+import socket
 import ssl
 import copy
 import pytest
@@ -32,6 +40,14 @@ class UnhandledException(BaseException):
     pass
 
 
+@pytest.fixture(autouse=True)
+def clear_ssl_context_cache():
+    # SSL contexts are shared across transports, so each test must start with an empty cache
+    ssl_context_cache.clear()
+    yield
+    ssl_context_cache.clear()
+
+
 @pytest.fixture
 def mock_mqtt_client(mocker):
     mock = mocker.patch.object(mqtt, "Client")
@@ -47,6 +63,21 @@ def transport(mock_mqtt_client):
     return MQTTTransport(client_id=fake_device_id, hostname=fake_hostname, username=fake_username)
 
 
+@pytest.fixture
+def io_engine(mocker):
+    return mocker.MagicMock()
+
+
+@pytest.fixture
+def engine_transport(mock_mqtt_client, io_engine):
+    return MQTTTransport(
+        client_id=fake_device_id,
+        hostname=fake_hostname,
+        username=fake_username,
+        io_engine=io_engine,
+    )
+
+
 @pytest.mark.describe("MQTTTransport - Instantiation")
 class TestInstantiation(object):
     @pytest.mark.it("Creates an instance of the Paho MQTT Client")
@@ -60,6 +91,50 @@ class TestInstantiation(object):
             client_id=fake_device_id, clean_session=False, protocol=mqtt.MQTTv311
         )
 
+    @pytest.mark.it(
+        "Sets the Paho MQTT Client in-flight window, if max_inflight_messages is provided"
+    )
+    def test_sets_max_inflight_messages(self, mocker):
+        mock_mqtt_client = mocker.patch.object(mqtt, "Client").return_value
+
+        MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            max_inflight_messages=42,
+        )
+
+        assert mock_mqtt_client.max_inflight_messages_set.call_count == 1
+        assert mock_mqtt_client.max_inflight_messages_set.call_args == mocker.call(42)
+
+    @pytest.mark.it(
+        "Creates the Paho MQTT Client without automatic reconnects if auto_reconnect is False"
+    )
+    def test_no_auto_reconnect(self, mocker):
+        mock_mqtt_client_constructor = mocker.patch.object(mqtt, "Client")
+
+        MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            auto_reconnect=False,
+        )
+
+        assert mock_mqtt_client_constructor.call_args == mocker.call(
+            client_id=fake_device_id,
+            clean_session=False,
+            protocol=mqtt.MQTTv311,
+            reconnect_on_failure=False,
+        )
+
+    @pytest.mark.it("Leaves the Paho MQTT Client in-flight window alone by default")
+    def test_default_max_inflight_messages(self, mocker):
+        mock_mqtt_client = mocker.patch.object(mqtt, "Client").return_value
+
+        MQTTTransport(client_id=fake_device_id, hostname=fake_hostname, username=fake_username)
+
+        assert mock_mqtt_client.max_inflight_messages_set.call_count == 0
+
     @pytest.mark.it("Sets Paho MQTT Client callbacks")
     def test_sets_paho_callbacks(self, mocker):
         mock_mqtt_client = mocker.patch.object(mqtt, "Client").return_value
@@ -93,6 +168,28 @@ class TestInstantiation(object):
         assert transport._op_manager._pending_operation_callbacks == {}
         assert transport._op_manager._unknown_operation_completions == {}
 
+    @pytest.mark.it("Gives pending operations a deadline, if operation_timeout is provided")
+    def test_operation_timeout(self, mocker):
+        transport = MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            operation_timeout=42,
+        )
+        assert transport._op_manager._operation_timeout == 42
+
+    @pytest.mark.it("Exposes the operation counters of its operation manager")
+    def test_operation_counters(self, mocker):
+        transport = MQTTTransport(
+            client_id=fake_device_id, hostname=fake_hostname, username=fake_username
+        )
+        transport._op_manager.expired_count = 3
+        transport._op_manager.establish_operation(1)
+        transport._op_manager.complete_operation(2)
+        assert transport.pending_operation_count == 1
+        assert transport.orphaned_operation_count == 1
+        assert transport.expired_operation_count == 3
+
 
 @pytest.mark.describe("MQTTTransport - .connect()")
 class TestConnect(object):
@@ -111,7 +208,8 @@ class TestConnect(object):
 
         # Verify correctness of MQTT Client TLS config
         assert mock_mqtt_client.tls_set_context.call_count == 1
-        assert mock_mqtt_client.tls_set_context.call_args == mocker.call(context=mock_ssl_context)
+        context = mock_mqtt_client.tls_set_context.call_args[1]["context"]
+        assert context.ssl_context is mock_ssl_context
         assert mock_mqtt_client.tls_insecure_set.call_count == 1
         assert mock_mqtt_client.tls_insecure_set.call_args == mocker.call(False)
 
@@ -170,6 +268,81 @@ class TestConnect(object):
             fake_client_cert.pass_phrase,
         )
 
+    @pytest.mark.it(
+        "Reuses the TLS/SSL context of a previous connection with the same certificates"
+    )
+    def test_reuses_tls_context(self, mocker, mock_mqtt_client, transport):
+        mock_ssl_context_constructor = mocker.patch.object(ssl, "SSLContext")
+        mock_ssl_context = mock_ssl_context_constructor.return_value
+
+        transport.connect(fake_password)
+        other_transport = MQTTTransport(
+            client_id=fake_device_id, hostname=fake_hostname, username=fake_username
+        )
+        other_transport.connect(fake_password)
+
+        assert mock_ssl_context_constructor.call_count == 1
+        assert mock_ssl_context.load_default_certs.call_count == 1
+        assert mock_mqtt_client.tls_set_context.call_count == 2
+        for call in mock_mqtt_client.tls_set_context.call_args_list:
+            assert call[1]["context"].ssl_context is mock_ssl_context
+
+    @pytest.mark.it("Configures TLS only once when the same Paho client connects again")
+    def test_connect_twice(self, mocker):
+        # A real Paho client, which raises if its TLS is configured twice
+        mocker.patch.object(mqtt.Client, "connect")
+        mocker.patch.object(mqtt.Client, "loop_start")
+        mocker.patch.object(mqtt.Client, "loop_stop")
+        transport = MQTTTransport(
+            client_id=fake_device_id, hostname=fake_hostname, username=fake_username
+        )
+
+        transport.connect(fake_password)
+        transport.connect(fake_password)
+
+        assert mqtt.Client.connect.call_count == 2
+
+    @pytest.mark.it(
+        "Uses the TLS/SSL context for the current certificates when the same Paho client connects again"
+    )
+    def test_connect_again_with_other_certificate(self, mocker, mock_mqtt_client, transport):
+        contexts = [mocker.MagicMock(), mocker.MagicMock()]
+        mocker.patch.object(
+            mqtt_transport.ssl_context_cache, "get_ssl_context", side_effect=contexts
+        )
+        fake_client_cert = X509("fantastic_beasts", "where_to_find_them", "alohomora")
+
+        transport.connect(password=None, client_certificate=fake_client_cert)
+        transport.connect(password=None, client_certificate=fake_client_cert)
+
+        assert mock_mqtt_client.tls_set_context.call_count == 1
+        context = mock_mqtt_client.tls_set_context.call_args[1]["context"]
+        context.wrap_socket("fake socket", server_hostname=fake_hostname)
+        assert contexts[0].wrap_socket.call_count == 0
+        assert contexts[1].wrap_socket.call_args == mocker.call(
+            "fake socket", server_hostname=fake_hostname
+        )
+
+    @pytest.mark.it(
+        "Configures Paho with a TLS/SSL context which offers the previous TLS session, if TLS session resumption is enabled"
+    )
+    def test_configures_session_resuming_context(self, mocker, mock_mqtt_client):
+        mock_ssl_context = mocker.patch.object(ssl, "SSLContext").return_value
+        transport = MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            tls_session_resumption=True,
+        )
+        transport.connect(fake_password)
+
+        context = mock_mqtt_client.tls_set_context.call_args[1]["context"]
+        assert context is not mock_ssl_context
+        context.wrap_socket("fake socket", server_hostname=fake_hostname)
+        assert mock_ssl_context.wrap_socket.call_args == mocker.call(
+            "fake socket", server_hostname=fake_hostname
+        )
+
     @pytest.mark.it("Sets username and password")
     def test_sets_username_and_password(self, mocker, mock_mqtt_client, transport):
         transport.connect(fake_password)
@@ -193,6 +366,31 @@ class TestConnect(object):
         assert mock_mqtt_client.loop_start.call_count == 1
         assert mock_mqtt_client.loop_start.call_args == mocker.call()
 
+    @pytest.mark.it(
+        "Cleans up the network loop of the previous connection first, if auto_reconnect is False"
+    )
+    def test_restarts_loop(self, mocker, mock_mqtt_client):
+        transport = MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            auto_reconnect=False,
+        )
+        transport.connect(fake_password)
+
+        assert mock_mqtt_client.method_calls[-2:] == [
+            mocker.call.loop_stop(),
+            mocker.call.loop_start(),
+        ]
+
+    @pytest.mark.it("Hands the Paho client to the MQTTEngine instead, if one was provided")
+    def test_adds_client_to_engine(self, mocker, mock_mqtt_client, io_engine, engine_transport):
+        engine_transport.connect(fake_password)
+
+        assert mock_mqtt_client.loop_start.call_count == 0
+        assert io_engine.add_client.call_count == 1
+        assert io_engine.add_client.call_args == mocker.call(mock_mqtt_client)
+
     @pytest.mark.it("Triggers on_mqtt_connected event handler callback upon connect completion")
     def test_calls_event_handler_callback(self, mocker, mock_mqtt_client, transport):
         callback = mocker.MagicMock()
@@ -208,6 +406,26 @@ class TestConnect(object):
         assert callback.call_count == 1
         assert callback.call_args == mocker.call()
 
+    @pytest.mark.it(
+        "Triggers on_mqtt_connection_failure event handler callback instead if the broker refuses the connection"
+    )
+    def test_calls_connection_failure_handler(self, mocker, mock_mqtt_client, transport):
+        transport.on_mqtt_connected = mocker.MagicMock()
+        transport.on_mqtt_connection_failure = mocker.MagicMock()
+        transport.connect(fake_password)
+
+        mock_mqtt_client.on_connect(
+            client=mock_mqtt_client,
+            userdata=None,
+            flags=None,
+            rc=mqtt.CONNACK_REFUSED_SERVER_UNAVAILABLE,
+        )
+
+        assert transport.on_mqtt_connected.call_count == 0
+        assert transport.on_mqtt_connection_failure.call_count == 1
+        error = transport.on_mqtt_connection_failure.call_args[0][0]
+        assert isinstance(error, ConnectionFailedError)
+
     @pytest.mark.it(
         "Skips on_mqtt_connected event handler callback if set to 'None' upon connect completion"
     )
@@ -266,6 +484,39 @@ class TestReconnect(object):
         assert mock_mqtt_client.reconnect.call_count == 1
         assert mock_mqtt_client.reconnect.call_args == mocker.call()
 
+    @pytest.mark.it("Hands the Paho client to the MQTTEngine again, if one was provided")
+    def test_adds_client_to_engine(self, mocker, mock_mqtt_client, io_engine, engine_transport):
+        engine_transport.reconnect(fake_password)
+
+        assert io_engine.add_client.call_count == 1
+        assert io_engine.add_client.call_args == mocker.call(mock_mqtt_client)
+
+    @pytest.mark.it("Stops the network thread while reconnecting, and starts it again after")
+    def test_restarts_loop(self, mocker, mock_mqtt_client, transport):
+        transport.reconnect(fake_password)
+
+        method_names = [
+            call[0]
+            for call in mock_mqtt_client.method_calls
+            if call[0] in ("loop_stop", "reconnect", "loop_start")
+        ]
+        assert method_names == ["loop_stop", "reconnect", "loop_start"]
+
+    @pytest.mark.it("Starts the network thread again if Paho fails to reconnect")
+    def test_restarts_loop_on_failure(self, mocker, mock_mqtt_client, transport):
+        mock_mqtt_client.reconnect.side_effect = socket.error()
+        with pytest.raises(socket.error):
+            transport.reconnect(fake_password)
+
+        assert mock_mqtt_client.loop_start.call_count == 1
+
+    @pytest.mark.it("Leaves the network thread alone if an MQTTEngine was provided")
+    def test_engine_no_loop(self, mocker, mock_mqtt_client, io_engine, engine_transport):
+        engine_transport.reconnect(fake_password)
+
+        assert mock_mqtt_client.loop_stop.call_count == 0
+        assert mock_mqtt_client.loop_start.call_count == 0
+
     @pytest.mark.it(
         "Triggers on_mqtt_connected event handler callback upon completion of user-driven reconnect"
     )
@@ -355,6 +606,16 @@ class TestDisconnect(object):
         assert mock_mqtt_client.loop_stop.call_count == 1
         assert mock_mqtt_client.loop_stop.call_args == mocker.call()
 
+    @pytest.mark.it("Removes the Paho client from the MQTTEngine instead, if one was provided")
+    def test_removes_client_from_engine(
+        self, mocker, mock_mqtt_client, io_engine, engine_transport
+    ):
+        engine_transport.disconnect()
+
+        assert mock_mqtt_client.loop_stop.call_count == 0
+        assert io_engine.remove_client.call_count == 1
+        assert io_engine.remove_client.call_args == mocker.call(mock_mqtt_client)
+
     @pytest.mark.it(
         "Triggers on_mqtt_disconnected event handler callback upon completion of user-driven disconnect "
     )
@@ -442,6 +703,15 @@ class TestSubscribe(object):
         assert mock_mqtt_client.subscribe.call_count == 1
         assert mock_mqtt_client.subscribe.call_args == mocker.call(fake_topic, qos=qos)
 
+    @pytest.mark.it("Subscribes to a list of topics with a single call to Paho")
+    def test_calls_paho_subscribe_with_list(self, mocker, mock_mqtt_client, transport):
+        transport.subscribe(["topic1", "topic2"], qos=fake_qos)
+
+        assert mock_mqtt_client.subscribe.call_count == 1
+        assert mock_mqtt_client.subscribe.call_args == mocker.call(
+            [("topic1", fake_qos), ("topic2", fake_qos)]
+        )
+
     @pytest.mark.it("Raises ValueError on invalid QoS")
     @pytest.mark.parametrize("qos", [pytest.param(-1, id="QoS < 0"), pytest.param(3, id="QoS > 2")])
     def test_raises_value_error_invalid_qos(self, qos):
@@ -956,6 +1226,65 @@ class TestPublish(object):
         # Check callback has now been called
         assert callback.call_count == 1
 
+    @pytest.mark.it("Triggers callback without waiting for a PUBACK when publishing with QoS 0")
+    def test_qos_0_triggers_callback(self, mocker, mock_mqtt_client, transport, message_info):
+        callback = mocker.MagicMock()
+        mock_mqtt_client.publish.return_value = message_info
+
+        transport.publish(topic=fake_topic, payload=fake_payload, qos=0, callback=callback)
+
+        assert callback.call_count == 1
+        assert transport.pending_operation_count == 0
+
+        # Paho reports the QoS 0 publish as sent, which is not an unknown completion
+        mock_mqtt_client.on_publish(client=mock_mqtt_client, userdata=None, mid=message_info.mid)
+        assert callback.call_count == 1
+        assert transport.orphaned_operation_count == 0
+
+    @pytest.mark.it(
+        "Does not track a QoS 0 publish as an unknown completion if Paho reports it as sent early"
+    )
+    def test_qos_0_sent_early(self, mocker, mock_mqtt_client, transport, message_info):
+        callback = mocker.MagicMock()
+
+        def publish(*args, **kwargs):
+            mock_mqtt_client.on_publish(
+                client=mock_mqtt_client, userdata=None, mid=message_info.mid
+            )
+            return message_info
+
+        mock_mqtt_client.publish.side_effect = publish
+
+        transport.publish(topic=fake_topic, payload=fake_payload, qos=0, callback=callback)
+
+        assert callback.call_count == 1
+        assert transport.orphaned_operation_count == 0
+
+    @pytest.mark.it("Triggers callback with an error for a QoS 0 publish which Paho dropped")
+    @pytest.mark.parametrize("rc", [mqtt.MQTT_ERR_NO_CONN, mqtt.MQTT_ERR_QUEUE_SIZE])
+    def test_qos_0_dropped(self, mocker, mock_mqtt_client, transport, message_info, rc):
+        callback = mocker.MagicMock()
+        message_info.rc = rc
+        mock_mqtt_client.publish.return_value = message_info
+
+        transport.publish(topic=fake_topic, payload=fake_payload, qos=0, callback=callback)
+
+        assert callback.call_count == 1
+        error = callback.call_args[1]["error"]
+        assert isinstance(error, mqtt_transport.PublishFailedError)
+
+    @pytest.mark.it("Does not wait for the MID of a QoS 0 publish which Paho dropped")
+    def test_qos_0_dropped_mid(self, mocker, mock_mqtt_client, transport, message_info):
+        callback = mocker.MagicMock()
+        message_info.rc = mqtt.MQTT_ERR_NO_CONN
+        mock_mqtt_client.publish.return_value = message_info
+        spy = mocker.spy(transport._op_manager, "establish_unacknowledged_operation")
+
+        transport.publish(topic=fake_topic, payload=fake_payload, qos=0, callback=callback)
+
+        assert spy.call_count == 0
+        assert transport.pending_operation_count == 0
+
     @pytest.mark.it(
         "Triggers callback upon publish completion when Paho event handler triggered early"
     )
@@ -1483,3 +1812,242 @@ class TestOperationManagerCompleteOperation(object):
 
         # Callback WAS NOT called while the lock was held
         assert mocker.call.cb() not in calls_during_lock
+
+
+@pytest.mark.describe("OperationManager - .establish_unacknowledged_operation()")
+class TestOperationManagerEstablishUnacknowledgedOperation(object):
+    @pytest.mark.it("Drops the completion of the operation when it arrives")
+    def test_drops_later_completion(self):
+        manager = OperationManager()
+        manager.establish_unacknowledged_operation(1)
+        manager.complete_operation(1)
+        assert manager.pending_count == 0
+        assert manager.orphaned_count == 0
+
+    @pytest.mark.it("Resolves a previous unknown completion for the MID")
+    def test_resolves_early_completion(self):
+        manager = OperationManager()
+        manager.complete_operation(1)
+        manager.establish_unacknowledged_operation(1)
+        assert manager.orphaned_count == 0
+
+    @pytest.mark.it("Lets a later operation which reuses the MID wait for its response")
+    def test_mid_reused(self, mocker):
+        manager = OperationManager()
+        cb_mock = mocker.MagicMock()
+        manager.establish_unacknowledged_operation(1)
+        manager.establish_operation(1, cb_mock)
+        manager.complete_operation(1)
+        assert cb_mock.call_count == 1
+
+
+@pytest.mark.describe("OperationManager - Deadlines")
+class TestOperationManagerDeadlines(object):
+    @pytest.fixture
+    def wheel(self, mocker):
+        return mocker.MagicMock()
+
+    @pytest.fixture
+    def manager(self, wheel):
+        return OperationManager(operation_timeout=30, timer_wheel=wheel)
+
+    def fire_timer(self, wheel):
+        wheel.schedule.call_args[0][1]()
+
+    @pytest.mark.it("Does not schedule a deadline if no operation_timeout is provided")
+    def test_no_timeout(self, wheel):
+        manager = OperationManager(timer_wheel=wheel)
+        manager.establish_operation(1)
+        assert wheel.schedule.call_count == 0
+
+    @pytest.mark.it("Schedules a deadline operation_timeout seconds away for a pending operation")
+    def test_schedules_deadline(self, manager, wheel):
+        manager.establish_operation(1)
+        assert wheel.schedule.call_count == 1
+        assert wheel.schedule.call_args[0][0] == 30
+
+    @pytest.mark.it("Cancels the deadline when the operation completes")
+    def test_cancels_deadline(self, manager, wheel):
+        manager.establish_operation(1)
+        manager.complete_operation(1)
+        assert wheel.schedule.return_value.cancel.call_count == 1
+
+    @pytest.mark.it("Triggers the callback with an OperationTimeoutError when the deadline passes")
+    def test_expires(self, mocker, manager, wheel):
+        cb_mock = mocker.MagicMock()
+        manager.establish_operation(1, cb_mock)
+        self.fire_timer(wheel)
+
+        assert cb_mock.call_count == 1
+        assert isinstance(cb_mock.call_args[1]["error"], OperationTimeoutError)
+        assert manager.pending_count == 0
+        assert manager.expired_count == 1
+
+    @pytest.mark.it(
+        "Does not trigger the callback again if the response arrives after the deadline"
+    )
+    def test_late_response(self, mocker, manager, wheel):
+        cb_mock = mocker.MagicMock()
+        manager.establish_operation(1, cb_mock)
+        self.fire_timer(wheel)
+        manager.complete_operation(1)
+        assert cb_mock.call_count == 1
+
+    @pytest.mark.it(
+        "Does not complete a later operation which reuses the MID with the late response of an expired one"
+    )
+    def test_late_response_mid_reused(self, mocker, manager, wheel):
+        manager.establish_operation(1, mocker.MagicMock())
+        self.fire_timer(wheel)
+        manager.complete_operation(1)
+        assert manager.orphaned_count == 0
+
+        cb_mock = mocker.MagicMock()
+        manager.establish_operation(1, cb_mock)
+        assert cb_mock.call_count == 0
+        manager.complete_operation(1)
+        assert cb_mock.call_count == 1
+
+    @pytest.mark.it(
+        "Completes a later operation which reuses the MID of an expired one with its own response"
+    )
+    def test_mid_reused_before_late_response(self, mocker, manager, wheel):
+        manager.establish_operation(1, mocker.MagicMock())
+        self.fire_timer(wheel)
+
+        cb_mock = mocker.MagicMock()
+        manager.establish_operation(1, cb_mock)
+        manager.complete_operation(1)
+        assert cb_mock.call_count == 1
+        assert cb_mock.call_args == mocker.call()
+
+    @pytest.mark.it("Recovers from Exception thrown in callback")
+    def test_callback_raises_exception(self, mocker, manager, wheel):
+        cb_mock = mocker.MagicMock(side_effect=DummyException)
+        manager.establish_operation(1, cb_mock)
+        self.fire_timer(wheel)
+        assert cb_mock.call_count == 1
+
+    @pytest.mark.it("Counts pending operations")
+    def test_pending_count(self, manager):
+        manager.establish_operation(1)
+        manager.establish_operation(2)
+        assert manager.pending_count == 2
+        manager.complete_operation(1)
+        assert manager.pending_count == 1
+
+
+@pytest.mark.describe("OperationManager - Unknown completions")
+class TestOperationManagerUnknownCompletions(object):
+    @pytest.fixture
+    def wheel(self, mocker):
+        return mocker.MagicMock()
+
+    @pytest.mark.it("Counts the unknown completions which are being remembered")
+    def test_orphaned_count(self, wheel):
+        manager = OperationManager(timer_wheel=wheel)
+        manager.complete_operation(1)
+        manager.complete_operation(2)
+        assert manager.orphaned_count == 2
+        manager.establish_operation(1)
+        assert manager.orphaned_count == 1
+
+    @pytest.mark.it("Forgets the oldest unknown completion when max_unknown_completions is reached")
+    def test_bounded(self, mocker, wheel):
+        manager = OperationManager(max_unknown_completions=2, timer_wheel=wheel)
+        for mid in (1, 2, 3):
+            manager.complete_operation(mid)
+        assert list(manager._unknown_operation_completions) == [2, 3]
+
+        # The completion of MID 1 was forgotten, so the operation is pending
+        cb_mock = mocker.MagicMock()
+        manager.establish_operation(1, cb_mock)
+        assert cb_mock.call_count == 0
+
+    @pytest.mark.it("Forgets an unknown completion after UNKNOWN_COMPLETION_TIMEOUT seconds")
+    def test_expires(self, wheel):
+        manager = OperationManager(timer_wheel=wheel)
+        manager.complete_operation(1)
+        assert wheel.schedule.call_args[0][0] == mqtt_transport.UNKNOWN_COMPLETION_TIMEOUT
+
+        wheel.schedule.call_args[0][1]()
+        assert manager.orphaned_count == 0
+
+    @pytest.mark.it("Cancels the timer of an unknown completion when its operation is established")
+    def test_cancels_timer(self, wheel):
+        manager = OperationManager(timer_wheel=wheel)
+        manager.complete_operation(1)
+        manager.establish_operation(1)
+        assert wheel.schedule.return_value.cancel.call_count == 1
+
+
+@pytest.mark.describe("TLSSessionResumption")
+class TestTLSSessionResumption(object):
+    @pytest.fixture
+    def ssl_context(self, mocker):
+        return mocker.MagicMock()
+
+    @pytest.fixture
+    def make_ssl_socket(self, mocker, ssl_context):
+        def make(reused=False):
+            sock = mocker.MagicMock(spec=ssl.SSLSocket)
+            sock.session = mocker.MagicMock()
+            sock.session_reused = reused
+            sock.context = ssl_context
+            return sock
+
+        return make
+
+    @pytest.mark.it("Does not offer a session before a connection has completed")
+    def test_no_session(self, mocker, ssl_context):
+        tls_session = TLSSessionResumption()
+        tls_session.wrap_context(ssl_context).wrap_socket("fake socket")
+        assert ssl_context.wrap_socket.call_args == mocker.call("fake socket")
+
+    @pytest.mark.it("Offers the session of the previous connection when wrapping a new socket")
+    def test_offers_session(self, mocker, ssl_context, make_ssl_socket):
+        tls_session = TLSSessionResumption()
+        sock = make_ssl_socket()
+        tls_session.on_handshake_complete(sock)
+        tls_session.wrap_context(ssl_context).wrap_socket("fake socket")
+        assert ssl_context.wrap_socket.call_args == mocker.call("fake socket", session=sock.session)
+
+    @pytest.mark.it("Does not offer a session which was created by a different SSL context")
+    def test_different_context(self, mocker, ssl_context, make_ssl_socket):
+        tls_session = TLSSessionResumption()
+        tls_session.on_handshake_complete(make_ssl_socket())
+        other_context = mocker.MagicMock()
+        tls_session.wrap_context(other_context).wrap_socket("fake socket")
+        assert other_context.wrap_socket.call_args == mocker.call("fake socket")
+
+    @pytest.mark.it("Counts a hit when an offered session is resumed")
+    def test_hit(self, ssl_context, make_ssl_socket):
+        tls_session = TLSSessionResumption()
+        tls_session.on_handshake_complete(make_ssl_socket())
+        tls_session.wrap_context(ssl_context).wrap_socket("fake socket")
+        tls_session.on_handshake_complete(make_ssl_socket(reused=True))
+        assert tls_session.hits == 1
+        assert tls_session.misses == 0
+
+    @pytest.mark.it("Counts a miss when an offered session is not resumed")
+    def test_miss(self, ssl_context, make_ssl_socket):
+        tls_session = TLSSessionResumption()
+        tls_session.on_handshake_complete(make_ssl_socket())
+        tls_session.wrap_context(ssl_context).wrap_socket("fake socket")
+        tls_session.on_handshake_complete(make_ssl_socket(reused=False))
+        assert tls_session.hits == 0
+        assert tls_session.misses == 1
+
+    @pytest.mark.it("Does not count connections where no session was offered")
+    def test_first_connection(self, make_ssl_socket):
+        tls_session = TLSSessionResumption()
+        tls_session.on_handshake_complete(make_ssl_socket())
+        assert tls_session.hits == 0
+        assert tls_session.misses == 0
+
+    @pytest.mark.it("Passes other SSL context attributes through to the real context")
+    def test_passes_through(self, ssl_context):
+        context = TLSSessionResumption().wrap_context(ssl_context)
+        context.check_hostname = False
+        assert ssl_context.check_hostname is False
+        assert context.verify_mode is ssl_context.verify_mode
@@ -0,0 +1,199 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import os
+import pytest
+from azure.iot.device.common.outbox import Outbox, OutboxFullError, DROP_OLDEST, DROP_NEWEST
+
+segment_size = 100
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join("outbox"))
+
+
+@pytest.fixture
+def outbox(path):
+    return Outbox(path, max_size=1000, segment_size=segment_size)
+
+
+def make_records(count):
+    return ["record {}".format(i).encode("utf-8") for i in range(count)]
+
+
+def read_all(outbox):
+    records = []
+    while True:
+        next_record = outbox.read()
+        if next_record is None:
+            return records
+        records.append(next_record)
+
+
+def segment_files(path):
+    return [f for f in os.listdir(path) if f.endswith(".log")]
+
+
+@pytest.mark.describe("Outbox - Instantiation")
+class TestOutboxInstantiation(object):
+    @pytest.mark.it("Creates the directory if it does not exist")
+    def test_creates_directory(self, path):
+        Outbox(path, max_size=1000)
+        assert os.path.isdir(path)
+
+    @pytest.mark.it("Is empty if the directory does not contain an outbox")
+    def test_empty(self, outbox):
+        assert len(outbox) == 0
+        assert outbox.size == 0
+        assert outbox.read() is None
+
+    @pytest.mark.it("Raises a ValueError if eviction_policy is invalid")
+    def test_invalid_eviction_policy(self, path):
+        with pytest.raises(ValueError):
+            Outbox(path, max_size=1000, eviction_policy="drop_everything")
+
+    @pytest.mark.it("Contains the records which were not committed before it was closed")
+    def test_reopen(self, path, outbox):
+        records = make_records(20)
+        for record in records:
+            outbox.append(record)
+        position = read_all(outbox)[4][0]
+        outbox.commit(position)
+        outbox.close()
+
+        reopened = Outbox(path, max_size=1000, segment_size=segment_size)
+        assert len(reopened) == 15
+        assert reopened.size == outbox.size
+        assert [record for _, record in read_all(reopened)] == records[5:]
+
+    @pytest.mark.it("Discards a partially written record at the end of the outbox")
+    def test_partial_record(self, path, outbox):
+        records = make_records(2)
+        for record in records:
+            outbox.append(record)
+        outbox.close()
+        segment_path = os.path.join(path, segment_files(path)[0])
+        with open(segment_path, "r+b") as f:
+            f.truncate(os.path.getsize(segment_path) - 3)
+
+        reopened = Outbox(path, max_size=1000, segment_size=segment_size)
+        assert len(reopened) == 1
+        assert [record for _, record in read_all(reopened)] == records[:1]
+
+        # New records are written after the last complete one
+        reopened.append(b"new record")
+        reopened.rewind()
+        assert [record for _, record in read_all(reopened)] == [records[0], b"new record"]
+
+
+@pytest.mark.describe("Outbox - .append()")
+class TestOutboxAppend(object):
+    @pytest.mark.it("Adds the record to the tail of the outbox")
+    def test_append(self, outbox):
+        records = make_records(3)
+        for record in records:
+            outbox.append(record)
+        assert len(outbox) == 3
+        assert [record for _, record in read_all(outbox)] == records
+
+    @pytest.mark.it("Starts a new segment file once the active segment reaches segment_size")
+    def test_segments(self, path, outbox):
+        for record in make_records(20):
+            outbox.append(record)
+        assert len(segment_files(path)) > 1
+
+    @pytest.mark.it(
+        "Drops the oldest records to make room for a new record if the outbox is full and eviction_policy is DROP_OLDEST"
+    )
+    def test_drop_oldest(self, path):
+        outbox = Outbox(path, max_size=100, eviction_policy=DROP_OLDEST, segment_size=40)
+        records = make_records(10)
+        evicted = [outbox.append(record) for record in records]
+        assert outbox.size <= 100
+        assert sum(evicted) == 10 - len(outbox)
+        assert [record for _, record in read_all(outbox)] == records[-len(outbox) :]
+
+    @pytest.mark.it(
+        "Raises an OutboxFullError if the outbox is full and eviction_policy is DROP_NEWEST"
+    )
+    def test_drop_newest(self, path):
+        outbox = Outbox(path, max_size=100, eviction_policy=DROP_NEWEST)
+        records = make_records(10)
+        with pytest.raises(OutboxFullError):
+            for record in records:
+                outbox.append(record)
+        assert [record for _, record in read_all(outbox)] == records[: len(outbox)]
+
+    @pytest.mark.it("Raises an OutboxFullError if the record is larger than the outbox")
+    def test_record_too_large(self, outbox):
+        with pytest.raises(OutboxFullError):
+            outbox.append(b"x" * 1000)
+        assert len(outbox) == 0
+
+
+@pytest.mark.describe("Outbox - .read()")
+class TestOutboxRead(object):
+    @pytest.mark.it("Does not remove the record from the outbox")
+    def test_does_not_remove(self, outbox):
+        outbox.append(b"record")
+        outbox.read()
+        assert len(outbox) == 1
+
+    @pytest.mark.it("Returns None once every record has been read")
+    def test_end(self, outbox):
+        outbox.append(b"record")
+        outbox.read()
+        assert outbox.read() is None
+
+        # Records appended later can be read
+        outbox.append(b"another record")
+        assert outbox.read()[1] == b"another record"
+
+
+@pytest.mark.describe("Outbox - .rewind()")
+class TestOutboxRewind(object):
+    @pytest.mark.it("Makes reading start again from the oldest uncommitted record")
+    def test_rewind(self, outbox):
+        records = make_records(20)
+        for record in records:
+            outbox.append(record)
+        outbox.commit(read_all(outbox)[1][0])
+        outbox.rewind()
+        assert [record for _, record in read_all(outbox)] == records[2:]
+
+
+@pytest.mark.describe("Outbox - .commit()")
+class TestOutboxCommit(object):
+    @pytest.mark.it("Removes every record up to and including the given position")
+    def test_commit(self, outbox):
+        records = make_records(20)
+        for record in records:
+            outbox.append(record)
+        size = outbox.size
+        positions = [position for position, _ in read_all(outbox)]
+
+        outbox.commit(positions[9])
+        assert len(outbox) == 10
+        assert outbox.size < size
+        outbox.commit(positions[19])
+        assert len(outbox) == 0
+        assert outbox.size == 0
+
+    @pytest.mark.it("Ignores positions which have already been committed")
+    def test_commit_twice(self, outbox):
+        for record in make_records(3):
+            outbox.append(record)
+        positions = [position for position, _ in read_all(outbox)]
+        outbox.commit(positions[1])
+        outbox.commit(positions[0])
+        assert len(outbox) == 1
+
+    @pytest.mark.it("Deletes segment files once all of their records are committed")
+    def test_deletes_segments(self, path, outbox):
+        for record in make_records(20):
+            outbox.append(record)
+        outbox.commit(read_all(outbox)[-1][0])
+        assert len(segment_files(path)) == 1
@@ -0,0 +1,108 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import ssl
+import pytest
+from azure.iot.device.common import ssl_context_cache
+from azure.iot.device.common.models.x509 import X509
+
+fake_ca_cert = "dummy_certificate"
+fake_x509 = X509("fantastic_beasts", "where_to_find_them", "alohomora")
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    ssl_context_cache.clear()
+    yield
+    ssl_context_cache.clear()
+
+
+@pytest.fixture
+def mock_ssl_context_constructor(mocker):
+    # Each call returns a new mock, so that different contexts can be told apart
+    return mocker.patch.object(ssl, "SSLContext", side_effect=lambda **kwargs: mocker.MagicMock())
+
+
+@pytest.mark.describe("ssl_context_cache - .get_ssl_context()")
+class TestGetSSLContext(object):
+    @pytest.mark.it("Creates a TLS 1.2 SSLContext which requires a valid server certificate")
+    def test_creates_context(self, mocker, mock_ssl_context_constructor):
+        ssl_context = ssl_context_cache.get_ssl_context()
+        assert mock_ssl_context_constructor.call_args == mocker.call(protocol=ssl.PROTOCOL_TLSv1_2)
+        assert ssl_context.verify_mode == ssl.CERT_REQUIRED
+        assert ssl_context.check_hostname is True
+
+    @pytest.mark.it("Loads the default certificates if no CA certificate is provided")
+    def test_default_certs(self, mock_ssl_context_constructor):
+        ssl_context = ssl_context_cache.get_ssl_context()
+        assert ssl_context.load_default_certs.call_count == 1
+        assert ssl_context.load_verify_locations.call_count == 0
+
+    @pytest.mark.it("Loads the CA certificate if provided")
+    def test_ca_cert(self, mocker, mock_ssl_context_constructor):
+        ssl_context = ssl_context_cache.get_ssl_context(ca_cert=fake_ca_cert)
+        assert ssl_context.load_verify_locations.call_args == mocker.call(cadata=fake_ca_cert)
+        assert ssl_context.load_default_certs.call_count == 0
+
+    @pytest.mark.it("Loads the client certificate chain if an x509 certificate is provided")
+    def test_x509(self, mocker, mock_ssl_context_constructor):
+        ssl_context = ssl_context_cache.get_ssl_context(x509=fake_x509)
+        assert ssl_context.load_cert_chain.call_args == mocker.call(
+            fake_x509.certificate_file, fake_x509.key_file, fake_x509.pass_phrase
+        )
+
+    @pytest.mark.it("Returns the cached context for the same certificates")
+    def test_cached(self, mock_ssl_context_constructor):
+        ssl_context = ssl_context_cache.get_ssl_context(fake_ca_cert, fake_x509)
+        same_x509 = X509(fake_x509.certificate_file, fake_x509.key_file, fake_x509.pass_phrase)
+        assert ssl_context_cache.get_ssl_context(fake_ca_cert, same_x509) is ssl_context
+        assert mock_ssl_context_constructor.call_count == 1
+
+    @pytest.mark.it("Creates a separate context for different certificates")
+    @pytest.mark.parametrize(
+        "ca_cert, x509",
+        [
+            pytest.param("other_certificate", fake_x509, id="Different CA certificate"),
+            pytest.param(fake_ca_cert, None, id="No x509 certificate"),
+            pytest.param(
+                fake_ca_cert,
+                X509("other_cert", fake_x509.key_file),
+                id="Different x509 certificate",
+            ),
+        ],
+    )
+    def test_not_cached(self, mock_ssl_context_constructor, ca_cert, x509):
+        ssl_context = ssl_context_cache.get_ssl_context(fake_ca_cert, fake_x509)
+        assert ssl_context_cache.get_ssl_context(ca_cert, x509) is not ssl_context
+        assert mock_ssl_context_constructor.call_count == 2
+
+
+@pytest.mark.describe("ssl_context_cache - .invalidate()")
+class TestInvalidate(object):
+    @pytest.mark.it("Makes the next call for the same certificates create a new context")
+    def test_invalidates(self, mock_ssl_context_constructor):
+        ssl_context = ssl_context_cache.get_ssl_context(fake_ca_cert, fake_x509)
+        ssl_context_cache.invalidate(fake_ca_cert, fake_x509)
+        assert ssl_context_cache.get_ssl_context(fake_ca_cert, fake_x509) is not ssl_context
+
+    @pytest.mark.it("Leaves contexts for other certificates in the cache")
+    def test_leaves_others(self, mock_ssl_context_constructor):
+        ssl_context = ssl_context_cache.get_ssl_context()
+        ssl_context_cache.get_ssl_context(fake_ca_cert, fake_x509)
+        ssl_context_cache.invalidate(fake_ca_cert, fake_x509)
+        assert ssl_context_cache.get_ssl_context() is ssl_context
+
+    @pytest.mark.it("Does nothing if there is no context for the certificates")
+    def test_not_cached(self):
+        ssl_context_cache.invalidate(fake_ca_cert, fake_x509)
+
+
+@pytest.mark.describe("ssl_context_cache - .clear()")
+class TestClear(object):
+    @pytest.mark.it("Removes every context from the cache")
+    def test_clears(self, mock_ssl_context_constructor):
+        ssl_context = ssl_context_cache.get_ssl_context()
+        ssl_context_cache.clear()
+        assert ssl_context_cache.get_ssl_context() is not ssl_context
@@ -0,0 +1,162 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import threading
+import time
+import pytest
+from azure.iot.device.common import timer_wheel
+from azure.iot.device.common.timer_wheel import TimerWheel
+
+# Long enough for the wheel thread to react, short enough to not slow the tests down
+wait_timeout = 5
+tick = 0.01
+
+
+@pytest.fixture
+def wheel():
+    wheel = TimerWheel(tick=tick, slot_count=8, name="wheel under test")
+    yield wheel
+    wheel.stop()
+
+
+@pytest.mark.describe("get_shared_timer_wheel()")
+class TestGetSharedTimerWheel(object):
+    @pytest.mark.it("Returns the same TimerWheel every time")
+    def test_same_wheel(self):
+        wheel = timer_wheel.get_shared_timer_wheel()
+        assert isinstance(wheel, TimerWheel)
+        assert timer_wheel.get_shared_timer_wheel() is wheel
+
+
+@pytest.mark.describe("TimerWheel - Instantiation")
+class TestTimerWheelInstantiation(object):
+    @pytest.mark.it("Raises ValueError if tick is not a positive number")
+    @pytest.mark.parametrize("value", [0, -0.5])
+    def test_invalid_tick(self, value):
+        with pytest.raises(ValueError):
+            TimerWheel(tick=value)
+
+    @pytest.mark.it("Raises ValueError if slot_count is not a positive integer")
+    @pytest.mark.parametrize("value", [0, -1])
+    def test_invalid_slot_count(self, value):
+        with pytest.raises(ValueError):
+            TimerWheel(slot_count=value)
+
+    @pytest.mark.it("Does not start a thread until a timer is scheduled")
+    def test_no_thread(self):
+        TimerWheel(name="idle wheel")
+        assert not any(t.name == "idle wheel" for t in threading.enumerate())
+
+
+@pytest.mark.describe("TimerWheel - .schedule()")
+class TestTimerWheelSchedule(object):
+    @pytest.mark.it("Calls the callback once the delay has passed")
+    def test_fires(self, wheel):
+        fired = threading.Event()
+        start = time.time()
+        wheel.schedule(0.05, fired.set)
+        assert fired.wait(wait_timeout)
+        assert time.time() - start >= 0.05
+        assert wheel.timer_count == 0
+
+    @pytest.mark.it("Calls the callbacks of timers which are due after more than one lap")
+    def test_multiple_laps(self, wheel):
+        fired = threading.Event()
+        start = time.time()
+        # 8 slots of 0.01 seconds make one lap 0.08 seconds long
+        wheel.schedule(0.2, fired.set)
+        assert fired.wait(wait_timeout)
+        assert time.time() - start >= 0.2
+
+    @pytest.mark.it("Calls the callbacks of many timers from a single thread")
+    def test_many_timers(self, wheel):
+        threads = set()
+        done = threading.Event()
+        remaining = [100]
+        lock = threading.Lock()
+
+        def callback():
+            threads.add(threading.current_thread())
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    done.set()
+
+        for i in range(100):
+            wheel.schedule(0.001 * i, callback)
+        assert done.wait(wait_timeout)
+        assert len(threads) == 1
+
+    @pytest.mark.it("Keeps calling other callbacks if a callback raises an exception")
+    def test_callback_raises_exception(self, wheel):
+        fired = threading.Event()
+
+        def bad_callback():
+            raise RuntimeError("boom")
+
+        wheel.schedule(0, bad_callback)
+        wheel.schedule(0.02, fired.set)
+        assert fired.wait(wait_timeout)
+
+    @pytest.mark.it("Wakes up an idle wheel")
+    def test_wakes_up(self, wheel):
+        first = threading.Event()
+        second = threading.Event()
+        wheel.schedule(0, first.set)
+        assert first.wait(wait_timeout)
+        time.sleep(0.05)
+        wheel.schedule(0, second.set)
+        assert second.wait(wait_timeout)
+
+    @pytest.mark.it("Sleeps until the earliest timer is due rather than waking up every tick")
+    def test_sleeps_until_deadline(self, mocker, wheel):
+        collect_spy = mocker.spy(wheel, "_collect_due_timers")
+        wheel.schedule(60, mocker.MagicMock())
+        # Polling every tick would look at the slots 20 times
+        time.sleep(20 * tick)
+        assert collect_spy.call_count == 0
+
+    @pytest.mark.it("Wakes up for a timer which is due before the timers already scheduled")
+    def test_earlier_timer(self, wheel):
+        fired = threading.Event()
+        wheel.schedule(60, fired.set)
+        wheel.schedule(0.02, fired.set)
+        assert fired.wait(wait_timeout)
+
+
+@pytest.mark.describe("Timer - .cancel()")
+class TestTimerCancel(object):
+    @pytest.mark.it("Keeps the callback from being called")
+    def test_cancel(self, wheel):
+        cancelled = threading.Event()
+        fired = threading.Event()
+        timer = wheel.schedule(0.02, cancelled.set)
+        wheel.schedule(0.05, fired.set)
+        timer.cancel()
+        assert wheel.timer_count == 1
+        assert fired.wait(wait_timeout)
+        assert not cancelled.is_set()
+
+    @pytest.mark.it("Does nothing if the timer already fired")
+    def test_cancel_after_fired(self, wheel):
+        fired = threading.Event()
+        timer = wheel.schedule(0, fired.set)
+        assert fired.wait(wait_timeout)
+        timer.cancel()
+        assert wheel.timer_count == 0
+
+
+@pytest.mark.describe("TimerWheel - .stop()")
+class TestTimerWheelStop(object):
+    @pytest.mark.it("Stops the thread of the wheel and drops the timers which have not fired")
+    def test_stops_thread(self):
+        wheel = TimerWheel(tick=tick, name="stopping wheel")
+        fired = threading.Event()
+        wheel.schedule(0.05, fired.set)
+        assert any(t.name == "stopping wheel" for t in threading.enumerate())
+        wheel.stop()
+        assert not any(t.name == "stopping wheel" for t in threading.enumerate())
+        assert wheel.timer_count == 0
+        assert not fired.wait(0.1)
@@ -4,6 +4,7 @@
 # license information.
 # --------------------------------------------------------------------------
 
+import json
 import logging
 import pytest
 import asyncio
@@ -12,7 +13,7 @@ import time
 import os
 import io
 from azure.iot.device.iothub.aio import IoTHubDeviceClient, IoTHubModuleClient
-from azure.iot.device.iothub.pipeline import IoTHubPipeline, constant
+from azure.iot.device.iothub.pipeline import IoTHubPipeline, IoTHubPipelineConfig, constant
 from azure.iot.device.iothub.models import Message, MethodRequest
 from azure.iot.device.iothub.aio.async_inbox import AsyncClientInbox
 from azure.iot.device.common import async_adapter
@@ -39,6 +40,10 @@ class SharedClientInstantiationTests(object):
         assert client._pipeline.on_disconnected is not None
         assert client._pipeline.on_disconnected == client._on_disconnected
 
+    @pytest.mark.it("Sets on_reconnect_attempt handler in pipeline")
+    async def test_sets_on_reconnect_attempt_handler_in_pipeline(self, client):
+        assert client._pipeline.on_reconnect_attempt == client._on_reconnect_attempt
+
     @pytest.mark.it("Sets on_method_request_eeceived handler in pipeline")
     async def test_sets_on_method_request_received_handler_in_pipleline(self, client):
         assert client._pipeline.on_method_request_received is not None
@@ -90,7 +95,8 @@ class SharedClientCreateFromConnectionStringTests(object):
         assert mock_auth_parse.call_args == mocker.call(mock_conn_str)
         assert mock_auth_parse.return_value.ca_cert is trusted_cert_chain
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth_parse.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth_parse.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
     # TODO: If auth package was refactored to use ConnectionString class, tests from that
@@ -134,7 +140,8 @@ class SharedClientFromCreateFromSharedAccessSignature(object):
 
         assert mock_auth_parse.call_count == 1
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth_parse.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth_parse.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
     # TODO: If auth package was refactored to use SasToken class, tests from that
@@ -172,6 +179,41 @@ class SharedClientConnectTests(object):
         # Assert callback completion is waited upon
         assert cb_mock.completion.call_count == 1
 
+    @pytest.mark.it("Raises the error if the 'connect' pipeline operation fails")
+    async def test_raises_error(self, client, pipeline):
+        error = Exception()
+        pipeline.connect.side_effect = lambda callback: callback(error=error)
+        with pytest.raises(Exception) as e_info:
+            await client.connect()
+        assert e_info.value is error
+
+    @pytest.mark.it(
+        "Calls into the pipeline on the event loop thread if the pipeline runs on the running event loop"
+    )
+    async def test_calls_pipeline_on_event_loop(self, client, pipeline):
+        pipeline.pipeline_configuration.event_loop = asyncio.get_event_loop()
+        threads = []
+
+        def connect(callback):
+            threads.append(threading.current_thread())
+            callback()
+
+        pipeline.connect.side_effect = connect
+        await client.connect()
+        assert threads == [threading.current_thread()]
+
+    @pytest.mark.it("Calls into the pipeline on a worker thread otherwise")
+    async def test_calls_pipeline_on_worker_thread(self, client, pipeline):
+        threads = []
+
+        def connect(callback):
+            threads.append(threading.current_thread())
+            callback()
+
+        pipeline.connect.side_effect = connect
+        await client.connect()
+        assert threads[0] is not threading.current_thread()
+
 
 class SharedClientDisconnectTests(object):
     @pytest.mark.it("Begins a 'disconnect' pipeline operation")
@@ -204,6 +246,16 @@ class SharedClientDisconnectEventTests(object):
         assert clear_method_request_spy.call_count == 1
 
 
+class SharedClientReconnectAttemptEventTests(object):
+    @pytest.mark.it("Calls the on_reconnect_attempt handler of the client, if there is one")
+    async def test_calls_handler(self, client, mocker):
+        client._on_reconnect_attempt(1, None, None)
+        client.on_reconnect_attempt = mocker.MagicMock()
+        error = Exception()
+        client._on_reconnect_attempt(2, error, 4.0)
+        assert client.on_reconnect_attempt.call_args == mocker.call(2, error, 4.0)
+
+
 # TODO: rename
 class SharedClientSendEventTests(object):
     @pytest.mark.it("Begins a 'send_d2c_message' pipeline operation")
@@ -226,6 +278,39 @@ class SharedClientSendEventTests(object):
         # Assert callback completion is waited upon
         assert cb_mock.completion.call_count == 1
 
+    @pytest.mark.it("Raises the error if the 'send_d2c_message' pipeline operation fails")
+    async def test_raises_error(self, client, pipeline, message):
+        error = Exception()
+        pipeline.send_d2c_message.side_effect = lambda message, callback: callback(error=error)
+        with pytest.raises(Exception) as e_info:
+            await client.send_d2c_message(message)
+        assert e_info.value is error
+
+    @pytest.mark.it(
+        "Calls into the pipeline on the event loop thread if the pipeline runs on the running event loop and its in-flight window is not full"
+    )
+    @pytest.mark.parametrize(
+        "window_full, on_event_loop",
+        [
+            pytest.param(False, True, id="Window not full"),
+            pytest.param(True, False, id="Window full"),
+        ],
+    )
+    async def test_calls_pipeline_on_event_loop(
+        self, client, pipeline, message, window_full, on_event_loop
+    ):
+        pipeline.pipeline_configuration.event_loop = asyncio.get_event_loop()
+        pipeline.inflight_window_full = window_full
+        threads = []
+
+        def send_d2c_message(message, callback):
+            threads.append(threading.current_thread())
+            callback()
+
+        pipeline.send_d2c_message.side_effect = send_d2c_message
+        await client.send_d2c_message(message)
+        assert (threads[0] is threading.current_thread()) == on_event_loop
+
     @pytest.mark.it(
         "Wraps 'message' input parameter in a Message object if it is not a Message object"
     )
@@ -250,6 +335,134 @@ class SharedClientSendEventTests(object):
         assert sent_message.data == message_input
 
 
+class SharedClientSendEventBatchTests(object):
+    @pytest.mark.it("Begins a single 'send_d2c_messages' pipeline operation for all the messages")
+    async def test_calls_pipeline_send_d2c_messages(self, client, pipeline):
+        messages = [Message("message 1"), Message("message 2"), Message("message 3")]
+        await client.send_d2c_messages(messages)
+        assert pipeline.send_d2c_messages.call_count == 1
+        assert pipeline.send_d2c_messages.call_args[0][0] == messages
+        assert pipeline.send_d2c_message.call_count == 0
+
+    @pytest.mark.it(
+        "Waits for the completion of the 'send_d2c_messages' pipeline operation before returning"
+    )
+    async def test_waits_for_pipeline_op_completion(self, mocker, client, pipeline):
+        cb_mock = mocker.patch.object(async_adapter, "AwaitableCallback").return_value
+        cb_mock.completion.return_value = await create_completed_future([None])
+
+        await client.send_d2c_messages([Message("message")])
+
+        # Assert callback is sent to pipeline
+        assert pipeline.send_d2c_messages.call_args[1]["callback"] is cb_mock
+        # Assert callback completion is waited upon
+        assert cb_mock.completion.call_count == 1
+
+    @pytest.mark.it("Returns the per-message results of the 'send_d2c_messages' pipeline operation")
+    async def test_returns_results(self, client, pipeline):
+        error = Exception()
+
+        def fake_send_d2c_messages(messages, callback):
+            callback([None, error])
+
+        pipeline.send_d2c_messages.side_effect = fake_send_d2c_messages
+        results = await client.send_d2c_messages([Message("message 1"), Message("message 2")])
+        assert results == [None, error]
+
+    @pytest.mark.it(
+        "Does not block the event loop if the pipeline runs on it and the batch is larger than the in-flight window"
+    )
+    async def test_batch_larger_than_window_on_event_loop(self, client, pipeline):
+        loop = asyncio.get_event_loop()
+        pipeline.pipeline_configuration.event_loop = loop
+        pipeline.inflight_window_full = False
+        max_inflight_messages = 2
+        window = threading.BoundedSemaphore(max_inflight_messages)
+
+        def fake_send_d2c_messages(messages, callback):
+            for _ in messages:
+                # Waiting forever would hang the test if this blocked the event loop
+                assert window.acquire(timeout=2)
+                # Acknowledgements are received on the event loop
+                loop.call_soon_threadsafe(window.release)
+            loop.call_soon_threadsafe(callback, [None] * len(messages))
+
+        pipeline.send_d2c_messages.side_effect = fake_send_d2c_messages
+        messages = [Message("message {}".format(i)) for i in range(max_inflight_messages * 3)]
+        results = await client.send_d2c_messages(messages)
+        assert results == [None] * len(messages)
+
+    @pytest.mark.it(
+        "Wraps each item in the 'messages' input parameter in a Message object if it is not a Message object"
+    )
+    async def test_wraps_data_in_message(self, client, pipeline):
+        message = Message("message")
+        await client.send_d2c_messages([message, "string", 222, {"a": 2}])
+        sent_messages = pipeline.send_d2c_messages.call_args[0][0]
+        assert sent_messages[0] is message
+        for sent_message in sent_messages:
+            assert isinstance(sent_message, Message)
+        assert [m.data for m in sent_messages[1:]] == ["string", 222, {"a": 2}]
+
+
+class SharedClientSendEventNowaitTests(object):
+    @pytest.mark.it("Begins a 'send_d2c_message' pipeline operation")
+    async def test_calls_pipeline_send_d2c_message(self, client, pipeline, message):
+        await client.send_d2c_message_nowait(message)
+        assert pipeline.send_d2c_message.call_count == 1
+        assert pipeline.send_d2c_message.call_args[0][0] is message
+
+    @pytest.mark.it(
+        "Returns a Future without waiting for the completion of the 'send_d2c_message' pipeline operation"
+    )
+    async def test_returns_future(self, mocker, client, pipeline, message):
+        # Replace the pipeline function with one that never completes
+        mocker.patch.object(pipeline, "send_d2c_message")
+
+        future = await client.send_d2c_message_nowait(message)
+
+        assert isinstance(future, asyncio.Future)
+        assert not future.done()
+
+    @pytest.mark.it(
+        "Completes the returned Future upon completion of the 'send_d2c_message' pipeline operation"
+    )
+    async def test_completes_future(self, client, pipeline, message):
+        future = await client.send_d2c_message_nowait(message)
+        result = await future
+        assert future.done()
+        assert result is None
+
+    @pytest.mark.it(
+        "Completes the returned Future with the error if the 'send_d2c_message' pipeline operation fails"
+    )
+    async def test_fails_future(self, client, pipeline, message):
+        error = Exception()
+        pipeline.send_d2c_message.side_effect = lambda message, callback: callback(error=error)
+        future = await client.send_d2c_message_nowait(message)
+        with pytest.raises(Exception) as e_info:
+            await future
+        assert e_info.value is error
+
+    @pytest.mark.it(
+        "Wraps 'message' input parameter in a Message object if it is not a Message object"
+    )
+    @pytest.mark.parametrize(
+        "message_input",
+        [
+            pytest.param("message", id="String input"),
+            pytest.param(222, id="Integer input"),
+            pytest.param(None, id="None input"),
+            pytest.param({"a": 2}, id="Dictionary input"),
+        ],
+    )
+    async def test_wraps_data_in_message(self, client, pipeline, message_input):
+        await client.send_d2c_message_nowait(message_input)
+        sent_message = pipeline.send_d2c_message.call_args[0][0]
+        assert isinstance(sent_message, Message)
+        assert sent_message.data == message_input
+
+
 class SharedClientReceiveMethodRequestTests(object):
     @pytest.mark.it("Implicitly enables methods feature if not already enabled")
     @pytest.mark.parametrize(
@@ -354,7 +567,7 @@ class SharedClientGetTwinTests(object):
     async def test_enables_twin_only_if_not_already_enabled(self, mocker, client, pipeline):
         # patch this so get_twin won't block
         def immediate_callback(callback):
-            callback(None)
+            callback(b"{}")
 
         mocker.patch.object(pipeline, "get_twin", side_effect=immediate_callback)
 
@@ -380,10 +593,18 @@ class SharedClientGetTwinTests(object):
         "Waits for the completion of the 'get_twin' pipeline operation before returning"
     )
     async def test_waits_for_pipeline_op_completion(self, mocker, client, pipeline):
-        cb_mock = mocker.patch.object(async_adapter, "AwaitableCallback").return_value
+        cb_init_mock = mocker.patch.object(async_adapter, "AwaitableCallback")
+        cb_mock = cb_init_mock.return_value
         cb_mock.completion.return_value = await create_completed_future(None)
         pipeline.feature_enabled.__getitem__.return_value = True  # twin will appear enabled
 
+        # The twin is decoded once the callback has been waited upon, so it has to be there
+        def make_callback(sync_callback):
+            sync_callback(b"{}")
+            return cb_mock
+
+        cb_init_mock.side_effect = make_callback
+
         await client.get_twin()
 
         # Assert callback is sent to pipeline
@@ -391,13 +612,13 @@ class SharedClientGetTwinTests(object):
         # Assert callback completion is waited upon
         assert cb_mock.completion.call_count == 1
 
-    @pytest.mark.it("Returns the twin that the pipeline returned")
+    @pytest.mark.it("Returns the twin that the pipeline returned, after decoding it")
     async def test_verifies_twin_returned(self, mocker, client, pipeline):
         twin = {"reported": {"foo": "bar"}}
 
         # make the pipeline the twin
         def immediate_callback(callback):
-            callback(twin)
+            callback(json.dumps(twin).encode("utf-8"))
 
         mocker.patch.object(pipeline, "get_twin", side_effect=immediate_callback)
 
@@ -457,15 +678,68 @@ class SharedClientPatchTwinReportedPropertiesTests(object):
         assert cb_mock.completion.call_count == 1
 
 
+class SharedClientUpdateReportedPropertiesTests(object):
+    @pytest.mark.it("Implicitly enables twin messaging feature if not already enabled")
+    async def test_enables_twin_only_if_not_already_enabled(
+        self, mocker, client, pipeline, twin_patch_reported
+    ):
+        # Verify twin enabled if not enabled
+        pipeline.feature_enabled.__getitem__.return_value = False  # twin will appear disabled
+        await client.update_reported_properties(twin_patch_reported)
+        assert pipeline.enable_feature.call_count == 1
+        assert pipeline.enable_feature.call_args[0][0] == constant.TWIN
+
+        pipeline.enable_feature.reset_mock()
+
+        # Verify twin not enabled if already enabled
+        pipeline.feature_enabled.__getitem__.return_value = True  # twin will appear enabled
+        await client.update_reported_properties(twin_patch_reported)
+        assert pipeline.enable_feature.call_count == 0
+
+    @pytest.mark.it("Begins an 'update_reported_properties' pipeline operation")
+    async def test_calls_pipeline(self, client, pipeline, twin_patch_reported):
+        await client.update_reported_properties(twin_patch_reported)
+        assert pipeline.update_reported_properties.call_count == 1
+        assert pipeline.update_reported_properties.call_args[1]["full_state"] is twin_patch_reported
+
+    @pytest.mark.it(
+        "Waits for the completion of the 'update_reported_properties' pipeline operation before returning"
+    )
+    async def test_waits_for_pipeline_op_completion(
+        self, mocker, client, pipeline, twin_patch_reported
+    ):
+        cb_mock = mocker.patch.object(async_adapter, "AwaitableCallback").return_value
+        cb_mock.completion.return_value = await create_completed_future(None)
+        pipeline.feature_enabled.__getitem__.return_value = True  # twin will appear enabled
+
+        await client.update_reported_properties(twin_patch_reported)
+
+        # Assert callback is sent to pipeline
+        assert pipeline.update_reported_properties.call_args[1]["callback"] is cb_mock
+        # Assert callback completion is waited upon
+        assert cb_mock.completion.call_count == 1
+
+    @pytest.mark.it("Raises the error if the 'update_reported_properties' pipeline operation fails")
+    async def test_raises_error(self, client, pipeline, twin_patch_reported):
+        error = Exception()
+        pipeline.update_reported_properties.side_effect = lambda full_state, callback: callback(
+            error=error
+        )
+        with pytest.raises(Exception) as e_info:
+            await client.update_reported_properties(twin_patch_reported)
+        assert e_info.value is error
+
+
 class SharedClientReceiveTwinDesiredPropertiesPatchTests(object):
     @pytest.mark.it("Implicitly enables twin patch messaging feature if not already enabled")
     async def test_enables_c2d_messaging_only_if_not_already_enabled(
         self, mocker, client, pipeline
     ):
         # patch this receive_twin_desired_properites_patch won't block
-        mocker.patch.object(
-            AsyncClientInbox, "get", return_value=(await create_completed_future(None))
-        )
+        async def get():
+            return b"{}"
+
+        mocker.patch.object(AsyncClientInbox, "get", side_effect=get)
 
         # Verify twin patches are enabled if not enabled
         pipeline.feature_enabled.__getitem__.return_value = (
@@ -482,10 +756,12 @@ class SharedClientReceiveTwinDesiredPropertiesPatchTests(object):
         await client.receive_twin_desired_properties_patch()
         assert pipeline.enable_feature.call_count == 0
 
-    @pytest.mark.it("Returns a message from the twin patch inbox, if available")
-    async def test_returns_message_from_twin_patch_inbox(self, mocker, client, twin_patch_desired):
+    @pytest.mark.it("Returns a message from the twin patch inbox, after decoding it, if available")
+    async def test_returns_message_from_twin_patch_inbox(
+        self, mocker, client, twin_patch_desired, twin_patch_desired_as_bytes
+    ):
         inbox_mock = mocker.MagicMock(autospec=AsyncClientInbox)
-        inbox_mock.get.return_value = await create_completed_future(twin_patch_desired)
+        inbox_mock.get.return_value = await create_completed_future(twin_patch_desired_as_bytes)
         manager_get_inbox_mock = mocker.patch.object(
             client._inbox_manager, "get_twin_patch_inbox", return_value=inbox_mock
         )
@@ -493,7 +769,7 @@ class SharedClientReceiveTwinDesiredPropertiesPatchTests(object):
         received_patch = await client.receive_twin_desired_properties_patch()
         assert manager_get_inbox_mock.call_count == 1
         assert inbox_mock.get.call_count == 1
-        assert received_patch is twin_patch_desired
+        assert received_patch == twin_patch_desired
 
 
 ################
@@ -567,7 +843,8 @@ class TestIoTHubDeviceClientCreateFromX509Certificate(IoTHubDeviceClientTestsCon
 
         assert mock_auth.call_count == 1
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
 
@@ -588,11 +865,32 @@ class TestIoTHubDeviceClientDisconnectEvent(
     pass
 
 
+@pytest.mark.describe("IoTHubDeviceClient (Asynchronous) - EVENT: Reconnect attempt")
+class TestIoTHubDeviceClientReconnectAttemptEvent(
+    IoTHubDeviceClientTestsConfig, SharedClientReconnectAttemptEventTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubDeviceClient (Asynchronous) - .send_d2c_message()")
 class TestIoTHubDeviceClientSendEvent(IoTHubDeviceClientTestsConfig, SharedClientSendEventTests):
     pass
 
 
+@pytest.mark.describe("IoTHubDeviceClient (Asynchronous) - .send_d2c_message_nowait()")
+class TestIoTHubDeviceClientSendEventNowait(
+    IoTHubDeviceClientTestsConfig, SharedClientSendEventNowaitTests
+):
+    pass
+
+
+@pytest.mark.describe("IoTHubDeviceClient (Asynchronous) - .send_d2c_messages()")
+class TestIoTHubDeviceClientSendEventBatch(
+    IoTHubDeviceClientTestsConfig, SharedClientSendEventBatchTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubDeviceClient (Asynchronous) - .receive_c2d_message()")
 class TestIoTHubDeviceClientReceiveC2DMessage(IoTHubDeviceClientTestsConfig):
     @pytest.mark.it("Implicitly enables C2D messaging feature if not already enabled")
@@ -657,6 +955,13 @@ class TestIoTHubDeviceClientPatchTwinReportedProperties(
     pass
 
 
+@pytest.mark.describe("IoTHubDeviceClient (Asynchronous) - .update_reported_properties()")
+class TestIoTHubDeviceClientUpdateReportedProperties(
+    IoTHubDeviceClientTestsConfig, SharedClientUpdateReportedPropertiesTests
+):
+    pass
+
+
 @pytest.mark.describe(
     "IoTHubDeviceClient (Asynchronous) - .receive_twin_desired_properties_patch()"
 )
@@ -745,7 +1050,8 @@ class TestIoTHubModuleClientCreateFromEdgeEnvironmentWithContainerEnv(
 
         assert mock_auth_init.call_count == 1
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth_init.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth_init.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
     @pytest.mark.it(
@@ -765,7 +1071,8 @@ class TestIoTHubModuleClientCreateFromEdgeEnvironmentWithContainerEnv(
 
         assert mock_auth_init.call_count == 1
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth_init.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth_init.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
     @pytest.mark.it("Raises IoTEdgeError if the environment is missing required variables")
@@ -854,7 +1161,8 @@ class TestIoTHubModuleClientCreateFromEdgeEnvironmentWithDebugEnv(IoTHubModuleCl
         )
         assert mock_auth.ca_cert == expected_cert
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
     @pytest.mark.it(
@@ -879,7 +1187,8 @@ class TestIoTHubModuleClientCreateFromEdgeEnvironmentWithDebugEnv(IoTHubModuleCl
 
         assert mock_auth_init.call_count == 1
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth_init.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth_init.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
     @pytest.mark.it("Raises IoTEdgeError if the environment is missing required variables")
@@ -896,6 +1205,16 @@ class TestIoTHubModuleClientCreateFromEdgeEnvironmentWithDebugEnv(IoTHubModuleCl
         with pytest.raises(IoTEdgeError):
             client_class.create_from_edge_environment()
 
+    @pytest.mark.it("Passes any additional keyword arguments to the pipeline configuration")
+    def test_pipeline_configuration(self, mocker, client_class, connection_string):
+        mock_pipeline_init = mocker.patch("azure.iot.device.iothub.abstract_clients.IoTHubPipeline")
+
+        client_class.create_from_connection_string(connection_string, max_inflight_messages=5)
+
+        config = mock_pipeline_init.call_args[0][1]
+        assert isinstance(config, IoTHubPipelineConfig)
+        assert config.max_inflight_messages == 5
+
     # TODO: If auth package was refactored to use ConnectionString class, tests from that
     # class would increase the coverage here.
     @pytest.mark.it(
@@ -969,7 +1288,8 @@ class TestIoTHubModuleClientCreateFromX509Certificate(IoTHubModuleClientTestsCon
 
         assert mock_auth.call_count == 1
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
 
@@ -990,11 +1310,32 @@ class TestIoTHubModuleClientDisconnectEvent(
     pass
 
 
+@pytest.mark.describe("IoTHubModuleClient (Asynchronous) - EVENT: Reconnect attempt")
+class TestIoTHubModuleClientReconnectAttemptEvent(
+    IoTHubModuleClientTestsConfig, SharedClientReconnectAttemptEventTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubModuleClient (Asynchronous) - .send_d2c_message()")
 class TestIoTHubNModuleClientSendEvent(IoTHubModuleClientTestsConfig, SharedClientSendEventTests):
     pass
 
 
+@pytest.mark.describe("IoTHubModuleClient (Asynchronous) - .send_d2c_message_nowait()")
+class TestIoTHubModuleClientSendEventNowait(
+    IoTHubModuleClientTestsConfig, SharedClientSendEventNowaitTests
+):
+    pass
+
+
+@pytest.mark.describe("IoTHubModuleClient (Asynchronous) - .send_d2c_messages()")
+class TestIoTHubModuleClientSendEventBatch(
+    IoTHubModuleClientTestsConfig, SharedClientSendEventBatchTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubModuleClient (Asynchronous) - .send_to_output()")
 class TestIoTHubModuleClientSendToOutput(IoTHubModuleClientTestsConfig):
     @pytest.mark.it("Begins a 'send_output_event' pipeline operation")
@@ -1020,6 +1361,14 @@ class TestIoTHubModuleClientSendToOutput(IoTHubModuleClientTestsConfig):
         # Assert callback completion is waited upon
         assert cb_mock.completion.call_count == 1
 
+    @pytest.mark.it("Raises the error if the 'send_output_event' pipeline operation fails")
+    async def test_raises_error(self, client, pipeline, message):
+        error = Exception()
+        pipeline.send_output_event.side_effect = lambda message, callback: callback(error=error)
+        with pytest.raises(Exception) as e_info:
+            await client.send_to_output(message, "some_output")
+        assert e_info.value is error
+
     @pytest.mark.it(
         "Wraps 'message' input parameter in Message object if it is not a Message object"
     )
@@ -1116,6 +1465,13 @@ class TestIoTHubModuleClientPatchTwinReportedProperties(
     pass
 
 
+@pytest.mark.describe("IoTHubModuleClient (Asynchronous) - .update_reported_properties()")
+class TestIoTHubModuleClientUpdateReportedProperties(
+    IoTHubModuleClientTestsConfig, SharedClientUpdateReportedPropertiesTests
+):
+    pass
+
+
 @pytest.mark.describe(
     "IoTHubModuleClient (Asynchronous) - .receive_twin_desired_properties_patch()"
 )
@@ -5,7 +5,8 @@
 # --------------------------------------------------------------------------
 import pytest
 from mock import MagicMock, patch
-from threading import Timer
+from azure.iot.device.common import timer_wheel
+from azure.iot.device.iothub.auth import base_renewable_token_authentication_provider
 from azure.iot.device.iothub.auth.base_renewable_token_authentication_provider import (
     BaseRenewableTokenAuthenticationProvider,
     DEFAULT_TOKEN_VALIDITY_PERIOD,
@@ -68,11 +69,9 @@ def fake_get_current_time_function():
 
 @pytest.fixture(scope="function")
 def fake_timer_object():
-    with patch(
-        "azure.iot.device.iothub.auth.base_renewable_token_authentication_provider.Timer",
-        MagicMock(spec=Timer),
-    ) as PatchedTimer:
-        yield PatchedTimer
+    with patch.object(timer_wheel, "get_shared_timer_wheel") as get_shared_timer_wheel:
+        # Scheduling a timer on the wheel takes the same arguments as creating a threading.Timer
+        yield get_shared_timer_wheel.return_value.schedule
 
 
 def test_device_get_current_sas_token_generates_and_returns_new_sas_token(
@@ -162,7 +161,12 @@ def test_update_timer_generates_new_sas_token_and_calls_token_update_callback(
     device_auth_provider.token_update_callback = update_callback
     timer_callback = fake_timer_object.call_args[0][1]
     device_auth_provider._sign.reset_mock()
-    timer_callback()
+    with patch.object(base_renewable_token_authentication_provider.threading, "Thread") as thread:
+        timer_callback()
+        # The update runs on a thread of its own, not on the thread of the timer wheel
+        assert thread.return_value.start.call_count == 1
+        assert update_callback.call_count == 0
+        thread.call_args[1]["target"]()
     update_callback.assert_called_once_with()
     assert device_auth_provider._sign.call_count == 1
 
@@ -4,8 +4,9 @@
 # license information.
 # --------------------------------------------------------------------------
 
+import json
 import pytest
-from azure.iot.device.iothub.pipeline import constant
+from azure.iot.device.iothub.pipeline import constant, IoTHubPipelineConfig
 from azure.iot.device.iothub.models import Message, MethodResponse, MethodRequest
 from azure.iot.device.common.models.x509 import X509
 
@@ -49,6 +50,11 @@ def twin_patch_desired():
     return {"properties": {"desired": {"foo": 1}}}
 
 
+@pytest.fixture
+def twin_patch_desired_as_bytes(twin_patch_desired):
+    return json.dumps(twin_patch_desired).encode("utf-8")
+
+
 @pytest.fixture
 def twin_patch_reported():
     return {"properties": {"reported": {"bar": 2}}}
@@ -167,6 +173,8 @@ def edge_local_debug_environment():
 class FakeIoTHubPipeline:
     def __init__(self):
         self.feature_enabled = {}  # This just has to be here for the spec
+        self.pipeline_configuration = IoTHubPipelineConfig()
+        self.inflight_window_full = False
 
     def connect(self, callback=None):
         callback()
@@ -183,6 +191,9 @@ class FakeIoTHubPipeline:
     def send_d2c_message(self, event, callback=None):
         callback()
 
+    def send_d2c_messages(self, events, callback=None):
+        callback([None for _ in events])
+
     def send_output_event(self, event, callback=None):
         callback()
 
@@ -190,11 +201,14 @@ class FakeIoTHubPipeline:
         callback()
 
     def get_twin(self, callback=None):
-        callback(None)
+        callback(b"{}")
 
     def patch_twin_reported_properties(self, patch, callback=None):
         callback()
 
+    def update_reported_properties(self, full_state, callback=None):
+        callback()
+
 
 @pytest.fixture
 def pipeline(mocker):
@@ -13,6 +13,7 @@ from .client_fixtures import (
     method_response,
     method_request,
     twin_patch_desired,
+    twin_patch_desired_as_bytes,
     twin_patch_reported,
     pipeline,
     pipeline_manual_cb,
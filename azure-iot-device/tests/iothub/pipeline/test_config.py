@@ -0,0 +1,118 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import pytest
+from azure.iot.device.common.pipeline.config import BasePipelineConfig
+from azure.iot.device.iothub.pipeline.config import (
+    IoTHubPipelineConfig,
+    DEFAULT_OUTBOX_MAX_SIZE,
+    DEFAULT_OUTBOX_DRAIN_RATE,
+)
+
+
+@pytest.mark.describe("IoTHubPipelineConfig - Instantiation")
+class TestIoTHubPipelineConfigInstantiation(object):
+    @pytest.mark.it("Is a BasePipelineConfig")
+    def test_base_config(self):
+        assert isinstance(IoTHubPipelineConfig(), BasePipelineConfig)
+
+    @pytest.mark.it("Accepts the options of BasePipelineConfig as keyword arguments")
+    def test_base_options(self):
+        config = IoTHubPipelineConfig(max_inflight_messages=5)
+        assert config.max_inflight_messages == 5
+
+    @pytest.mark.it("Raises a TypeError if given an unknown option")
+    def test_unknown_option(self):
+        with pytest.raises(TypeError):
+            IoTHubPipelineConfig(not_an_option=True)
+
+    @pytest.mark.it("Sets the outbox options to their defaults if not provided")
+    def test_default_outbox_options(self):
+        config = IoTHubPipelineConfig()
+        assert config.outbox_path is None
+        assert config.outbox_max_size == DEFAULT_OUTBOX_MAX_SIZE
+        assert config.outbox_eviction_policy == "drop_oldest"
+        assert config.outbox_drain_rate == DEFAULT_OUTBOX_DRAIN_RATE
+
+    @pytest.mark.it("Sets the outbox options to the provided values")
+    def test_outbox_options(self):
+        config = IoTHubPipelineConfig(
+            outbox_path="/some/path",
+            outbox_max_size=1024,
+            outbox_eviction_policy="drop_newest",
+            outbox_drain_rate=5,
+        )
+        assert config.outbox_path == "/some/path"
+        assert config.outbox_max_size == 1024
+        assert config.outbox_eviction_policy == "drop_newest"
+        assert config.outbox_drain_rate == 5
+
+    @pytest.mark.it("Raises a ValueError if an outbox option is invalid")
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            pytest.param({"outbox_max_size": 0}, id="outbox_max_size"),
+            pytest.param(
+                {"outbox_eviction_policy": "drop_everything"}, id="outbox_eviction_policy"
+            ),
+            pytest.param({"outbox_drain_rate": 0}, id="outbox_drain_rate"),
+        ],
+    )
+    def test_invalid_outbox_options(self, kwargs):
+        with pytest.raises(ValueError):
+            IoTHubPipelineConfig(**kwargs)
+
+    @pytest.mark.it("Sets telemetry_qos to 1 if not provided")
+    def test_default_telemetry_qos(self):
+        config = IoTHubPipelineConfig()
+        assert config.telemetry_qos == 1
+
+    @pytest.mark.it("Sets telemetry_qos to the provided value")
+    def test_telemetry_qos(self):
+        config = IoTHubPipelineConfig(telemetry_qos=0)
+        assert config.telemetry_qos == 0
+
+    @pytest.mark.it("Raises a ValueError if telemetry_qos is not 0 or 1")
+    @pytest.mark.parametrize("value", [-1, 2])
+    def test_invalid_telemetry_qos(self, value):
+        with pytest.raises(ValueError):
+            IoTHubPipelineConfig(telemetry_qos=value)
+
+    @pytest.mark.it("Sets twin_cache to False if not provided")
+    def test_default_twin_cache(self):
+        config = IoTHubPipelineConfig()
+        assert config.twin_cache is False
+
+    @pytest.mark.it("Sets twin_cache to the provided value")
+    def test_twin_cache(self):
+        config = IoTHubPipelineConfig(twin_cache=True)
+        assert config.twin_cache is True
+
+    @pytest.mark.it("Sets reported_properties_coalesce_interval to 0 if not provided")
+    def test_default_coalesce_interval(self):
+        config = IoTHubPipelineConfig()
+        assert config.reported_properties_coalesce_interval == 0
+
+    @pytest.mark.it("Raises ValueError if the coalesce options are invalid")
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            pytest.param({"reported_properties_coalesce_interval": -1}, id="Interval"),
+            pytest.param({"reported_properties_coalesce_max_size": 0}, id="Max size"),
+        ],
+    )
+    def test_invalid_coalesce_options(self, kwargs):
+        with pytest.raises(ValueError):
+            IoTHubPipelineConfig(**kwargs)
+
+    @pytest.mark.it("Sets subscribe_on_connect to an empty list if not provided")
+    def test_default_subscribe_on_connect(self):
+        config = IoTHubPipelineConfig()
+        assert config.subscribe_on_connect == []
+
+    @pytest.mark.it("Raises ValueError if subscribe_on_connect contains an unknown feature")
+    def test_invalid_subscribe_on_connect(self):
+        with pytest.raises(ValueError):
+            IoTHubPipelineConfig(subscribe_on_connect=["twin", "__not_a_feature__"])
@@ -6,11 +6,15 @@
 
 import pytest
 import logging
+import threading
 import six.moves.urllib as urllib
+from azure.iot.device.common import json_codec
 from azure.iot.device.common.pipeline import (
     pipeline_stages_base,
     pipeline_stages_mqtt,
     pipeline_ops_base,
+    pipeline_events_base,
+    pipeline_thread,
 )
 from azure.iot.device.iothub.pipeline import (
     pipeline_stages_iothub,
@@ -19,7 +23,7 @@ from azure.iot.device.iothub.pipeline import (
     pipeline_events_iothub,
 )
 from azure.iot.device.iothub import Message
-from azure.iot.device.iothub.pipeline import IoTHubPipeline, constant
+from azure.iot.device.iothub.pipeline import IoTHubPipeline, IoTHubPipelineConfig, constant
 from azure.iot.device.iothub.auth import (
     SymmetricKeyAuthenticationProvider,
     X509AuthenticationProvider,
@@ -78,6 +82,48 @@ class TestIoTHubPipelineInstantiation(object):
         assert pipeline.on_method_request_received is None
         assert pipeline.on_twin_patch_received is None
 
+    @pytest.mark.it("Uses a default IoTHubPipelineConfig if no configuration is provided")
+    def test_default_configuration(self, auth_provider):
+        pipeline = IoTHubPipeline(auth_provider)
+        assert isinstance(pipeline.pipeline_configuration, IoTHubPipelineConfig)
+        assert pipeline._pipeline.pipeline_configuration is pipeline.pipeline_configuration
+
+    @pytest.mark.it("Attaches the provided configuration to the root of the pipeline")
+    def test_provided_configuration(self, auth_provider):
+        config = IoTHubPipelineConfig(max_inflight_messages=3)
+        pipeline = IoTHubPipeline(auth_provider, config)
+        assert pipeline.pipeline_configuration is config
+        assert pipeline._pipeline.pipeline_configuration is config
+
+    @pytest.mark.it("Uses the shared executors if executor_shards is 1")
+    def test_unsharded(self, auth_provider):
+        pipeline = IoTHubPipeline(auth_provider)
+        assert pipeline._pipeline.executor_shard is None
+
+    @pytest.mark.it(
+        "Pins the pipeline to an executor shard based on the device and module id if executor_shards is greater than 1"
+    )
+    def test_sharded(self, mocker):
+        config = IoTHubPipelineConfig(executor_shards=64)
+        shards = set()
+        for device_id in ["device 1", "device 2", "device 3", "device 4"]:
+            auth_provider = mocker.MagicMock(device_id=device_id, module_id="module")
+            pipeline = IoTHubPipeline(auth_provider, config)
+            shard = pipeline._pipeline.executor_shard
+            assert 0 <= shard < 64
+            assert IoTHubPipeline(auth_provider, config)._pipeline.executor_shard == shard
+            shards.add(shard)
+        assert len(shards) > 1
+
+    @pytest.mark.it("Runs the pipeline on the event loop if one is configured")
+    def test_event_loop(self, mocker, auth_provider):
+        loop = mocker.MagicMock()
+        loop.is_running.return_value = False
+        pipeline = IoTHubPipeline(auth_provider, IoTHubPipelineConfig(event_loop=loop))
+        shard = pipeline._pipeline.executor_shard
+        assert isinstance(shard, pipeline_thread.EventLoopShard)
+        assert shard.loop is loop
+
     @pytest.mark.it("Configures the pipeline to trigger handlers in response to external events")
     def test_handlers_configured(self, auth_provider):
         pipeline = IoTHubPipeline(auth_provider)
@@ -95,6 +141,8 @@ class TestIoTHubPipelineInstantiation(object):
             pipeline_stages_iothub.UseAuthProviderStage,
             pipeline_stages_iothub.HandleTwinOperationsStage,
             pipeline_stages_base.CoordinateRequestAndResponseStage,
+            pipeline_stages_iothub.StoreAndForwardStage,
+            pipeline_stages_base.ReconnectStage,
             pipeline_stages_base.EnsureConnectionStage,
             pipeline_stages_iothub_mqtt.IoTHubMQTTConverterStage,
             pipeline_stages_mqtt.MQTTClientStage,
@@ -201,28 +249,29 @@ class TestIoTHubPipelineConnect(object):
 
         # No assertions required - if the code executes without error, the test passes
 
-    @pytest.mark.it("Raise SystemExit upon unsuccessful completion of the ConnectOperation")
-    def test_op_fail(self, mocker, pipeline):
-        pipeline.connect()
+    @pytest.mark.it(
+        "Triggers the callback with the error upon unsuccessful completion of the ConnectOperation"
+    )
+    def test_op_fail_with_callback(self, mocker, pipeline):
+        cb = mocker.MagicMock()
+        pipeline.connect(callback=cb)
         op = pipeline._pipeline.run_op.call_args[0][0]
         op.error = Exception()
+        op.callback(op)
 
-        with pytest.raises(SystemExit):
-            op.callback(op)
+        assert cb.call_count == 1
+        assert cb.call_args == mocker.call(error=op.error)
 
     @pytest.mark.it(
-        "Does not trigger callback upon unsuccessful completion of the ConnectOperation"
+        "Does nothing upon unsuccessful completion of the ConnectOperation if no callback is provided"
     )
-    def test_op_fail_no_callback(self, mocker, pipeline):
-        cb = mocker.MagicMock()
-        pipeline.connect(callback=cb)
+    def test_op_fail_no_callback(self, pipeline):
+        pipeline.connect()
         op = pipeline._pipeline.run_op.call_args[0][0]
         op.error = Exception()
+        op.callback(op)
 
-        with pytest.raises(SystemExit):
-            op.callback(op)
-
-        assert cb.call_count == 0
+        # No assertions required - if the code executes without error, the test passes
 
 
 @pytest.mark.describe("IoTHubPipeline - .disconnect()")
@@ -322,29 +371,182 @@ class TestIoTHubPipelineSendD2CMessage(object):
 
         # No assertions required - if the code executes without error, the test passes
 
-    @pytest.mark.it("Raise SystemExit upon unsuccessful completion of the SendD2CMessageOperation")
-    def test_op_fail(self, mocker, pipeline, message):
-        pipeline.send_d2c_message(message)
+    @pytest.mark.it(
+        "Triggers the callback with the error upon unsuccessful completion of the SendD2CMessageOperation"
+    )
+    def test_op_fail_with_callback(self, mocker, pipeline, message):
+        cb = mocker.MagicMock()
+        pipeline.send_d2c_message(message, callback=cb)
         op = pipeline._pipeline.run_op.call_args[0][0]
         op.error = Exception()
+        op.callback(op)
 
-        with pytest.raises(SystemExit):
-            op.callback(op)
+        assert cb.call_count == 1
+        assert cb.call_args == mocker.call(error=op.error)
 
     @pytest.mark.it(
-        "Does not trigger callback upon unsuccessful completion of the SendD2CMessageOperation"
+        "Does nothing upon unsuccessful completion of the SendD2CMessageOperation if no callback is provided"
     )
-    def test_op_fail_no_callback(self, mocker, pipeline, message):
-        cb = mocker.MagicMock()
-        pipeline.send_d2c_message(message, callback=cb)
+    def test_op_fail_no_callback(self, pipeline, message):
+        pipeline.send_d2c_message(message)
         op = pipeline._pipeline.run_op.call_args[0][0]
         op.error = Exception()
+        op.callback(op)
+
+        # No assertions required - if the code executes without error, the test passes
 
-        with pytest.raises(SystemExit):
-            op.callback(op)
 
+@pytest.mark.describe("IoTHubPipeline - .send_d2c_message() -- in-flight window")
+class TestIoTHubPipelineSendD2CMessageInflightWindow(object):
+    @pytest.fixture
+    def pipeline(self, mocker, auth_provider):
+        pipeline = IoTHubPipeline(auth_provider, IoTHubPipelineConfig(max_inflight_messages=2))
+        mocker.patch.object(pipeline._pipeline, "run_op")
+        return pipeline
+
+    @pytest.mark.it(
+        "Runs SendD2CMessageOperations without waiting for completion while the window has room"
+    )
+    def test_does_not_block(self, pipeline, message):
+        pipeline.send_d2c_message(message)
+        pipeline.send_d2c_message(message)
+        assert pipeline._pipeline.run_op.call_count == 2
+
+    @pytest.mark.it(
+        "Waits for a SendD2CMessageOperation to complete before running another one if the window is full"
+    )
+    def test_blocks_when_window_full(self, pipeline, message):
+        pipeline.send_d2c_message(message)
+        pipeline.send_d2c_message(message)
+
+        third_send = threading.Thread(target=pipeline.send_d2c_message, args=(message,))
+        third_send.start()
+        third_send.join(0.1)
+        assert third_send.is_alive()
+        assert pipeline._pipeline.run_op.call_count == 2
+
+        # Completing one of the outstanding operations frees up a slot
+        op = pipeline._pipeline.run_op.call_args_list[0][0][0]
+        op.callback(op)
+        third_send.join(5)
+        assert not third_send.is_alive()
+        assert pipeline._pipeline.run_op.call_count == 3
+
+    @pytest.mark.it("Shares the window with SendOutputEventOperations")
+    def test_shared_with_output_events(self, pipeline, message):
+        pipeline.send_output_event(message)
+        pipeline.send_output_event(message)
+
+        send = threading.Thread(target=pipeline.send_d2c_message, args=(message,))
+        send.start()
+        send.join(0.1)
+        assert send.is_alive()
+
+        op = pipeline._pipeline.run_op.call_args_list[1][0][0]
+        op.callback(op)
+        send.join(5)
+        assert not send.is_alive()
+        assert isinstance(
+            pipeline._pipeline.run_op.call_args[0][0], pipeline_ops_iothub.SendD2CMessageOperation
+        )
+
+    @pytest.mark.it("Reports whether the window is full through inflight_window_full")
+    def test_inflight_window_full(self, pipeline, message):
+        pipeline.send_d2c_message(message)
+        assert not pipeline.inflight_window_full
+        pipeline.send_d2c_message(message)
+        assert pipeline.inflight_window_full
+
+        op = pipeline._pipeline.run_op.call_args_list[0][0][0]
+        op.callback(op)
+        assert not pipeline.inflight_window_full
+
+
+@pytest.mark.describe("IoTHubPipeline - .send_d2c_messages()")
+class TestIoTHubPipelineSendD2CMessages(object):
+    @pytest.fixture
+    def pipeline(self, mocker, auth_provider):
+        pipeline = IoTHubPipeline(auth_provider, IoTHubPipelineConfig(max_inflight_messages=2))
+        mocker.patch.object(pipeline._pipeline, "run_op_batch")
+        return pipeline
+
+    def complete_batch(self, pipeline, index, errors=None):
+        ops, callback = pipeline._pipeline.run_op_batch.call_args_list[index][0]
+        for i, op in enumerate(ops):
+            op.error = errors[i] if errors else None
+        callback(ops)
+
+    @pytest.mark.it(
+        "Runs a SendD2CMessageOperation for each of the provided Messages in a single batch on the pipeline"
+    )
+    def test_runs_ops_in_one_batch(self, pipeline):
+        messages = [Message("message 1"), Message("message 2")]
+        pipeline.send_d2c_messages(messages)
+
+        assert pipeline._pipeline.run_op_batch.call_count == 1
+        ops = pipeline._pipeline.run_op_batch.call_args[0][0]
+        assert [type(op) for op in ops] == [pipeline_ops_iothub.SendD2CMessageOperation] * 2
+        assert [op.message for op in ops] == messages
+
+    @pytest.mark.it(
+        "Triggers the optionally provided callback with the result of each Message once all of them complete"
+    )
+    def test_callback_with_results(self, mocker, pipeline):
+        cb = mocker.MagicMock()
+        error = Exception()
+        pipeline.send_d2c_messages([Message("message 1"), Message("message 2")], callback=cb)
+        assert cb.call_count == 0
+
+        self.complete_batch(pipeline, 0, errors=[None, error])
+        assert cb.call_count == 1
+        assert cb.call_args == mocker.call([None, error])
+
+    @pytest.mark.it(
+        "Triggers the optionally provided callback immediately if there are no Messages"
+    )
+    def test_empty(self, mocker, pipeline):
+        cb = mocker.MagicMock()
+        pipeline.send_d2c_messages([], callback=cb)
+        assert cb.call_count == 1
+        assert cb.call_args == mocker.call([])
+        assert pipeline._pipeline.run_op_batch.call_count == 0
+
+    @pytest.mark.it(
+        "Splits the Messages into several batches, waiting for the in-flight window in between, if they do not fit into the window"
+    )
+    def test_splits_batches(self, mocker, pipeline):
+        cb = mocker.MagicMock()
+        messages = [Message("message {}".format(i)) for i in range(3)]
+
+        send = threading.Thread(target=pipeline.send_d2c_messages, args=(messages, cb))
+        send.start()
+        send.join(0.1)
+        assert send.is_alive()
+        assert pipeline._pipeline.run_op_batch.call_count == 1
+        assert len(pipeline._pipeline.run_op_batch.call_args[0][0]) == 2
+
+        # Completing the first batch frees up the window for the remaining message
+        self.complete_batch(pipeline, 0)
+        send.join(5)
+        assert not send.is_alive()
+        assert pipeline._pipeline.run_op_batch.call_count == 2
+        assert len(pipeline._pipeline.run_op_batch.call_args[0][0]) == 1
         assert cb.call_count == 0
 
+        self.complete_batch(pipeline, 1)
+        assert cb.call_count == 1
+        assert cb.call_args == mocker.call([None, None, None])
+
+    @pytest.mark.it("Returns the in-flight window slots once the Messages complete")
+    def test_releases_window(self, mocker, pipeline, message):
+        pipeline.send_d2c_messages([Message("message 1"), Message("message 2")])
+        self.complete_batch(pipeline, 0)
+
+        mocker.patch.object(pipeline._pipeline, "run_op")
+        pipeline.send_d2c_message(message)
+        pipeline.send_d2c_message(message)
+        assert pipeline._pipeline.run_op.call_count == 2
+
 
 @pytest.mark.describe("IoTHubPipeline - .send_output_event()")
 class TestIoTHubPipelineSendOutputEvent(object):
@@ -389,28 +591,29 @@ class TestIoTHubPipelineSendOutputEvent(object):
 
         # No assertions required - if the code executes without error, the test passes
 
-    @pytest.mark.it("Raise SystemExit upon unsuccessful completion of the SendOutputEventOperation")
-    def test_op_fail(self, mocker, pipeline, message):
-        pipeline.send_output_event(message)
+    @pytest.mark.it(
+        "Triggers the callback with the error upon unsuccessful completion of the SendOutputEventOperation"
+    )
+    def test_op_fail_with_callback(self, mocker, pipeline, message):
+        cb = mocker.MagicMock()
+        pipeline.send_output_event(message, callback=cb)
         op = pipeline._pipeline.run_op.call_args[0][0]
         op.error = Exception()
+        op.callback(op)
 
-        with pytest.raises(SystemExit):
-            op.callback(op)
+        assert cb.call_count == 1
+        assert cb.call_args == mocker.call(error=op.error)
 
     @pytest.mark.it(
-        "Does not trigger callback upon unsuccessful completion of the SendOutputEventOperation"
+        "Does nothing upon unsuccessful completion of the SendOutputEventOperation if no callback is provided"
     )
-    def test_op_fail_no_callback(self, mocker, pipeline, message):
-        cb = mocker.MagicMock()
-        pipeline.send_output_event(message, callback=cb)
+    def test_op_fail_no_callback(self, pipeline, message):
+        pipeline.send_output_event(message)
         op = pipeline._pipeline.run_op.call_args[0][0]
         op.error = Exception()
+        op.callback(op)
 
-        with pytest.raises(SystemExit):
-            op.callback(op)
-
-        assert cb.call_count == 0
+        # No assertions required - if the code executes without error, the test passes
 
 
 @pytest.mark.describe("IoTHubPipeline - .send_method_response()")
@@ -426,6 +629,12 @@ class TestIoTHubPipelineSendMethodResponse(object):
         assert isinstance(op, pipeline_ops_iothub.SendMethodResponseOperation)
         assert op.method_response == method_response
 
+    @pytest.mark.it("JSON encodes the payload of the method response before running the op")
+    def test_encodes_payload(self, pipeline, method_response):
+        pipeline.send_method_response(method_response)
+        op = pipeline._pipeline.run_op.call_args[0][0]
+        assert op.payload == json_codec.dumps(method_response.payload)
+
     @pytest.mark.it(
         "Triggers an optionally provided callback upon successful completion of the SendMethodResponseOperation"
     )
@@ -530,6 +739,102 @@ class TestIoTHubPipelineGetTwin(object):
         assert cb.call_count == 0
 
 
+@pytest.mark.describe("IoTHubPipeline - .get_twin() -- twin cache")
+class TestIoTHubPipelineGetTwinCache(object):
+    @pytest.fixture
+    def pipeline(self, mocker, auth_provider):
+        pipeline = IoTHubPipeline(auth_provider, IoTHubPipelineConfig(twin_cache=True))
+        mocker.patch.object(pipeline._pipeline, "run_op")
+        return pipeline
+
+    @pytest.fixture
+    def twin(self):
+        return b'{"desired": {"$version": 5, "a": 1}, "reported": {"$version": 1}}'
+
+    def get_twin(self, mocker, pipeline):
+        cb = mocker.MagicMock()
+        pipeline.get_twin(callback=cb)
+        return cb
+
+    def complete_get_twin(self, pipeline, twin):
+        op = pipeline._pipeline.run_op.call_args[0][0]
+        op.twin = twin
+        op.callback(op)
+
+    def subscribe(self, pipeline):
+        pipeline.enable_feature(constant.TWIN_PATCHES)
+        op = pipeline._pipeline.run_op.call_args[0][0]
+        op.callback(op)
+        pipeline._pipeline.run_op.reset_mock()
+
+    @pytest.mark.it("Does not use the cache if twin_cache is not set in the configuration")
+    def test_no_cache(self, mocker, auth_provider):
+        pipeline = IoTHubPipeline(auth_provider)
+        assert pipeline._twin_cache is None
+
+    @pytest.mark.it("Requests the twin from the service while twin patches are not enabled")
+    def test_not_subscribed(self, mocker, pipeline, twin):
+        self.get_twin(mocker, pipeline)
+        self.complete_get_twin(pipeline, twin)
+        self.get_twin(mocker, pipeline)
+        assert pipeline._pipeline.run_op.call_count == 2
+
+    @pytest.mark.it(
+        "Returns the cached twin without running an operation while twin patches are enabled"
+    )
+    def test_cache_hit(self, mocker, pipeline, twin):
+        self.subscribe(pipeline)
+        self.get_twin(mocker, pipeline)
+        self.complete_get_twin(pipeline, twin)
+        cb = self.get_twin(mocker, pipeline)
+        assert pipeline._pipeline.run_op.call_count == 1
+        assert cb.call_args == mocker.call(twin)
+
+    @pytest.mark.it("Applies the twin patches which are received to the cached twin")
+    def test_patch_applied(self, mocker, pipeline, twin):
+        self.subscribe(pipeline)
+        self.get_twin(mocker, pipeline)
+        self.complete_get_twin(pipeline, twin)
+        pipeline._pipeline.on_pipeline_event(
+            pipeline_events_iothub.TwinDesiredPropertiesPatchEvent(b'{"$version": 6, "a": 2}')
+        )
+        cb = self.get_twin(mocker, pipeline)
+        assert pipeline._pipeline.run_op.call_count == 1
+        assert json_codec.loads(cb.call_args[0][0])["desired"] == {"$version": 6, "a": 2}
+
+    @pytest.mark.it("Requests the twin from the service again after a disconnect")
+    def test_disconnected(self, mocker, pipeline, twin):
+        self.subscribe(pipeline)
+        self.get_twin(mocker, pipeline)
+        self.complete_get_twin(pipeline, twin)
+        pipeline._pipeline.on_disconnected()
+        pipeline._pipeline.on_connected()
+        self.get_twin(mocker, pipeline)
+        assert pipeline._pipeline.run_op.call_count == 2
+
+    @pytest.mark.it(
+        "Requests the twin from the service again after reported properties are patched"
+    )
+    def test_reported_patched(self, mocker, pipeline, twin):
+        self.subscribe(pipeline)
+        self.get_twin(mocker, pipeline)
+        self.complete_get_twin(pipeline, twin)
+        pipeline.patch_twin_reported_properties({"b": 1})
+        op = pipeline._pipeline.run_op.call_args[0][0]
+        op.callback(op)
+        self.get_twin(mocker, pipeline)
+        assert pipeline._pipeline.run_op.call_count == 3
+
+    @pytest.mark.it("Requests the twin from the service again after twin patches are disabled")
+    def test_unsubscribed(self, mocker, pipeline, twin):
+        self.subscribe(pipeline)
+        self.get_twin(mocker, pipeline)
+        self.complete_get_twin(pipeline, twin)
+        pipeline.disable_feature(constant.TWIN_PATCHES)
+        self.get_twin(mocker, pipeline)
+        assert pipeline._pipeline.run_op.call_count == 3
+
+
 @pytest.mark.describe("IoTHubPipeline - .patch_twin_reported_properties()")
 class TestIoTHubPipelinePatchTwinReportedProperties(object):
     @pytest.mark.it(
@@ -595,6 +900,121 @@ class TestIoTHubPipelinePatchTwinReportedProperties(object):
         assert cb.call_count == 0
 
 
+@pytest.mark.describe("IoTHubPipeline - .update_reported_properties()")
+class TestIoTHubPipelineUpdateReportedProperties(object):
+    def update(self, mocker, pipeline, full_state):
+        cb = mocker.MagicMock()
+        pipeline._pipeline.run_op.reset_mock()
+        pipeline.update_reported_properties(full_state, callback=cb)
+        return cb
+
+    def complete(self, pipeline, error=None):
+        op = pipeline._pipeline.run_op.call_args[0][0]
+        op.error = error
+        op.callback(op)
+
+    def patch_sent(self, pipeline):
+        op = pipeline._pipeline.run_op.call_args[0][0]
+        assert isinstance(op, pipeline_ops_iothub.PatchTwinReportedPropertiesOperation)
+        return op.patch
+
+    @pytest.mark.it("Sends the whole state the first time it is called")
+    def test_first_call(self, mocker, pipeline):
+        self.update(mocker, pipeline, {"a": 1, "b": {"c": 2}})
+        assert self.patch_sent(pipeline) == {"a": 1, "b": {"c": 2}}
+
+    @pytest.mark.it("Sends only what changed since the previous call, with None for removed keys")
+    def test_sends_diff(self, mocker, pipeline):
+        self.update(mocker, pipeline, {"a": 1, "b": {"c": 2, "d": 3}, "e": 4})
+        self.complete(pipeline)
+        self.update(mocker, pipeline, {"a": 1, "b": {"c": 2, "d": 5}})
+        assert self.patch_sent(pipeline) == {"b": {"d": 5}, "e": None}
+
+    @pytest.mark.it("Diffs against the previous call even if it has not completed yet")
+    def test_diff_against_pending(self, mocker, pipeline):
+        self.update(mocker, pipeline, {"a": 1, "b": 2})
+        self.update(mocker, pipeline, {"a": 1})
+        assert self.patch_sent(pipeline) == {"b": None}
+
+    @pytest.mark.it("Calls the callback without running an operation if nothing changed")
+    def test_nothing_changed(self, mocker, pipeline):
+        self.update(mocker, pipeline, {"a": 1})
+        self.complete(pipeline)
+        cb = self.update(mocker, pipeline, {"a": 1})
+        assert pipeline._pipeline.run_op.call_count == 0
+        assert cb.call_count == 1
+
+    @pytest.mark.it("Is not affected by changes the application makes to its state afterwards")
+    def test_copies_state(self, mocker, pipeline):
+        state = {"a": {"b": 1}}
+        self.update(mocker, pipeline, state)
+        self.complete(pipeline)
+        state["a"]["b"] = 2
+        self.update(mocker, pipeline, state)
+        assert self.patch_sent(pipeline) == {"a": {"b": 2}}
+
+    @pytest.mark.it(
+        "Triggers the provided callback upon successful completion of the PatchTwinReportedPropertiesOperation"
+    )
+    def test_op_success_with_callback(self, mocker, pipeline):
+        cb = self.update(mocker, pipeline, {"a": 1})
+        assert cb.call_count == 0
+        self.complete(pipeline)
+        assert cb.call_count == 1
+
+    @pytest.mark.it(
+        "Triggers the provided callback with the error upon unsuccessful completion of the PatchTwinReportedPropertiesOperation"
+    )
+    def test_op_fail_with_callback(self, mocker, pipeline):
+        cb = self.update(mocker, pipeline, {"a": 1})
+        error = Exception()
+        self.complete(pipeline, error=error)
+        assert cb.call_count == 1
+        assert cb.call_args == mocker.call(error=error)
+
+    @pytest.mark.it(
+        "Does not raise upon unsuccessful completion of the PatchTwinReportedPropertiesOperation without a callback"
+    )
+    def test_op_fail_no_callback(self, pipeline):
+        pipeline.update_reported_properties({"a": 1})
+        self.complete(pipeline, error=Exception())
+
+    @pytest.mark.it("Sends the whole state after a call which failed")
+    def test_after_failure(self, mocker, pipeline):
+        self.update(mocker, pipeline, {"a": 1})
+        self.complete(pipeline)
+        self.update(mocker, pipeline, {"a": 1, "b": 2})
+        self.complete(pipeline, error=Exception())
+
+        self.update(mocker, pipeline, {"a": 1, "b": 2})
+        assert self.patch_sent(pipeline) == {"a": 1, "b": 2}
+
+    @pytest.mark.it("Diffs against the last acknowledged state once no call is pending")
+    def test_diff_against_acknowledged(self, mocker, pipeline):
+        self.update(mocker, pipeline, {"a": 1})
+        self.complete(pipeline)
+        self.update(mocker, pipeline, {"a": 2})
+        self.complete(pipeline)
+
+        self.update(mocker, pipeline, {"a": 2, "b": 3})
+        assert self.patch_sent(pipeline) == {"b": 3}
+
+    @pytest.mark.it(
+        "Sends the whole state if a call failed while a later one was pending, even if the later one succeeded"
+    )
+    def test_failure_while_pending(self, mocker, pipeline):
+        self.update(mocker, pipeline, {"a": 1})
+        first_op = pipeline._pipeline.run_op.call_args[0][0]
+        self.update(mocker, pipeline, {"a": 1, "b": 2})
+        second_op = pipeline._pipeline.run_op.call_args[0][0]
+        first_op.error = Exception()
+        first_op.callback(first_op)
+        second_op.callback(second_op)
+
+        self.update(mocker, pipeline, {"a": 1, "b": 2})
+        assert self.patch_sent(pipeline) == {"a": 1, "b": 2}
+
+
 @pytest.mark.describe("IoTHubPipeline - .enable_feature()")
 class TestIoTHubPipelineEnableFeature(object):
     @pytest.mark.it("Marks the feature as enabled")
@@ -807,6 +1227,30 @@ class TestIoTHubPipelineEVENTDisconnect(object):
         # No assertions required - not throwing an exception means the test passed
 
 
+@pytest.mark.describe("IoTHubPipeline - EVENT: Reconnect Attempt")
+class TestIoTHubPipelineEVENTReconnectAttempt(object):
+    @pytest.mark.it(
+        "Triggers the 'on_reconnect_attempt' handler, passing the attempt, error and next delay as arguments"
+    )
+    def test_with_handler(self, mocker, pipeline):
+        mock_handler = mocker.MagicMock()
+        pipeline.on_reconnect_attempt = mock_handler
+        error = Exception()
+
+        event = pipeline_events_base.ReconnectAttemptEvent(attempt=2, error=error, next_delay=3.5)
+        pipeline._pipeline.on_pipeline_event(event)
+
+        assert mock_handler.call_count == 1
+        assert mock_handler.call_args == mocker.call(2, error, 3.5)
+
+    @pytest.mark.it("Does nothing if the 'on_reconnect_attempt' handler is not set")
+    def test_no_handler(self, pipeline):
+        event = pipeline_events_base.ReconnectAttemptEvent(attempt=1, error=None, next_delay=None)
+        pipeline._pipeline.on_pipeline_event(event)
+
+        # No assertions required - not throwing an exception means the test passed
+
+
 @pytest.mark.describe("IoTHubPipeline - EVENT: C2D Message Received")
 class TestIoTHubPipelineEVENTRecieveC2DMessage(object):
     @pytest.mark.it(
@@ -0,0 +1,288 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import datetime
+import pytest
+from azure.iot.device.iothub.pipeline import mqtt_topic_iothub
+from azure.iot.device.common import json_codec
+from azure.iot.device.iothub.models import Message, MethodRequest
+from azure.iot.device.iothub.pipeline.mqtt_topic_iothub import (
+    TopicRouter,
+    IncomingTopic,
+    ReceivedMessage,
+    PropertyEncoder,
+    ReceivedMethodRequest,
+)
+
+fake_device_id = "__fake_device_id__"
+fake_module_id = "__fake_module_id__"
+fake_properties = "%24.ct=text%2Fjson&prop=value"
+
+
+@pytest.fixture
+def router():
+    return TopicRouter(fake_device_id, fake_module_id)
+
+
+@pytest.mark.describe("TopicRouter - .route()")
+class TestTopicRouterRoute(object):
+    @pytest.mark.it("Routes C2D topics, with their properties")
+    @pytest.mark.parametrize(
+        "topic, properties",
+        [
+            pytest.param(
+                "devices/{}/messages/devicebound/{}".format(fake_device_id, fake_properties),
+                fake_properties,
+                id="With properties",
+            ),
+            pytest.param(
+                "devices/{}/messages/devicebound/".format(fake_device_id), "", id="No properties"
+            ),
+            pytest.param(
+                "devices/{}/messages/devicebound".format(fake_device_id), None, id="No slash"
+            ),
+        ],
+    )
+    def test_c2d(self, router, topic, properties):
+        assert router.route(topic) == IncomingTopic(
+            mqtt_topic_iothub.C2D, None, None, None, properties
+        )
+
+    @pytest.mark.it("Routes input topics, with their input name and properties")
+    def test_input(self, router):
+        topic = "devices/{}/modules/{}/inputs/input1/{}".format(
+            fake_device_id, fake_module_id, fake_properties
+        )
+        assert router.route(topic) == IncomingTopic(
+            mqtt_topic_iothub.INPUT, "input1", None, None, fake_properties
+        )
+
+    @pytest.mark.it("Routes method topics, with their method name and request id")
+    def test_method(self, router):
+        topic = "$iothub/methods/POST/reboot/?$rid=12"
+        assert router.route(topic) == IncomingTopic(
+            mqtt_topic_iothub.METHOD, "reboot", "12", None, None
+        )
+
+    @pytest.mark.it("Routes twin response topics, with their status code and request id")
+    def test_twin_response(self, router):
+        topic = "$iothub/twin/res/200/?$rid=34&$version=5"
+        assert router.route(topic) == IncomingTopic(
+            mqtt_topic_iothub.TWIN_RESPONSE, None, "34", "200", None
+        )
+
+    @pytest.mark.it("Decodes the request id if it is url encoded")
+    def test_encoded_request_id(self, router):
+        topic = "$iothub/twin/res/200/?$version=5&$rid=a%2Fb"
+        assert router.route(topic).request_id == "a/b"
+
+    @pytest.mark.it("Routes twin patch topics")
+    def test_twin_patch(self, router):
+        topic = "$iothub/twin/PATCH/properties/desired/?$version=5"
+        assert router.route(topic).kind == mqtt_topic_iothub.TWIN_PATCH
+
+    @pytest.mark.it("Returns None for topics of other devices and modules")
+    @pytest.mark.parametrize(
+        "topic",
+        [
+            pytest.param("devices/__other_device__/messages/devicebound/", id="C2D"),
+            pytest.param(
+                "devices/{}_2/messages/devicebound/".format(fake_device_id),
+                id="C2D, device id with the same prefix",
+            ),
+            pytest.param(
+                "devices/{}/modules/__other_module__/inputs/input1/".format(fake_device_id),
+                id="Input",
+            ),
+        ],
+    )
+    def test_other_client(self, router, topic):
+        assert router.route(topic) is None
+
+    @pytest.mark.it("Returns None for unknown topics")
+    def test_unknown(self, router):
+        assert router.route("__unmatched_mqtt_topic__") is None
+
+    @pytest.mark.it("Only routes method and twin topics if created without a device id")
+    def test_no_device(self):
+        router = TopicRouter()
+        assert router.route("devices/{}/messages/devicebound/".format(fake_device_id)) is None
+        assert router.route("$iothub/methods/POST/reboot/?$rid=12").kind == mqtt_topic_iothub.METHOD
+
+    @pytest.mark.it("Raises an error if the request id is missing from a twin response topic")
+    def test_missing_request_id(self, router):
+        with pytest.raises(IndexError):
+            router.route("$iothub/twin/res/200")
+
+
+@pytest.mark.describe("set_message_properties()")
+class TestSetMessageProperties(object):
+    @pytest.mark.it("Sets system and custom properties on the message")
+    def test_sets_properties(self, mocker):
+        message = mocker.MagicMock(custom_properties={})
+        mqtt_topic_iothub.set_message_properties(fake_properties, message)
+        assert message.content_type == "text/json"
+        assert message.custom_properties == {"prop": "value"}
+
+
+@pytest.mark.describe("ReceivedMessage")
+class TestReceivedMessage(object):
+    @pytest.mark.it("Is a Message")
+    def test_is_message(self):
+        assert isinstance(ReceivedMessage(b"data", fake_properties), Message)
+
+    @pytest.mark.it("Does not decode the properties until a property is read")
+    def test_lazy(self, mocker):
+        spy = mocker.spy(mqtt_topic_iothub, "_decode_properties")
+        message = ReceivedMessage(b"data", fake_properties)
+        assert message.data == b"data"
+        assert spy.call_count == 0
+
+        assert message.content_type == "text/json"
+        assert message.custom_properties == {"prop": "value"}
+        assert message.message_id is None
+        assert spy.call_count == 1
+
+    @pytest.mark.it("Has no properties if created without a properties string")
+    def test_no_properties(self):
+        message = ReceivedMessage(b"data", None)
+        assert message.custom_properties == {}
+        assert message.content_type is None
+
+    @pytest.mark.it("Keeps properties which were set before any property was read")
+    def test_set_before_read(self):
+        message = ReceivedMessage(b"data", fake_properties)
+        message.content_type = "application/octet-stream"
+        assert message.custom_properties == {"prop": "value"}
+        assert message.content_type == "application/octet-stream"
+
+    @pytest.mark.it("Has the attributes set by the Message initializer")
+    def test_message_attributes(self):
+        message = ReceivedMessage(b"data", fake_properties)
+        for name in vars(Message(b"data")):
+            getattr(message, name)
+        assert message.lock_token is None
+        assert message.output_name is None
+
+    @pytest.mark.it("Raises AttributeError for attributes which a Message does not have")
+    def test_unknown_attribute(self):
+        with pytest.raises(AttributeError):
+            ReceivedMessage(b"data", fake_properties).not_an_attribute
+
+
+def make_message(**kwargs):
+    message = Message(b"data")
+    for name, value in kwargs.items():
+        setattr(message, name, value)
+    return message
+
+
+fake_topic = "devices/{}/messages/events/".format(fake_device_id)
+
+
+@pytest.fixture
+def encoder():
+    return PropertyEncoder(max_cache_size=2)
+
+
+@pytest.mark.describe("PropertyEncoder - Instantiation")
+class TestPropertyEncoderInstantiation(object):
+    @pytest.mark.it("Raises ValueError if max_cache_size is not a positive integer")
+    def test_invalid_max_cache_size(self):
+        with pytest.raises(ValueError):
+            PropertyEncoder(max_cache_size=0)
+
+
+@pytest.mark.describe("PropertyEncoder - .encode()")
+class TestPropertyEncoderEncode(object):
+    @pytest.mark.it("Encodes the same topic as encode_properties()")
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            pytest.param({}, id="No properties"),
+            pytest.param({"message_id": "a b/c"}, id="Message id"),
+            pytest.param({"output_name": "out1"}, id="Output name"),
+            pytest.param({"output_name": "out1", "message_id": "1"}, id="Output name and id"),
+            pytest.param(
+                {
+                    "output_name": "out1",
+                    "message_id": "1",
+                    "correlation_id": "2",
+                    "user_id": "user",
+                    "to": "to",
+                    "content_type": "application/json",
+                    "content_encoding": "utf-8",
+                    "expiry_time_utc": datetime.date(2020, 1, 2),
+                    "custom_properties": {"a": "1", "b c": 2},
+                },
+                id="All properties",
+            ),
+            pytest.param(
+                {"expiry_time_utc": "2020-01-02", "content_type": "text/json"},
+                id="String expiry time",
+            ),
+            pytest.param({"custom_properties": {"a": "b"}}, id="Only custom properties"),
+            pytest.param({"message_id": 5, "correlation_id": "\u00e9"}, id="Not str values"),
+        ],
+    )
+    def test_same_as_encode_properties(self, encoder, kwargs):
+        message = make_message(**kwargs)
+        expected = mqtt_topic_iothub.encode_properties(message, fake_topic)
+        assert encoder.encode(message, fake_topic) == expected
+        # Again, from the cache
+        assert encoder.encode(message, fake_topic) == expected
+
+    @pytest.mark.it("Only encodes recurring properties once")
+    def test_caches(self, mocker, encoder):
+        spy = mocker.spy(mqtt_topic_iothub.urllib.parse, "urlencode")
+        for i in range(10):
+            message = make_message(
+                message_id=str(i), content_type="text/json", custom_properties={"a": "b"}
+            )
+            assert encoder.encode(message, fake_topic) == mqtt_topic_iothub.encode_properties(
+                message, fake_topic
+            )
+        # 2 calls for each encode_properties(), and 2 for the first encode()
+        assert spy.call_count == 22
+
+    @pytest.mark.it("Drops the least recently used entry when the cache is full")
+    def test_lru(self, encoder):
+        for content_type in ["a", "b", "a", "c"]:
+            encoder.encode(make_message(content_type=content_type), fake_topic)
+        cached = [key[4] for key in encoder._system_cache]
+        assert cached == ["a", "c"]
+
+    @pytest.mark.it("Falls back to encode_properties() for values which cannot be cached")
+    def test_unhashable(self, encoder):
+        message = make_message(custom_properties={"a": ["b"]})
+        assert encoder.encode(message, fake_topic) == mqtt_topic_iothub.encode_properties(
+            message, fake_topic
+        )
+        assert len(encoder._custom_cache) == 0
+
+
+@pytest.mark.describe("ReceivedMethodRequest")
+class TestReceivedMethodRequest(object):
+    @pytest.mark.it("Is a MethodRequest")
+    def test_is_method_request(self):
+        request = ReceivedMethodRequest(request_id="1", name="reboot", payload=b"{}")
+        assert isinstance(request, MethodRequest)
+        assert request.request_id == "1"
+        assert request.name == "reboot"
+
+    @pytest.mark.it("Does not decode the payload until it is read")
+    def test_lazy(self, mocker):
+        spy = mocker.spy(json_codec, "loads")
+        request = ReceivedMethodRequest(request_id="1", name="reboot", payload=b'{"delay": 5}')
+        assert spy.call_count == 0
+        assert request.payload == {"delay": 5}
+        assert request.payload == {"delay": 5}
+        assert spy.call_count == 1
+
+    @pytest.mark.it("Raises ValueError when the payload is read, if it is not JSON")
+    def test_not_json(self):
+        request = ReceivedMethodRequest(request_id="1", name="reboot", payload=b"not json")
+        with pytest.raises(ValueError):
+            request.payload
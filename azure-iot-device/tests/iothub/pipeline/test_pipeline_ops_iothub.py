@@ -4,6 +4,7 @@
 # license information.
 # --------------------------------------------------------------------------
 import sys
+from azure.iot.device.common.pipeline import pipeline_ops_base
 from azure.iot.device.iothub.pipeline import pipeline_ops_iothub
 from tests.common.pipeline import pipeline_data_object_test
 
@@ -37,33 +38,36 @@ pipeline_data_object_test.add_operation_test(
     module=this_module,
     positional_arguments=["message"],
     keyword_arguments={"callback": None},
-    extra_defaults={"needs_connection": True},
+    extra_defaults={"needs_connection": True, "priority": pipeline_ops_base.PRIORITY_TELEMETRY},
 )
 pipeline_data_object_test.add_operation_test(
     cls=pipeline_ops_iothub.SendOutputEventOperation,
     module=this_module,
     positional_arguments=["message"],
     keyword_arguments={"callback": None},
-    extra_defaults={"needs_connection": True},
+    extra_defaults={"needs_connection": True, "priority": pipeline_ops_base.PRIORITY_TELEMETRY},
 )
 pipeline_data_object_test.add_operation_test(
     cls=pipeline_ops_iothub.SendMethodResponseOperation,
     module=this_module,
     positional_arguments=["method_response"],
-    keyword_arguments={"callback": None},
-    extra_defaults={"needs_connection": True},
+    keyword_arguments={"payload": None, "callback": None},
+    extra_defaults={
+        "needs_connection": True,
+        "priority": pipeline_ops_base.PRIORITY_METHOD_RESPONSE,
+    },
 )
 pipeline_data_object_test.add_operation_test(
     cls=pipeline_ops_iothub.GetTwinOperation,
     module=this_module,
     positional_arguments=[],
     keyword_arguments={"callback": None},
-    extra_defaults={"needs_connection": True},
+    extra_defaults={"needs_connection": True, "priority": pipeline_ops_base.PRIORITY_TWIN},
 )
 pipeline_data_object_test.add_operation_test(
     cls=pipeline_ops_iothub.PatchTwinReportedPropertiesOperation,
     module=this_module,
     positional_arguments=["patch"],
     keyword_arguments={"callback": None},
-    extra_defaults={"needs_connection": True},
+    extra_defaults={"needs_connection": True, "priority": pipeline_ops_base.PRIORITY_TWIN},
 )
@@ -8,8 +8,11 @@ import json
 import logging
 import pytest
 import sys
-from azure.iot.device.common.pipeline import pipeline_ops_base
+from azure.iot.device.common import json_codec, outbox, timer_wheel
+from azure.iot.device.common.pipeline import pipeline_ops_base, operation_flow
+from azure.iot.device.iothub.models import Message
 from azure.iot.device.iothub.pipeline import pipeline_stages_iothub, pipeline_ops_iothub
+from azure.iot.device.iothub.pipeline.config import IoTHubPipelineConfig
 from tests.common.pipeline.helpers import (
     assert_callback_succeeded,
     assert_callback_failed,
@@ -61,6 +64,7 @@ pipeline_stage_test.add_base_pipeline_stage_tests(
     ],
     all_events=all_common_events + all_iothub_events,
     handled_events=[],
+    methods_that_enter_pipeline_thread=["_on_sas_token_updated"],
 )
 
 
@@ -339,6 +343,55 @@ class TestUseAuthProviderRunOpWithSetAuthProviderOperation(object):
         assert_callback_failed(op=set_auth_provider, error=fake_exception)
 
 
+@pytest.mark.describe("UseAuthProvider - EVENT: Sas token updated")
+class TestUseAuthProviderSasTokenUpdated(object):
+    @pytest.fixture
+    def stage(self, mocker):
+        stage = make_mock_stage(mocker, pipeline_stages_iothub.UseAuthProviderStage)
+        # Operations passed down stay pending unless the test completes them
+        stage.next.run_op = mocker.MagicMock()
+        return stage
+
+    @pytest.fixture
+    def auth_provider(self):
+        auth_provider = make_mock_sas_token_auth_provider()
+        auth_provider.token_update_callback = None
+        return auth_provider
+
+    def set_auth_provider(self, mocker, stage, auth_provider):
+        stage.run_op(
+            pipeline_ops_iothub.SetAuthProviderOperation(
+                auth_provider=auth_provider, callback=mocker.MagicMock()
+            )
+        )
+        for _ in range(2):
+            op = stage.next.run_op.call_args[0][0]
+            operation_flow.complete_op(stage.next, op)
+        stage.next.run_op.reset_mock()
+
+    @pytest.mark.it("Sets the token_update_callback of an auth provider which renews its token")
+    def test_sets_callback(self, mocker, stage, auth_provider):
+        self.set_auth_provider(mocker, stage, auth_provider)
+        assert auth_provider.token_update_callback is not None
+
+    @pytest.mark.it(
+        "Runs SetSasTokenOperation with the new token, then ReconnectOperation, when the token is updated"
+    )
+    def test_sets_token_and_reconnects(self, mocker, stage, auth_provider):
+        self.set_auth_provider(mocker, stage, auth_provider)
+        auth_provider.get_current_sas_token = mocker.MagicMock(return_value="__new_sas_token__")
+
+        auth_provider.token_update_callback()
+        set_sas_token = stage.next.run_op.call_args[0][0]
+        assert isinstance(set_sas_token, pipeline_ops_base.SetSasTokenOperation)
+        assert set_sas_token.sas_token == "__new_sas_token__"
+        assert stage.next.run_op.call_count == 1
+
+        operation_flow.complete_op(stage.next, set_sas_token)
+        assert stage.next.run_op.call_count == 2
+        assert isinstance(stage.next.run_op.call_args[0][0], pipeline_ops_base.ReconnectOperation)
+
+
 pipeline_stage_test.add_base_pipeline_stage_tests(
     cls=pipeline_stages_iothub.HandleTwinOperationsStage,
     module=this_module,
@@ -356,7 +409,9 @@ pipeline_stage_test.add_base_pipeline_stage_tests(
 class TestHandleTwinOperationsRunOpWithGetTwin(object):
     @pytest.fixture
     def stage(self, mocker):
-        return make_mock_stage(mocker, pipeline_stages_iothub.HandleTwinOperationsStage)
+        stage = make_mock_stage(mocker, pipeline_stages_iothub.HandleTwinOperationsStage)
+        stage.pipeline_configuration = IoTHubPipelineConfig()
+        return stage
 
     @pytest.fixture
     def op(self, stage, callback):
@@ -432,9 +487,9 @@ class TestHandleTwinOperationsRunOpWithGetTwin(object):
         assert_callback_failed(op=op, error=Exception)
 
     @pytest.mark.it(
-        "Decodes, deserializes, and returns the request_body from SendIotRequestAndWaitForResponseOperation as the twin attribute on the op along with no error if the status code < 300"
+        "Returns the request_body from SendIotRequestAndWaitForResponseOperation, without decoding it, as the twin attribute on the op along with no error if the status code < 300"
     )
-    def test_next_stage_completes_correctly(self, stage, op, twin, twin_as_bytes):
+    def test_next_stage_completes_correctly(self, stage, op, twin_as_bytes):
         def next_stage_run_op(self, op):
             op.status_code = 200
             op.response_body = twin_as_bytes
@@ -443,7 +498,7 @@ class TestHandleTwinOperationsRunOpWithGetTwin(object):
         stage.next.run_op = functools.partial(next_stage_run_op, (stage.next,))
         stage.run_op(op)
         assert_callback_succeeded(op=op)
-        assert op.twin == twin
+        assert op.twin == twin_as_bytes
 
 
 @pytest.mark.describe(
@@ -452,7 +507,9 @@ class TestHandleTwinOperationsRunOpWithGetTwin(object):
 class TestHandleTwinOperationsRunOpWithPatchTwinReportedProperties(object):
     @pytest.fixture
     def stage(self, mocker):
-        return make_mock_stage(mocker, pipeline_stages_iothub.HandleTwinOperationsStage)
+        stage = make_mock_stage(mocker, pipeline_stages_iothub.HandleTwinOperationsStage)
+        stage.pipeline_configuration = IoTHubPipelineConfig()
+        return stage
 
     @pytest.fixture
     def patch(self):
@@ -460,7 +517,7 @@ class TestHandleTwinOperationsRunOpWithPatchTwinReportedProperties(object):
 
     @pytest.fixture
     def patch_as_string(self, patch):
-        return json.dumps(patch)
+        return json_codec.dumps(patch)
 
     @pytest.fixture
     def op(self, stage, callback, patch):
@@ -538,3 +595,423 @@ class TestHandleTwinOperationsRunOpWithPatchTwinReportedProperties(object):
         stage.next.run_op = functools.partial(next_stage_run_op, (stage.next,))
         stage.run_op(op)
         assert_callback_succeeded(op=op)
+
+
+@pytest.mark.describe(
+    "HandleTwinOperationsStage - .run_op() -- called with PatchTwinReportedPropertiesOperation while coalescing"
+)
+class TestHandleTwinOperationsRunOpWithPatchTwinReportedPropertiesCoalesced(object):
+    @pytest.fixture
+    def config(self):
+        return IoTHubPipelineConfig(
+            reported_properties_coalesce_interval=0.5, reported_properties_coalesce_max_size=100
+        )
+
+    @pytest.fixture
+    def stage(self, mocker, config):
+        stage = make_mock_stage(mocker, pipeline_stages_iothub.HandleTwinOperationsStage)
+        stage.pipeline_configuration = config
+        # Operations passed down stay pending unless the test completes them
+        stage.next.run_op = mocker.MagicMock()
+        return stage
+
+    @pytest.fixture
+    def timer(self, mocker):
+        wheel = mocker.MagicMock()
+        mocker.patch.object(timer_wheel, "get_shared_timer_wheel", return_value=wheel)
+        return wheel.schedule
+
+    def patch_reported(self, mocker, stage, patch):
+        op = pipeline_ops_iothub.PatchTwinReportedPropertiesOperation(
+            patch=patch, callback=mocker.MagicMock()
+        )
+        stage.run_op(op)
+        return op
+
+    def fire_timer(self, timer):
+        timer.call_args[0][1]()
+
+    def requests_sent(self, stage):
+        return [call[0][0] for call in stage.next.run_op.call_args_list]
+
+    @pytest.mark.it("Holds patches back until the coalesce interval is over")
+    def test_holds_back(self, mocker, stage, timer):
+        self.patch_reported(mocker, stage, {"a": 1})
+        self.patch_reported(mocker, stage, {"b": 2})
+        assert stage.next.run_op.call_count == 0
+        assert timer.call_count == 1
+        assert timer.call_args[0][0] == 0.5
+
+    @pytest.mark.it(
+        "Sends the patches merged into a single PATCH request once the interval is over"
+    )
+    def test_sends_merged(self, mocker, stage, timer):
+        self.patch_reported(mocker, stage, {"a": {"x": 1, "y": 2}, "b": 1})
+        self.patch_reported(mocker, stage, {"a": {"y": 3}, "b": None, "c": 4})
+        self.fire_timer(timer)
+        requests = self.requests_sent(stage)
+        assert len(requests) == 1
+        assert requests[0].method == "PATCH"
+        assert requests[0].resource_location == "/properties/reported/"
+        assert json_codec.loads(requests[0].request_body) == {
+            "a": {"x": 1, "y": 3},
+            "b": None,
+            "c": 4,
+        }
+
+    @pytest.mark.it("Completes every merged operation with the response to the request")
+    @pytest.mark.parametrize(
+        "status_code, error",
+        [pytest.param(200, None, id="Success"), pytest.param(400, Exception, id="Failure")],
+    )
+    def test_completes_all(self, mocker, stage, timer, status_code, error):
+        ops = [self.patch_reported(mocker, stage, {"a": i}) for i in range(3)]
+        self.fire_timer(timer)
+        request = self.requests_sent(stage)[0]
+        request.status_code = status_code
+        request.callback(request)
+        for op in ops:
+            if error:
+                assert_callback_failed(op=op, error=error)
+            else:
+                assert_callback_succeeded(op=op)
+
+    @pytest.mark.it("Sends the pending patches right away once they reach the maximum size")
+    def test_max_size(self, mocker, stage, timer):
+        self.patch_reported(mocker, stage, {"a": "x" * 50})
+        assert stage.next.run_op.call_count == 0
+        self.patch_reported(mocker, stage, {"b": "x" * 50})
+        assert stage.next.run_op.call_count == 1
+        assert timer.return_value.cancel.call_count == 1
+
+    @pytest.mark.it("Measures the size of the patches in encoded bytes")
+    def test_max_size_bytes(self, mocker, stage, timer):
+        # Whether a codec escapes non-ASCII characters depends on the codec, so the encoded patch
+        # is 60 characters, but 120 bytes in UTF-8
+        mocker.patch.object(json_codec, "dumps", return_value=u"\u00e9" * 60)
+        self.patch_reported(mocker, stage, {"a": 1})
+        assert stage.next.run_op.call_count == 1
+
+    @pytest.mark.it(
+        "Does not send the next patches early if the timer fired for patches already sent"
+    )
+    def test_stale_timer(self, mocker, stage, timer):
+        self.patch_reported(mocker, stage, {"a": "x" * 50})
+        stale_timer_callback = timer.call_args[0][1]
+        self.patch_reported(mocker, stage, {"b": "x" * 50})
+        assert stage.next.run_op.call_count == 1
+
+        self.patch_reported(mocker, stage, {"c": 1})
+        # The timer of the patches sent for reaching the maximum size was already queued
+        stale_timer_callback()
+        assert stage.next.run_op.call_count == 1
+
+        self.fire_timer(timer)
+        assert stage.next.run_op.call_count == 2
+
+    @pytest.mark.it(
+        "Sends the pending patches first if a patch sets properties inside a property they set to a value"
+    )
+    @pytest.mark.parametrize(
+        "first_patch",
+        [pytest.param({"a": None}, id="Removed"), pytest.param({"a": 1}, id="Not an object")],
+    )
+    def test_conflict(self, mocker, stage, timer, first_patch):
+        self.patch_reported(mocker, stage, first_patch)
+        self.patch_reported(mocker, stage, {"a": {"b": 1}})
+        self.fire_timer(timer)
+        requests = self.requests_sent(stage)
+        assert [json_codec.loads(r.request_body) for r in requests] == [
+            first_patch,
+            {"a": {"b": 1}},
+        ]
+
+    @pytest.mark.it("Sends the pending patches before a GetTwinOperation")
+    def test_get_twin(self, mocker, stage, timer):
+        self.patch_reported(mocker, stage, {"a": 1})
+        stage.run_op(pipeline_ops_iothub.GetTwinOperation(callback=mocker.MagicMock()))
+        requests = self.requests_sent(stage)
+        assert [r.method for r in requests] == ["PATCH", "GET"]
+
+    @pytest.mark.it("Does not change the patches of the operations")
+    def test_patch_not_modified(self, mocker, stage, timer):
+        patch = {"a": {"b": 1}}
+        self.patch_reported(mocker, stage, patch)
+        self.patch_reported(mocker, stage, {"a": {"c": 2}})
+        assert patch == {"a": {"b": 1}}
+
+
+pipeline_stage_test.add_base_pipeline_stage_tests(
+    cls=pipeline_stages_iothub.StoreAndForwardStage,
+    module=this_module,
+    all_ops=all_common_ops + all_iothub_ops,
+    handled_ops=[
+        pipeline_ops_iothub.SendD2CMessageOperation,
+        pipeline_ops_iothub.SendOutputEventOperation,
+    ],
+    all_events=all_common_events + all_iothub_events,
+    handled_events=[],
+)
+
+
+class StoreAndForwardStageTestBase(object):
+    @pytest.fixture
+    def config(self, tmpdir):
+        return IoTHubPipelineConfig(outbox_path=str(tmpdir.join("outbox")))
+
+    @pytest.fixture
+    def stage(self, mocker, config):
+        stage = make_mock_stage(mocker, pipeline_stages_iothub.StoreAndForwardStage)
+        stage.pipeline_configuration = config
+        # Operations passed down stay pending unless the test completes them
+        stage.next.run_op = mocker.MagicMock()
+        return stage
+
+    @pytest.fixture
+    def timer(self, mocker):
+        wheel = mocker.MagicMock()
+        mocker.patch.object(timer_wheel, "get_shared_timer_wheel", return_value=wheel)
+        return wheel.schedule
+
+    def ops_sent_down(self, stage, op_cls=pipeline_ops_iothub.SendD2CMessageOperation):
+        return [
+            call[0][0] for call in stage.next.run_op.call_args_list if type(call[0][0]) is op_cls
+        ]
+
+    def store_messages(self, stage, count):
+        for i in range(count):
+            stage.run_op(
+                pipeline_ops_iothub.SendD2CMessageOperation(
+                    message=Message("message {}".format(i)), callback=lambda op: None
+                )
+            )
+
+
+@pytest.mark.describe("StoreAndForwardStage - .run_op() -- called with telemetry operations")
+class TestStoreAndForwardStageRunOp(StoreAndForwardStageTestBase):
+    @pytest.fixture
+    def op(self, callback):
+        return pipeline_ops_iothub.SendD2CMessageOperation(
+            message=Message("some data"), callback=callback
+        )
+
+    @pytest.mark.it("Passes the operation down if there is no outbox_path in the configuration")
+    def test_no_outbox(self, stage, op):
+        stage.pipeline_configuration = IoTHubPipelineConfig()
+        stage.run_op(op)
+        assert stage.next.run_op.call_args[0][0] is op
+        assert stage.outbox is None
+
+    @pytest.mark.it("Passes the operation down if connected and the outbox is empty")
+    def test_connected(self, stage, op):
+        stage.connected = True
+        stage.run_op(op)
+        assert stage.next.run_op.call_args[0][0] is op
+        assert len(stage.outbox) == 0
+
+    @pytest.mark.it("Stores the message in the outbox and completes the operation if not connected")
+    @pytest.mark.parametrize(
+        "op_cls",
+        [pipeline_ops_iothub.SendD2CMessageOperation, pipeline_ops_iothub.SendOutputEventOperation],
+    )
+    def test_stores_when_disconnected(self, stage, callback, op_cls):
+        op = op_cls(message=Message("some data"), callback=callback)
+        stage.run_op(op)
+        assert len(stage.outbox) == 1
+        assert self.ops_sent_down(stage, op_cls) == []
+        assert_callback_succeeded(op=op)
+
+    @pytest.mark.it("Stores the message if older messages are still waiting in the outbox")
+    def test_stores_when_outbox_not_empty(self, stage, op):
+        self.store_messages(stage, 1)
+        stage.connected = True
+        stage.run_op(op)
+        assert len(stage.outbox) == 2
+        assert op not in self.ops_sent_down(stage)
+
+    @pytest.mark.it("Starts a single ConnectOperation if not connected")
+    def test_connects(self, stage):
+        self.store_messages(stage, 3)
+        connect_ops = self.ops_sent_down(stage, pipeline_ops_base.ConnectOperation)
+        assert len(connect_ops) == 1
+
+        # A new connect is started once the previous one completes
+        connect_ops[0].error = Exception()
+        connect_ops[0].callback(connect_ops[0])
+        self.store_messages(stage, 1)
+        assert len(self.ops_sent_down(stage, pipeline_ops_base.ConnectOperation)) == 2
+        assert len(stage.outbox) == 4
+
+    @pytest.mark.it(
+        "Fails the operation with an OutboxFullError if the outbox is full and outbox_eviction_policy is 'drop_newest'"
+    )
+    def test_outbox_full(self, tmpdir, stage, op):
+        stage.pipeline_configuration = IoTHubPipelineConfig(
+            outbox_path=str(tmpdir.join("outbox")),
+            outbox_max_size=200,
+            outbox_eviction_policy="drop_newest",
+        )
+        self.store_messages(stage, 10)
+        stage.run_op(op)
+        assert_callback_failed(op=op, error=outbox.OutboxFullError)
+
+    @pytest.mark.it(
+        "Stores the message data as the payload which the MQTT client would publish for it while connected"
+    )
+    @pytest.mark.parametrize(
+        "data, payload",
+        [
+            pytest.param(u"d\u00e4ta", u"d\u00e4ta".encode("utf-8"), id="Text"),
+            pytest.param(b"\x00\xff", b"\x00\xff", id="Bytes"),
+            pytest.param(bytearray(b"\x01"), b"\x01", id="Bytearray"),
+            pytest.param(5, b"5", id="Integer"),
+            pytest.param(1.5, b"1.5", id="Float"),
+            pytest.param(True, b"True", id="Bool"),
+            pytest.param(None, b"", id="None"),
+        ],
+    )
+    def test_stored_payload(self, stage, callback, data, payload):
+        stage.run_op(
+            pipeline_ops_iothub.SendD2CMessageOperation(message=Message(data), callback=callback)
+        )
+        stage.on_connected()
+        assert self.ops_sent_down(stage)[0].message.data == payload
+
+    @pytest.mark.it("Fails the operation with a TypeError if the message data cannot be published")
+    def test_unsupported_data(self, stage, op):
+        op.message.data = object()
+        stage.run_op(op)
+        assert_callback_failed(op=op, error=TypeError)
+        assert len(stage.outbox) == 0
+
+
+@pytest.mark.describe("StoreAndForwardStage - .on_connected()")
+class TestStoreAndForwardStageOnConnected(StoreAndForwardStageTestBase):
+    @pytest.mark.it("Sends the messages in the outbox in the order they were stored")
+    def test_sends_stored_messages(self, stage):
+        self.store_messages(stage, 3)
+        stage.on_connected()
+        sent = self.ops_sent_down(stage)
+        assert [op.message.data for op in sent] == [b"message 0", b"message 1", b"message 2"]
+
+    @pytest.mark.it("Removes messages from the outbox once they are acknowledged")
+    def test_commits_acknowledged_messages(self, stage):
+        self.store_messages(stage, 3)
+        stage.on_connected()
+        sent = self.ops_sent_down(stage)
+
+        # Acknowledging out of order only removes messages from the head of the outbox
+        sent[1].callback(sent[1])
+        assert len(stage.outbox) == 3
+        sent[0].callback(sent[0])
+        assert len(stage.outbox) == 1
+        sent[2].callback(sent[2])
+        assert len(stage.outbox) == 0
+
+    @pytest.mark.it("Passes telemetry operations down again once the outbox is empty")
+    def test_resumes_passing_down(self, stage, callback):
+        self.store_messages(stage, 1)
+        stage.on_connected()
+        sent = self.ops_sent_down(stage)[0]
+        sent.callback(sent)
+
+        op = pipeline_ops_iothub.SendD2CMessageOperation(message=Message("new"), callback=callback)
+        stage.run_op(op)
+        assert stage.next.run_op.call_args[0][0] is op
+
+    @pytest.mark.it(
+        "Keeps no more than max_inflight_messages stored messages awaiting acknowledgement"
+    )
+    def test_inflight_limit(self, tmpdir, stage):
+        stage.pipeline_configuration = IoTHubPipelineConfig(
+            outbox_path=str(tmpdir.join("outbox")), max_inflight_messages=2
+        )
+        self.store_messages(stage, 3)
+        stage.on_connected()
+        sent = self.ops_sent_down(stage)
+        assert len(sent) == 2
+
+        sent[0].callback(sent[0])
+        assert len(self.ops_sent_down(stage)) == 3
+
+    @pytest.mark.it("Sends no more than outbox_drain_rate stored messages per second")
+    def test_drain_rate(self, tmpdir, stage, timer):
+        stage.pipeline_configuration = IoTHubPipelineConfig(
+            outbox_path=str(tmpdir.join("outbox")), outbox_drain_rate=2
+        )
+        self.store_messages(stage, 5)
+        stage.on_connected()
+        assert len(self.ops_sent_down(stage)) == 2
+        assert timer.call_count == 1
+        assert 0 < timer.call_args[0][0] <= 1
+
+    @pytest.mark.it("Sends messages which were stored by a previous run of the process")
+    def test_sends_previously_stored_messages(self, mocker, stage, config):
+        self.store_messages(stage, 2)
+        stage.outbox.close()
+
+        new_stage = make_mock_stage(mocker, pipeline_stages_iothub.StoreAndForwardStage)
+        new_stage.pipeline_configuration = config
+        new_stage.next.run_op = mocker.MagicMock()
+        new_stage.on_connected()
+        assert [op.message.data for op in self.ops_sent_down(new_stage)] == [
+            b"message 0",
+            b"message 1",
+        ]
+
+    @pytest.mark.it("Keeps the properties of stored messages")
+    def test_message_properties(self, stage):
+        message = Message(b"\x00\x01binary", message_id="id", content_type="application/json")
+        message.custom_properties = {"key": "value"}
+        message.output_name = "output"
+        stage.run_op(
+            pipeline_ops_iothub.SendOutputEventOperation(message=message, callback=lambda op: None)
+        )
+        stage.on_connected()
+
+        sent = self.ops_sent_down(stage, pipeline_ops_iothub.SendOutputEventOperation)[0]
+        assert sent.message.data == b"\x00\x01binary"
+        assert sent.message.message_id == "id"
+        assert sent.message.content_type == "application/json"
+        assert sent.message.custom_properties == {"key": "value"}
+        assert sent.message.output_name == "output"
+
+    @pytest.mark.it("Keeps a message in the outbox and retries later if sending it fails")
+    def test_send_failure(self, stage, timer):
+        self.store_messages(stage, 1)
+        stage.on_connected()
+        sent = self.ops_sent_down(stage)[0]
+        sent.error = Exception()
+        sent.callback(sent)
+
+        assert len(stage.outbox) == 1
+        assert timer.call_count == 1
+        timer.call_args[0][1]()
+        assert len(self.ops_sent_down(stage)) == 2
+
+
+@pytest.mark.describe("StoreAndForwardStage - .on_disconnected()")
+class TestStoreAndForwardStageOnDisconnected(StoreAndForwardStageTestBase):
+    @pytest.mark.it("Stores new messages again")
+    def test_stores_messages(self, stage, callback):
+        stage.on_connected()
+        stage.on_disconnected()
+        op = pipeline_ops_iothub.SendD2CMessageOperation(message=Message("new"), callback=callback)
+        stage.run_op(op)
+        assert len(stage.outbox) == 1
+
+    @pytest.mark.it("Sends unacknowledged messages again after the next connect")
+    def test_resends_unacknowledged(self, stage):
+        self.store_messages(stage, 2)
+        stage.on_connected()
+        first_send = self.ops_sent_down(stage)
+        first_send[0].callback(first_send[0])
+
+        stage.on_disconnected()
+        # Completions from before the disconnect are ignored
+        first_send[1].callback(first_send[1])
+        assert len(stage.outbox) == 1
+
+        stage.on_connected()
+        second_send = self.ops_sent_down(stage)[2:]
+        assert [op.message.data for op in second_send] == [b"message 1"]
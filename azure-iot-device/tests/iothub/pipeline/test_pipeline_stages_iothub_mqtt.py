@@ -9,6 +9,7 @@ import pytest
 import json
 import sys
 from azure.iot.device.common.pipeline import (
+    operation_flow,
     pipeline_events_base,
     pipeline_ops_base,
     pipeline_stages_base,
@@ -21,6 +22,7 @@ from azure.iot.device.iothub.pipeline import (
     pipeline_ops_iothub,
     pipeline_stages_iothub_mqtt,
 )
+from azure.iot.device.iothub.pipeline.config import IoTHubPipelineConfig
 from azure.iot.device.iothub.models.message import Message
 from azure.iot.device.iothub.models.methods import MethodRequest, MethodResponse
 from tests.common.pipeline.helpers import (
@@ -109,6 +111,8 @@ ops_handled_by_this_stage = [
     pipeline_ops_base.SendIotRequestOperation,
     pipeline_ops_base.EnableFeatureOperation,
     pipeline_ops_base.DisableFeatureOperation,
+    pipeline_ops_base.ConnectOperation,
+    pipeline_ops_base.ReconnectOperation,
 ]
 
 events_handled_by_this_stage = [pipeline_events_mqtt.IncomingMQTTMessageEvent]
@@ -125,7 +129,9 @@ pipeline_stage_test.add_base_pipeline_stage_tests(
 
 @pytest.fixture
 def stage(mocker):
-    return make_mock_stage(mocker, pipeline_stages_iothub_mqtt.IoTHubMQTTConverterStage)
+    stage = make_mock_stage(mocker, pipeline_stages_iothub_mqtt.IoTHubMQTTConverterStage)
+    stage.pipeline_configuration = IoTHubPipelineConfig()
+    return stage
 
 
 @pytest.fixture
@@ -411,6 +417,14 @@ publish_ops = [
         "topic": "$iothub/methods/res/__fake_method_status__/?$rid=__fake_request_id__",
         "publish_payload": json.dumps(fake_method_payload),
     },
+    {
+        "name": "send method result with encoded payload",
+        "stage_type": "both",
+        "op_class": pipeline_ops_iothub.SendMethodResponseOperation,
+        "op_init_kwargs": {"method_response": fake_method_response, "payload": "__encoded__"},
+        "topic": "$iothub/methods/res/__fake_method_status__/?$rid=__fake_request_id__",
+        "publish_payload": "__encoded__",
+    },
 ]
 
 
@@ -439,6 +453,19 @@ class TestIoTHubMQTTConverterForPublishOps(object):
         new_op = stage.next._run_op.call_args[0][0]
         assert new_op.payload == params["publish_payload"]
 
+    @pytest.mark.it(
+        "Publishes telemetry and output events with the telemetry_qos of the pipeline configuration"
+    )
+    @pytest.mark.parametrize("telemetry_qos", [0, 1])
+    def test_telemetry_qos(self, stage, stages_configured_for_both, params, op, telemetry_qos):
+        stage.pipeline_configuration.telemetry_qos = telemetry_qos
+        stage.run_op(op)
+        new_op = stage.next._run_op.call_args[0][0]
+        if params["op_class"] is pipeline_ops_iothub.SendMethodResponseOperation:
+            assert new_op.qos == 1
+        else:
+            assert new_op.qos == telemetry_qos
+
 
 feature_name_to_subscribe_topic = [
     {
@@ -516,6 +543,160 @@ class TestIoTHubMQTTConverterWithEnableFeature(object):
         assert isinstance(callback_arg.error, KeyError)
 
 
+connect_ops = [
+    pytest.param(pipeline_ops_base.ConnectOperation, id="ConnectOperation"),
+    pytest.param(pipeline_ops_base.ReconnectOperation, id="ReconnectOperation"),
+]
+
+
+@pytest.fixture
+def subscribe_on_connect(stage):
+    stage.pipeline_configuration.subscribe_on_connect = [constant.METHODS, constant.TWIN]
+
+
+@pytest.mark.describe(
+    "IoTHubMQTTConverterStage - .run_op() -- called with ConnectOperation or ReconnectOperation"
+)
+class TestIoTHubMQTTConverterWithConnect(object):
+    @pytest.mark.it("Passes the operation down if subscribe_on_connect is not set")
+    @pytest.mark.parametrize("op_class", connect_ops)
+    def test_passes_op_down(self, stage, stages_configured_for_both, op_class, callback):
+        op = op_class(callback=callback)
+        stage.run_op(op)
+        assert stage.next._run_op.call_count == 1
+        assert stage.next._run_op.call_args[0][0] is op
+        assert_callback_succeeded(op=op)
+
+    @pytest.mark.it(
+        "Subscribes to the topics of all of the subscribe_on_connect features in one operation after connecting"
+    )
+    @pytest.mark.parametrize("op_class", connect_ops)
+    def test_subscribes_after_connecting(
+        self, stage, stages_configured_for_both, subscribe_on_connect, op_class, callback
+    ):
+        stage.run_op(op_class(callback=callback))
+        assert stage.next._run_op.call_count == 2
+        assert isinstance(stage.next._run_op.call_args_list[0][0][0], op_class)
+        new_op = stage.next._run_op.call_args_list[1][0][0]
+        assert isinstance(new_op, pipeline_ops_mqtt.MQTTSubscribeOperation)
+        assert new_op.topic == [
+            stage.feature_to_topic[constant.METHODS],
+            stage.feature_to_topic[constant.TWIN],
+        ]
+
+    @pytest.mark.it("Leaves the input feature out of the subscribe operation for a device")
+    @pytest.mark.parametrize("op_class", connect_ops)
+    def test_device_input(self, stage, stage_configured_for_device, op_class, callback):
+        stage.pipeline_configuration.subscribe_on_connect = [constant.INPUT_MSG, constant.TWIN]
+        stage.run_op(op_class(callback=callback))
+        new_op = stage.next._run_op.call_args_list[1][0][0]
+        assert isinstance(new_op, pipeline_ops_mqtt.MQTTSubscribeOperation)
+        assert new_op.topic == [stage.feature_to_topic[constant.TWIN]]
+
+    @pytest.mark.it("Passes the operation down if input is the only feature, for a device")
+    @pytest.mark.parametrize("op_class", connect_ops)
+    def test_device_input_only(self, stage, stage_configured_for_device, op_class, callback):
+        stage.pipeline_configuration.subscribe_on_connect = [constant.INPUT_MSG]
+        op = op_class(callback=callback)
+        stage.run_op(op)
+        assert stage.next._run_op.call_count == 1
+        assert stage.next._run_op.call_args[0][0] is op
+        assert_callback_succeeded(op=op)
+
+    @pytest.mark.it("Subscribes to the input feature for a module")
+    @pytest.mark.parametrize("op_class", connect_ops)
+    def test_module_input(self, stage, stage_configured_for_module, op_class, callback):
+        stage.pipeline_configuration.subscribe_on_connect = [constant.INPUT_MSG, constant.TWIN]
+        stage.run_op(op_class(callback=callback))
+        new_op = stage.next._run_op.call_args_list[1][0][0]
+        assert new_op.topic == [
+            stage.feature_to_topic[constant.INPUT_MSG],
+            stage.feature_to_topic[constant.TWIN],
+        ]
+
+    @pytest.mark.it("Completes the operation once the subscribe operation completes")
+    @pytest.mark.parametrize("op_class", connect_ops)
+    def test_completes_after_subscribe(
+        self, mocker, stage, stages_configured_for_both, subscribe_on_connect, op_class, callback
+    ):
+        stage.next.run_op = mocker.MagicMock()
+        op = op_class(callback=callback)
+        stage.run_op(op)
+        connect_op = stage.next.run_op.call_args[0][0]
+        operation_flow.complete_op(stage.next, connect_op)
+        assert callback.call_count == 0
+
+        subscribe_op = stage.next.run_op.call_args[0][0]
+        operation_flow.complete_op(stage.next, subscribe_op)
+        assert_callback_succeeded(op=op)
+
+    @pytest.mark.it("Fails the operation without subscribing if the connect fails")
+    @pytest.mark.parametrize("op_class", connect_ops)
+    def test_connect_fails(
+        self, mocker, stage, stages_configured_for_both, subscribe_on_connect, op_class, callback
+    ):
+        stage.next.run_op = mocker.MagicMock()
+        op = op_class(callback=callback)
+        stage.run_op(op)
+        connect_op = stage.next.run_op.call_args[0][0]
+        connect_op.error = Exception()
+        operation_flow.complete_op(stage.next, connect_op)
+        assert stage.next.run_op.call_count == 1
+        assert_callback_failed(op=op, error=connect_op.error)
+
+    @pytest.mark.it(
+        "Completes the operation, and subscribes to each feature when it is enabled, if the subscribe fails"
+    )
+    @pytest.mark.parametrize("op_class", connect_ops)
+    def test_subscribe_fails(
+        self, mocker, stage, stages_configured_for_both, subscribe_on_connect, op_class, callback
+    ):
+        stage.next.run_op = mocker.MagicMock()
+        op = op_class(callback=callback)
+        stage.run_op(op)
+        operation_flow.complete_op(stage.next, stage.next.run_op.call_args[0][0])
+        subscribe_op = stage.next.run_op.call_args[0][0]
+        subscribe_op.error = Exception()
+        operation_flow.complete_op(stage.next, subscribe_op)
+        assert_callback_succeeded(op=op)
+
+        stage.run_op(pipeline_ops_base.EnableFeatureOperation(feature_name=constant.TWIN))
+        assert isinstance(
+            stage.next.run_op.call_args[0][0], pipeline_ops_mqtt.MQTTSubscribeOperation
+        )
+
+    @pytest.mark.it(
+        "Completes EnableFeatureOperation operations for subscribe_on_connect features without subscribing"
+    )
+    def test_enable_feature_completes(
+        self, stage, stages_configured_for_both, subscribe_on_connect, callback
+    ):
+        stage.run_op(pipeline_ops_base.ConnectOperation())
+        stage.next._run_op.reset_mock()
+        op = pipeline_ops_base.EnableFeatureOperation(feature_name=constant.TWIN, callback=callback)
+        stage.run_op(op)
+        assert stage.next._run_op.call_count == 0
+        assert_callback_succeeded(op=op)
+
+    @pytest.mark.it("Subscribes again when a feature is enabled after it was disabled")
+    def test_enable_after_disable(self, stage, stages_configured_for_both, subscribe_on_connect):
+        stage.run_op(pipeline_ops_base.ConnectOperation())
+        stage.run_op(pipeline_ops_base.DisableFeatureOperation(feature_name=constant.TWIN))
+        stage.next._run_op.reset_mock()
+        stage.run_op(pipeline_ops_base.EnableFeatureOperation(feature_name=constant.TWIN))
+        assert stage.next._run_op.call_count == 1
+        new_op = stage.next._run_op.call_args[0][0]
+        assert isinstance(new_op, pipeline_ops_mqtt.MQTTSubscribeOperation)
+        assert new_op.topic == stage.feature_to_topic[constant.TWIN]
+
+    @pytest.mark.it("Subscribes to other features when they are enabled")
+    def test_other_feature(self, stage, stages_configured_for_both, subscribe_on_connect):
+        stage.run_op(pipeline_ops_base.ConnectOperation())
+        stage.next._run_op.reset_mock()
+        stage.run_op(pipeline_ops_base.EnableFeatureOperation(feature_name=constant.TWIN_PATCHES))
+        assert stage.next._run_op.call_count == 1
+
+
 @pytest.fixture
 def add_pipeline_root(stage, mocker):
     root = pipeline_stages_base.PipelineRootStage()
@@ -978,10 +1159,6 @@ class TestIotHubMQTTConverterHandlePipelineEventTwinPatch(object):
     def fake_patch_as_bytes(self, fake_patch):
         return json.dumps(fake_patch).encode("utf-8")
 
-    @pytest.fixture
-    def fake_patch_not_bytes(self):
-        return "__fake_patch_that_is_not_bytes__"
-
     @pytest.fixture
     def fake_patch_not_json(self):
         return "__fake_patch_that_is_not_json__".encode("utf-8")
@@ -999,14 +1176,16 @@ class TestIotHubMQTTConverterHandlePipelineEventTwinPatch(object):
         stage.device_id = fake_device_id
 
     @pytest.mark.it(
-        "Calls .handle_pipeline_event() on the previous stage with an TwinDesiredPropertiesPatchEvent, with the patch set to the payload after decoding and deserializing it"
+        "Calls .handle_pipeline_event() on the previous stage with an TwinDesiredPropertiesPatchEvent, with the patch set to the payload, without decoding it"
     )
-    def test_calls_previous_stage(self, stage, fixup_stage_for_test, fake_event, fake_patch):
+    def test_calls_previous_stage(
+        self, stage, fixup_stage_for_test, fake_event, fake_patch_as_bytes
+    ):
         stage.handle_pipeline_event(fake_event)
         assert stage.previous.handle_pipeline_event.call_count == 1
         new_event = stage.previous.handle_pipeline_event.call_args[0][0]
         assert isinstance(new_event, pipeline_events_iothub.TwinDesiredPropertiesPatchEvent)
-        assert new_event.patch == fake_patch
+        assert new_event.patch is fake_patch_as_bytes
 
     @pytest.mark.it("Calls the unhandled exception handler if there is no previous stage")
     def test_no_previous_stage(
@@ -1017,26 +1196,12 @@ class TestIotHubMQTTConverterHandlePipelineEventTwinPatch(object):
         assert unhandled_error_handler.call_count == 1
         assert isinstance(unhandled_error_handler.call_args[0][0], NotImplementedError)
 
-    @pytest.mark.it("Calls the unhandled exception handler if the payload is not a Bytes object")
-    def test_payload_not_bytes(
-        self, stage, fixup_stage_for_test, fake_event, fake_patch_not_bytes, unhandled_error_handler
-    ):
-        fake_event.payload = fake_patch_not_bytes
-        stage.handle_pipeline_event(fake_event)
-        assert unhandled_error_handler.call_count == 1
-        if not (
-            isinstance(unhandled_error_handler.call_args[0][0], AttributeError)
-            or isinstance(unhandled_error_handler.call_args[0][0], ValueError)
-        ):
-            assert False
-
-    @pytest.mark.it(
-        "Calls the unhandled exception handler if the payload cannot be deserialized as a JSON object"
-    )
+    @pytest.mark.it("Does not deserialize the payload, even if it is not a JSON object")
     def test_payload_not_json(
         self, stage, fixup_stage_for_test, fake_event, fake_patch_not_json, unhandled_error_handler
     ):
         fake_event.payload = fake_patch_not_json
         stage.handle_pipeline_event(fake_event)
-        assert unhandled_error_handler.call_count == 1
-        assert isinstance(unhandled_error_handler.call_args[0][0], ValueError)
+        assert unhandled_error_handler.call_count == 0
+        new_event = stage.previous.handle_pipeline_event.call_args[0][0]
+        assert new_event.patch is fake_patch_not_json
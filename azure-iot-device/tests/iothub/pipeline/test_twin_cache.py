@@ -0,0 +1,209 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import pytest
+from azure.iot.device.common import json_codec
+from azure.iot.device.iothub.pipeline import twin_cache
+from azure.iot.device.iothub.pipeline.twin_cache import (
+    TwinCache,
+    apply_merge_patch,
+    create_merge_patch,
+)
+
+
+def encode(obj):
+    return json_codec.dumps(obj).encode("utf-8")
+
+
+def make_twin(version, **desired):
+    desired["$version"] = version
+    return encode({"desired": desired, "reported": {"$version": 1}})
+
+
+def make_patch(version, **properties):
+    properties["$version"] = version
+    return encode(properties)
+
+
+@pytest.fixture
+def cache():
+    cache = TwinCache()
+    cache.start_tracking()
+    return cache
+
+
+@pytest.fixture
+def seeded_cache(cache):
+    cache.seed(cache.generation, make_twin(5, a=1))
+    return cache
+
+
+def desired(cache):
+    return json_codec.loads(cache.get())["desired"]
+
+
+@pytest.mark.describe("apply_merge_patch()")
+class TestApplyMergePatch(object):
+    @pytest.mark.it("Applies a merge patch as described in RFC 7386")
+    @pytest.mark.parametrize(
+        "target, patch, expected",
+        [
+            pytest.param({"a": 1}, {"a": 2}, {"a": 2}, id="Replace"),
+            pytest.param({"a": 1}, {"b": 2}, {"a": 1, "b": 2}, id="Add"),
+            pytest.param({"a": 1, "b": 2}, {"a": None}, {"b": 2}, id="Remove"),
+            pytest.param({"a": 1}, {"b": None}, {"a": 1}, id="Remove missing key"),
+            pytest.param(
+                {"a": {"b": 1, "c": 2}}, {"a": {"b": 3}}, {"a": {"b": 3, "c": 2}}, id="Nested"
+            ),
+            pytest.param({"a": 1}, {"a": {"b": None, "c": 2}}, {"a": {"c": 2}}, id="Not a dict"),
+            pytest.param({"a": {"b": 1}}, {"a": [1, 2]}, {"a": [1, 2]}, id="List"),
+        ],
+    )
+    def test_merge_patch(self, target, patch, expected):
+        apply_merge_patch(target, patch)
+        assert target == expected
+
+
+@pytest.mark.describe("create_merge_patch()")
+class TestCreateMergePatch(object):
+    @pytest.mark.it("Creates the smallest merge patch from the source to the target")
+    @pytest.mark.parametrize(
+        "source, target, expected",
+        [
+            pytest.param({"a": 1}, {"a": 1}, {}, id="Unchanged"),
+            pytest.param({"a": 1}, {"a": 2}, {"a": 2}, id="Changed"),
+            pytest.param({"a": 1}, {"a": 1, "b": 2}, {"b": 2}, id="Added"),
+            pytest.param({"a": 1, "b": 2}, {"a": 1}, {"b": None}, id="Removed"),
+            pytest.param({"a": 1, "b": 2}, {"a": 1, "b": None}, {"b": None}, id="Set to None"),
+            pytest.param({"a": 1}, {"a": 1, "b": None}, {}, id="None, not in source"),
+            pytest.param(
+                {"a": {"b": 1, "c": 2}, "d": 3},
+                {"a": {"b": 1, "c": 3}, "d": 3},
+                {"a": {"c": 3}},
+                id="Nested",
+            ),
+            pytest.param({"a": {"b": 1}}, {"a": 1}, {"a": 1}, id="Object to value"),
+            pytest.param({"a": 1}, {"a": {"b": 1}}, {"a": {"b": 1}}, id="Value to object"),
+            pytest.param({"a": [1, 2]}, {"a": [1, 3]}, {"a": [1, 3]}, id="List"),
+            pytest.param({"a": 1}, {"a": True}, {"a": True}, id="Type changed"),
+        ],
+    )
+    def test_merge_patch(self, source, target, expected):
+        assert create_merge_patch(source, target) == expected
+
+    @pytest.mark.it("Creates a patch which turns the source into the target when applied")
+    def test_round_trip(self):
+        source = {"a": {"b": 1, "c": {"d": 2}}, "e": [1], "f": "g"}
+        target = {"a": {"c": {"d": 3, "h": 4}}, "e": [1, 2], "i": None}
+        patched = json_codec.loads(json_codec.dumps(source))
+        apply_merge_patch(patched, create_merge_patch(source, target))
+        assert patched == {"a": {"c": {"d": 3, "h": 4}}, "e": [1, 2]}
+
+
+@pytest.mark.describe("TwinCache - .get()")
+class TestTwinCacheGet(object):
+    @pytest.mark.it("Returns None if the cache has not been seeded")
+    def test_not_seeded(self, cache):
+        assert cache.get() is None
+
+    @pytest.mark.it("Returns the twin the cache was seeded with")
+    def test_seeded(self, cache):
+        twin = make_twin(5, a=1)
+        cache.seed(cache.generation, twin)
+        assert cache.get() is twin
+
+    @pytest.mark.it("Returns the twin with the patches which were added since applied")
+    def test_applies_patches(self, seeded_cache):
+        seeded_cache.add_patch(make_patch(6, a=2, b=3))
+        seeded_cache.add_patch(make_patch(7, b=None))
+        assert desired(seeded_cache) == {"a": 2, "$version": 7}
+
+    @pytest.mark.it("Only decodes the patches once")
+    def test_decodes_once(self, mocker, seeded_cache):
+        seeded_cache.add_patch(make_patch(6, a=2))
+        seeded_cache.get()
+        spy = mocker.spy(json_codec, "loads")
+        seeded_cache.get()
+        assert spy.call_count == 0
+
+    @pytest.mark.it("Skips patches which are already in the twin the cache was seeded with")
+    def test_skips_old_patches(self, cache):
+        cache.add_patch(make_patch(5, a=1))
+        cache.seed(cache.generation, make_twin(5, a=1))
+        cache.add_patch(make_patch(6, a=2))
+        assert desired(cache) == {"a": 2, "$version": 6}
+
+    @pytest.mark.it("Drops the cache and returns None if a patch was missed")
+    def test_version_gap(self, seeded_cache):
+        generation = seeded_cache.generation
+        seeded_cache.add_patch(make_patch(7, a=2))
+        assert seeded_cache.get() is None
+        assert seeded_cache.generation != generation
+        # Adding the missing patch now does not help
+        seeded_cache.add_patch(make_patch(6, a=2))
+        assert seeded_cache.get() is None
+
+    @pytest.mark.it("Drops the cache and returns None if a patch has no $version")
+    def test_no_version(self, seeded_cache):
+        seeded_cache.add_patch(encode({"a": 2}))
+        assert seeded_cache.get() is None
+
+    @pytest.mark.it("Returns None if tracking has not started")
+    def test_not_tracking(self):
+        cache = TwinCache()
+        cache.seed(cache.generation, make_twin(5))
+        assert cache.get() is None
+
+
+@pytest.mark.describe("TwinCache - .seed()")
+class TestTwinCacheSeed(object):
+    @pytest.mark.it("Does not seed the cache if it was dropped since the twin was requested")
+    def test_generation_changed(self, cache):
+        generation = cache.generation
+        cache.clear()
+        cache.seed(generation, make_twin(5))
+        assert cache.get() is None
+
+
+@pytest.mark.describe("TwinCache - .add_patch()")
+class TestTwinCacheAddPatch(object):
+    @pytest.mark.it("Drops the cache if too many patches are waiting to be applied")
+    def test_too_many_patches(self, seeded_cache):
+        for version in range(6, 6 + twin_cache.MAX_PENDING_PATCHES + 1):
+            seeded_cache.add_patch(make_patch(version, a=version))
+        assert seeded_cache.get() is None
+
+    @pytest.mark.it("Does not decode the patch")
+    def test_does_not_decode(self, mocker, seeded_cache):
+        spy = mocker.spy(json_codec, "loads")
+        seeded_cache.add_patch(make_patch(6, a=2))
+        assert spy.call_count == 0
+
+
+@pytest.mark.describe("TwinCache - Tracking")
+class TestTwinCacheTracking(object):
+    @pytest.mark.it("Drops the cache when it is cleared, but keeps tracking patches")
+    def test_clear(self, seeded_cache):
+        seeded_cache.clear()
+        assert seeded_cache.get() is None
+        seeded_cache.seed(seeded_cache.generation, make_twin(5))
+        assert seeded_cache.get() is not None
+
+    @pytest.mark.it("Drops the cache when it is invalidated, and stops tracking until resumed")
+    def test_invalidate(self, seeded_cache):
+        seeded_cache.invalidate()
+        seeded_cache.seed(seeded_cache.generation, make_twin(5))
+        assert seeded_cache.get() is None
+
+        seeded_cache.resume_tracking()
+        seeded_cache.seed(seeded_cache.generation, make_twin(5))
+        assert seeded_cache.get() is not None
+
+    @pytest.mark.it("Does not resume tracking after tracking was stopped")
+    def test_stop_tracking(self, seeded_cache):
+        seeded_cache.stop_tracking()
+        seeded_cache.resume_tracking()
+        seeded_cache.seed(seeded_cache.generation, make_twin(5))
+        assert seeded_cache.get() is None
@@ -4,14 +4,16 @@
 # license information.
 # --------------------------------------------------------------------------
 
+import json
 import pytest
 import threading
 import time
 import os
 import io
 import six
+from concurrent.futures import Future
 from azure.iot.device.iothub import IoTHubDeviceClient, IoTHubModuleClient
-from azure.iot.device.iothub.pipeline import IoTHubPipeline, constant
+from azure.iot.device.iothub.pipeline import IoTHubPipeline, IoTHubPipelineConfig, constant
 from azure.iot.device.iothub.models import Message, MethodRequest
 from azure.iot.device.iothub.sync_inbox import SyncClientInbox, InboxEmpty
 from azure.iot.device.iothub.auth import IoTEdgeError
@@ -31,6 +33,10 @@ class SharedClientInstantiationTests(object):
         assert client._pipeline.on_disconnected is not None
         assert client._pipeline.on_disconnected == client._on_disconnected
 
+    @pytest.mark.it("Sets on_reconnect_attempt handler in pipeline")
+    def test_sets_on_reconnect_attempt_handler_in_pipeline(self, client):
+        assert client._pipeline.on_reconnect_attempt == client._on_reconnect_attempt
+
     @pytest.mark.it("Sets on_method_request_received handler in pipeline")
     def test_sets_on_method_request_received_handler_in_pipleline(self, client):
         assert client._pipeline.on_method_request_received is not None
@@ -82,9 +88,20 @@ class SharedClientFromCreateFromConnectionStringTests(object):
         assert mock_auth_parse.call_args == mocker.call(mock_conn_str)
         assert mock_auth_parse.return_value.ca_cert is trusted_cert_chain
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth_parse.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth_parse.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
+    @pytest.mark.it("Passes any additional keyword arguments to the pipeline configuration")
+    def test_pipeline_configuration(self, mocker, client_class, connection_string):
+        mock_pipeline_init = mocker.patch("azure.iot.device.iothub.abstract_clients.IoTHubPipeline")
+
+        client_class.create_from_connection_string(connection_string, max_inflight_messages=5)
+
+        config = mock_pipeline_init.call_args[0][1]
+        assert isinstance(config, IoTHubPipelineConfig)
+        assert config.max_inflight_messages == 5
+
     # TODO: If auth package was refactored to use ConnectionString class, tests from that
     # class would increase the coverage here.
     @pytest.mark.it("Raises ValueError when given an invalid connection string")
@@ -124,7 +141,8 @@ class SharedClientFromCreateFromSharedAccessSignature(object):
 
         assert mock_auth_parse.call_count == 1
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth_parse.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth_parse.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
     # TODO: If auth package was refactored to use SasToken class, tests from that
@@ -181,6 +199,14 @@ class SharedClientConnectTests(WaitsForEventCompletion):
         )
         client_manual_cb.connect()
 
+    @pytest.mark.it("Raises the error if the 'connect' pipeline operation fails")
+    def test_raises_error(self, client, pipeline):
+        error = Exception()
+        pipeline.connect.side_effect = lambda callback: callback(error=error)
+        with pytest.raises(Exception) as e_info:
+            client.connect()
+        assert e_info.value is error
+
 
 class SharedClientDisconnectTests(WaitsForEventCompletion):
     @pytest.mark.it("Begins a 'disconnect' pipeline operation")
@@ -206,6 +232,16 @@ class SharedClientDisconnectEventTests(object):
         assert clear_method_request_spy.call_count == 1
 
 
+class SharedClientReconnectAttemptEventTests(object):
+    @pytest.mark.it("Calls the on_reconnect_attempt handler of the client, if there is one")
+    def test_calls_handler(self, client, mocker):
+        client._on_reconnect_attempt(1, None, None)
+        client.on_reconnect_attempt = mocker.MagicMock()
+        error = Exception()
+        client._on_reconnect_attempt(2, error, 4.0)
+        assert client.on_reconnect_attempt.call_args == mocker.call(2, error, 4.0)
+
+
 # TODO: rename
 class SharedClientSendEventTests(WaitsForEventCompletion):
     @pytest.mark.it("Begins a 'send_d2c_message' pipeline operation")
@@ -225,6 +261,14 @@ class SharedClientSendEventTests(WaitsForEventCompletion):
         )
         client_manual_cb.send_d2c_message(message)
 
+    @pytest.mark.it("Raises the error if the 'send_d2c_message' pipeline operation fails")
+    def test_raises_error(self, client, pipeline, message):
+        error = Exception()
+        pipeline.send_d2c_message.side_effect = lambda message, callback: callback(error=error)
+        with pytest.raises(Exception) as e_info:
+            client.send_d2c_message(message)
+        assert e_info.value is error
+
     @pytest.mark.it(
         "Wraps 'message' input parameter in a Message object if it is not a Message object"
     )
@@ -249,6 +293,124 @@ class SharedClientSendEventTests(WaitsForEventCompletion):
         assert sent_message.data == message_input
 
 
+class SharedClientSendEventBatchTests(WaitsForEventCompletion):
+    @pytest.mark.it("Begins a single 'send_d2c_messages' pipeline operation for all the messages")
+    def test_calls_pipeline_send_d2c_messages(self, client, pipeline):
+        messages = [Message("message 1"), Message("message 2"), Message("message 3")]
+        client.send_d2c_messages(messages)
+        assert pipeline.send_d2c_messages.call_count == 1
+        assert pipeline.send_d2c_messages.call_args[0][0] == messages
+        assert pipeline.send_d2c_message.call_count == 0
+
+    @pytest.mark.it(
+        "Waits for the completion of the 'send_d2c_messages' pipeline operation before returning"
+    )
+    def test_waits_for_pipeline_op_completion(self, mocker, client_manual_cb, pipeline_manual_cb):
+        messages = [Message("message 1"), Message("message 2")]
+        self.add_event_completion_checks(
+            mocker=mocker,
+            pipeline_function=pipeline_manual_cb.send_d2c_messages,
+            args=[[None, None]],
+        )
+        client_manual_cb.send_d2c_messages(messages)
+
+    @pytest.mark.it("Returns the per-message results of the 'send_d2c_messages' pipeline operation")
+    def test_returns_results(self, mocker, client, pipeline):
+        error = Exception()
+
+        def fake_send_d2c_messages(messages, callback):
+            callback([None, error])
+
+        pipeline.send_d2c_messages.side_effect = fake_send_d2c_messages
+        results = client.send_d2c_messages([Message("message 1"), Message("message 2")])
+        assert results == [None, error]
+
+    @pytest.mark.it("Accepts any iterable of messages")
+    def test_accepts_generator(self, client, pipeline):
+        client.send_d2c_messages(Message(str(i)) for i in range(3))
+        sent_messages = pipeline.send_d2c_messages.call_args[0][0]
+        assert [m.data for m in sent_messages] == ["0", "1", "2"]
+
+    @pytest.mark.it(
+        "Wraps each item in the 'messages' input parameter in a Message object if it is not a Message object"
+    )
+    def test_wraps_data_in_message(self, client, pipeline):
+        message = Message("message")
+        client.send_d2c_messages([message, "string", 222, {"a": 2}])
+        sent_messages = pipeline.send_d2c_messages.call_args[0][0]
+        assert sent_messages[0] is message
+        for sent_message in sent_messages:
+            assert isinstance(sent_message, Message)
+        assert [m.data for m in sent_messages[1:]] == ["string", 222, {"a": 2}]
+
+
+class SharedClientSendEventNowaitTests(object):
+    @pytest.mark.it("Begins a 'send_d2c_message' pipeline operation")
+    def test_calls_pipeline_send_d2c_message(self, client, pipeline, message):
+        client.send_d2c_message_nowait(message)
+        assert pipeline.send_d2c_message.call_count == 1
+        assert pipeline.send_d2c_message.call_args[0][0] is message
+
+    @pytest.mark.it(
+        "Returns a Future without waiting for the completion of the 'send_d2c_message' pipeline operation"
+    )
+    def test_returns_future(self, client_manual_cb, pipeline_manual_cb, message):
+        future = client_manual_cb.send_d2c_message_nowait(message)
+        assert isinstance(future, Future)
+        assert not future.done()
+
+    @pytest.mark.it(
+        "Completes the returned Future upon completion of the 'send_d2c_message' pipeline operation"
+    )
+    def test_completes_future(self, client_manual_cb, pipeline_manual_cb, message):
+        future = client_manual_cb.send_d2c_message_nowait(message)
+        cb = pipeline_manual_cb.send_d2c_message.call_args[1]["callback"]
+        cb()
+        assert future.done()
+        assert future.result() is None
+
+    @pytest.mark.it(
+        "Completes the returned Future with the error if the 'send_d2c_message' pipeline operation fails"
+    )
+    def test_fails_future(self, client_manual_cb, pipeline_manual_cb, message):
+        future = client_manual_cb.send_d2c_message_nowait(message)
+        error = Exception()
+        pipeline_manual_cb.send_d2c_message.call_args[1]["callback"](error=error)
+        assert future.exception() is error
+
+    @pytest.mark.it("Returns a distinct Future for each message sent")
+    def test_multiple_messages_in_flight(self, client_manual_cb, pipeline_manual_cb):
+        future1 = client_manual_cb.send_d2c_message_nowait(Message("message 1"))
+        future2 = client_manual_cb.send_d2c_message_nowait(Message("message 2"))
+        assert pipeline_manual_cb.send_d2c_message.call_count == 2
+
+        # Complete the second message first
+        pipeline_manual_cb.send_d2c_message.call_args_list[1][1]["callback"]()
+        assert future2.done()
+        assert not future1.done()
+
+        pipeline_manual_cb.send_d2c_message.call_args_list[0][1]["callback"]()
+        assert future1.done()
+
+    @pytest.mark.it(
+        "Wraps 'message' input parameter in a Message object if it is not a Message object"
+    )
+    @pytest.mark.parametrize(
+        "message_input",
+        [
+            pytest.param("message", id="String input"),
+            pytest.param(222, id="Integer input"),
+            pytest.param(None, id="None input"),
+            pytest.param({"a": 2}, id="Dictionary input"),
+        ],
+    )
+    def test_wraps_data_in_message(self, client, pipeline, message_input):
+        client.send_d2c_message_nowait(message_input)
+        sent_message = pipeline.send_d2c_message.call_args[0][0]
+        assert isinstance(sent_message, Message)
+        assert sent_message.data == message_input
+
+
 class SharedClientReceiveMethodRequestTests(object):
     @pytest.mark.it("Implicitly enables methods feature if not already enabled")
     @pytest.mark.parametrize(
@@ -436,7 +598,7 @@ class SharedClientGetTwinTests(WaitsForEventCompletion):
     def test_enables_twin_only_if_not_already_enabled(self, mocker, client, pipeline):
         # patch this so get_twin won't block
         def immediate_callback(callback):
-            callback(None)
+            callback(b"{}")
 
         mocker.patch.object(pipeline, "get_twin", side_effect=immediate_callback)
 
@@ -463,15 +625,17 @@ class SharedClientGetTwinTests(WaitsForEventCompletion):
     )
     def test_waits_for_pipeline_op_completion(self, mocker, client_manual_cb, pipeline_manual_cb):
         self.add_event_completion_checks(
-            mocker=mocker, pipeline_function=pipeline_manual_cb.get_twin, args=[None]
+            mocker=mocker, pipeline_function=pipeline_manual_cb.get_twin, args=[b"{}"]
         )
         client_manual_cb.get_twin()
 
-    @pytest.mark.it("Returns the twin that the pipeline returned")
+    @pytest.mark.it("Returns the twin that the pipeline returned, after decoding it")
     def test_verifies_twin_returned(self, mocker, client_manual_cb, pipeline_manual_cb):
         twin = {"reported": {"foo": "bar"}}
         self.add_event_completion_checks(
-            mocker=mocker, pipeline_function=pipeline_manual_cb.get_twin, args=[twin]
+            mocker=mocker,
+            pipeline_function=pipeline_manual_cb.get_twin,
+            args=[json.dumps(twin).encode("utf-8")],
         )
         returned_twin = client_manual_cb.get_twin()
         assert returned_twin == twin
@@ -523,13 +687,59 @@ class SharedClientPatchTwinReportedPropertiesTests(WaitsForEventCompletion):
         client_manual_cb.patch_twin_reported_properties(twin_patch_reported)
 
 
+class SharedClientUpdateReportedPropertiesTests(WaitsForEventCompletion):
+    @pytest.mark.it("Implicitly enables twin messaging feature if not already enabled")
+    def test_enables_twin_only_if_not_already_enabled(
+        self, mocker, client, pipeline, twin_patch_reported
+    ):
+        # Verify twin enabled if not enabled
+        pipeline.feature_enabled.__getitem__.return_value = False  # twin will appear disabled
+        client.update_reported_properties(twin_patch_reported)
+        assert pipeline.enable_feature.call_count == 1
+        assert pipeline.enable_feature.call_args[0][0] == constant.TWIN
+
+        pipeline.enable_feature.reset_mock()
+
+        # Verify twin not enabled if already enabled
+        pipeline.feature_enabled.__getitem__.return_value = True  # twin will appear enabled
+        client.update_reported_properties(twin_patch_reported)
+        assert pipeline.enable_feature.call_count == 0
+
+    @pytest.mark.it("Begins an 'update_reported_properties' pipeline operation")
+    def test_calls_pipeline(self, client, pipeline, twin_patch_reported):
+        client.update_reported_properties(twin_patch_reported)
+        assert pipeline.update_reported_properties.call_count == 1
+        assert pipeline.update_reported_properties.call_args[1]["full_state"] is twin_patch_reported
+
+    @pytest.mark.it(
+        "Waits for the completion of the 'update_reported_properties' pipeline operation before returning"
+    )
+    def test_waits_for_pipeline_op_completion(
+        self, mocker, client_manual_cb, pipeline_manual_cb, twin_patch_reported
+    ):
+        self.add_event_completion_checks(
+            mocker=mocker, pipeline_function=pipeline_manual_cb.update_reported_properties
+        )
+        client_manual_cb.update_reported_properties(twin_patch_reported)
+
+    @pytest.mark.it("Raises the error if the 'update_reported_properties' pipeline operation fails")
+    def test_raises_error(self, client, pipeline, twin_patch_reported):
+        error = Exception()
+        pipeline.update_reported_properties.side_effect = lambda full_state, callback: callback(
+            error=error
+        )
+        with pytest.raises(Exception) as e_info:
+            client.update_reported_properties(twin_patch_reported)
+        assert e_info.value is error
+
+
 class SharedClientReceiveTwinDesiredPropertiesPatchTests(object):
     @pytest.mark.it(
         "Implicitly enables Twin desired properties patch feature if not already enabled"
     )
     def test_enables_twin_patches_only_if_not_already_enabled(self, mocker, client, pipeline):
         mocker.patch.object(
-            SyncClientInbox, "get"
+            SyncClientInbox, "get", return_value=b"{}"
         )  # patch this so receive_twin_desired_properties_patch won't block
 
         # Verify twin patches enabled if not enabled
@@ -547,10 +757,12 @@ class SharedClientReceiveTwinDesiredPropertiesPatchTests(object):
         client.receive_twin_desired_properties_patch()
         assert pipeline.enable_feature.call_count == 0
 
-    @pytest.mark.it("Returns a patch from the twin patch inbox, if available")
-    def test_returns_message_from_twin_patch_inbox(self, mocker, client, twin_patch_desired):
+    @pytest.mark.it("Returns a patch from the twin patch inbox, after decoding it, if available")
+    def test_returns_message_from_twin_patch_inbox(
+        self, mocker, client, twin_patch_desired, twin_patch_desired_as_bytes
+    ):
         inbox_mock = mocker.MagicMock(autospec=SyncClientInbox)
-        inbox_mock.get.return_value = twin_patch_desired
+        inbox_mock.get.return_value = twin_patch_desired_as_bytes
         manager_get_inbox_mock = mocker.patch.object(
             client._inbox_manager, "get_twin_patch_inbox", return_value=inbox_mock
         )
@@ -558,7 +770,7 @@ class SharedClientReceiveTwinDesiredPropertiesPatchTests(object):
         received_patch = client.receive_twin_desired_properties_patch()
         assert manager_get_inbox_mock.call_count == 1
         assert inbox_mock.get.call_count == 1
-        assert received_patch is twin_patch_desired
+        assert received_patch == twin_patch_desired
 
     @pytest.mark.it("Can be called in various modes")
     @pytest.mark.parametrize(
@@ -571,6 +783,7 @@ class SharedClientReceiveTwinDesiredPropertiesPatchTests(object):
     )
     def test_can_be_called_in_mode(self, mocker, client, block, timeout):
         inbox_mock = mocker.MagicMock(autospec=SyncClientInbox)
+        inbox_mock.get.return_value = b"{}"
         mocker.patch.object(client._inbox_manager, "get_twin_patch_inbox", return_value=inbox_mock)
 
         client.receive_twin_desired_properties_patch(block=block, timeout=timeout)
@@ -580,6 +793,7 @@ class SharedClientReceiveTwinDesiredPropertiesPatchTests(object):
     @pytest.mark.it("Defaults to blocking mode with no timeout")
     def test_default_mode(self, mocker, client):
         inbox_mock = mocker.MagicMock(autospec=SyncClientInbox)
+        inbox_mock.get.return_value = b"{}"
         mocker.patch.object(client._inbox_manager, "get_twin_patch_inbox", return_value=inbox_mock)
 
         client.receive_twin_desired_properties_patch()
@@ -587,20 +801,22 @@ class SharedClientReceiveTwinDesiredPropertiesPatchTests(object):
         assert inbox_mock.get.call_args == mocker.call(block=True, timeout=None)
 
     @pytest.mark.it("Blocks until a patch is available, in blocking mode")
-    def test_no_message_in_inbox_blocking_mode(self, client, twin_patch_desired):
+    def test_no_message_in_inbox_blocking_mode(
+        self, client, twin_patch_desired, twin_patch_desired_as_bytes
+    ):
 
         twin_patch_inbox = client._inbox_manager.get_twin_patch_inbox()
         assert twin_patch_inbox.empty()
 
         def insert_item_after_delay():
             time.sleep(0.01)
-            twin_patch_inbox._put(twin_patch_desired)
+            twin_patch_inbox._put(twin_patch_desired_as_bytes)
 
         insertion_thread = threading.Thread(target=insert_item_after_delay)
         insertion_thread.start()
 
         received_patch = client.receive_twin_desired_properties_patch(block=True)
-        assert received_patch is twin_patch_desired
+        assert received_patch == twin_patch_desired
         # This proves that the blocking happens because 'received_patch' can't be
         # 'twin_patch_desired' until after a 10 millisecond delay on the insert. But because the
         # 'received_patch' IS 'twin_patch_desired', it means that client.receive_twin_desired_properties_patch
@@ -699,7 +915,8 @@ class TestIoTHubDeviceClientCreateFromX509Certificate(IoTHubDeviceClientTestsCon
 
         assert mock_auth.call_count == 1
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
 
@@ -720,11 +937,32 @@ class TestIoTHubDeviceClientDisconnectEvent(
     pass
 
 
+@pytest.mark.describe("IoTHubDeviceClient (Synchronous) - EVENT: Reconnect attempt")
+class TestIoTHubDeviceClientReconnectAttemptEvent(
+    IoTHubDeviceClientTestsConfig, SharedClientReconnectAttemptEventTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubDeviceClient (Synchronous) - .send_d2c_message()")
 class TestIoTHubDeviceClientSendEvent(IoTHubDeviceClientTestsConfig, SharedClientSendEventTests):
     pass
 
 
+@pytest.mark.describe("IoTHubDeviceClient (Synchronous) - .send_d2c_message_nowait()")
+class TestIoTHubDeviceClientSendEventNowait(
+    IoTHubDeviceClientTestsConfig, SharedClientSendEventNowaitTests
+):
+    pass
+
+
+@pytest.mark.describe("IoTHubDeviceClient (Synchronous) - .send_d2c_messages()")
+class TestIoTHubDeviceClientSendEventBatch(
+    IoTHubDeviceClientTestsConfig, SharedClientSendEventBatchTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubDeviceClient (Synchronous) - .receive_c2d_message()")
 class TestIoTHubDeviceClientReceiveC2DMessage(IoTHubDeviceClientTestsConfig):
     @pytest.mark.it("Implicitly enables C2D messaging feature if not already enabled")
@@ -843,6 +1081,13 @@ class TestIoTHubDeviceClientPatchTwinReportedProperties(
     pass
 
 
+@pytest.mark.describe("IoTHubDeviceClient (Synchronous) - .update_reported_properties()")
+class TestIoTHubDeviceClientUpdateReportedProperties(
+    IoTHubDeviceClientTestsConfig, SharedClientUpdateReportedPropertiesTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubDeviceClient (Synchronous) - .receive_twin_desired_properties_patch()")
 class TestIoTHubDeviceClientReceiveTwinDesiredPropertiesPatch(
     IoTHubDeviceClientTestsConfig, SharedClientReceiveTwinDesiredPropertiesPatchTests
@@ -934,7 +1179,8 @@ class TestIoTHubModuleClientCreateFromEdgeEnvironmentWithContainerEnv(
 
         assert mock_auth_init.call_count == 1
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth_init.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth_init.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
     @pytest.mark.it(
@@ -954,7 +1200,8 @@ class TestIoTHubModuleClientCreateFromEdgeEnvironmentWithContainerEnv(
 
         assert mock_auth_init.call_count == 1
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth_init.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth_init.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
     @pytest.mark.it("Raises IoTEdgeError if the environment is missing required variables")
@@ -1041,7 +1288,8 @@ class TestIoTHubModuleClientCreateFromEdgeEnvironmentWithDebugEnv(IoTHubModuleCl
         )
         assert mock_auth.ca_cert == expected_cert
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
     @pytest.mark.it(
@@ -1066,7 +1314,8 @@ class TestIoTHubModuleClientCreateFromEdgeEnvironmentWithDebugEnv(IoTHubModuleCl
 
         assert mock_auth_init.call_count == 1
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth_init.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth_init.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
     @pytest.mark.it("Raises IoTEdgeError if the environment is missing required variables")
@@ -1165,7 +1414,8 @@ class TestIoTHubModuleClientCreateFromX509Certificate(IoTHubModuleClientTestsCon
 
         assert mock_auth.call_count == 1
         assert mock_pipeline_init.call_count == 1
-        assert mock_pipeline_init.call_args == mocker.call(mock_auth.return_value)
+        assert mock_pipeline_init.call_args[0][0] == mock_auth.return_value
+        assert isinstance(mock_pipeline_init.call_args[0][1], IoTHubPipelineConfig)
         assert client._pipeline == mock_pipeline_init.return_value
 
 
@@ -1186,11 +1436,32 @@ class TestIoTHubModuleClientDisconnectEvent(
     pass
 
 
+@pytest.mark.describe("IoTHubModuleClient (Synchronous) - EVENT: Reconnect attempt")
+class TestIoTHubModuleClientReconnectAttemptEvent(
+    IoTHubModuleClientTestsConfig, SharedClientReconnectAttemptEventTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubModuleClient (Synchronous) - .send_d2c_message()")
 class TestIoTHubNModuleClientSendEvent(IoTHubModuleClientTestsConfig, SharedClientSendEventTests):
     pass
 
 
+@pytest.mark.describe("IoTHubModuleClient (Synchronous) - .send_d2c_message_nowait()")
+class TestIoTHubModuleClientSendEventNowait(
+    IoTHubModuleClientTestsConfig, SharedClientSendEventNowaitTests
+):
+    pass
+
+
+@pytest.mark.describe("IoTHubModuleClient (Synchronous) - .send_d2c_messages()")
+class TestIoTHubModuleClientSendEventBatch(
+    IoTHubModuleClientTestsConfig, SharedClientSendEventBatchTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubModuleClient (Synchronous) - .send_to_output()")
 class TestIoTHubModuleClientSendToOutput(IoTHubModuleClientTestsConfig, WaitsForEventCompletion):
     @pytest.mark.it("Begins a 'send_output_event' pipeline operation")
@@ -1213,6 +1484,14 @@ class TestIoTHubModuleClientSendToOutput(IoTHubModuleClientTestsConfig, WaitsFor
         output_name = "some_output"
         client_manual_cb.send_to_output(message, output_name)
 
+    @pytest.mark.it("Raises the error if the 'send_output_event' pipeline operation fails")
+    def test_raises_error(self, client, pipeline, message):
+        error = Exception()
+        pipeline.send_output_event.side_effect = lambda message, callback: callback(error=error)
+        with pytest.raises(Exception) as e_info:
+            client.send_to_output(message, "some_output")
+        assert e_info.value is error
+
     @pytest.mark.it(
         "Wraps 'message' input parameter in Message object if it is not a Message object"
     )
@@ -1373,6 +1652,13 @@ class TestIoTHubModuleClientPatchTwinReportedProperties(
     pass
 
 
+@pytest.mark.describe("IoTHubModuleClient (Synchronous) - .update_reported_properties()")
+class TestIoTHubModuleClientUpdateReportedProperties(
+    IoTHubModuleClientTestsConfig, SharedClientUpdateReportedPropertiesTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubModuleClient (Synchronous) - .receive_twin_desired_properties_patch()")
 class TestIoTHubModuleClientReceiveTwinDesiredPropertiesPatch(
     IoTHubModuleClientTestsConfig, SharedClientReceiveTwinDesiredPropertiesPatchTests
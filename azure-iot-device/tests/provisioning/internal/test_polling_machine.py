@@ -12,7 +12,7 @@ from azure.iot.device.provisioning.internal.request_response_provider import Req
 from azure.iot.device.provisioning.internal.polling_machine import PollingMachine
 from azure.iot.device.provisioning.models.registration_result import RegistrationResult
 from azure.iot.device.provisioning.pipeline import constant
-import time
+from azure.iot.device.common import timer_wheel
 
 fake_request_id = "Request1234"
 fake_retry_after = "3"
@@ -81,11 +81,7 @@ class TestRegister(object):
             "azure.iot.device.provisioning.internal.polling_machine.uuid.uuid4"
         )
         mock_init_uuid.return_value = fake_request_id
-        mock_init_query_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
-        )
-        mock_query_timer = mock_init_query_timer.return_value
-        mocker.patch.object(mock_query_timer, "start")
+        mocker.patch.object(timer_wheel, "get_shared_timer_wheel")
 
         mock_polling_machine.state = "initializing"
         mock_request_response_provider = mock_polling_machine._request_response_provider
@@ -143,9 +139,9 @@ class TestRegisterResponse(object):
             '{"operationId":"' + fake_operation_id + '","status":"' + fake_assigning_status + '"}'
         )
 
-        mock_init_polling_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
-        )
+        mock_init_polling_timer = mocker.patch.object(
+            timer_wheel, "get_shared_timer_wheel"
+        ).return_value.schedule
 
         # Complete string pre-fixed by a b is the one that works for all versions of python
         # or a encode on a string works for all versions of python
@@ -359,9 +355,9 @@ class TestRegisterResponse(object):
 
         fake_payload_result = "HelloHogwarts"
 
-        mock_init_polling_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
-        )
+        mock_init_polling_timer = mocker.patch.object(
+            timer_wheel, "get_shared_timer_wheel"
+        ).return_value.schedule
 
         mock_request_response_provider.receive_response(
             fake_request_id, "430", key_value_dict, fake_payload_result
@@ -399,11 +395,17 @@ class TestRegisterResponse(object):
         )
         mock_init_uuid.return_value = fake_request_id
 
+        mock_query_timer = mocker.patch.object(
+            timer_wheel, "get_shared_timer_wheel"
+        ).return_value.schedule
+
         # to transition into registering
         polling_machine._on_subscribe_completed()
 
-        # sleep so that it times out query
-        time.sleep(constant.DEFAULT_TIMEOUT_INTERVAL + 0.2)
+        # call query timer's time up call to simulate the query timing out
+        assert mock_query_timer.call_args[0][0] == constant.DEFAULT_TIMEOUT_INTERVAL
+        time_up_call = mock_query_timer.call_args[0][1]
+        time_up_call()
 
         polling_machine._on_disconnect_completed_error()
 
@@ -456,9 +458,9 @@ class TestQueryResponse(object):
             '{"operationId":"' + fake_operation_id + '","status":"' + fake_assigning_status + '"}'
         )
 
-        mock_init_polling_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
-        )
+        mock_init_polling_timer = mocker.patch.object(
+            timer_wheel, "get_shared_timer_wheel"
+        ).return_value.schedule
 
         # Response for register to transition to waiting polling
         mock_request_response_provider.receive_response(
@@ -548,9 +550,9 @@ class TestQueryResponse(object):
             '{"operationId":"' + fake_operation_id + '","status":"' + fake_assigning_status + '"}'
         )
 
-        mock_init_polling_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
-        )
+        mock_init_polling_timer = mocker.patch.object(
+            timer_wheel, "get_shared_timer_wheel"
+        ).return_value.schedule
 
         # Response for register to transition to waiting and polling
         mock_request_response_provider.receive_response(
@@ -644,9 +646,9 @@ class TestQueryResponse(object):
             '{"operationId":"' + fake_operation_id + '","status":"' + fake_assigning_status + '"}'
         )
 
-        mock_init_polling_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
-        )
+        mock_init_polling_timer = mocker.patch.object(
+            timer_wheel, "get_shared_timer_wheel"
+        ).return_value.schedule
 
         # Response for register to transition to waiting and polling
         mock_request_response_provider.receive_response(
@@ -721,9 +723,9 @@ class TestQueryResponse(object):
             '{"operationId":"' + fake_operation_id + '","status":"' + fake_assigning_status + '"}'
         )
 
-        mock_init_polling_timer = mocker.patch(
-            "azure.iot.device.provisioning.internal.polling_machine.Timer"
-        )
+        mock_init_polling_timer = mocker.patch.object(
+            timer_wheel, "get_shared_timer_wheel"
+        ).return_value.schedule
 
         # Response for register to transition to waiting polling
         mock_request_response_provider.receive_response(
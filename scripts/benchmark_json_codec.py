@@ -0,0 +1,80 @@
+"""
+Micro-benchmark for the JSON codecs which azure.iot.device.common.json_codec can use.
+
+Compares the cost of decoding and encoding realistic twin and method payloads with every codec
+which is installed (orjson, ujson and the json module of the standard library).
+
+Run from the root of the repository, with azure-iot-device installed:
+
+    python scripts/benchmark_json_codec.py [--number N]
+"""
+
+import argparse
+import timeit
+from azure.iot.device.common import json_codec
+
+
+def make_twin(sensor_count):
+    """A twin with desired and reported properties, and the metadata IoT Hub adds to them"""
+    properties = {
+        "sensor{}".format(i): {
+            "enabled": True,
+            "interval": 30,
+            "threshold": 21.5 + i,
+            "label": "Sensor number {}".format(i),
+        }
+        for i in range(sensor_count)
+    }
+    metadata = {
+        name: {"$lastUpdated": "2019-10-01T12:00:00.0000000Z", "$lastUpdatedVersion": 12}
+        for name in properties
+    }
+    return {
+        "desired": dict(properties, **{"$metadata": metadata, "$version": 12}),
+        "reported": dict(properties, **{"$metadata": metadata, "$version": 34}),
+    }
+
+
+payloads = [
+    ("method request", {"delay": 5, "force": False}),
+    ("method response", {"result": "rebooting", "eta": "2019-10-01T12:00:00Z", "code": 0}),
+    ("twin patch", {"sensor1": {"interval": 60}, "$version": 13}),
+    ("twin, 10 props", make_twin(10)),
+    ("twin, 100 props", make_twin(100)),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=10000, help="operations per measurement")
+    args = parser.parse_args()
+
+    codec_names = []
+    for name, _ in json_codec._codec_factories:
+        try:
+            json_codec.use_codec(name)
+        except ImportError:
+            print("{} is not installed".format(name))
+            continue
+        codec_names.append(name)
+
+    print(
+        "{:<18}{:>7}".format("payload", "bytes")
+        + "".join("{:>22}".format(name + " loads/dumps") for name in codec_names)
+    )
+    for payload_name, payload in payloads:
+        encoded = json_codec.dumps(payload).encode("utf-8")
+        row = "{:<18}{:>7}".format(payload_name, len(encoded))
+        for name in codec_names:
+            json_codec.use_codec(name)
+            codec = json_codec.get_codec()
+            loads = min(timeit.repeat(lambda: codec.loads(encoded), number=args.number, repeat=3))
+            dumps = min(timeit.repeat(lambda: codec.dumps(payload), number=args.number, repeat=3))
+            row += "{:>22}".format(
+                "{:.2f}/{:.2f} us".format(loads / args.number * 1e6, dumps / args.number * 1e6)
+            )
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Micro-benchmark for the parsing of incoming IoTHub MQTT topics.
+
+Compares the per-message cost of the chain of mqtt_topic_iothub.is_*_topic checks (and the
+get_*_from_topic helpers) which IoTHubMQTTConverterStage used to run, with the cost of
+mqtt_topic_iothub.TopicRouter.route(), for C2D, input, method and twin topics.
+
+The checks decode the message properties, so the router path is timed both with the properties
+of the ReceivedMessage read (which decodes them) and without (the lazy path, where decoding is
+left to whoever reads them). Decoding the properties costs the same on both paths and most of
+the time of a C2D or input message, so for those the router is only faster when the properties
+are not read. With the properties read it is no faster than the checks, and can be slightly
+slower (a speedup of 0.8x to 1.0x); without, it is several times faster (the lazy speedup).
+
+Run from the root of the repository, with azure-iot-device installed:
+
+    python scripts/benchmark_topic_router.py [--number N]
+"""
+
+import argparse
+import timeit
+from azure.iot.device.iothub.models import Message
+from azure.iot.device.iothub.pipeline import mqtt_topic_iothub
+
+device_id = "my-device"
+module_id = "my-module"
+
+topics = [
+    ("C2D", "devices/{}/messages/devicebound/%24.mid=1&%24.ct=text%2Fjson&a=b".format(device_id)),
+    ("input", "devices/{}/modules/{}/inputs/in1/%24.mid=1&a=b".format(device_id, module_id)),
+    ("method", "$iothub/methods/POST/reboot/?$rid=12"),
+    ("twin response", "$iothub/twin/res/200/?$rid=34&$version=5"),
+    ("twin patch", "$iothub/twin/PATCH/properties/desired/?$version=5"),
+]
+
+
+def parse_with_checks(topic):
+    """What the converter stage did before TopicRouter, without creating events"""
+    if mqtt_topic_iothub.is_c2d_topic(topic, device_id):
+        mqtt_topic_iothub.extract_properties_from_topic(topic, Message(b""))
+    elif mqtt_topic_iothub.is_input_topic(topic, device_id, module_id):
+        mqtt_topic_iothub.extract_properties_from_topic(topic, Message(b""))
+        mqtt_topic_iothub.get_input_name_from_topic(topic)
+    elif mqtt_topic_iothub.is_method_topic(topic):
+        mqtt_topic_iothub.get_method_request_id_from_topic(topic)
+        mqtt_topic_iothub.get_method_name_from_topic(topic)
+    elif mqtt_topic_iothub.is_twin_response_topic(topic):
+        mqtt_topic_iothub.get_twin_request_id_from_topic(topic)
+        int(mqtt_topic_iothub.get_twin_status_code_from_topic(topic))
+    elif mqtt_topic_iothub.is_twin_desired_property_patch_topic(topic):
+        pass
+
+
+def parse_with_router(router, topic, decode=True):
+    """What the converter stage does with TopicRouter, without creating events"""
+    incoming = router.route(topic)
+    if incoming.kind is mqtt_topic_iothub.C2D or incoming.kind is mqtt_topic_iothub.INPUT:
+        message = mqtt_topic_iothub.ReceivedMessage(b"", incoming.properties)
+        if decode:
+            message.custom_properties
+    elif incoming.kind is mqtt_topic_iothub.TWIN_RESPONSE:
+        int(incoming.status_code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=100000, help="messages per topic")
+    args = parser.parse_args()
+
+    router = mqtt_topic_iothub.TopicRouter(device_id, module_id)
+
+    print(
+        "{:<15}{:>15}{:>15}{:>15}{:>10}{:>15}".format(
+            "topic", "checks (us)", "router (us)", "lazy (us)", "speedup", "lazy speedup"
+        )
+    )
+    for name, topic in topics:
+        checks = min(timeit.repeat(lambda: parse_with_checks(topic), number=args.number, repeat=5))
+        routed = min(
+            timeit.repeat(lambda: parse_with_router(router, topic), number=args.number, repeat=5)
+        )
+        lazy = min(
+            timeit.repeat(
+                lambda: parse_with_router(router, topic, decode=False), number=args.number, repeat=5
+            )
+        )
+        print(
+            "{:<15}{:>15.2f}{:>15.2f}{:>15.2f}{:>9.1f}x{:>14.1f}x".format(
+                name,
+                checks / args.number * 1e6,
+                routed / args.number * 1e6,
+                lazy / args.number * 1e6,
+                checks / routed,
+                checks / lazy,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()